@@ -59,6 +59,18 @@ resource "aws_ecs_task_definition" "bedrock_gateway" {
       image = "${aws_ecr_repository.bedrock_gateway.repository_url}:latest"
       user  = "0"
 
+      # Time for gunicorn to drain in-flight requests (GRACEFUL_TIMEOUT) before SIGKILL.
+      stopTimeout = 60
+
+      # Liveness only: a saturated task stays up and recovers instead of being replaced.
+      healthCheck = {
+        command     = ["CMD", "python", "-c", "import urllib.request; urllib.request.urlopen('http://127.0.0.1/healthz', timeout=3)"]
+        interval    = 30
+        timeout     = 5
+        retries     = 3
+        startPeriod = 15
+      }
+
       portMappings = [
         {
           containerPort = 80
@@ -139,6 +151,18 @@ resource "aws_ecs_task_definition" "open_webui" {
       image = "${aws_ecr_repository.open_webui.repository_url}:latest"
       user  = "0"
 
+      # Time for gunicorn to drain in-flight requests (GRACEFUL_TIMEOUT) before SIGKILL.
+      stopTimeout = 60
+
+      # Liveness only: a saturated task stays up and recovers instead of being replaced.
+      healthCheck = {
+        command     = ["CMD", "python", "-c", "import urllib.request; urllib.request.urlopen('http://127.0.0.1/healthz', timeout=3)"]
+        interval    = 30
+        timeout     = 5
+        retries     = 3
+        startPeriod = 15
+      }
+
       portMappings = [
         {
           containerPort = 80
@@ -183,6 +207,10 @@ resource "aws_ecs_task_definition" "open_webui" {
         {
           name  = "WEBUI_SECRET_KEY"
           value = random_password.webui_secret_key.result
+        },
+        {
+          name  = "RETRIEVAL_SHARD_URLS"
+          value = join(",", [for index in range(var.retrieval_shard_count) : "http://retrieval-${index}.internal"])
         }
       ]
 
@@ -211,11 +239,12 @@ resource "aws_lb_target_group" "open_webui" {
   target_type = "ip"
 
   health_check {
-    path                = "/healthz"
+    # Readiness fails while the task is saturated, so the ALB routes around it.
+    path                = "/readyz"
     protocol            = "HTTP"
     matcher             = "200"
-    interval            = 15
-    timeout             = 10
+    interval            = 10
+    timeout             = 5
     healthy_threshold   = 2
     unhealthy_threshold = 2
   }
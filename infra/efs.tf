@@ -7,7 +7,7 @@ resource "aws_security_group" "efs" {
     from_port       = 2049
     to_port         = 2049
     protocol        = "tcp"
-    security_groups = [aws_security_group.open_webui.id]
+    security_groups = [aws_security_group.open_webui.id, aws_security_group.retrieval_shard.id]
   }
 
   egress {
@@ -92,3 +92,26 @@ resource "aws_iam_role_policy" "open_webui" {
   role   = aws_iam_role.open_webui.id
   policy = data.aws_iam_policy_document.open_webui_logs.json
 }
+
+data "aws_iam_policy_document" "open_webui_documents" {
+  count = length(var.document_bucket_arns) > 0 ? 1 : 0
+
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:ListBucket"]
+    resources = var.document_bucket_arns
+  }
+
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:GetObject"]
+    resources = [for arn in var.document_bucket_arns : "${arn}/*"]
+  }
+}
+
+resource "aws_iam_role_policy" "open_webui_documents" {
+  count  = length(var.document_bucket_arns) > 0 ? 1 : 0
+  name   = "${local.project}-open-webui-documents"
+  role   = aws_iam_role.open_webui.id
+  policy = data.aws_iam_policy_document.open_webui_documents[0].json
+}
@@ -0,0 +1,144 @@
+# Optional retrieval shards: one ECS service per shard, each registered in the
+# Cloud Map namespace as retrieval-N.internal. The open-webui tasks fan queries
+# out to them (RETRIEVAL_SHARD_URLS) for collections split with --shard.
+
+resource "aws_security_group" "retrieval_shard" {
+  vpc_id = aws_vpc.main.id
+
+  name        = "${local.project}-retrieval-shard-sg"
+  description = "Allows Open WebUI tasks to query the retrieval shards"
+
+  ingress {
+    from_port       = 80
+    to_port         = 80
+    protocol        = "tcp"
+    security_groups = [aws_security_group.open_webui.id]
+  }
+
+  egress {
+    from_port   = 0
+    to_port     = 0
+    protocol    = "-1"
+    cidr_blocks = ["0.0.0.0/0"]
+  }
+
+  tags = {
+    Name    = "${local.project}-retrieval-shard-sg"
+    Project = local.project
+  }
+}
+
+resource "aws_cloudwatch_log_group" "retrieval_shard" {
+  count             = var.retrieval_shard_count > 0 ? 1 : 0
+  name              = "/ecs/retrieval-shard"
+  retention_in_days = 30
+}
+
+resource "aws_service_discovery_service" "retrieval_shard" {
+  count = var.retrieval_shard_count
+  name  = "retrieval-${count.index}"
+
+  dns_config {
+    namespace_id = aws_service_discovery_private_dns_namespace.internal.id
+
+    dns_records {
+      ttl  = 10
+      type = "A"
+    }
+
+    routing_policy = "MULTIVALUE"
+  }
+
+  depends_on = [aws_service_discovery_private_dns_namespace.internal]
+}
+
+resource "aws_ecs_task_definition" "retrieval_shard" {
+  count                    = var.retrieval_shard_count > 0 ? 1 : 0
+  family                   = "${local.project}-retrieval-shard"
+  network_mode             = "awsvpc"
+  requires_compatibilities = ["FARGATE"]
+  cpu                      = 512
+  memory                   = var.retrieval_shard_memory
+  execution_role_arn       = aws_iam_role.ecs_task_execution.arn
+  task_role_arn            = aws_iam_role.open_webui.arn
+
+  volume {
+    name = "open-webui-data"
+
+    efs_volume_configuration {
+      file_system_id = aws_efs_file_system.open_webui.id
+
+      authorization_config {
+        access_point_id = aws_efs_access_point.open_webui.id
+        iam             = "ENABLED"
+      }
+
+      transit_encryption = "ENABLED"
+    }
+  }
+
+  container_definitions = jsonencode([
+    {
+      name    = "retrieval-shard"
+      image   = "${aws_ecr_repository.open_webui.repository_url}:latest"
+      user    = "0"
+      command = ["python", "-m", "app.shards", "serve", "--port", "80"]
+
+      healthCheck = {
+        command     = ["CMD", "python", "-c", "import urllib.request; urllib.request.urlopen('http://127.0.0.1/healthz', timeout=3)"]
+        interval    = 30
+        timeout     = 5
+        retries     = 3
+        startPeriod = 15
+      }
+
+      portMappings = [
+        {
+          containerPort = 80
+          protocol      = "tcp"
+        }
+      ]
+
+      logConfiguration = {
+        logDriver = "awslogs"
+        options = {
+          awslogs-group         = aws_cloudwatch_log_group.retrieval_shard[0].name
+          awslogs-region        = var.aws_region
+          awslogs-stream-prefix = "retrieval-shard"
+        }
+      }
+
+      mountPoints = [
+        {
+          containerPath = "/app/backend/data"
+          sourceVolume  = "open-webui-data"
+          readOnly      = true
+        }
+      ]
+    }
+  ])
+}
+
+resource "aws_ecs_service" "retrieval_shard" {
+  count            = var.retrieval_shard_count
+  name             = "${local.project}-retrieval-shard-${count.index}"
+  cluster          = aws_ecs_cluster.main.id
+  desired_count    = var.retrieval_shard_replicas
+  launch_type      = "FARGATE"
+  task_definition  = aws_ecs_task_definition.retrieval_shard[0].arn
+  platform_version = "1.4.0"
+
+  network_configuration {
+    subnets          = aws_subnet.public[*].id
+    security_groups  = [aws_security_group.retrieval_shard.id]
+    assign_public_ip = true
+  }
+
+  service_registries {
+    registry_arn = aws_service_discovery_service.retrieval_shard[count.index].arn
+  }
+
+  depends_on = [
+    aws_service_discovery_service.retrieval_shard
+  ]
+}
@@ -7,3 +7,27 @@ variable "vpc_cidr" {
   type    = string
   default = "10.0.0.0/16"
 }
+
+variable "document_bucket_arns" {
+  description = "S3 buckets the open-webui task may read documents from for `python -m app.ingest sync`."
+  type        = list(string)
+  default     = []
+}
+
+variable "retrieval_shard_count" {
+  description = "Retrieval shard services (retrieval-N.internal) serving NAME.shardN collections; 0 keeps all retrieval in the open-webui tasks."
+  type        = number
+  default     = 0
+}
+
+variable "retrieval_shard_replicas" {
+  description = "Tasks per retrieval shard service."
+  type        = number
+  default     = 1
+}
+
+variable "retrieval_shard_memory" {
+  description = "Memory (MiB) of each retrieval shard task; size it to hold one shard's vectors."
+  type        = number
+  default     = 2048
+}
@@ -0,0 +1,35 @@
+#!/usr/bin/env bash
+# Download the UI fonts at pinned versions into services/open-webui/app/static/fonts.
+#
+# The files are committed with the UI, so image builds need no network access and
+# always ship the same bytes. Every file is checked against SHA256SUMS in the same
+# directory; run with --update after changing a version to record the new sums.
+set -euo pipefail
+
+FONT_DIR="$(cd "$(dirname "$0")/.." && pwd)/services/open-webui/app/static/fonts"
+BASE_URL="${FONT_BASE_URL:-https://cdn.jsdelivr.net/npm}"
+SPACE_GROTESK_VERSION="5.1.0"
+JETBRAINS_MONO_VERSION="5.1.0"
+FONTS=(
+  "space-grotesk@${SPACE_GROTESK_VERSION} space-grotesk-latin-400-normal.woff2"
+  "space-grotesk@${SPACE_GROTESK_VERSION} space-grotesk-latin-500-normal.woff2"
+  "space-grotesk@${SPACE_GROTESK_VERSION} space-grotesk-latin-600-normal.woff2"
+  "space-grotesk@${SPACE_GROTESK_VERSION} space-grotesk-latin-700-normal.woff2"
+  "jetbrains-mono@${JETBRAINS_MONO_VERSION} jetbrains-mono-latin-400-normal.woff2"
+  "jetbrains-mono@${JETBRAINS_MONO_VERSION} jetbrains-mono-latin-600-normal.woff2"
+)
+
+mkdir -p "$FONT_DIR"
+for entry in "${FONTS[@]}"; do
+  read -r package file <<<"$entry"
+  curl --fail --silent --show-error --location -o "$FONT_DIR/$file" "$BASE_URL/@fontsource/$package/files/$file"
+done
+
+cd "$FONT_DIR"
+if [[ "${1:-}" == "--update" || ! -f SHA256SUMS ]]; then
+  sha256sum -- *.woff2 >SHA256SUMS
+  echo "Recorded checksums in $FONT_DIR/SHA256SUMS"
+else
+  sha256sum --check --quiet SHA256SUMS
+  echo "Fonts in $FONT_DIR match SHA256SUMS"
+fi
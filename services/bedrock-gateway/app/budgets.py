@@ -0,0 +1,79 @@
+"""Output budgets: default and maximum ``max_tokens`` per model and per API key.
+
+Every completion is sent with an explicit output budget so worst-case latency
+and cost are bounded. The budget is the caller's ``maxTokens`` if given, else
+the most specific configured default, and is then clamped to every cap that
+applies (global, model, API key).
+
+``GATEWAY_GENERATION_LIMITS`` configures the overrides as JSON::
+
+    {
+      "models": {"anthropic.claude-3-5-sonnet": {"defaultMaxTokens": 1024, "maxTokens": 4096}},
+      "keys": {"batch": {"defaultMaxTokens": 512, "maxTokens": 1024}}
+    }
+
+Model entries match by prefix of the base model ID (inference-profile prefixes
+such as ``us.`` are ignored); the longest matching prefix wins.
+"""
+
+import json
+import math
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from app.codecs import base_model_id
+
+
+@dataclass
+class TokenLimits:
+    default_max_tokens: Optional[int] = None
+    max_tokens: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, raw: Dict[str, int]) -> "TokenLimits":
+        return cls(default_max_tokens=raw.get("defaultMaxTokens"), max_tokens=raw.get("maxTokens"))
+
+
+class BudgetPolicy:
+    def __init__(
+        self,
+        default_max_tokens: int,
+        max_tokens_cap: int,
+        models: Optional[Dict[str, TokenLimits]] = None,
+        keys: Optional[Dict[str, TokenLimits]] = None,
+    ):
+        self.defaults = TokenLimits(default_max_tokens, max_tokens_cap)
+        # Longest prefix first so the most specific model entry wins.
+        self.models = sorted((models or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.keys = keys or {}
+
+    @classmethod
+    def from_env(cls, default_max_tokens: int, max_tokens_cap: int, raw_limits: Optional[str]) -> "BudgetPolicy":
+        limits = json.loads(raw_limits) if raw_limits else {}
+        return cls(
+            default_max_tokens,
+            max_tokens_cap,
+            models={prefix: TokenLimits.from_dict(entry) for prefix, entry in limits.get("models", {}).items()},
+            keys={name: TokenLimits.from_dict(entry) for name, entry in limits.get("keys", {}).items()},
+        )
+
+    def _model_limits(self, model_id: str) -> TokenLimits:
+        base_id = base_model_id(model_id)
+        for prefix, limits in self.models:
+            if model_id.startswith(prefix) or base_id.startswith(prefix):
+                return limits
+        return TokenLimits()
+
+    def resolve(self, model_id: str, key_name: str, requested: Optional[int]) -> Tuple[int, bool]:
+        """Return ``(max_tokens, capped)``; ``capped`` is True when the caller asked for more than allowed."""
+        scopes = [self.keys.get(key_name, TokenLimits()), self._model_limits(model_id), self.defaults]
+        budget = requested
+        if budget is None:
+            budget = next(scope.default_max_tokens for scope in scopes if scope.default_max_tokens is not None)
+        cap = min(scope.max_tokens for scope in scopes if scope.max_tokens is not None)
+        return min(budget, cap), requested is not None and requested > cap
+
+
+def output_read_timeout(max_tokens: int, base_seconds: float, min_tokens_per_second: float) -> float:
+    """Upper bound on how long a healthy model needs to produce ``max_tokens`` tokens."""
+    return base_seconds + math.ceil(max_tokens / min_tokens_per_second)
@@ -0,0 +1,168 @@
+"""Circuit breakers per (modelId, region) for Bedrock invocations.
+
+A breaker watches a sliding window of call outcomes. When the upstream error
+rate or the share of slow calls crosses its threshold it opens, and calls fail
+immediately (or go to a configured fallback model) instead of waiting on boto3
+retries. After a cooldown it lets a few probe calls through (half-open); one
+success closes it again, one failure reopens it.
+
+Breakers are per worker process and are only touched from the event loop.
+"""
+
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        model_id: str,
+        region: str,
+        window_seconds: float = 60.0,
+        min_samples: int = 10,
+        error_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 30.0,
+        slow_rate_threshold: float = 0.8,
+        cooldown_seconds: float = 30.0,
+        half_open_probes: int = 1,
+    ):
+        self.model_id = model_id
+        self.region = region
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate_threshold = slow_rate_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.times_opened = 0
+        self.rejected = 0
+        # (timestamp, failed, slow)
+        self._outcomes: Deque[Tuple[float, bool, bool]] = deque()
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._outcomes.popleft()
+
+    def rates(self) -> Tuple[int, float, float]:
+        self._trim(time.monotonic())
+        samples = len(self._outcomes)
+        if not samples:
+            return 0, 0.0, 0.0
+        failures = sum(1 for _, failed, _ in self._outcomes if failed)
+        slow = sum(1 for _, _, is_slow in self._outcomes if is_slow)
+        return samples, failures / samples, slow / samples
+
+    def retry_after(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """Return True if a call may proceed; half-open admits a limited number of probes."""
+        if self.state == OPEN and self.retry_after() <= 0:
+            self.state = HALF_OPEN
+            self.probes_in_flight = 0
+
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self.probes_in_flight < self.half_open_probes:
+            self.probes_in_flight += 1
+            return True
+
+        self.rejected += 1
+        return False
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self._outcomes.clear()
+
+    def record(self, failed: bool, latency_seconds: float) -> None:
+        slow = latency_seconds >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            if failed or slow:
+                self._open()
+            else:
+                self.state = CLOSED
+                self._outcomes.clear()
+            return
+
+        now = time.monotonic()
+        self._outcomes.append((now, failed, slow))
+        samples, error_rate, slow_rate = self.rates()
+        if samples >= self.min_samples and (
+            error_rate >= self.error_rate_threshold or slow_rate >= self.slow_rate_threshold
+        ):
+            self._open()
+
+    def release(self) -> None:
+        """Forget a call whose outcome says nothing about upstream health (e.g. caller errors)."""
+        if self.state == HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+
+    def snapshot(self) -> dict:
+        samples, error_rate, slow_rate = self.rates()
+        return {
+            "modelId": self.model_id,
+            "region": self.region,
+            "state": self.state,
+            "samples": samples,
+            "errorRate": round(error_rate, 4),
+            "slowRate": round(slow_rate, 4),
+            "timesOpened": self.times_opened,
+            "rejected": self.rejected,
+            "retryAfterSeconds": round(self.retry_after(), 2),
+        }
+
+
+class CircuitRegistry:
+    def __init__(self, region: str, fallbacks: Optional[Dict[str, str]] = None, **breaker_options):
+        self.region = region
+        self.fallbacks = fallbacks or {}
+        self.breaker_options = breaker_options
+        self.breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, model_id: str) -> CircuitBreaker:
+        key = (model_id, self.region)
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(model_id, self.region, **self.breaker_options)
+            self.breakers[key] = breaker
+        return breaker
+
+    def acquire(self, model_id: str) -> Tuple[Optional[CircuitBreaker], Optional[str]]:
+        """Pick the breaker to call through: the model's own, else its fallback's.
+
+        Returns ``(breaker, None)`` when a call may proceed, or ``(None, reason)`` when every
+        candidate circuit is open.
+        """
+        breaker = self.get(model_id)
+        if breaker.allow():
+            return breaker, None
+
+        fallback_id = self.fallbacks.get(model_id)
+        if fallback_id:
+            fallback = self.get(fallback_id)
+            if fallback.allow():
+                return fallback, None
+
+        return None, (
+            f"Circuit open for {model_id} in {self.region}; "
+            f"retry in {breaker.retry_after():.0f}s"
+        )
+
+    def snapshot(self) -> list:
+        return [breaker.snapshot() for breaker in self.breakers.values()]
@@ -0,0 +1,345 @@
+"""Per-model-family request builders and response parsers for Bedrock.
+
+Each family gets a codec that knows how to build the ``invoke_model`` body and
+how to pull the assistant text, stop reason and token usage back out of the
+response. ``resolve_codec`` maps a model ID to its codec once and caches the
+result, so requests do not rescan prefixes and clients do not need to parse
+raw provider payloads.
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+# Cross-region inference profiles prefix the model ID (e.g. ``us.anthropic.claude-3-5-haiku...``).
+INFERENCE_PROFILE_PREFIXES = ("us.", "eu.", "apac.", "us-gov.", "global.")
+
+ANTHROPIC_VERSION = "bedrock-2023-05-31"
+ANTHROPIC_DEFAULT_MAX_TOKENS = 2048
+
+ROLE_LABELS = {"user": "User", "assistant": "Assistant", "system": "System"}
+COHERE_CHAT_ROLES = {"user": "USER", "assistant": "CHATBOT"}
+
+Message = Tuple[str, str]
+
+
+# Stop reasons (lowercased) meaning the model hit its output budget rather than finishing.
+TRUNCATION_STOP_REASONS = {"max_tokens", "length", "max_length"}
+
+
+@dataclass
+class GenerationParams:
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    top_p: Optional[float] = None
+    stop: Optional[List[str]] = None
+
+
+@dataclass
+class NormalizedOutput:
+    text: str
+    stop_reason: Optional[str] = None
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+
+    @property
+    def truncated(self) -> bool:
+        return (self.stop_reason or "").lower() in TRUNCATION_STOP_REASONS
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "text": self.text,
+            "stopReason": self.stop_reason,
+            "truncated": self.truncated,
+            "usage": {"inputTokens": self.input_tokens, "outputTokens": self.output_tokens},
+        }
+
+
+def render_chat_prompt(messages: List[Message]) -> str:
+    """Render chat turns into a plain prompt for models that don't support chat natively."""
+    parts = [f"{ROLE_LABELS.get(role, role)}:\n{content}" for role, content in messages]
+    # Hint the model to continue as the assistant.
+    parts.append("Assistant:")
+    return "\n\n".join(parts)
+
+
+def split_system(messages: List[Message]) -> Tuple[List[str], List[Message]]:
+    system = [content for role, content in messages if role == "system"]
+    turns = [(role, content) for role, content in messages if role != "system"]
+    return system, turns
+
+
+def first(items: Any) -> Dict[str, Any]:
+    return items[0] if isinstance(items, list) and items and isinstance(items[0], dict) else {}
+
+
+@dataclass
+class ModelCodec:
+    family: str
+    supports_converse: bool = True
+
+    # Body field names for the generation parameters; ``None`` means the family has no such setting.
+    max_tokens_key = "max_tokens"
+    top_p_key = "top_p"
+    stop_key = "stop"
+
+    def generation_fields(self, params: GenerationParams) -> Dict[str, Any]:
+        fields: Dict[str, Any] = {}
+        if params.temperature is not None:
+            fields["temperature"] = params.temperature
+        if params.max_tokens is not None:
+            fields[self.max_tokens_key] = params.max_tokens
+        if params.top_p is not None:
+            fields[self.top_p_key] = params.top_p
+        if params.stop and self.stop_key:
+            fields[self.stop_key] = params.stop
+        return fields
+
+    def build_body(
+        self, messages: List[Message], params: GenerationParams, raw_prompt: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """``raw_prompt`` is the caller's plain prompt, sent verbatim to prompt-style models."""
+        body: Dict[str, Any] = {"prompt": raw_prompt if raw_prompt is not None else render_chat_prompt(messages)}
+        body.update(self.generation_fields(params))
+        return body
+
+    def parse(self, body: Dict[str, Any]) -> NormalizedOutput:
+        return NormalizedOutput(text=generic_text(body))
+
+
+def generic_text(body: Any) -> str:
+    """Best-effort extraction for models without a dedicated codec."""
+    if isinstance(body, str):
+        return body
+    if not isinstance(body, dict):
+        return ""
+    for key in ("generation", "completion", "outputText", "output", "text"):
+        if isinstance(body.get(key), str):
+            return body[key]
+    choice = first(body.get("choices"))
+    if choice:
+        return (choice.get("message") or {}).get("content") or choice.get("text") or ""
+    for key, text_key in (("outputs", "text"), ("results", "outputText"), ("generations", "text")):
+        entry = first(body.get(key))
+        if entry.get(text_key):
+            return entry[text_key]
+    if isinstance(body.get("content"), list):
+        return "".join(part.get("text", "") for part in body["content"] if isinstance(part, dict))
+    return ""
+
+
+def parse_openai_chat(body: Dict[str, Any]) -> NormalizedOutput:
+    choice = first(body.get("choices"))
+    usage = body.get("usage") or {}
+    return NormalizedOutput(
+        text=(choice.get("message") or {}).get("content") or choice.get("text") or "",
+        stop_reason=choice.get("finish_reason"),
+        input_tokens=usage.get("prompt_tokens"),
+        output_tokens=usage.get("completion_tokens"),
+    )
+
+
+class AnthropicCodec(ModelCodec):
+    stop_key = "stop_sequences"
+
+    def build_body(self, messages, params, raw_prompt=None):
+        system, turns = split_system(messages)
+        body = {
+            "anthropic_version": ANTHROPIC_VERSION,
+            "max_tokens": ANTHROPIC_DEFAULT_MAX_TOKENS,
+            "messages": [{"role": role, "content": [{"type": "text", "text": content}]} for role, content in turns],
+        }
+        if system:
+            body["system"] = "\n\n".join(system)
+        body.update(self.generation_fields(params))
+        return body
+
+    def parse(self, body):
+        usage = body.get("usage") or {}
+        return NormalizedOutput(
+            text="".join(part.get("text", "") for part in body.get("content") or [] if part.get("type") == "text"),
+            stop_reason=body.get("stop_reason"),
+            input_tokens=usage.get("input_tokens"),
+            output_tokens=usage.get("output_tokens"),
+        )
+
+
+class NovaCodec(ModelCodec):
+    max_tokens_key = "max_new_tokens"
+    stop_key = "stopSequences"
+
+    def build_body(self, messages, params, raw_prompt=None):
+        system, turns = split_system(messages)
+        body: Dict[str, Any] = {
+            "messages": [{"role": role, "content": [{"text": content}]} for role, content in turns],
+        }
+        if system:
+            body["system"] = [{"text": text} for text in system]
+        inference_config = self.generation_fields(params)
+        if inference_config:
+            body["inferenceConfig"] = inference_config
+        return body
+
+    def parse(self, body):
+        message = (body.get("output") or {}).get("message") or {}
+        usage = body.get("usage") or {}
+        return NormalizedOutput(
+            text="".join(part.get("text", "") for part in message.get("content") or []),
+            stop_reason=body.get("stopReason"),
+            input_tokens=usage.get("inputTokens"),
+            output_tokens=usage.get("outputTokens"),
+        )
+
+
+class OpenAIChatCodec(ModelCodec):
+    def build_body(self, messages, params, raw_prompt=None):
+        body: Dict[str, Any] = {"messages": [{"role": role, "content": content} for role, content in messages]}
+        body.update(self.generation_fields(params))
+        return body
+
+    def parse(self, body):
+        return parse_openai_chat(body)
+
+
+class LlamaCodec(ModelCodec):
+    max_tokens_key = "max_gen_len"
+    stop_key = None
+
+    def parse(self, body):
+        return NormalizedOutput(
+            text=body.get("generation") or "",
+            stop_reason=body.get("stop_reason"),
+            input_tokens=body.get("prompt_token_count"),
+            output_tokens=body.get("generation_token_count"),
+        )
+
+
+class MistralCodec(ModelCodec):
+    def parse(self, body):
+        output = first(body.get("outputs"))
+        if not output:
+            return parse_openai_chat(body)
+        return NormalizedOutput(text=output.get("text") or "", stop_reason=output.get("stop_reason"))
+
+
+class TitanTextCodec(ModelCodec):
+    max_tokens_key = "maxTokenCount"
+    top_p_key = "topP"
+    stop_key = "stopSequences"
+
+    def build_body(self, messages, params, raw_prompt=None):
+        config = self.generation_fields(params)
+        body: Dict[str, Any] = {"inputText": raw_prompt if raw_prompt is not None else render_chat_prompt(messages)}
+        if config:
+            body["textGenerationConfig"] = config
+        return body
+
+    def parse(self, body):
+        result = first(body.get("results"))
+        return NormalizedOutput(
+            text=result.get("outputText") or "",
+            stop_reason=result.get("completionReason"),
+            input_tokens=body.get("inputTextTokenCount"),
+            output_tokens=result.get("tokenCount"),
+        )
+
+
+class CohereCodec(ModelCodec):
+    """Command and Command Light take a plain ``prompt`` and answer with ``generations``."""
+
+    top_p_key = "p"
+    stop_key = "stop_sequences"
+
+    def parse(self, body):
+        generation = first(body.get("generations"))
+        return NormalizedOutput(text=generation.get("text") or "", stop_reason=generation.get("finish_reason"))
+
+
+class CohereCommandRCodec(ModelCodec):
+    """Command R and R+ take a chat body: the last turn as ``message``, earlier turns as ``chat_history``."""
+
+    top_p_key = "p"
+    stop_key = "stop_sequences"
+
+    def build_body(self, messages, params, raw_prompt=None):
+        system, turns = split_system(messages)
+        if raw_prompt is not None:
+            history, message = [], raw_prompt
+        else:
+            history, message = turns[:-1], turns[-1][1] if turns else ""
+        body: Dict[str, Any] = {"message": message}
+        if history:
+            body["chat_history"] = [
+                {"role": COHERE_CHAT_ROLES.get(role, "USER"), "message": content} for role, content in history
+            ]
+        if system:
+            body["preamble"] = "\n\n".join(system)
+        body.update(self.generation_fields(params))
+        return body
+
+    def parse(self, body):
+        return NormalizedOutput(text=body.get("text") or "", stop_reason=body.get("finish_reason"))
+
+
+# Ordered most-specific first; the first matching prefix wins.
+CODEC_REGISTRY: List[Tuple[Tuple[str, ...], ModelCodec]] = [
+    (("anthropic.",), AnthropicCodec("anthropic")),
+    (("amazon.nova",), NovaCodec("nova")),
+    (("amazon.titan-text",), TitanTextCodec("titan-text")),
+    (("openai.", "nvidia.", "ai21.jamba"), OpenAIChatCodec("openai-chat")),
+    (("meta.llama",), LlamaCodec("llama")),
+    (("mistral.",), MistralCodec("mistral")),
+    (("cohere.command-r",), CohereCommandRCodec("cohere-command-r")),
+    (("cohere.command",), CohereCodec("cohere")),
+]
+
+DEFAULT_CODEC = ModelCodec("prompt", supports_converse=False)
+
+
+def base_model_id(model_id: str) -> str:
+    for prefix in INFERENCE_PROFILE_PREFIXES:
+        if model_id.startswith(prefix):
+            return model_id[len(prefix):]
+    return model_id
+
+
+@lru_cache(maxsize=1024)
+def resolve_codec(model_id: str) -> ModelCodec:
+    base_id = base_model_id(model_id)
+    for prefixes, codec in CODEC_REGISTRY:
+        if base_id.startswith(prefixes):
+            return codec
+    return DEFAULT_CODEC
+
+
+def build_converse_request(model_id: str, messages: List[Message], params: GenerationParams) -> Dict[str, Any]:
+    system, turns = split_system(messages)
+    request: Dict[str, Any] = {
+        "modelId": model_id,
+        "messages": [{"role": role, "content": [{"text": content}]} for role, content in turns],
+    }
+    if system:
+        request["system"] = [{"text": text} for text in system]
+    inference_config: Dict[str, Any] = {}
+    if params.temperature is not None:
+        inference_config["temperature"] = params.temperature
+    if params.max_tokens is not None:
+        inference_config["maxTokens"] = params.max_tokens
+    if params.top_p is not None:
+        inference_config["topP"] = params.top_p
+    if params.stop:
+        inference_config["stopSequences"] = params.stop
+    if inference_config:
+        request["inferenceConfig"] = inference_config
+    return request
+
+
+def parse_converse_response(response: Dict[str, Any]) -> NormalizedOutput:
+    message = (response.get("output") or {}).get("message") or {}
+    usage = response.get("usage") or {}
+    return NormalizedOutput(
+        text="".join(part.get("text", "") for part in message.get("content") or []),
+        stop_reason=response.get("stopReason"),
+        input_tokens=usage.get("inputTokens"),
+        output_tokens=usage.get("outputTokens"),
+    )
@@ -0,0 +1,286 @@
+"""Contextual compression of retrieved passages before they are put in the prompt.
+
+Retrieved chunks are sent whole by default, and most of their sentences are
+usually unrelated to the question, while Bedrock latency and cost grow with
+input tokens. For grounded completions the gateway:
+
+1. splits every passage into sentences,
+2. drops sentences whose words already appeared in a higher-ranked passage
+   (chunks overlap, and the same paragraph is often stored twice),
+3. scores each sentence against the question with BM25 over the candidate
+   sentences (one NumPy pass), plus a share of its best neighbour's score so
+   the sentences around an answer stay with it,
+4. keeps sentences scoring at least ``RELEVANCE_FLOOR`` of the best one and
+   packs them best-first into the model's context budget,
+5. reassembles the survivors in their original order, marking gaps with "…".
+
+If no sentence shares a word with the question, passages are packed in
+retrieval order instead, so a paraphrased question still gets context.
+
+Budgets are ``GATEWAY_CONTEXT_TOKENS`` (estimated tokens, ~4 characters each)
+overridden per model-ID prefix by ``GATEWAY_CONTEXT_TOKEN_LIMITS``, e.g.
+``{"amazon.nova-lite": 1200, "anthropic.claude-3-5-sonnet": 4000}``.
+
+    python -m app.context_compression bench cases.jsonl
+
+reads ``{"question", "passages": [{"text", "source"}], "answer"}`` lines and
+reports the token reduction and how often the answer text survives.
+"""
+
+import argparse
+import json
+import re
+import sys
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.codecs import base_model_id
+from app.deadlines import estimate_tokens
+
+TOKEN = re.compile(r"\w+")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])|\n\s*\n|\n(?=\s*(?:[-*•]|\d+[.)])\s)")
+MAX_SENTENCE_CHARS = 600
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from how i if in into is it its me my not of on or so that the "
+    "their them then there these they this to was what when where which who why will with you your".split()
+)
+BM25_K1 = 1.2
+BM25_B = 0.75
+NEIGHBOUR_SHARE = 0.3
+RANK_DECAY = 0.05
+RELEVANCE_FLOOR = 0.2
+DUPLICATE_SHARE = 0.8
+GAP = " … "
+
+
+@dataclass
+class Sentence:
+    passage: int
+    position: int
+    text: str
+    tokens: int
+    words: List[str]
+    score: float = 0.0
+    duplicate: bool = False
+
+
+@dataclass
+class Passage:
+    index: int  # 1-based position in the request's context list, used for citations
+    source: Optional[str]
+    text: str
+
+
+def split_sentences(text: str) -> List[str]:
+    pieces = []
+    for piece in SENTENCE_BREAK.split(text):
+        piece = piece.strip()
+        while len(piece) > MAX_SENTENCE_CHARS:
+            # Code and tables rarely have sentence punctuation: fall back to line breaks, then a hard cut.
+            cut = piece.rfind("\n", 0, MAX_SENTENCE_CHARS)
+            cut = cut if cut > 0 else piece.rfind(" ", 0, MAX_SENTENCE_CHARS)
+            cut = cut if cut > 0 else MAX_SENTENCE_CHARS
+            pieces.append(piece[:cut].strip())
+            piece = piece[cut:].strip()
+        if piece:
+            pieces.append(piece)
+    return pieces
+
+
+def words_of(text: str) -> List[str]:
+    return TOKEN.findall(text.lower())
+
+
+def _shingles(words: List[str]) -> set:
+    if len(words) < 3:
+        return {tuple(words)}
+    return {tuple(words[index : index + 3]) for index in range(len(words) - 2)}
+
+
+class ScoredContext:
+    """Passages split into scored, de-duplicated sentences; ``pack`` fits them to a budget."""
+
+    def __init__(self, query: str, passages: Sequence[Tuple[Optional[str], str]]):
+        self.sources = [source for source, _ in passages]
+        self.tokens_before = sum(estimate_tokens(text) for _, text in passages)
+        self.sentences: List[Sentence] = []
+        self._dedupe([split_sentences(text) for _, text in passages])
+        self.duplicates = sum(sentence.duplicate for sentence in self.sentences)
+        self.relevant = self._score(words_of(query))
+
+    def _dedupe(self, passages: List[List[str]]) -> None:
+        """Mark sentences whose trigrams mostly appeared in an earlier passage.
+
+        Overlapping chunks cut sentences at their edges, so when a later sentence
+        contains an earlier, shorter one, the fragment is dropped instead.
+        """
+        owners: Dict[tuple, int] = {}
+        for passage, texts in enumerate(passages):
+            added = []
+            for position, text in enumerate(texts):
+                words = words_of(text)
+                # One extra token pays for the separator or gap marker it is joined with.
+                sentence = Sentence(passage, position, text, estimate_tokens(text) + 1, words)
+                shingles = _shingles(words)
+                earlier = Counter(owners[shingle] for shingle in shingles if shingle in owners)
+                if words and sum(earlier.values()) >= DUPLICATE_SHARE * len(shingles):
+                    fragments = [
+                        index
+                        for index, shared in earlier.items()
+                        if len(self.sentences[index].words) < len(words)
+                        and shared >= DUPLICATE_SHARE * len(_shingles(self.sentences[index].words))
+                    ]
+                    if fragments and sum(earlier[index] for index in fragments) == sum(earlier.values()):
+                        for index in fragments:
+                            self.sentences[index].duplicate = True
+                    else:
+                        sentence.duplicate = True
+                added.append((len(self.sentences), shingles))
+                self.sentences.append(sentence)
+            # Only earlier passages count, so a sentence that repeats inside one passage is kept.
+            for index, shingles in added:
+                for shingle in shingles:
+                    owners.setdefault(shingle, index)
+
+    def _score(self, query_words: List[str]) -> bool:
+        """BM25 of each sentence against the query terms; False if no sentence shares a term with the query."""
+        terms = sorted({word for word in query_words if word not in STOPWORDS}) or sorted(set(query_words))
+        if not terms or not self.sentences:
+            return False
+        column = {term: index for index, term in enumerate(terms)}
+        counts = np.zeros((len(self.sentences), len(terms)), dtype=np.float32)
+        lengths = np.empty(len(self.sentences), dtype=np.float32)
+        for row, sentence in enumerate(self.sentences):
+            lengths[row] = len(sentence.words)
+            for word, count in Counter(sentence.words).items():
+                if word in column:
+                    counts[row, column[word]] = count
+        present = counts > 0
+        documents = len(self.sentences)
+        frequency = present.sum(axis=0)
+        idf = np.log1p((documents - frequency + 0.5) / (frequency + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(float(lengths.mean()), 1.0))
+        scores = (counts * (BM25_K1 + 1) / (counts + norm[:, None])) @ idf
+        if not scores.any():
+            return False
+        # Sentences next to a relevant one (same passage) carry part of its score.
+        passages = np.array([sentence.passage for sentence in self.sentences])
+        same_next = np.append(passages[1:] == passages[:-1], False)
+        same_prev = np.insert(passages[1:] == passages[:-1], 0, False)
+        following = np.where(same_next, np.append(scores[1:], 0), 0)
+        preceding = np.where(same_prev, np.insert(scores[:-1], 0, 0), 0)
+        scores = scores + NEIGHBOUR_SHARE * np.maximum(following, preceding)
+        scores = scores / (1 + RANK_DECAY * passages)
+        for sentence, score in zip(self.sentences, scores.tolist()):
+            sentence.score = score
+        return True
+
+    def pack(self, budget: int) -> Tuple[List[Passage], dict]:
+        candidates = [sentence for sentence in self.sentences if not sentence.duplicate]
+        if self.relevant:
+            best = max(sentence.score for sentence in candidates) if candidates else 0.0
+            candidates = [sentence for sentence in candidates if sentence.score >= RELEVANCE_FLOOR * best]
+            candidates.sort(key=lambda sentence: -sentence.score)
+        kept: List[Sentence] = []
+        remaining = budget
+        for sentence in candidates:
+            if sentence.tokens <= remaining or not kept:
+                kept.append(sentence)
+                remaining -= sentence.tokens
+        kept.sort(key=lambda sentence: (sentence.passage, sentence.position))
+
+        passages: List[Passage] = []
+        for sentence in kept:
+            if passages and passages[-1].index == sentence.passage + 1:
+                joiner = " " if sentence.position == previous.position + 1 else GAP
+                passages[-1].text += joiner + sentence.text
+            else:
+                prefix = "" if sentence.position == 0 else "… "
+                passages.append(Passage(sentence.passage + 1, self.sources[sentence.passage], prefix + sentence.text))
+            previous = sentence
+        tokens_after = sum(estimate_tokens(passage.text) for passage in passages)
+        return passages, {
+            "compressed": True,
+            "tokensBefore": self.tokens_before,
+            "tokensAfter": tokens_after,
+            "budget": budget,
+            "passages": len(passages),
+            "passagesIn": len(self.sources),
+            "sentences": len(kept),
+            "sentencesIn": len(self.sentences),
+            "duplicates": self.duplicates,
+        }
+
+
+class ContextCompressor:
+    def __init__(self, default_tokens: int, model_tokens: Optional[Dict[str, int]] = None, enabled: bool = True):
+        self.enabled = enabled
+        self.default_tokens = default_tokens
+        # Longest prefix first so the most specific model entry wins.
+        self.model_tokens = sorted((model_tokens or {}).items(), key=lambda item: len(item[0]), reverse=True)
+
+    @classmethod
+    def from_env(cls, enabled: str, default_tokens: str, raw_limits: Optional[str]) -> "ContextCompressor":
+        return cls(int(default_tokens), json.loads(raw_limits) if raw_limits else {}, enabled.lower() == "true")
+
+    def budget(self, model_id: str, requested: Optional[int] = None) -> int:
+        """Context tokens for ``model_id``: the caller's ``contextTokens`` if given, never above the model's budget."""
+        base_id = base_model_id(model_id)
+        matches = (
+            tokens for prefix, tokens in self.model_tokens if base_id.startswith(prefix) or model_id.startswith(prefix)
+        )
+        limit = next(matches, self.default_tokens)
+        return limit if requested is None else min(requested, limit)
+
+
+def uncompressed(passages: Sequence[Tuple[Optional[str], str]]) -> Tuple[List[Passage], dict]:
+    tokens = sum(estimate_tokens(text) for _, text in passages)
+    return (
+        [Passage(index, source, text) for index, (source, text) in enumerate(passages, start=1)],
+        {"compressed": False, "tokensBefore": tokens, "tokensAfter": tokens},
+    )
+
+
+def run_bench(args) -> int:
+    with open(args.cases, encoding="utf-8") as handle:
+        cases = [json.loads(line) for line in handle if line.strip()]
+    print(f"{len(cases)} cases")
+    print(f"{'budget':>8}  {'tokens in':>9}  {'tokens out':>10}  {'saved':>6}  {'answer kept':>11}")
+    inputs = [[(passage.get("source"), passage["text"]) for passage in case["passages"]] for case in cases]
+    contexts = [ScoredContext(case["question"], passages) for case, passages in zip(cases, inputs)]
+    for budget in args.budgets:
+        before = after = kept = 0
+        for context, case, raw in zip(contexts, cases, inputs):
+            passages, report = context.pack(budget) if budget else uncompressed(raw)
+            before += report["tokensBefore"]
+            after += report["tokensAfter"]
+            answer = " ".join(case["answer"].split())
+            kept += any(answer in " ".join(passage.text.split()) for passage in passages)
+        label = str(budget) if budget else "off"
+        print(
+            f"{label:>8}  {before / len(cases):>9.0f}  {after / len(cases):>10.0f}  "
+            f"{1 - after / before:>6.0%}  {kept / len(cases):>11.2f}"
+        )
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m app.context_compression")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="Token reduction and answer retention on recorded cases")
+    bench.add_argument("cases", help="JSON lines with question, passages and answer")
+    bench.add_argument(
+        "--budgets",
+        type=lambda value: [int(entry) for entry in value.split(",")],
+        default=[0, 2000, 1000, 500],
+        help="Comma-separated context budgets in tokens (0: no compression)",
+    )
+    return run_bench(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""End-to-end deadlines and cancellation of abandoned Bedrock calls.
+
+Callers send their remaining time budget in ``x-deadline-ms``. The gateway
+skips work that cannot finish in time, bounds boto3 read timeouts by the
+budget, and stops waiting (or closes the upstream stream) once the client has
+disconnected. What cancellation saved is counted in memory, flushed to the
+shared store from a thread every few seconds, and reported on ``/metrics``
+summed across workers.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import Counter
+from typing import Callable, Optional, TypeVar
+
+import anyio.to_thread
+from fastapi import Header, HTTPException, Request
+
+from app.shared_store import SharedStore
+
+DEADLINE_HEADER = "x-deadline-ms"
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    def __init__(self, budget_seconds: float):
+        self.budget_seconds = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+
+def deadline_dependency(max_seconds: float):
+    """FastAPI dependency that turns the caller's ``x-deadline-ms`` budget into a Deadline."""
+
+    def request_deadline(x_deadline_ms: Optional[int] = Header(None, alias=DEADLINE_HEADER)) -> Deadline:
+        if x_deadline_ms is None or x_deadline_ms <= 0:
+            return Deadline(max_seconds)
+        return Deadline(min(x_deadline_ms / 1000.0, max_seconds))
+
+    return request_deadline
+
+
+class CancellationStats:
+    PREFIX = "cancellation:"
+
+    def __init__(self, store: SharedStore, flush_interval: float = 2.0):
+        self.store = store
+        self.flush_interval = flush_interval
+        self._pending: Counter = Counter()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def record(self, kind: str, seconds_saved: float = 0.0, tokens_saved: float = 0.0) -> None:
+        """Hot path: in-memory counters only; ``flush`` writes them to the shared store."""
+        self._pending[f"{self.PREFIX}{kind}"] += 1
+        self._pending[f"{self.PREFIX}secondsSaved"] += seconds_saved
+        self._pending[f"{self.PREFIX}estimatedTokensSaved"] += tokens_saved
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, Counter()
+        amounts = {key: round(value, 3) for key, value in pending.items()}
+        try:
+            await anyio.to_thread.run_sync(self.store.add_totals, amounts)
+        except sqlite3.Error:
+            logger.exception("Failed to write cancellation totals; keeping them for the next flush")
+            self._pending.update(pending)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def snapshot(self) -> dict:
+        # Include this worker's unflushed counts so a caller sees its own latest requests.
+        await self.flush()
+        return await anyio.to_thread.run_sync(self.store.get_totals, self.PREFIX)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) for accounting only."""
+    return max(1, len(text) // 4)
+
+
+async def run_until_disconnect(request: Request, deadline: Deadline, func: Callable[[], T], poll_seconds: float = 0.25) -> T:
+    """Run a blocking call in the threadpool, giving up as soon as the client leaves or the deadline passes.
+
+    Raises ``HTTPException`` 499 (client closed request) or 504 when the call is abandoned. The worker
+    thread cannot be interrupted, but its boto3 read timeout is bounded by the same deadline.
+    """
+    task = asyncio.ensure_future(anyio.to_thread.run_sync(func, abandon_on_cancel=True))
+    while True:
+        try:
+            done, _ = await asyncio.wait({task}, timeout=min(poll_seconds, max(deadline.remaining(), 0.01)))
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            raise HTTPException(status_code=499, detail="Client closed request")
+        if deadline.expired():
+            task.cancel()
+            raise HTTPException(status_code=504, detail="Deadline exceeded waiting for Bedrock")
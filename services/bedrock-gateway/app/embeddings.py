@@ -0,0 +1,56 @@
+"""Request bodies and response parsing for Bedrock text-embedding models.
+
+Titan embedding models take one text per ``invoke_model`` call, so a batch is
+sent as concurrent calls. Cohere embedding models accept up to 96 texts per
+call and are sent in slices of that size.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from app.codecs import base_model_id
+
+COHERE_MAX_TEXTS = 96
+
+
+@dataclass(frozen=True)
+class EmbeddingFamily:
+    name: str
+    texts_per_call: int
+
+
+TITAN = EmbeddingFamily("titan", 1)
+COHERE = EmbeddingFamily("cohere", COHERE_MAX_TEXTS)
+
+
+def embedding_family(model_id: str) -> Optional[EmbeddingFamily]:
+    base_id = base_model_id(model_id)
+    if base_id.startswith("amazon.titan-embed"):
+        return TITAN
+    if base_id.startswith("cohere.embed"):
+        return COHERE
+    return None
+
+
+def build_embedding_body(
+    family: EmbeddingFamily, model_id: str, texts: List[str], dimensions: Optional[int], input_type: str
+) -> Dict:
+    if family is COHERE:
+        return {"texts": texts, "input_type": f"search_{input_type}", "truncate": "END"}
+    body: Dict = {"inputText": texts[0]}
+    # Only Titan v2 accepts the dimensions/normalize options.
+    if "embed-text-v2" in base_model_id(model_id):
+        body["normalize"] = True
+        if dimensions:
+            body["dimensions"] = dimensions
+    return body
+
+
+def parse_embedding_body(family: EmbeddingFamily, body: Dict) -> Tuple[List[List[float]], Optional[int]]:
+    """Return (vectors, input tokens) from one response body."""
+    if family is COHERE:
+        embeddings = body.get("embeddings") or []
+        if isinstance(embeddings, dict):
+            embeddings = embeddings.get("float") or []
+        return embeddings, None
+    return [body["embedding"]], body.get("inputTextTokenCount")
@@ -0,0 +1,419 @@
+"""Priority lanes in front of the Bedrock calls.
+
+Interactive chat and bulk jobs (evaluation scripts, ingestion) share the
+gateway. Without lanes every call waits in one FIFO threadpool queue, so a
+batch run of hundreds of ``invoke_model`` calls puts chat users behind it.
+
+Each request is put in a lane, chosen in this order:
+
+1. the API key's lane from ``GATEWAY_LANE_KEYS`` (e.g. ``{"eval": "batch"}``),
+2. otherwise the lane of the longest matching path prefix in
+   ``GATEWAY_LANE_ROUTES``, otherwise the first (highest-priority) lane,
+3. an ``x-gateway-lane`` header may then move the request to a lower-priority
+   lane, never a higher one.
+
+Lanes are configured by ``GATEWAY_LANES``, a JSON object ordered from highest
+to lowest priority. A worker has one ``LanePool`` per kind of upstream call
+(completions, embeddings), each with a fixed number of slots:
+
+- A free slot always goes to the highest-priority lane with a waiting request;
+  within a lane requests are served in arrival order.
+- ``share`` caps the slots a lane may hold, which keeps the rest for the lanes
+  above it. A lane below never waits behind a lane above that has nothing queued.
+- ``maxQueue`` bounds a lane's queue; further requests get 429 + ``Retry-After``.
+- ``maxWaitSeconds`` bounds the time a request may wait for a slot (429).
+- A ``preemptible`` lane gives way at admission: while a higher-priority
+  request is waiting, its queued requests are rejected with 429 and new ones
+  are rejected at once, so bulk clients back off instead of holding their place.
+
+Calls that already hold a slot are never interrupted. Queue waits per lane
+(p50/p95/max over the last five minutes) are reported under ``lanes`` on
+``/metrics``.
+
+    python -m app.lanes bench
+
+simulates interactive traffic with and without a concurrent batch flood.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException, Request
+
+from app.deadlines import Deadline
+
+LANE_HEADER = "x-gateway-lane"
+DEFAULT_LANES = {
+    "interactive": {},
+    "batch": {"share": 0.5, "maxQueue": 32, "maxWaitSeconds": 30, "preemptible": True},
+}
+WAIT_WINDOW_SECONDS = 300.0
+WAIT_SAMPLES = 2048
+
+
+@dataclass
+class LaneConfig:
+    name: str
+    priority: int  # 0 is the highest
+    share: float = 1.0
+    max_queue: int = 64
+    max_wait_seconds: Optional[float] = None
+    preemptible: bool = False
+
+
+class LanePolicy:
+    """Lane definitions and the rules that put a request in one of them."""
+
+    def __init__(
+        self,
+        lanes: Dict[str, dict],
+        key_lanes: Optional[Dict[str, str]] = None,
+        route_lanes: Optional[Dict[str, str]] = None,
+    ):
+        if not lanes:
+            raise ValueError("At least one lane is required")
+        self.lanes: Dict[str, LaneConfig] = {}
+        for priority, (name, options) in enumerate(lanes.items()):
+            self.lanes[name] = LaneConfig(
+                name,
+                priority,
+                share=float(options.get("share", 1.0)),
+                max_queue=int(options.get("maxQueue", 64)),
+                max_wait_seconds=options.get("maxWaitSeconds"),
+                preemptible=bool(options.get("preemptible", False)),
+            )
+        self.default = next(iter(self.lanes))
+        self.key_lanes = dict(key_lanes or {})
+        # Longest prefix first so the most specific route wins.
+        self.route_lanes = sorted((route_lanes or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        for lane in list(self.key_lanes.values()) + [lane for _, lane in self.route_lanes]:
+            if lane not in self.lanes:
+                raise ValueError(f"Unknown lane {lane!r}; lanes are {', '.join(self.lanes)}")
+
+    @classmethod
+    def from_env(cls, raw_lanes: Optional[str], raw_keys: Optional[str], raw_routes: Optional[str]) -> "LanePolicy":
+        lanes = json.loads(raw_lanes) if raw_lanes else DEFAULT_LANES
+        return cls(lanes, json.loads(raw_keys) if raw_keys else {}, json.loads(raw_routes) if raw_routes else {})
+
+    def classify(self, key_name: str, path: str, requested: Optional[str] = None) -> str:
+        lane = self.key_lanes.get(key_name)
+        if lane is None:
+            lane = next((lane for prefix, lane in self.route_lanes if path.startswith(prefix)), self.default)
+        if requested:
+            if requested not in self.lanes:
+                raise HTTPException(status_code=400, detail=f"Unknown lane {requested!r}")
+            # Callers may lower their own priority but not raise it.
+            if self.lanes[requested].priority > self.lanes[lane].priority:
+                lane = requested
+        return lane
+
+
+@dataclass
+class LaneState:
+    config: LaneConfig
+    limit: int
+    active: int = 0
+    waiters: Deque[Tuple[asyncio.Future, float]] = field(default_factory=deque)
+    admitted: int = 0
+    queue_full: int = 0
+    preempted: int = 0
+    timed_out: int = 0
+    abandoned: int = 0
+    waits: Deque[Tuple[float, float]] = field(default_factory=lambda: deque(maxlen=WAIT_SAMPLES))
+
+    def record_wait(self, now: float, seconds: float) -> None:
+        self.admitted += 1
+        self.waits.append((now, seconds))
+
+    def wait_percentiles(self, now: float) -> dict:
+        cutoff = now - WAIT_WINDOW_SECONDS
+        while self.waits and self.waits[0][0] < cutoff:
+            self.waits.popleft()
+        if not self.waits:
+            return {"samples": 0, "p50Ms": None, "p95Ms": None, "maxMs": None}
+        waits = np.fromiter((seconds for _, seconds in self.waits), dtype=np.float64) * 1000
+        return {
+            "samples": len(waits),
+            "p50Ms": round(float(np.percentile(waits, 50)), 2),
+            "p95Ms": round(float(np.percentile(waits, 95)), 2),
+            "maxMs": round(float(waits.max()), 2),
+        }
+
+
+class Lease:
+    """A slot held in a pool; ``release`` is idempotent."""
+
+    def __init__(self, pool: "LanePool", lane: str, waited_seconds: float):
+        self.pool = pool
+        self.lane = lane
+        self.waited_seconds = waited_seconds
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.pool._release(self.lane)
+
+    def to_dict(self) -> dict:
+        return {"name": self.lane, "queuedMs": round(self.waited_seconds * 1000, 1)}
+
+
+class LanePool:
+    """Slots for one kind of upstream call, handed out by lane priority. One per worker, used from the event loop."""
+
+    def __init__(self, name: str, slots: int, policy: LanePolicy, retry_after_seconds: int = 2):
+        self.name = name
+        self.slots = slots
+        self.policy = policy
+        self.retry_after_seconds = retry_after_seconds
+        self.active = 0
+        self.lanes = {
+            lane.name: LaneState(lane, limit=max(1, int(slots * lane.share))) for lane in policy.lanes.values()
+        }
+        # Highest priority first.
+        self._order = sorted(self.lanes.values(), key=lambda state: state.config.priority)
+
+    def _above(self, state: LaneState) -> List[LaneState]:
+        return [other for other in self._order if other.config.priority < state.config.priority]
+
+    def _waiting_above(self, state: LaneState) -> bool:
+        return any(other.waiters for other in self._above(state))
+
+    def _blocked(self, state: LaneState) -> bool:
+        """A free slot would go to an earlier request of this lane or of an uncapped lane above it."""
+        if state.waiters:
+            return True
+        return any(other.waiters and other.active < other.limit for other in self._above(state))
+
+    def _can_start(self, state: LaneState) -> bool:
+        return self.active < self.slots and state.active < state.limit
+
+    def _reject(self, detail: str) -> HTTPException:
+        return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(self.retry_after_seconds)})
+
+    def _grant(self, state: LaneState) -> None:
+        self.active += 1
+        state.active += 1
+
+    def _dispatch(self) -> None:
+        """Give free slots to waiting requests, highest-priority lane first."""
+        for state in self._order:
+            while state.waiters and self._can_start(state):
+                future, _ = state.waiters.popleft()
+                if future.done():
+                    continue
+                self._grant(state)
+                future.set_result(None)
+
+    def _preempt_below(self, state: LaneState) -> None:
+        for other in self._order:
+            if other.config.priority <= state.config.priority or not other.config.preemptible:
+                continue
+            while other.waiters:
+                future, _ = other.waiters.popleft()
+                if not future.done():
+                    other.preempted += 1
+                    future.set_exception(self._reject(f"Preempted by higher-priority traffic in {self.name}"))
+
+    def _release(self, lane: str) -> None:
+        self.active -= 1
+        self.lanes[lane].active -= 1
+        self._dispatch()
+
+    async def admit(self, lane: str, request: Request, deadline: Deadline, poll_seconds: float = 0.25) -> Lease:
+        """Wait for a slot in ``lane``; 429 when the lane is full or preempted, 499/504 when the caller gives up."""
+        state = self.lanes[lane]
+        loop = asyncio.get_running_loop()
+        queued_at = loop.time()
+        if not self._blocked(state) and self._can_start(state):
+            self._grant(state)
+            state.record_wait(queued_at, 0.0)
+            return Lease(self, lane, 0.0)
+        if state.config.preemptible and self._waiting_above(state):
+            state.preempted += 1
+            raise self._reject(f"Preempted by higher-priority traffic in {self.name}")
+        if len(state.waiters) >= state.config.max_queue:
+            state.queue_full += 1
+            raise self._reject(f"Lane {lane} is full in {self.name}, retry shortly")
+
+        future = loop.create_future()
+        state.waiters.append((future, queued_at))
+        self._preempt_below(state)
+        give_up = deadline.remaining()
+        if state.config.max_wait_seconds is not None:
+            give_up = min(give_up, state.config.max_wait_seconds)
+        give_up_at = queued_at + give_up
+        try:
+            while True:
+                done, _ = await asyncio.wait({future}, timeout=min(poll_seconds, max(give_up_at - loop.time(), 0.01)))
+                if done:
+                    break
+                if await request.is_disconnected():
+                    state.abandoned += 1
+                    raise HTTPException(status_code=499, detail="Client closed request")
+                if loop.time() >= give_up_at:
+                    if deadline.expired():
+                        raise HTTPException(status_code=504, detail="Deadline exceeded waiting for an upstream slot")
+                    state.timed_out += 1
+                    raise self._reject(f"Timed out waiting in lane {lane} of {self.name}")
+        except BaseException:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Granted just as the caller gave up: hand the slot on.
+                self._release(lane)
+            else:
+                future.cancel()
+                self._drop_waiter(state, future)
+            raise
+        future.result()  # re-raises a preemption
+        waited = loop.time() - queued_at
+        state.record_wait(loop.time(), waited)
+        return Lease(self, lane, waited)
+
+    def _drop_waiter(self, state: LaneState, future: asyncio.Future) -> None:
+        for index, (waiter, _) in enumerate(state.waiters):
+            if waiter is future:
+                del state.waiters[index]
+                break
+        # Lanes below may have been held back by this waiter.
+        self._dispatch()
+
+    def slot(self, lane: str, request: Request, deadline: Deadline) -> "LeaseContext":
+        return LeaseContext(self, lane, request, deadline)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {
+            "slots": self.slots,
+            "active": self.active,
+            "lanes": {
+                name: {
+                    "priority": state.config.priority,
+                    "limit": state.limit,
+                    "active": state.active,
+                    "waiting": len(state.waiters),
+                    "admitted": state.admitted,
+                    "rejected": {
+                        "queueFull": state.queue_full,
+                        "preempted": state.preempted,
+                        "timedOut": state.timed_out,
+                    },
+                    "abandoned": state.abandoned,
+                    "queueWait": state.wait_percentiles(now),
+                }
+                for name, state in self.lanes.items()
+            },
+        }
+
+
+class LeaseContext:
+    def __init__(self, pool: LanePool, lane: str, request: Request, deadline: Deadline):
+        self.args = (pool, lane, request, deadline)
+        self.lease: Optional[Lease] = None
+
+    async def __aenter__(self) -> Lease:
+        pool, lane, request, deadline = self.args
+        self.lease = await pool.admit(lane, request, deadline)
+        return self.lease
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.lease.release()
+
+
+class _Connected:
+    """Stand-in request for the bench: the client never disconnects."""
+
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+async def simulate(args, flood: bool, lanes: bool) -> Dict[str, List[float]]:
+    """Interactive requests at a steady rate, optionally alongside batch clients that retry on 429.
+
+    Upstream calls are sleeps of ``--call-ms`` (with 30% jitter). Without lanes both kinds share a plain
+    FIFO semaphore of the same size, which is how the gateway queued calls before.
+    """
+    policy = LanePolicy(DEFAULT_LANES)
+    pool = LanePool("bench", args.slots, policy, retry_after_seconds=0)
+    fifo = asyncio.Semaphore(args.slots)
+    rng = random.Random(7)
+    latencies: Dict[str, List[float]] = {"interactive": [], "batch": []}
+    stop = asyncio.Event()
+    request = _Connected()
+
+    async def call(lane: str) -> bool:
+        started = time.perf_counter()
+        seconds = args.call_ms / 1000 * rng.uniform(0.7, 1.3)
+        if lanes:
+            try:
+                async with pool.slot(lane, request, Deadline(60.0)):
+                    await asyncio.sleep(seconds)
+            except HTTPException:
+                return False
+        else:
+            async with fifo:
+                await asyncio.sleep(seconds)
+        latencies[lane].append(time.perf_counter() - started)
+        return True
+
+    async def batch_client():
+        while not stop.is_set():
+            if not await call("batch"):
+                await asyncio.sleep(args.call_ms / 1000)  # honour Retry-After with a short backoff
+
+    batch = [asyncio.ensure_future(batch_client()) for _ in range(args.batch_clients if flood else 0)]
+    await asyncio.sleep(0.05 if flood else 0)
+    interactive = []
+    for _ in range(args.requests):
+        interactive.append(asyncio.ensure_future(call("interactive")))
+        await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*interactive)
+    stop.set()
+    await asyncio.gather(*batch)
+    return latencies
+
+
+def run_bench(args) -> int:
+    print(
+        f"{args.slots} slots, {args.call_ms:.0f} ms calls, {args.rate:.0f} interactive req/s, "
+        f"{args.batch_clients} batch clients"
+    )
+    print(f"{'':>22}  {'chat p50 ms':>11}  {'chat p95 ms':>11}  {'batch done/s':>12}")
+    for label, flood, lanes in (
+        ("chat only", False, False),
+        ("flood, one queue", True, False),
+        ("flood, lanes", True, True),
+    ):
+        started = time.perf_counter()
+        latencies = asyncio.run(simulate(args, flood, lanes))
+        elapsed = time.perf_counter() - started
+        chat = np.array(latencies["interactive"]) * 1000
+        print(
+            f"{label:>22}  {np.percentile(chat, 50):>11.1f}  {np.percentile(chat, 95):>11.1f}  "
+            f"{len(latencies['batch']) / elapsed:>12.1f}"
+        )
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m app.lanes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="Interactive latency with and without a concurrent batch flood")
+    bench.add_argument("--slots", type=int, default=30)
+    bench.add_argument("--call-ms", type=float, default=200.0, help="Simulated upstream call duration")
+    bench.add_argument("--rate", type=float, default=40.0, help="Interactive requests per second")
+    bench.add_argument("--requests", type=int, default=400, help="Interactive requests")
+    bench.add_argument("--batch-clients", type=int, default=300, help="Concurrent batch callers")
+    return run_bench(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""Gateway throughput under gunicorn at several worker counts, against a stub Bedrock.
+
+    python -m app.loadtest --workers 1,2,3,4
+
+starts a local stub of the Bedrock control-plane and runtime APIs (each
+``invoke_model`` answers a Nova-style body after ``--bedrock-ms``), then, for
+each worker count, runs ``gunicorn app.main:app --config gunicorn.conf.py`` with
+``WEB_CONCURRENCY`` set to that count and drives it with ``--concurrency``
+clients sending completions and ``/models`` requests. boto3 is pointed at the
+stub through ``AWS_ENDPOINT_URL_BEDROCK`` and ``AWS_ENDPOINT_URL_BEDROCK_RUNTIME``,
+so the request path is the real one end to end.
+
+The report shows requests per second, completion latency, and how many
+``list_foundation_models`` calls reached the stub: with the catalog cached in
+the shared store it stays near one per run whatever the worker count (workers
+that miss at the same moment each fetch it once).
+Throughput only grows with workers while the gateway, not the client or the
+stub, is CPU-bound, so run it on a host with at least as many cores as workers.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import httpx
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_ID = "amazon.nova-lite-v1:0"
+API_KEY = "loadtest"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_stub(port: int, delay_seconds: float, catalog_calls) -> None:
+    """Answer ``list_foundation_models`` and ``invoke_model`` like Bedrock does, counting catalog calls."""
+    catalog = {
+        "modelSummaries": [
+            {
+                "modelId": MODEL_ID,
+                "modelName": "Nova Lite",
+                "outputModalities": ["TEXT"],
+                "inferenceTypesSupported": ["ON_DEMAND"],
+            }
+        ]
+    }
+    reply = {
+        "output": {"message": {"role": "assistant", "content": [{"text": "Stub answer. " * 20}]}},
+        "stopReason": "end_turn",
+        "usage": {"inputTokens": 40, "outputTokens": 60},
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, payload: dict) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with catalog_calls.get_lock():
+                catalog_calls.value += 1
+            self._send(catalog)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            time.sleep(delay_seconds)
+            self._send(reply)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer.daemon_threads = True
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def start_gateway(workers: int, port: int, stub_url: str, state_dir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [os.path.dirname(SERVICE_DIR), os.environ.get("PYTHONPATH")])),
+        "WEB_CONCURRENCY": str(workers),
+        "BIND": f"127.0.0.1:{port}",
+        "OPENWEBUI_GATEWAY_API_KEY": API_KEY,
+        "AWS_ENDPOINT_URL_BEDROCK": stub_url,
+        "AWS_ENDPOINT_URL_BEDROCK_RUNTIME": stub_url,
+        "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+        "AWS_ACCESS_KEY_ID": "loadtest",
+        "AWS_SECRET_ACCESS_KEY": "loadtest",
+        "GATEWAY_SHARED_STATE_PATH": os.path.join(state_dir, f"state-{workers}.sqlite3"),
+        "GATEWAY_USAGE_DB_PATH": os.path.join(state_dir, f"usage-{workers}.sqlite3"),
+        "LOG_LEVEL": "WARNING",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app.main:app", "--config", "gunicorn.conf.py"]
+        + ["--access-logfile", "/dev/null"],
+        cwd=SERVICE_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, base_url: str, timeout_seconds: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(f"{base_url}/readyz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Gateway at {base_url} did not become ready")
+
+
+async def drive(base_url: str, requests: int, concurrency: int, models_share: float) -> dict:
+    headers = {"x-openwebui-api-key": API_KEY}
+    body = {"modelId": MODEL_ID, "prompt": "Summarize the release notes.", "responseFormat": "compact"}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+    models_every = int(1 / models_share) if models_share > 0 else 0
+
+    async with httpx.AsyncClient(timeout=60.0, limits=limits) as client:
+        await wait_ready(client, base_url)
+
+        async def worker() -> None:
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                if models_every and remaining % models_every == 0:
+                    response = await client.get(f"{base_url}/models", headers=headers)
+                else:
+                    response = await client.post(f"{base_url}/api/v1/completions", headers=headers, json=body)
+                    latencies.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    timings = np.array(latencies) * 1000
+    return {
+        "rps": requests / elapsed,
+        "p50": float(np.percentile(timings, 50)),
+        "p95": float(np.percentile(timings, 95)),
+        "errors": errors,
+    }
+
+
+def run(args) -> int:
+    stub_port = free_port()
+    catalog_calls = multiprocessing.Value("i", 0)
+    stub = multiprocessing.Process(
+        target=serve_stub, args=(stub_port, args.bedrock_ms / 1000, catalog_calls), daemon=True
+    )
+    stub.start()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    print(
+        f"{args.requests} requests, {args.concurrency} clients, stub Bedrock {args.bedrock_ms:.0f} ms, "
+        f"{os.cpu_count()} CPUs"
+    )
+    print(f"{'workers':>7}  {'req/s':>8}  {'p50 ms':>8}  {'p95 ms':>8}  {'errors':>6}  {'catalog calls':>13}")
+    try:
+        with tempfile.TemporaryDirectory() as state_dir:
+            for workers in args.workers:
+                port = free_port()
+                catalog_calls.value = 0
+                gateway = start_gateway(workers, port, stub_url, state_dir)
+                try:
+                    result = asyncio.run(
+                        drive(f"http://127.0.0.1:{port}", args.requests, args.concurrency, args.models_share)
+                    )
+                finally:
+                    gateway.terminate()
+                    gateway.wait(timeout=60)
+                print(
+                    f"{workers:>7}  {result['rps']:>8.1f}  {result['p50']:>8.1f}  {result['p95']:>8.1f}  "
+                    f"{result['errors']:>6}  {catalog_calls.value:>13}"
+                )
+    finally:
+        stub.terminate()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m app.loadtest")
+    parser.add_argument(
+        "--workers",
+        type=lambda value: [int(entry) for entry in value.split(",")],
+        default=[1, 2, 3, 4],
+        help="Comma-separated gunicorn worker counts",
+    )
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=48, help="Concurrent clients")
+    parser.add_argument("--bedrock-ms", type=float, default=20.0, help="Stub invoke_model latency")
+    parser.add_argument("--models-share", type=float, default=0.1, help="Share of requests that call /models")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,48 @@
+import asyncio
+import functools
 import json
 import logging
+import math
 import os
-from typing import List, Optional
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, List, Literal, Optional, Tuple, TypeVar
 
+import anyio.to_thread
 import boto3
-from botocore.exceptions import ClientError
-from fastapi import Depends, FastAPI, Header, HTTPException
-from fastapi.responses import JSONResponse
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError, ReadTimeoutError
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
-logging.basicConfig(level=logging.INFO)
+from app.budgets import BudgetPolicy, output_read_timeout
+from app.circuit import CircuitBreaker, CircuitRegistry
+from app.codecs import (
+    GenerationParams,
+    NormalizedOutput,
+    build_converse_request,
+    parse_converse_response,
+    resolve_codec,
+)
+from app.context_compression import ContextCompressor, ScoredContext, uncompressed
+from app.deadlines import CancellationStats, Deadline, deadline_dependency, estimate_tokens, run_until_disconnect
+from app.embeddings import build_embedding_body, embedding_family, parse_embedding_body
+from app.lanes import LANE_HEADER, Lease, LanePolicy, LanePool
+from app.rerank import DOCUMENTS_PER_CALL, build_rerank_body, is_rerank_model, parse_rerank_body
+from app.routing import AUTO_MODEL_ID, ModelRouter, RoutingDecision, load_profiles
+from app.shared_store import SharedStore, default_store_path
+from app.usage import UsageEntry, UsageLedger
+from common.compression import CompressionMiddleware
+from common.logs import RequestIdMiddleware, pipeline_from_env
+from common.profiling import RequestTracker, RequestTrackingMiddleware, build_admin_router, stage
+from common.saturation import LoadSheddingMiddleware, SaturationMonitor
+
+T = TypeVar("T")
+
+log_pipeline = pipeline_from_env("bedrock-gateway")
+log_pipeline.install()
 
 API_KEY_ENV = "OPENWEBUI_GATEWAY_API_KEY"
 api_key = os.environ.get(API_KEY_ENV)
@@ -17,18 +50,182 @@ api_key = os.environ.get(API_KEY_ENV)
 if not api_key:
     raise RuntimeError(f"{API_KEY_ENV} is required to run the gateway")
 
-bedrock_client = boto3.client("bedrock")
-runtime_client = boto3.client("bedrock-runtime")
+# Extra named keys ("name:secret,name:secret") so limits can differ per caller; the shared key is "openwebui".
+ADMIN_KEY_NAME = "openwebui"
+API_KEYS = {api_key: ADMIN_KEY_NAME}
+for entry in os.environ.get("GATEWAY_API_KEYS", "").split(","):
+    if entry.strip():
+        key_name, _, secret = entry.strip().partition(":")
+        if not key_name or not secret:
+            raise RuntimeError("GATEWAY_API_KEYS entries must look like name:secret")
+        API_KEYS[secret] = key_name
+
+MODEL_CATALOG_TTL_SECONDS = float(os.environ.get("MODEL_CATALOG_TTL_SECONDS", "300"))
+RATE_LIMIT_PER_MINUTE = int(os.environ.get("GATEWAY_RATE_LIMIT_PER_MINUTE", "0"))
+USE_CONVERSE_DEFAULT = os.environ.get("GATEWAY_USE_CONVERSE", "false").lower() == "true"
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get("COMPRESSION_MINIMUM_SIZE", "1024"))
+MAX_REQUEST_SECONDS = float(os.environ.get("GATEWAY_MAX_REQUEST_SECONDS", "120"))
+MIN_UPSTREAM_SECONDS = float(os.environ.get("GATEWAY_MIN_UPSTREAM_SECONDS", "1.0"))
+STREAM_TOKEN_ESTIMATE_CAP = 2048
+READ_TIMEOUT_BASE_SECONDS = float(os.environ.get("GATEWAY_READ_TIMEOUT_BASE_SECONDS", "10"))
+MIN_TOKENS_PER_SECOND = float(os.environ.get("GATEWAY_MIN_TOKENS_PER_SECOND", "15"))
+
+context_compressor = ContextCompressor.from_env(
+    enabled=os.environ.get("GATEWAY_CONTEXT_COMPRESSION", "true"),
+    default_tokens=os.environ.get("GATEWAY_CONTEXT_TOKENS", "2000"),
+    raw_limits=os.environ.get("GATEWAY_CONTEXT_TOKEN_LIMITS"),
+)
+
+budgets = BudgetPolicy.from_env(
+    default_max_tokens=int(os.environ.get("GATEWAY_DEFAULT_MAX_TOKENS", "1024")),
+    max_tokens_cap=int(os.environ.get("GATEWAY_MAX_TOKENS_CAP", "4096")),
+    raw_limits=os.environ.get("GATEWAY_GENERATION_LIMITS"),
+)
+
+saturation = SaturationMonitor(
+    max_in_flight=int(os.environ.get("SHED_MAX_IN_FLIGHT", "80")),
+    max_queue_depth=int(os.environ.get("SHED_MAX_QUEUE_DEPTH", "20")),
+    max_loop_lag_ms=float(os.environ.get("SHED_MAX_LOOP_LAG_MS", "500")),
+)
+SHUTDOWN_READINESS_GRACE_SECONDS = float(os.environ.get("SHUTDOWN_READINESS_GRACE_SECONDS", "5"))
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", "30"))
+
+# Shared by all gunicorn workers so caches and limits are not duplicated per process.
+shared_store = SharedStore(os.environ.get("GATEWAY_SHARED_STATE_PATH") or default_store_path())
+
+cancellation = CancellationStats(
+    shared_store, flush_interval=float(os.environ.get("USAGE_FLUSH_INTERVAL_SECONDS", "2"))
+)
+usage_ledger = UsageLedger(
+    os.environ.get("GATEWAY_USAGE_DB_PATH")
+    or os.path.join(os.path.dirname(default_store_path()), "bedrock-gateway-usage.sqlite3"),
+    capacity=int(os.environ.get("USAGE_BUFFER_SIZE", "10000")),
+    flush_interval=float(os.environ.get("USAGE_FLUSH_INTERVAL_SECONDS", "2")),
+    retention_seconds=float(os.environ.get("USAGE_RETENTION_HOURS", "168")) * 3600,
+)
+request_deadline = deadline_dependency(MAX_REQUEST_SECONDS)
+EMBEDDING_MODEL_ID = os.environ.get("GATEWAY_EMBEDDING_MODEL", "amazon.titan-embed-text-v2:0")
+RERANK_MODEL_ID = os.environ.get("GATEWAY_RERANK_MODEL", "cohere.rerank-v3-5:0")
+lane_policy = LanePolicy.from_env(
+    os.environ.get("GATEWAY_LANES"), os.environ.get("GATEWAY_LANE_KEYS"), os.environ.get("GATEWAY_LANE_ROUTES")
+)
+# Bedrock calls wait for a slot here, by lane priority, instead of in the threadpool's FIFO queue. An embedding or
+# rerank request takes one slot and runs up to EMBEDDING_FANOUT calls in it (Titan embeds one text per call), so
+# completion slots plus embedding slots times the fanout should stay below the threadpool's 40 threads.
+completion_lanes = LanePool(
+    "completions",
+    int(os.environ.get("GATEWAY_UPSTREAM_CONCURRENCY", "30")),
+    lane_policy,
+    retry_after_seconds=saturation.retry_after_seconds,
+)
+embedding_lanes = LanePool(
+    "embeddings",
+    int(os.environ.get("GATEWAY_EMBEDDING_CONCURRENCY", "2")),
+    lane_policy,
+    retry_after_seconds=saturation.retry_after_seconds,
+)
+EMBEDDING_FANOUT = int(os.environ.get("GATEWAY_EMBEDDING_FANOUT", "4"))
+tracker = RequestTracker(
+    float(os.environ.get("SLOW_REQUEST_THRESHOLD_SECONDS", "5")),
+    slow_capacity=int(os.environ.get("SLOW_REQUEST_BUFFER_SIZE", "100")),
+)
 
-app = FastAPI(title="Bedrock Access Gateway", version="0.2.0")
+bedrock_client = boto3.client("bedrock")
+circuits = CircuitRegistry(
+    region=bedrock_client.meta.region_name,
+    fallbacks=json.loads(os.environ.get("GATEWAY_CIRCUIT_FALLBACKS") or "{}"),
+    error_rate_threshold=float(os.environ.get("CIRCUIT_ERROR_RATE", "0.5")),
+    slow_call_seconds=float(os.environ.get("CIRCUIT_SLOW_CALL_SECONDS", "30")),
+    min_samples=int(os.environ.get("CIRCUIT_MIN_SAMPLES", "10")),
+    cooldown_seconds=float(os.environ.get("CIRCUIT_COOLDOWN_SECONDS", "30")),
+)
+router = ModelRouter(
+    load_profiles(os.environ.get("GATEWAY_AUTO_MODELS")),
+    default_policy=os.environ.get("GATEWAY_ROUTING_POLICY", "fastest"),
+    max_error_rate=float(os.environ.get("ROUTING_MAX_ERROR_RATE", "0.25")),
+)
+runtime_clients = {}
+runtime_clients_lock = threading.Lock()
+
+
+def runtime_client_for(budget_seconds: float):
+    """Runtime client whose read timeout fits the remaining budget, bucketed to 5s so few clients exist."""
+    read_timeout = int(min(MAX_REQUEST_SECONDS, max(5, math.ceil(budget_seconds / 5) * 5)))
+    with runtime_clients_lock:
+        client = runtime_clients.get(read_timeout)
+        if client is None:
+            client = boto3.client(
+                "bedrock-runtime",
+                config=Config(
+                    read_timeout=read_timeout,
+                    connect_timeout=min(5, read_timeout),
+                    retries={"mode": "standard", "max_attempts": 2},
+                ),
+            )
+            runtime_clients[read_timeout] = client
+    return client
 
 
-def require_api_key(x_api_key: str = Header(..., alias="x-openwebui-api-key")):
-    if x_api_key != api_key:
+app = FastAPI(title="Bedrock Access Gateway", version="0.2.0")
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+app.add_middleware(LoadSheddingMiddleware, monitor=saturation)
+app.add_middleware(RequestTrackingMiddleware, tracker=tracker)
+app.add_middleware(RequestIdMiddleware)
+app.include_router(build_admin_router(tracker, os.environ.get("ADMIN_API_KEY")))
+app.state.drain = functools.partial(saturation.drain, SHUTDOWN_READINESS_GRACE_SECONDS, SHUTDOWN_DRAIN_SECONDS)
+
+
+@app.on_event("startup")
+async def start_saturation_monitor():
+    # Runs in each forked worker: restart the log listener and take over uvicorn's loggers.
+    log_pipeline.install()
+    saturation.start()
+    usage_ledger.start()
+    cancellation.start()
+
+
+@app.on_event("shutdown")
+async def cleanup_clients():
+    await saturation.stop()
+    await usage_ledger.stop()
+    await cancellation.stop()
+    bedrock_client.close()
+    for client in runtime_clients.values():
+        client.close()
+    log_pipeline.stop()
+
+
+def require_api_key(x_api_key: str = Header(..., alias="x-openwebui-api-key")) -> str:
+    """Return the name of the caller's API key."""
+    key_name = API_KEYS.get(x_api_key)
+    if key_name is None:
         logging.warning("Rejected request with invalid API key")
         raise HTTPException(status_code=401, detail="Invalid API key")
 
-    return True
+    return key_name
+
+
+def request_lane(
+    request: Request,
+    key_name: str = Depends(require_api_key),
+    requested: Optional[str] = Header(None, alias=LANE_HEADER),
+) -> str:
+    return lane_policy.classify(key_name, request.url.path, requested)
+
+
+def enforce_rate_limit():
+    if RATE_LIMIT_PER_MINUTE <= 0:
+        return
+
+    if shared_store.incr_window("ratelimit:completions", 60.0) > RATE_LIMIT_PER_MINUTE:
+        raise HTTPException(status_code=429, detail="Rate limit exceeded, retry shortly")
+
+
+def is_upstream_fault(exc: ClientError) -> bool:
+    """Throttling and 5xx responses count against upstream health; caller mistakes do not."""
+    error = exc.response.get("Error", {}) if hasattr(exc, "response") else {}
+    status = exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 500) if hasattr(exc, "response") else 500
+    return status >= 500 or status == 429 or "Throttl" in error.get("Code", "")
 
 
 class CompletionRequest(BaseModel):
@@ -36,12 +233,44 @@ class CompletionRequest(BaseModel):
         role: str = Field(..., description="Message role (user/assistant/system)")
         content: str = Field(..., description="Plain text content")
 
-    modelId: str = Field(..., description="Bedrock model identifier (e.g., anthropic.claude-3-opus)")
+    modelId: str = Field(
+        ..., description="Bedrock model identifier (e.g., anthropic.claude-3-opus), or 'auto' to let the gateway pick"
+    )
     prompt: Optional[str] = Field(None, description="Prompt text to send to Bedrock")
     messages: Optional[List[ChatMessage]] = Field(
         None, description="Optional chat-style messages; if provided, overrides prompt"
     )
     temperature: Optional[float] = Field(None, ge=0.0, le=1.0, description="Optional temperature hint")
+    maxTokens: Optional[int] = Field(
+        None, ge=1, description="Maximum output tokens; defaulted and capped per model and API key"
+    )
+    topP: Optional[float] = Field(None, ge=0.0, le=1.0, description="Optional nucleus sampling threshold")
+    stopSequences: Optional[List[str]] = Field(
+        None, max_length=4, description="Stop generating when any of these strings is produced"
+    )
+    responseFormat: Literal["raw", "compact"] = Field(
+        "raw", description="'compact' returns only the normalized output instead of the raw Bedrock body"
+    )
+    useConverse: Optional[bool] = Field(
+        None, description="Use the Bedrock Converse API when the model family supports it"
+    )
+    routingPolicy: Optional[Literal["fastest", "cheapest", "quality"]] = Field(
+        None, description="Policy used when modelId is 'auto' (defaults to GATEWAY_ROUTING_POLICY)"
+    )
+
+    class ContextPassage(BaseModel):
+        text: str = Field(..., description="Retrieved passage text")
+        source: Optional[str] = Field(None, description="Where the passage came from (file, URL)")
+
+    context: Optional[List[ContextPassage]] = Field(
+        None, max_length=100, description="Retrieved passages to ground the answer in; added to the last user turn"
+    )
+    compressContext: Optional[bool] = Field(
+        None, description="Keep only the context relevant to the question (defaults to GATEWAY_CONTEXT_COMPRESSION)"
+    )
+    contextTokens: Optional[int] = Field(
+        None, ge=1, description="Context budget in tokens after compression; capped by the model's budget"
+    )
 
 
 @app.get("/healthz")
@@ -49,14 +278,29 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/readyz")
+async def readiness():
+    reasons = saturation.readiness_reasons()
+    return JSONResponse(
+        status_code=503 if reasons else 200,
+        content={"status": "saturated" if reasons else "ok", "reasons": reasons, **saturation.snapshot()},
+    )
+
+
 @app.get("/models", dependencies=[Depends(require_api_key)])
 def list_models():
+    cached = shared_store.get_json("catalog:models")
+    if cached is not None:
+        return cached
+
     try:
         response = bedrock_client.list_foundation_models()
     except ClientError as exc:
+        saturation.record_upstream(not is_upstream_fault(exc))
         logging.exception("Bedrock list_foundation_models failed")
         raise HTTPException(status_code=502, detail="Bedrock list models failed") from exc
 
+    saturation.record_upstream(True)
     models = response.get("modelSummaries") or response.get("models") or []
 
     filtered_models = []
@@ -66,99 +310,642 @@ def list_models():
         if "TEXT" in outputs and "ON_DEMAND" in inference:
             filtered_models.append(model)
 
-    return {
+    catalog = {
         "models": filtered_models or models,
         "nextToken": response.get("nextToken"),
     }
+    shared_store.set_json("catalog:models", catalog, MODEL_CATALOG_TTL_SECONDS)
+    return catalog
+
+
+class BedrockError(HTTPException):
+    """HTTP error raised for a failed Bedrock call, remembering whether Bedrock (not the caller) was at fault."""
+
+    def __init__(self, status_code: int, detail: str, upstream_fault: bool):
+        super().__init__(status_code=status_code, detail=detail)
+        self.upstream_fault = upstream_fault
+
+
+def bedrock_error(exc: Exception) -> BedrockError:
+    if isinstance(exc, ClientError):
+        upstream_fault = is_upstream_fault(exc)
+        saturation.record_upstream(not upstream_fault)
+        error_detail = exc.response.get("Error", {}).get("Message") if hasattr(exc, "response") else str(exc)
+        return BedrockError(502, f"Bedrock invocation failed: {error_detail}", upstream_fault)
 
+    saturation.record_upstream(False)
+    if isinstance(exc, ReadTimeoutError):
+        return BedrockError(504, "Bedrock did not respond within the request deadline", True)
+    return BedrockError(502, f"Bedrock invocation failed: {exc}", True)
 
-@app.post("/api/v1/completions", dependencies=[Depends(require_api_key)])
-def invoke_completion(payload: CompletionRequest):
+
+def select_model(payload: CompletionRequest, messages) -> Tuple[str, Optional[RoutingDecision]]:
+    """Resolve ``modelId: "auto"`` to a concrete model; explicit model IDs pass through unchanged."""
+    stage("route")
+    if payload.modelId != AUTO_MODEL_ID:
+        return payload.modelId, None
+
+    decision = router.route(messages, payload.routingPolicy, lambda model_id: circuits.get(model_id).retry_after() == 0)
+    if decision is None:
+        raise HTTPException(
+            status_code=503, detail="No healthy model available for auto routing", headers={"Retry-After": "5"}
+        )
+    return decision.model_id, decision
+
+
+def acquire_circuit(model_id: str) -> Tuple[str, CircuitBreaker]:
+    """Return the model to call (the requested one or its configured fallback) and its breaker."""
+    stage("circuit")
+    breaker, rejection = circuits.acquire(model_id)
+    if breaker is None:
+        retry_after = max(1, math.ceil(circuits.get(model_id).retry_after()))
+        raise HTTPException(status_code=503, detail=rejection, headers={"Retry-After": str(retry_after)})
+    if breaker.model_id != model_id:
+        logging.warning("Circuit open for %s, falling back to %s", model_id, breaker.model_id)
+    return breaker.model_id, breaker
+
+
+def prepare_completion(payload: CompletionRequest):
     if not payload.prompt and not payload.messages:
         raise HTTPException(status_code=400, detail="Provide either 'prompt' or 'messages'")
 
-    def build_chat_like_prompt(messages: List[CompletionRequest.ChatMessage]) -> str:
-        """Render chat turns into a plain prompt for models that don't support chat natively."""
-        parts = []
-        role_map = {"user": "User", "assistant": "Assistant", "system": "System"}
-        for msg in messages:
-            role = role_map.get(msg.role, msg.role)
-            parts.append(f"{role}:\n{msg.content}")
-        # Hint the model to continue as the assistant.
-        parts.append("Assistant:")
-        return "\n\n".join(parts)
-
-    # Normalize prompt/messages for downstream models.
     if payload.messages:
-        prompt_text = build_chat_like_prompt(payload.messages)
+        messages = [(msg.role, msg.content) for msg in payload.messages]
+        raw_prompt = None
     else:
-        prompt_text = payload.prompt or ""
+        messages = [("user", payload.prompt)]
+        raw_prompt = payload.prompt
+    params = GenerationParams(temperature=payload.temperature, top_p=payload.topP, stop=payload.stopSequences)
+    return GroundedPrompt(payload, messages, raw_prompt), params
+
+
+def last_user_index(messages) -> int:
+    return max((index for index, (role, _) in enumerate(messages) if role == "user"), default=len(messages) - 1)
+
+
+class GroundedPrompt:
+    """The request's messages with its context passages compressed to the budget of the model being called."""
+
+    def __init__(self, payload: CompletionRequest, messages, raw_prompt: Optional[str]):
+        self.messages = messages
+        self.raw_prompt = raw_prompt
+        self.passages = [(passage.source, passage.text) for passage in payload.context or []]
+        self.requested_tokens = payload.contextTokens
+        self.compress = context_compressor.enabled if payload.compressContext is None else payload.compressContext
+        self.scored: Optional[ScoredContext] = None
+        self.report: Optional[dict] = None
+        self._grounded = {}
+
+    async def score(self) -> None:
+        """Split, dedupe and score the passages in a thread; large contexts would otherwise stall the event loop."""
+        if self.passages and self.compress:
+            stage("compress")
+            question = self.messages[last_user_index(self.messages)][1]
+            self.scored = await anyio.to_thread.run_sync(ScoredContext, question, self.passages)
+
+    def for_model(self, model_id: str) -> Tuple[list, Optional[str]]:
+        """Messages and raw prompt for ``model_id``; ``report`` then describes the context that was sent."""
+        if not self.passages:
+            return self.messages, self.raw_prompt
+        budget = context_compressor.budget(model_id, self.requested_tokens) if self.scored else None
+        if budget not in self._grounded:
+            passages, report = self.scored.pack(budget) if self.scored else uncompressed(self.passages)
+            messages = ground_messages(self.messages, passages)
+            raw_prompt = messages[-1][1] if self.raw_prompt is not None else None
+            self._grounded[budget] = (messages, raw_prompt, report)
+        messages, raw_prompt, self.report = self._grounded[budget]
+        return messages, raw_prompt
+
+
+def ground_messages(messages, passages) -> list:
+    """Put numbered context passages in front of the last user message.
+
+    Passages keep the number of their position in the request, so citations still
+    match when compression drops some of them.
+    """
+    blocks = [
+        f"[{passage.index}]{f' ({passage.source})' if passage.source else ''}\n{passage.text}" for passage in passages
+    ]
+    last_user = last_user_index(messages)
+    role, question = messages[last_user]
+    grounded = (
+        "Answer using the context below when it is relevant, and cite passages by number.\n\n"
+        + "\n\n".join(blocks)
+        + f"\n\nQuestion: {question}"
+    )
+    return messages[:last_user] + [(role, grounded)] + messages[last_user + 1 :]
+
+
+def apply_output_budget(payload: CompletionRequest, model_id: str, key_name: str, params: GenerationParams) -> bool:
+    """Set ``params.max_tokens`` from the request, model and key limits; return True if the request was capped."""
+    params.max_tokens, capped = budgets.resolve(model_id, key_name, payload.maxTokens)
+    return capped
 
-    def is_bedrock_chat_model(model_id: str) -> bool:
-        return model_id.startswith(("anthropic.", "amazon.nova"))
 
-    def is_openai_chat_model(model_id: str) -> bool:
-        return model_id.startswith(("openai.", "nvidia."))
+def upstream_client(deadline: Deadline, params: GenerationParams):
+    """Read timeout sized to the output budget, never beyond the caller's deadline."""
+    expected = output_read_timeout(params.max_tokens, READ_TIMEOUT_BASE_SECONDS, MIN_TOKENS_PER_SECOND)
+    return runtime_client_for(min(deadline.remaining(), expected))
 
-    if is_bedrock_chat_model(payload.modelId):
-        # Bedrock chat schema (Claude/Nova).
-        if payload.messages:
-            messages_payload = [
-                {"role": msg.role, "content": [{"type": "text", "text": msg.content}]}
-                for msg in payload.messages
-            ]
+
+def ensure_time_left(deadline: Deadline, messages) -> None:
+    """Refuse work that cannot finish before the caller gives up on it."""
+    if deadline.remaining() < MIN_UPSTREAM_SECONDS:
+        cancellation.record(
+            "skippedCalls",
+            seconds_saved=deadline.remaining(),
+            tokens_saved=sum(estimate_tokens(content) for _, content in messages),
+        )
+        raise HTTPException(status_code=504, detail="Not enough time left before the request deadline")
+
+
+def record_call(breaker: CircuitBreaker, failed: bool, started: float) -> None:
+    latency = time.monotonic() - started
+    breaker.record(failed, latency)
+    router.record(breaker.model_id, latency, failed)
+
+
+async def call_bedrock(request: Request, deadline: Deadline, breaker: CircuitBreaker, func):
+    stage("bedrock")
+    started = time.monotonic()
+    try:
+        result = await run_until_disconnect(request, deadline, func)
+    except BedrockError as exc:
+        if exc.upstream_fault:
+            record_call(breaker, True, started)
         else:
-            messages_payload = [{"role": "user", "content": [{"type": "text", "text": prompt_text}]}]
-        body_payload = {"messages": messages_payload}
-    elif is_openai_chat_model(payload.modelId):
-        # OpenAI-style chat schema (GPT-OSS/NVIDIA).
-        if payload.messages:
-            messages_payload = [{"role": msg.role, "content": msg.content} for msg in payload.messages]
+            breaker.release()
+        raise
+    except HTTPException as exc:
+        if exc.status_code in (499, 504):
+            # The caller is gone or out of its own deadline: stop holding the request open for it. That says
+            # nothing about the model (an upstream read timeout is a BedrockError), so it must not trip the circuit.
+            cancellation.record("abandonedCalls", seconds_saved=deadline.remaining())
+            breaker.release()
         else:
-            messages_payload = [{"role": "user", "content": prompt_text}]
-        body_payload = {"messages": messages_payload}
-    else:
-        # Prompt-based schema for other models (e.g., Llama/Mistral/Qwen).
-        body_payload = {"prompt": prompt_text}
+            record_call(breaker, True, started)
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+
+    record_call(breaker, False, started)
+    stage("parse")
+    return result
 
-    if payload.temperature is not None:
-        body_payload["temperature"] = payload.temperature
 
+def invoke_model_blocking(client, model_id: str, body_payload: dict):
     try:
-        response = runtime_client.invoke_model(
-            modelId=payload.modelId,
+        response = client.invoke_model(
+            modelId=model_id,
             contentType="application/json",
             accept="application/json",
             body=json.dumps(body_payload).encode("utf-8"),
         )
-    except ClientError as exc:
+        streaming_body = response.get("body")
+        if streaming_body is None:
+            raise HTTPException(status_code=502, detail="Bedrock response missing payload")
+        body_bytes = streaming_body.read()
+        streaming_body.close()
+    except (ClientError, BotoCoreError) as exc:
         logging.exception("Bedrock invoke_model failed")
-        error_detail = exc.response.get("Error", {}).get("Message") if hasattr(exc, "response") else str(exc)
-        raise HTTPException(
-            status_code=502,
-            detail=f"Bedrock invocation failed: {error_detail}",
-        ) from exc
+        raise bedrock_error(exc) from exc
 
-    streaming_body = response.get("body")
-    if streaming_body is None:
-        raise HTTPException(status_code=502, detail="Bedrock response missing payload")
-
-    body_bytes = streaming_body.read()
-    streaming_body.close()
+    saturation.record_upstream(True)
     raw_body = body_bytes.decode("utf-8")
 
     try:
         parsed_body = json.loads(raw_body)
     except json.JSONDecodeError:
         parsed_body = {"output": raw_body}
+    return parsed_body, response.get("contentType")
 
-    return JSONResponse(
-        content={
-            "modelId": payload.modelId,
-            "body": parsed_body,
-            "metadata": {
-                "contentType": response.get("contentType"),
-                "modelId": payload.modelId,
-            },
-        }
+
+def converse_blocking(client, model_id: str, messages, params: GenerationParams, stream: bool = False):
+    request = build_converse_request(model_id, messages, params)
+    try:
+        response = client.converse_stream(**request) if stream else client.converse(**request)
+    except (ClientError, BotoCoreError) as exc:
+        logging.exception("Bedrock converse failed")
+        raise bedrock_error(exc) from exc
+
+    if not stream:
+        saturation.record_upstream(True)
+    response.pop("ResponseMetadata", None)
+    return response
+
+
+@app.post("/api/v1/completions", dependencies=[Depends(require_api_key), Depends(enforce_rate_limit)])
+async def invoke_completion(
+    payload: CompletionRequest,
+    request: Request,
+    deadline: Deadline = Depends(request_deadline),
+    key_name: str = Depends(require_api_key),
+    lane: str = Depends(request_lane),
+):
+    with usage_ledger.track(UsageEntry(key_name, payload.modelId)) as usage:
+        plan = await plan_completion(payload, deadline, key_name, usage)
+        lease = await admit_completion(plan, lane, request, deadline)
+        try:
+            return await complete(payload, request, deadline, usage, plan, lease)
+        finally:
+            lease.release()
+
+
+@dataclass
+class CompletionPlan:
+    """What a completion will call, settled before it waits for a lane slot."""
+
+    prompt: GroundedPrompt
+    params: GenerationParams
+    model_id: str
+    routing: Optional[RoutingDecision]
+    breaker: CircuitBreaker
+    capped: bool
+
+
+async def plan_completion(
+    payload: CompletionRequest, deadline: Deadline, key_name: str, usage: UsageEntry, stream: bool = False
+) -> CompletionPlan:
+    """Route and take a circuit permit up front, so an open circuit answers 503 at once instead of after queueing."""
+    prompt, params = prepare_completion(payload)
+    await prompt.score()
+    messages, _ = prompt.for_model(payload.modelId)
+    ensure_time_left(deadline, messages)
+    requested_model_id, routing = select_model(payload, messages)
+    if stream and not resolve_codec(requested_model_id).supports_converse:
+        raise HTTPException(status_code=400, detail=f"Streaming is not supported for {requested_model_id}")
+    model_id, breaker = acquire_circuit(requested_model_id)
+    usage.model_id = model_id
+    try:
+        capped = apply_output_budget(payload, model_id, key_name, params)
+    except BaseException:
+        breaker.release()
+        raise
+    return CompletionPlan(prompt, params, model_id, routing, breaker, capped)
+
+
+async def admit_completion(plan: CompletionPlan, lane: str, request: Request, deadline: Deadline) -> Lease:
+    """Wait for a completion slot, handing the circuit permit back if none is granted."""
+    stage("queue")
+    try:
+        return await completion_lanes.admit(lane, request, deadline)
+    except BaseException:
+        plan.breaker.release()
+        raise
+
+
+def record_output(usage: UsageEntry, model_id: str, output: NormalizedOutput) -> NormalizedOutput:
+    usage.model_id = model_id
+    usage.input_tokens = output.input_tokens
+    usage.output_tokens = output.output_tokens
+    return output
+
+
+async def complete(
+    payload: CompletionRequest,
+    request: Request,
+    deadline: Deadline,
+    usage: UsageEntry,
+    plan: CompletionPlan,
+    lease: Lease,
+):
+    model_id, params, breaker = plan.model_id, plan.params, plan.breaker
+    messages, raw_prompt = plan.prompt.for_model(model_id)
+    codec = resolve_codec(model_id)
+    client = upstream_client(deadline, params)
+    fields = response_fields(payload, model_id, plan.routing, params, plan.capped, plan.prompt.report, lease)
+
+    use_converse = USE_CONVERSE_DEFAULT if payload.useConverse is None else payload.useConverse
+    if use_converse and codec.supports_converse:
+        response = await call_bedrock(
+            request, deadline, breaker, functools.partial(converse_blocking, client, model_id, messages, params)
+        )
+        output = record_output(usage, model_id, parse_converse_response(response))
+        return completion_response(payload, fields, output, response, "application/json", api="converse")
+
+    body_payload = codec.build_body(messages, params, raw_prompt=raw_prompt)
+    parsed_body, content_type = await call_bedrock(
+        request, deadline, breaker, functools.partial(invoke_model_blocking, client, model_id, body_payload)
     )
+    output = codec.parse(parsed_body) if isinstance(parsed_body, dict) else NormalizedOutput(text=str(parsed_body))
+    record_output(usage, model_id, output)
+    return completion_response(payload, fields, output, parsed_body, content_type, api="invoke_model")
+
+
+def response_fields(
+    payload: CompletionRequest,
+    model_id: str,
+    routing: Optional[RoutingDecision],
+    params: GenerationParams,
+    capped: bool,
+    context: Optional[dict] = None,
+    lease: Optional[Lease] = None,
+) -> dict:
+    """Fields describing how the request was served, shared by JSON responses and the stream's done event."""
+    fields = {"modelId": model_id, "budget": {"maxTokens": params.max_tokens, "capped": capped}}
+    if context:
+        fields["context"] = context
+    if lease:
+        fields["lane"] = lease.to_dict()
+    requested_model_id = routing.model_id if routing else payload.modelId
+    if model_id != requested_model_id:
+        fields["fallbackFrom"] = requested_model_id
+    if routing:
+        fields["routing"] = routing.to_dict()
+    return fields
+
+
+def completion_response(
+    payload: CompletionRequest,
+    fields: dict,
+    output: NormalizedOutput,
+    raw_body,
+    content_type: Optional[str],
+    api: str,
+) -> JSONResponse:
+    content = {**fields, "output": output.to_dict()}
+    if payload.responseFormat == "compact":
+        return JSONResponse(content=content)
+
+    content["body"] = raw_body
+    content["metadata"] = {
+        "contentType": content_type,
+        "modelId": fields["modelId"],
+        "api": api,
+    }
+    return JSONResponse(content=content)
+
+
+class LeasedStreamingResponse(StreamingResponse):
+    """Holds the stream's lane slot until the response ends, since every event is read on a threadpool thread.
+
+    Cleanup happens here rather than only in the body generator, which never starts if the client leaves before
+    the first event: the upstream stream is closed and the usage entry recorded (as 499) either way.
+    """
+
+    def __init__(self, content, lease: Lease, event_stream, usage: UsageEntry, **kwargs):
+        super().__init__(content, **kwargs)
+        self.lease = lease
+        self.event_stream = event_stream
+        self.usage = usage
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                # Runs the generator's own cleanup if it stopped at a yield; a no-op if it finished or never started.
+                await self.body_iterator.aclose()
+            finally:
+                self.lease.release()
+                self.event_stream.close()
+                if not self.usage.finished:
+                    self.usage.status = 499
+                    usage_ledger.finish(self.usage)
+
+
+def sse_event(data: dict) -> str:
+    return f"data: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def stream_events(event_stream, fields: dict, deadline: Deadline, usage: UsageEntry):
+    """Relay ConverseStream events as SSE; close the upstream stream if the client or deadline goes away."""
+    events = iter(event_stream)
+    started = time.monotonic()
+    emitted_tokens = 0
+    output = NormalizedOutput(text="")
+    finished = False
+    stage("streaming")
+    try:
+        while not deadline.expired():
+            event = await anyio.to_thread.run_sync(next, events, None)
+            if event is None:
+                finished = True
+                break
+            if "contentBlockDelta" in event:
+                text = event["contentBlockDelta"].get("delta", {}).get("text", "")
+                if text:
+                    emitted_tokens += estimate_tokens(text)
+                    yield sse_event({"type": "delta", "text": text})
+            elif "messageStop" in event:
+                output.stop_reason = event["messageStop"].get("stopReason")
+            elif "metadata" in event:
+                token_usage = event["metadata"].get("usage") or {}
+                output.input_tokens = token_usage.get("inputTokens")
+                output.output_tokens = token_usage.get("outputTokens")
+
+        if finished:
+            saturation.record_upstream(True)
+            done = output.to_dict()
+            done.pop("text")
+            yield sse_event({"type": "done", **fields, "output": done})
+        else:
+            usage.status = 504
+            yield sse_event({"type": "error", "status": 504, "detail": "Deadline exceeded while streaming"})
+    except (ClientError, BotoCoreError) as exc:
+        logging.exception("Bedrock converse stream failed")
+        error = bedrock_error(exc)
+        usage.status = error.status_code
+        yield sse_event({"type": "error", "status": error.status_code, "detail": error.detail})
+    finally:
+        usage.input_tokens = output.input_tokens
+        usage.output_tokens = output.output_tokens or (emitted_tokens or None)
+        if not finished and usage.status < 400:
+            usage.status = 499
+        usage_ledger.finish(usage)
+        if not finished:
+            event_stream.close()
+            elapsed = max(time.monotonic() - started, 1e-3)
+            remaining = deadline.remaining()
+            # Extrapolate the output rate seen so far over the time the stream could still have run.
+            tokens_saved = min(STREAM_TOKEN_ESTIMATE_CAP - emitted_tokens, emitted_tokens / elapsed * remaining)
+            cancellation.record("cancelledStreams", seconds_saved=remaining, tokens_saved=max(0.0, tokens_saved))
+
+
+@app.post("/api/v1/completions/stream", dependencies=[Depends(require_api_key), Depends(enforce_rate_limit)])
+async def stream_completion(
+    payload: CompletionRequest,
+    request: Request,
+    deadline: Deadline = Depends(request_deadline),
+    key_name: str = Depends(require_api_key),
+    lane: str = Depends(request_lane),
+):
+    with usage_ledger.track(UsageEntry(key_name, payload.modelId)) as usage:
+        plan = await plan_completion(payload, deadline, key_name, usage, stream=True)
+        lease = await admit_completion(plan, lane, request, deadline)
+        try:
+            return await start_stream(payload, request, deadline, usage, plan, lease)
+        finally:
+            if not usage.deferred:
+                lease.release()
+
+
+async def start_stream(
+    payload: CompletionRequest,
+    request: Request,
+    deadline: Deadline,
+    usage: UsageEntry,
+    plan: CompletionPlan,
+    lease: Lease,
+):
+    model_id, params, breaker = plan.model_id, plan.params, plan.breaker
+    messages, _ = plan.prompt.for_model(model_id)
+    client = upstream_client(deadline, params)
+
+    response = await call_bedrock(
+        request,
+        deadline,
+        breaker,
+        functools.partial(converse_blocking, client, model_id, messages, params, stream=True),
+    )
+    # From here the stream records the usage entry when it ends.
+    usage.deferred = True
+    fields = response_fields(payload, model_id, plan.routing, params, plan.capped, plan.prompt.report, lease)
+    return LeasedStreamingResponse(
+        stream_events(response["stream"], fields, deadline, usage),
+        lease,
+        response["stream"],
+        usage,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def run_slices(calls: Iterable[Callable[[], Awaitable[T]]], limit: int = EMBEDDING_FANOUT) -> List[T]:
+    """Run one request's upstream calls, ``limit`` at a time, in order; the first failure cancels the rest."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(call):
+        async with semaphore:
+            return await call()
+
+    tasks = [asyncio.ensure_future(bounded(call)) for call in calls]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+class EmbeddingRequest(BaseModel):
+    texts: List[str] = Field(..., min_length=1, max_length=256, description="Texts to embed, in order")
+    modelId: Optional[str] = Field(None, description="Embedding model (defaults to GATEWAY_EMBEDDING_MODEL)")
+    dimensions: Optional[int] = Field(None, description="Output size for models that support it (Titan v2)")
+    inputType: Literal["document", "query"] = Field(
+        "document", description="Whether the texts are stored passages or search queries"
+    )
+
+
+@app.post("/api/v1/embeddings", dependencies=[Depends(require_api_key), Depends(enforce_rate_limit)])
+async def create_embeddings(
+    payload: EmbeddingRequest,
+    request: Request,
+    deadline: Deadline = Depends(request_deadline),
+    key_name: str = Depends(require_api_key),
+    lane: str = Depends(request_lane),
+):
+    model_id = payload.modelId or EMBEDDING_MODEL_ID
+    family = embedding_family(model_id)
+    if family is None:
+        raise HTTPException(status_code=400, detail=f"{model_id} is not a supported embedding model")
+
+    with usage_ledger.track(UsageEntry(key_name, model_id)) as usage:
+        client = runtime_client_for(deadline.remaining())
+        step = family.texts_per_call
+
+        async def embed_slice(texts: List[str]):
+            body = build_embedding_body(family, model_id, texts, payload.dimensions, payload.inputType)
+            parsed, _ = await run_until_disconnect(
+                request, deadline, functools.partial(invoke_model_blocking, client, model_id, body)
+            )
+            return parse_embedding_body(family, parsed)
+
+        stage("queue")
+        async with embedding_lanes.slot(lane, request, deadline):
+            results = await run_slices(
+                functools.partial(embed_slice, payload.texts[start : start + step])
+                for start in range(0, len(payload.texts), step)
+            )
+        embeddings = [vector for vectors, _ in results for vector in vectors]
+        tokens = [count for _, count in results if count is not None]
+        usage.input_tokens = sum(tokens) if tokens else None
+        usage.output_tokens = 0
+        return {
+            "modelId": model_id,
+            "dimensions": len(embeddings[0]) if embeddings else 0,
+            "embeddings": embeddings,
+            "inputTokens": usage.input_tokens,
+        }
+
+
+class RerankRequest(BaseModel):
+    query: str = Field(..., min_length=1)
+    documents: List[str] = Field(..., min_length=1, max_length=1000, description="Candidate passages, in order")
+    modelId: Optional[str] = Field(None, description="Rerank model (defaults to GATEWAY_RERANK_MODEL)")
+
+
+@app.post("/api/v1/rerank", dependencies=[Depends(require_api_key), Depends(enforce_rate_limit)])
+async def rerank_documents(
+    payload: RerankRequest,
+    request: Request,
+    deadline: Deadline = Depends(request_deadline),
+    key_name: str = Depends(require_api_key),
+    lane: str = Depends(request_lane),
+):
+    model_id = payload.modelId or RERANK_MODEL_ID
+    if not is_rerank_model(model_id):
+        raise HTTPException(status_code=400, detail=f"{model_id} is not a supported rerank model")
+
+    with usage_ledger.track(UsageEntry(key_name, model_id)) as usage:
+        client = runtime_client_for(deadline.remaining())
+
+        async def score_slice(documents: List[str]):
+            body = build_rerank_body(model_id, payload.query, documents)
+            parsed, _ = await run_until_disconnect(
+                request, deadline, functools.partial(invoke_model_blocking, client, model_id, body)
+            )
+            return parse_rerank_body(parsed, len(documents))
+
+        step = DOCUMENTS_PER_CALL
+        stage("queue")
+        async with embedding_lanes.slot(lane, request, deadline):
+            results = await run_slices(
+                functools.partial(score_slice, payload.documents[start : start + step])
+                for start in range(0, len(payload.documents), step)
+            )
+        usage.output_tokens = 0
+        return {"modelId": model_id, "scores": [score for scores in results for score in scores]}
+
+
+@app.get("/metrics", dependencies=[Depends(require_api_key)])
+async def metrics():
+    return {
+        "saturation": saturation.snapshot(),
+        "cancellation": await cancellation.snapshot(),
+        "circuits": circuits.snapshot(),
+        "routing": router.snapshot(),
+        "lanes": {"completions": completion_lanes.snapshot(), "embeddings": embedding_lanes.snapshot()},
+        "usageLedger": usage_ledger.snapshot(),
+        "logging": log_pipeline.snapshot(),
+    }
+
+
+@app.get("/usage")
+async def usage_report(
+    key_name: str = Depends(require_api_key),
+    sinceHours: float = Query(24.0, gt=0, description="Aggregate records from this many hours ago until now"),
+    groupBy: Literal["key", "model", "key,model"] = Query("key,model"),
+):
+    """Token and latency totals per API key and/or model. Named keys only see their own usage."""
+    until = time.time()
+    since = until - sinceHours * 3600
+    scope = None if key_name == ADMIN_KEY_NAME else key_name
+    return {
+        "since": since,
+        "until": until,
+        "groupBy": groupBy,
+        "groups": await usage_ledger.aggregate(since, until, groupBy, api_key=scope),
+    }
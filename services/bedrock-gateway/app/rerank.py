@@ -0,0 +1,32 @@
+"""Request bodies and response parsing for Bedrock rerank models.
+
+Cohere Rerank 3.5 and Amazon Rerank 1.0 score every document against the
+query independently, so a long list can be split into slices that are scored
+concurrently and the scores compared across slices.
+"""
+
+from typing import Dict, List, Optional
+
+from app.codecs import base_model_id
+
+RERANK_PREFIXES = ("cohere.rerank", "amazon.rerank")
+DOCUMENTS_PER_CALL = 100
+
+
+def is_rerank_model(model_id: str) -> bool:
+    return base_model_id(model_id).startswith(RERANK_PREFIXES)
+
+
+def build_rerank_body(model_id: str, query: str, documents: List[str]) -> Dict:
+    body: Dict = {"query": query, "documents": documents, "top_n": len(documents)}
+    if base_model_id(model_id).startswith("cohere."):
+        body["api_version"] = 2
+    return body
+
+
+def parse_rerank_body(body: Dict, count: int) -> List[Optional[float]]:
+    """Scores in document order (``None`` for any document the model left out)."""
+    scores: List[Optional[float]] = [None] * count
+    for result in body.get("results") or []:
+        scores[result["index"]] = float(result["relevance_score"])
+    return scores
@@ -0,0 +1,242 @@
+"""Model routing for ``modelId: "auto"``.
+
+A cheap local classifier scores the prompt's complexity from its length and a
+few textual cues. The router then picks among the configured candidate models
+using live per-model latency (p95) and error-rate statistics, according to a
+policy:
+
+- ``fastest``: the lowest p95 latency among models good enough for the prompt.
+- ``cheapest``: the lowest estimated cost among models good enough for the prompt.
+- ``quality``: the highest quality tier, with latency as the tie-breaker.
+
+Statistics are kept per worker process and only touched from the event loop.
+"""
+
+import json
+import math
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from app.codecs import Message
+from app.deadlines import estimate_tokens
+
+AUTO_MODEL_ID = "auto"
+POLICIES = ("fastest", "cheapest", "quality")
+
+SIMPLE, MODERATE, COMPLEX = 1, 2, 3
+COMPLEXITY_LABELS = {SIMPLE: "simple", MODERATE: "moderate", COMPLEX: "complex"}
+
+# Cues that a prompt needs a stronger model regardless of its length.
+COMPLEX_CUES = re.compile(
+    r"```|\b(?:step[- ]by[- ]step|prove|derive|analy[sz]e|architecture|refactor|debug|trade-?offs?|"
+    r"compare|critique|optimi[sz]e|algorithm|legal|contract|diagnos\w*)\b",
+    re.IGNORECASE,
+)
+MODERATE_CUES = re.compile(
+    r"\b(explain|summari[sz]e|rewrite|translate|outline|draft|write|plan|why|how)\b", re.IGNORECASE
+)
+
+
+@dataclass
+class ModelProfile:
+    model_id: str
+    quality: int
+    input_cost_per_1k: float
+    output_cost_per_1k: float
+    # Prior used until enough live samples exist.
+    expected_latency_seconds: float
+
+
+# On-demand list prices in USD (us-east-1) per 1K tokens.
+DEFAULT_AUTO_MODELS = [
+    ModelProfile("amazon.nova-lite-v1:0", SIMPLE, 0.00006, 0.00024, 1.0),
+    ModelProfile("anthropic.claude-3-haiku-20240307-v1:0", MODERATE, 0.00025, 0.00125, 1.5),
+    ModelProfile("amazon.nova-pro-v1:0", MODERATE, 0.0008, 0.0032, 2.5),
+    ModelProfile("anthropic.claude-3-5-sonnet-20240620-v1:0", COMPLEX, 0.003, 0.015, 5.0),
+]
+
+
+def load_profiles(raw: Optional[str]) -> List[ModelProfile]:
+    """Parse ``GATEWAY_AUTO_MODELS``: a JSON list of objects with the ``ModelProfile`` fields."""
+    if not raw:
+        return list(DEFAULT_AUTO_MODELS)
+    return [ModelProfile(**entry) for entry in json.loads(raw)]
+
+
+@dataclass
+class PromptProfile:
+    complexity: int
+    input_tokens: int
+    expected_output_tokens: int
+    signals: List[str] = field(default_factory=list)
+
+    @property
+    def label(self) -> str:
+        return COMPLEXITY_LABELS[self.complexity]
+
+
+def classify_prompt(messages: List[Message]) -> PromptProfile:
+    """Score prompt complexity from the latest user turn, total length and conversation depth."""
+    turns = [content for role, content in messages if role != "system"]
+    latest = next((content for role, content in reversed(messages) if role == "user"), "")
+    input_tokens = int(sum(estimate_tokens(content) for _, content in messages))
+
+    score = 0
+    signals = []
+    latest_tokens = estimate_tokens(latest)
+    if latest_tokens > 400:
+        score += 2
+        signals.append("long request")
+    elif latest_tokens > 80:
+        score += 1
+        signals.append("medium-length request")
+    if input_tokens > 3000:
+        score += 1
+        signals.append("large context")
+    if len(turns) > 8:
+        score += 1
+        signals.append("long conversation")
+    cues = sorted({match.group(0).lower() for match in COMPLEX_CUES.finditer(latest)})
+    if cues:
+        # One cue alone ("compare A and B") is routine; several together signal real depth.
+        score += 2 * min(len(cues), 2)
+        signals.append("complex cues " + ", ".join(f"'{cue}'" for cue in cues[:3]))
+    elif MODERATE_CUES.search(latest):
+        score += 1
+        signals.append("open-ended request")
+    if latest.count("?") > 2:
+        score += 1
+        signals.append("several questions")
+
+    complexity = SIMPLE if score == 0 else MODERATE if score <= 2 else COMPLEX
+    expected_output_tokens = {SIMPLE: 150, MODERATE: 500, COMPLEX: 1200}[complexity]
+    return PromptProfile(complexity, input_tokens, expected_output_tokens, signals)
+
+
+class ModelStats:
+    """Sliding window of call latencies and outcomes for one model."""
+
+    def __init__(self, window_seconds: float, max_samples: int = 500):
+        self.window_seconds = window_seconds
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=max_samples)
+
+    def record(self, latency_seconds: float, failed: bool) -> None:
+        self._samples.append((time.monotonic(), latency_seconds, failed))
+
+    def _recent(self) -> List[Tuple[float, float, bool]]:
+        cutoff = time.monotonic() - self.window_seconds
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return list(self._samples)
+
+    def summary(self) -> Tuple[int, Optional[float], float]:
+        """Return (samples, p95 latency of successful calls, error rate)."""
+        samples = self._recent()
+        if not samples:
+            return 0, None, 0.0
+        latencies = sorted(latency for _, latency, failed in samples if not failed)
+        p95 = latencies[min(len(latencies) - 1, math.ceil(0.95 * len(latencies)) - 1)] if latencies else None
+        error_rate = sum(1 for _, _, failed in samples if failed) / len(samples)
+        return len(samples), p95, error_rate
+
+
+@dataclass
+class RoutingDecision:
+    model_id: str
+    policy: str
+    complexity: str
+    reason: str
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"modelId": self.model_id, "policy": self.policy, "complexity": self.complexity, "reason": self.reason}
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        profiles: List[ModelProfile],
+        default_policy: str = "fastest",
+        window_seconds: float = 300.0,
+        min_samples: int = 5,
+        max_error_rate: float = 0.25,
+    ):
+        if default_policy not in POLICIES:
+            raise ValueError(f"Unknown routing policy {default_policy!r}; expected one of {POLICIES}")
+        self.profiles = {profile.model_id: profile for profile in profiles}
+        self.default_policy = default_policy
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.stats: Dict[str, ModelStats] = {model_id: ModelStats(window_seconds) for model_id in self.profiles}
+
+    def record(self, model_id: str, latency_seconds: float, failed: bool) -> None:
+        stats = self.stats.get(model_id)
+        if stats is not None:
+            stats.record(latency_seconds, failed)
+
+    def _p95(self, profile: ModelProfile) -> Tuple[float, bool]:
+        """Live p95 when enough samples exist, else the configured prior; the flag says which."""
+        samples, p95, _ = self.stats[profile.model_id].summary()
+        if samples >= self.min_samples and p95 is not None:
+            return p95, True
+        return profile.expected_latency_seconds, False
+
+    def _healthy(self, profile: ModelProfile) -> bool:
+        samples, _, error_rate = self.stats[profile.model_id].summary()
+        return samples < self.min_samples or error_rate <= self.max_error_rate
+
+    @staticmethod
+    def _cost(profile: ModelProfile, prompt: PromptProfile) -> float:
+        return (
+            prompt.input_tokens / 1000 * profile.input_cost_per_1k
+            + prompt.expected_output_tokens / 1000 * profile.output_cost_per_1k
+        )
+
+    def route(
+        self, messages: List[Message], policy: Optional[str], available: Callable[[str], bool]
+    ) -> Optional[RoutingDecision]:
+        """Pick a model for the prompt, skipping models that ``available`` rejects (e.g. open circuits)."""
+        policy = policy or self.default_policy
+        prompt = classify_prompt(messages)
+        candidates = [p for p in self.profiles.values() if available(p.model_id) and self._healthy(p)]
+        if not candidates:
+            return None
+
+        acceptable = [p for p in candidates if p.quality >= prompt.complexity]
+        relaxed = not acceptable
+        pool = acceptable or candidates
+
+        if policy == "cheapest":
+            chosen = min(pool, key=lambda p: (self._cost(p, prompt), self._p95(p)[0]))
+        elif policy == "quality":
+            chosen = max(pool, key=lambda p: (p.quality, -self._p95(p)[0]))
+        else:
+            chosen = min(pool, key=lambda p: (self._p95(p)[0], self._cost(p, prompt)))
+
+        latency, live = self._p95(chosen)
+        reason = [
+            f"{prompt.label} prompt (~{prompt.input_tokens} tokens"
+            + (f"; {', '.join(prompt.signals)})" if prompt.signals else ")"),
+            f"p95 {latency:.1f}s" + ("" if live else " (prior)"),
+            f"est. ${self._cost(chosen, prompt):.5f}",
+        ]
+        if relaxed:
+            reason.append("no healthy model meets the quality tier, using best available")
+        return RoutingDecision(chosen.model_id, policy, prompt.label, "; ".join(reason))
+
+    def snapshot(self) -> List[dict]:
+        result = []
+        for model_id, profile in self.profiles.items():
+            samples, p95, error_rate = self.stats[model_id].summary()
+            result.append(
+                {
+                    "modelId": model_id,
+                    "quality": profile.quality,
+                    "samples": samples,
+                    "p95Seconds": round(p95, 3) if p95 is not None else None,
+                    "errorRate": round(error_rate, 4),
+                }
+            )
+        return result
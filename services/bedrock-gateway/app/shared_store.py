@@ -0,0 +1,92 @@
+"""Small key/value store shared by every worker process of the gateway.
+
+Gunicorn forks several workers from one preloaded app. Anything cached in a
+module global would be duplicated (and refreshed independently) per worker, so
+cross-worker state lives in a SQLite database. By default the database sits on
+``/dev/shm`` so it is backed by shared memory rather than the container disk.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+def default_store_path() -> str:
+    base_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base_dir, "bedrock-gateway-state.sqlite3")
+
+
+class SharedStore:
+    """JSON values with expiry plus fixed-window counters, safe across processes and threads."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork or be shared between threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self) -> None:
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, window_start REAL NOT NULL, count INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS totals (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+
+    def get_json(self, key: str) -> Optional[Any]:
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM kv WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set_json(self, key: str, value: Any, ttl_seconds: float) -> None:
+        self._connection().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, json.dumps(value, separators=(",", ":")), time.time() + ttl_seconds),
+        )
+
+    def incr_window(self, key: str, window_seconds: float) -> int:
+        """Increment the counter for the current fixed window and return its new value."""
+        window_start = time.time() // window_seconds * window_seconds
+        row = self._connection().execute(
+            "INSERT INTO counters (key, window_start, count) VALUES (?, ?, 1) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "count = CASE WHEN counters.window_start = excluded.window_start THEN counters.count + 1 ELSE 1 END, "
+            "window_start = excluded.window_start "
+            "RETURNING count",
+            (key, window_start),
+        ).fetchone()
+        return int(row[0])
+
+    def add_totals(self, amounts: Dict[str, float]) -> None:
+        """Add to monotonically growing totals (metrics that should aggregate across workers)."""
+        conn = self._connection()
+        conn.executemany(
+            "INSERT INTO totals (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = totals.value + excluded.value",
+            list(amounts.items()),
+        )
+
+    def get_totals(self, prefix: str) -> Dict[str, float]:
+        rows = self._connection().execute(
+            "SELECT key, value FROM totals WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+        ).fetchall()
+        return {key[len(prefix):]: value for key, value in rows}
@@ -0,0 +1,199 @@
+"""Per-API-key usage ledger with batched, off-path writes.
+
+The request path only appends a small tuple to an in-memory ring buffer. A
+background task drains the buffer every ``flush_interval`` seconds and writes
+the batch to a local SQLite file in a worker thread, so no request ever waits
+on disk or stdout for accounting. If the buffer fills faster than it is
+flushed, the oldest records are dropped and counted.
+
+All workers write to the same database, so aggregate queries cover the whole
+task.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+import anyio.to_thread
+from fastapi import HTTPException
+
+logger = logging.getLogger("uvicorn.error")
+
+GROUP_COLUMNS = {"key": ("api_key",), "model": ("model_id",), "key,model": ("api_key", "model_id")}
+
+Row = Tuple[float, str, str, int, Optional[int], Optional[int], float, int]
+
+
+@dataclass
+class UsageEntry:
+    """Mutable record for one request, filled in as the request progresses."""
+
+    api_key: str
+    model_id: str
+    status: int = 200
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    cached: bool = False
+    # Set when a streaming response takes over responsibility for finishing the entry.
+    deferred: bool = False
+    finished: bool = False
+    timestamp: float = field(default_factory=time.time)
+    started: float = field(default_factory=time.monotonic)
+
+
+class UsageLedger:
+    def __init__(
+        self,
+        path: str,
+        capacity: int = 10000,
+        flush_interval: float = 2.0,
+        retention_seconds: float = 7 * 24 * 3600,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retention_seconds = retention_seconds
+        self._buffer: Deque[Row] = deque(maxlen=capacity)
+        self.dropped = 0
+        self._local = threading.local()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._init_schema()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork or be shared between threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self) -> None:
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage (ts REAL NOT NULL, api_key TEXT NOT NULL, model_id TEXT NOT NULL, "
+            "status INTEGER NOT NULL, input_tokens INTEGER, output_tokens INTEGER, latency_ms REAL NOT NULL, "
+            "cached INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)")
+
+    def finish(self, entry: UsageEntry) -> None:
+        """Hot path: one deque append, no I/O. An entry is recorded once; later calls are ignored."""
+        if entry.finished:
+            return
+        entry.finished = True
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(
+            (
+                entry.timestamp,
+                entry.api_key,
+                entry.model_id,
+                entry.status,
+                entry.input_tokens,
+                entry.output_tokens,
+                round((time.monotonic() - entry.started) * 1000.0, 1),
+                int(entry.cached),
+            )
+        )
+
+    @contextmanager
+    def track(self, entry: UsageEntry):
+        """Finish ``entry`` when the block exits, recording the HTTP status of any error raised."""
+        try:
+            yield entry
+        except HTTPException as exc:
+            entry.status = exc.status_code
+            raise
+        except BaseException:
+            entry.status = 500
+            raise
+        finally:
+            if not entry.deferred or entry.status >= 400:
+                self.finish(entry)
+
+    def _write(self, rows: List[Row]) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("DELETE FROM usage WHERE ts < ?", (time.time() - self.retention_seconds,))
+
+    async def flush(self) -> int:
+        rows = []
+        while self._buffer:
+            rows.append(self._buffer.popleft())
+        if rows:
+            try:
+                await anyio.to_thread.run_sync(self._write, rows)
+            except sqlite3.Error:
+                logger.exception("Failed to write %d usage records", len(rows))
+        return len(rows)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def _aggregate(self, since: float, until: float, group_by: str, api_key: Optional[str]) -> List[Dict]:
+        columns = GROUP_COLUMNS[group_by]
+        where = "ts >= ? AND ts < ?"
+        params: list = [since, until]
+        if api_key is not None:
+            where += " AND api_key = ?"
+            params.append(api_key)
+        rows = self._connection().execute(
+            f"SELECT {', '.join(columns)}, COUNT(*), SUM(status >= 400), SUM(cached), "
+            "COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0), AVG(latency_ms), MAX(latency_ms) "
+            f"FROM usage WHERE {where} GROUP BY {', '.join(columns)} ORDER BY COUNT(*) DESC",
+            params,
+        ).fetchall()
+
+        names = {"api_key": "apiKey", "model_id": "modelId"}
+        result = []
+        for row in rows:
+            group = {names[column]: value for column, value in zip(columns, row)}
+            requests, errors, cached, input_tokens, output_tokens, avg_latency, max_latency = row[len(columns):]
+            result.append(
+                {
+                    **group,
+                    "requests": requests,
+                    "errors": errors,
+                    "cacheHits": cached,
+                    "inputTokens": input_tokens,
+                    "outputTokens": output_tokens,
+                    "avgLatencyMs": round(avg_latency, 1),
+                    "maxLatencyMs": max_latency,
+                }
+            )
+        return result
+
+    async def aggregate(self, since: float, until: float, group_by: str, api_key: Optional[str] = None) -> List[Dict]:
+        # Include this worker's unflushed records so a caller sees its own latest requests.
+        await self.flush()
+        return await anyio.to_thread.run_sync(self._aggregate, since, until, group_by, api_key)
+
+    def snapshot(self) -> dict:
+        return {"buffered": len(self._buffer), "dropped": self.dropped}
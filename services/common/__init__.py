@@ -0,0 +1 @@
+"""Modules shared by the gateway and the UI service: compression, logging, profiling, saturation, workers."""
@@ -0,0 +1,255 @@
+"""Negotiated response compression (zstd, brotli, gzip) as plain ASGI middleware.
+
+Unlike Starlette's ``GZipMiddleware`` this picks the best encoding the client
+accepts and flushes the compressor after every streamed body chunk, so
+server-sent events reach the client one event at a time instead of waiting
+for the compressor's internal buffer to fill.
+
+    python -m common.compression bench [payload.json ...]
+
+reports, per encoding, the bytes sent and CPU time per response for a
+completion, a model catalog and a streamed answer (one flush per SSE event),
+or for the given files.
+"""
+
+import argparse
+import json
+import sys
+import time
+import zlib
+from typing import List, Optional, Sequence
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "text/",
+)
+
+
+def available_encodings() -> list:
+    """Encodings this process can produce, in order of preference."""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def choose_encoding(accept_encoding: str, offered: Optional[Sequence[str]] = None) -> Optional[str]:
+    """The first of ``offered`` (default: every encoding this process can produce) that the client accepts."""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if token and quality > 0:
+            accepted.add(token.strip().lower())
+
+    for encoding in available_encodings() if offered is None else offered:
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+class StreamCompressor:
+    """Incremental compressor whose ``flush`` emits everything written so far."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._zstd = zstandard.ZstdCompressor(level=3).compressobj()
+        elif encoding == "br":
+            self._brotli = brotli.Compressor(quality=4)
+        else:
+            self._zlib = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        if self.encoding == "zstd":
+            out = self._zstd.compress(data)
+            return out + self._zstd.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK) if flush else out
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + self._brotli.flush() if flush else out
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self) -> bytes:
+        if self.encoding == "zstd":
+            return self._zstd.flush()
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressingResponder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder)
+
+
+class _CompressingResponder:
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.compressor: Optional[StreamCompressor] = None
+        self.passthrough = False
+        self.streaming = False
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            if (
+                "content-encoding" in headers
+                or message["status"] < 200
+                or message["status"] in (204, 304)
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                self.passthrough = True
+                await self.send(message)
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.streaming:
+            if not more_body and len(body) < self.minimum_size:
+                # Small single-chunk response: not worth the CPU.
+                self.passthrough = True
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            self.compressor = StreamCompressor(self.encoding)
+
+            if not more_body:
+                compressed = self.compressor.compress(body, flush=False) + self.compressor.finish()
+                headers["Content-Length"] = str(len(compressed))
+                await self.send(self.start_message)
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+
+            del headers["Content-Length"]
+            self.streaming = True
+            await self.send(self.start_message)
+
+        # Flush per chunk so each SSE event is delivered as soon as it is produced.
+        chunk = self.compressor.compress(body, flush=True) if body else b""
+        if not more_body:
+            chunk += self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+
+def sample_payloads() -> List[tuple]:
+    """Synthetic completion, model catalog and SSE stream shaped like the gateway's responses."""
+    sentence = "The gateway forwards the request to Bedrock and returns the normalized output. "
+    completion = {
+        "modelId": "anthropic.claude-3-haiku-20240307-v1:0",
+        "budget": {"maxTokens": 1024, "capped": False},
+        "output": {"text": sentence * 24, "stopReason": "end_turn", "usage": {"inputTokens": 812, "outputTokens": 455}},
+    }
+    catalog = {
+        "models": [
+            {
+                "modelId": f"vendor.model-{index}-v{index % 3}:0",
+                "modelName": f"Model {index}",
+                "providerName": ["Amazon", "Anthropic", "Meta", "Mistral AI", "Cohere"][index % 5],
+                "inputModalities": ["TEXT"],
+                "outputModalities": ["TEXT"],
+                "responseStreamingSupported": True,
+                "inferenceTypesSupported": ["ON_DEMAND"],
+                "modelLifecycle": {"status": "ACTIVE"},
+            }
+            for index in range(90)
+        ]
+    }
+    words = (sentence * 24).split(" ")
+    events = [f"data: {json.dumps({'type': 'delta', 'text': word + ' '})}\n\n".encode() for word in words]
+    events.append(b'data: {"type":"done","output":{"stopReason":"end_turn"}}\n\n')
+    return [
+        ("completion", [json.dumps(completion).encode()]),
+        ("model catalog", [json.dumps(catalog).encode()]),
+        ("sse stream", events),
+    ]
+
+
+def compress_chunks(encoding: str, chunks: List[bytes]) -> int:
+    """Compress like the middleware does: in one pass for a single body, flushing per chunk for a stream."""
+    compressor = StreamCompressor(encoding)
+    if len(chunks) == 1:
+        return len(compressor.compress(chunks[0], flush=False) + compressor.finish())
+    size = sum(len(compressor.compress(chunk, flush=True)) for chunk in chunks)
+    return size + len(compressor.finish())
+
+
+def run_bench(args) -> int:
+    payloads = sample_payloads()
+    for path in args.payloads:
+        with open(path, "rb") as handle:
+            payloads.append((path, [handle.read()]))
+    print(f"{'payload':>16}  {'encoding':>8}  {'bytes in':>9}  {'bytes out':>9}  {'saved':>6}  {'us/response':>11}")
+    for label, chunks in payloads:
+        size = sum(len(chunk) for chunk in chunks)
+        for encoding in available_encodings():
+            out = compress_chunks(encoding, chunks)
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                compress_chunks(encoding, chunks)
+            micros = (time.perf_counter() - started) / args.repeat * 1e6
+            print(f"{label:>16}  {encoding:>8}  {size:>9}  {out:>9}  {1 - out / size:>6.0%}  {micros:>11.1f}")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m common.compression")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="Bytes saved and CPU time per response for each encoding")
+    bench.add_argument("payloads", nargs="*", help="Extra response bodies to measure (compressed as one chunk)")
+    bench.add_argument("--repeat", type=int, default=200, help="Compressions per measurement")
+    return run_bench(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
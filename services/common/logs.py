@@ -0,0 +1,253 @@
+"""Structured JSON logging through a queue, with bounded cost under error storms.
+
+Request threads and the event loop only run a cheap filter and put the record
+on a bounded in-memory queue; a listener thread formats it as one JSON line
+and writes it to stdout. Tracebacks are rendered on the listener thread too.
+
+The filter bounds what gets queued:
+
+- WARNING and above are deduplicated: an identical error (same logger, message
+  and exception) is logged once per ``dedup_window_seconds``, and the next
+  occurrence after the window carries ``suppressed`` with the number collapsed.
+  A token bucket caps distinct error records at ``max_errors_per_second``.
+- INFO and below are sampled per request: all records of a sampled request are
+  kept (including its access log line), all records of other requests are
+  dropped. Records outside a request (startup, drain) are always kept.
+
+If the queue is full the record is dropped and counted rather than blocking.
+"""
+
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+import zlib
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+REQUEST_ID_HEADER = "x-request-id"
+
+# Loggers that gunicorn/uvicorn wire to their own synchronous stream handlers.
+ROUTED_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access", "gunicorn.error", "gunicorn.access")
+
+# Per-call client chatter that would otherwise add a line to every proxied request.
+QUIET_LOGGERS = ("httpx", "httpcore")
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["requestId"] = request_id
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, separators=(",", ":"), ensure_ascii=False)
+
+
+class LogBudgetFilter(logging.Filter):
+    """Runs on the calling thread before a record is queued, so dropping is cheap."""
+
+    MAX_TRACKED_ERRORS = 1000
+
+    def __init__(self, info_sample_rate: float, dedup_window_seconds: float, max_errors_per_second: float):
+        super().__init__()
+        self.sample_threshold = int(max(0.0, min(1.0, info_sample_rate)) * 10000)
+        self.dedup_window_seconds = dedup_window_seconds
+        self.max_errors_per_second = max_errors_per_second
+        self._tokens = max_errors_per_second
+        self._refilled_at = time.monotonic()
+        # error key -> [last logged at, occurrences suppressed since]
+        self._errors: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+        self.sampled_out = 0
+        self.suppressed = 0
+        self.rate_limited = 0
+
+    def _sampled(self, request_id: str) -> bool:
+        return zlib.crc32(request_id.encode("utf-8")) % 10000 < self.sample_threshold
+
+    @staticmethod
+    def _error_key(record: logging.LogRecord) -> Tuple:
+        exc = record.exc_info[1] if record.exc_info else None
+        return (
+            record.name,
+            record.levelno,
+            record.msg if isinstance(record.msg, str) else repr(record.msg),
+            type(exc).__name__ if exc is not None else None,
+            str(exc)[:200] if exc is not None else None,
+        )
+
+    def _take_token(self, now: float) -> bool:
+        self._tokens = min(
+            self.max_errors_per_second, self._tokens + (now - self._refilled_at) * self.max_errors_per_second
+        )
+        self._refilled_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        if record.levelno < logging.WARNING:
+            if record.request_id is None or self._sampled(record.request_id):
+                return True
+            self.sampled_out += 1
+            return False
+
+        key = self._error_key(record)
+        now = time.monotonic()
+        with self._lock:
+            state = self._errors.get(key)
+            if state is not None and now - state[0] < self.dedup_window_seconds:
+                state[1] += 1
+                self.suppressed += 1
+                return False
+            if not self._take_token(now):
+                self.rate_limited += 1
+                return False
+            record.suppressed = state[1] if state is not None else 0
+            self._errors[key] = [now, 0]
+            if len(self._errors) > self.MAX_TRACKED_ERRORS:
+                cutoff = now - self.dedup_window_seconds
+                self._errors = {k: v for k, v in self._errors.items() if v[0] >= cutoff}
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the arguments here; traceback formatting happens on the listener thread.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    def __init__(
+        self,
+        service: str,
+        level: str = "INFO",
+        info_sample_rate: float = 1.0,
+        dedup_window_seconds: float = 60.0,
+        max_errors_per_second: float = 20.0,
+        queue_size: int = 10000,
+    ):
+        self.level = level
+        self.queue_size = queue_size
+        self.output = logging.StreamHandler(sys.stdout)
+        self.output.setFormatter(JsonFormatter(service))
+        self.budget = LogBudgetFilter(info_sample_rate, dedup_window_seconds, max_errors_per_second)
+        self.handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        self.handler.addFilter(self.budget)
+        self._listener: Optional[QueueListener] = None
+        self._pid: Optional[int] = None
+
+    def install(self) -> None:
+        """Route every logger through the queue; call again in each forked worker."""
+        root = logging.getLogger()
+        root.handlers = [self.handler]
+        root.setLevel(self.level)
+        for name in ROUTED_LOGGERS:
+            routed = logging.getLogger(name)
+            routed.handlers = []
+            routed.propagate = True
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+        if self._pid != os.getpid():
+            # Neither the listener thread nor a safely usable queue lock survives fork.
+            self.handler.queue = queue.Queue(self.queue_size)
+            self._listener = QueueListener(self.handler.queue, self.output)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def stop(self) -> None:
+        """Flush queued records; anything logged afterwards is written directly."""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+        logging.getLogger().handlers = [self.output]
+
+    def snapshot(self) -> dict:
+        return {
+            "queued": self.handler.queue.qsize(),
+            "queueDropped": self.handler.dropped,
+            "infoSampledOut": self.budget.sampled_out,
+            "errorsSuppressed": self.budget.suppressed,
+            "errorsRateLimited": self.budget.rate_limited,
+        }
+
+
+def pipeline_from_env(service: str) -> LogPipeline:
+    return LogPipeline(
+        service,
+        level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+        info_sample_rate=float(os.environ.get("LOG_INFO_SAMPLE_RATE", "0.1")),
+        dedup_window_seconds=float(os.environ.get("LOG_DEDUP_WINDOW_SECONDS", "60")),
+        max_errors_per_second=float(os.environ.get("LOG_MAX_ERRORS_PER_SECOND", "20")),
+        queue_size=int(os.environ.get("LOG_QUEUE_SIZE", "10000")),
+    )
+
+
+class RequestIdMiddleware:
+    """Tag each request with an ID (the caller's ``x-request-id`` or a new one) for logs and responses."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER.encode():
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.encode(), request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
@@ -0,0 +1,258 @@
+"""On-demand sampling profiles, in-flight request stages and slow-request capture.
+
+``SamplingProfiler`` does nothing until a profile is requested; then a worker
+thread wakes every ``interval`` seconds, snapshots the stack of every thread
+(``sys._current_frames``) and every asyncio task on the event loop, and counts
+identical stacks. The result is returned in the collapsed-stack format
+(``frame;frame;frame count`` per line) read by flamegraph.pl, speedscope and
+most flamegraph viewers. When no profile is running nothing is hooked or
+sampled.
+
+``RequestTracker`` keeps a small record per in-flight request. Handlers mark
+progress with ``stage("name")``; requests slower than the threshold keep their
+full stage timings in a bounded buffer.
+"""
+
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+import anyio.to_thread
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import Response
+
+from common.logs import request_id_var
+
+ADMIN_PREFIX = "/admin/"
+MAX_PROFILE_SECONDS = 60.0
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frames) -> List[str]:
+    """Frame labels outermost first."""
+    labels = []
+    while frames is not None:
+        labels.append(_frame_label(frames))
+        frames = frames.f_back
+    labels.reverse()
+    return labels
+
+
+class SamplingProfiler:
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self._lock = threading.Lock()
+
+    def _sample_tasks(self, counts: Counter) -> None:
+        if self.loop is None:
+            return
+        try:
+            tasks = asyncio.all_tasks(self.loop)
+        except RuntimeError:
+            return
+        for task in tasks:
+            # A suspended task's stack shows where it is awaiting; a running one shows up under its thread.
+            stack = [_frame_label(frame) for frame in task.get_stack()]
+            if stack:
+                counts[";".join([f"task:{task.get_name()}"] + stack)] += 1
+
+    def sample(self, seconds: float, interval: float) -> Tuple[str, int]:
+        """Blocking: sample for ``seconds`` and return (collapsed stacks, number of samples)."""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            counts: Counter = Counter()
+            me = threading.get_ident()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    counts[";".join([f"thread:{names.get(ident, ident)}"] + _collapse(frame))] += 1
+                self._sample_tasks(counts)
+                samples += 1
+                time.sleep(interval)
+            lines = [f"{stack} {count}" for stack, count in counts.most_common()]
+            return "\n".join(lines) + "\n", samples
+        finally:
+            self._lock.release()
+
+
+@dataclass
+class RequestTrace:
+    request_id: str
+    method: str
+    path: str
+    started: float = field(default_factory=time.monotonic)
+    stages: List[Tuple[str, float]] = field(default_factory=list)
+
+    def stage(self, name: str) -> None:
+        self.stages.append((name, time.monotonic()))
+
+    def to_dict(self, now: Optional[float] = None) -> Dict:
+        now = now if now is not None else time.monotonic()
+        timings = []
+        for index, (name, started) in enumerate(self.stages):
+            ended = self.stages[index + 1][1] if index + 1 < len(self.stages) else now
+            timings.append(
+                {
+                    "stage": name,
+                    "startMs": round((started - self.started) * 1000, 1),
+                    "durationMs": round((ended - started) * 1000, 1),
+                }
+            )
+        return {
+            "requestId": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "elapsedMs": round((now - self.started) * 1000, 1),
+            "stage": self.stages[-1][0] if self.stages else None,
+            "stages": timings,
+        }
+
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+def stage(name: str) -> None:
+    """Mark the current request as having entered ``name``; a no-op outside a tracked request."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.stage(name)
+
+
+class RequestTracker:
+    def __init__(self, slow_threshold_seconds: float, slow_capacity: int = 100):
+        self.slow_threshold_seconds = slow_threshold_seconds
+        self.in_flight: Dict[int, RequestTrace] = {}
+        self.slow: Deque[Dict] = deque(maxlen=slow_capacity)
+
+    def begin(self, method: str, path: str) -> RequestTrace:
+        trace = RequestTrace(request_id_var.get() or "", method, path)
+        trace.stage("received")
+        self.in_flight[id(trace)] = trace
+        return trace
+
+    def end(self, trace: RequestTrace, status: Optional[int]) -> None:
+        self.in_flight.pop(id(trace), None)
+        now = time.monotonic()
+        if now - trace.started >= self.slow_threshold_seconds:
+            entry = trace.to_dict(now)
+            entry["status"] = status
+            entry["finishedAt"] = time.time()
+            self.slow.append(entry)
+
+    @contextmanager
+    def track(self, method: str, path: str):
+        """Track work that does not arrive as its own HTTP request, such as a stream on a WebSocket."""
+        trace = self.begin(method, path)
+        token = current_trace.set(trace)
+        status = 500
+        try:
+            yield trace
+            status = 200
+        except HTTPException as exc:
+            status = exc.status_code
+            raise
+        except asyncio.CancelledError:
+            status = 499
+            raise
+        finally:
+            current_trace.reset(token)
+            self.end(trace, status)
+
+    def top_in_flight(self, limit: int) -> List[Dict]:
+        now = time.monotonic()
+        oldest = sorted(self.in_flight.values(), key=lambda trace: trace.started)[:limit]
+        return [trace.to_dict(now) for trace in oldest]
+
+
+class RequestTrackingMiddleware:
+    def __init__(self, app, tracker: RequestTracker):
+        self.app = app
+        self.tracker = tracker
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(ADMIN_PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        trace = self.tracker.begin(scope["method"], scope["path"])
+        token = current_trace.set(trace)
+        status = None
+
+        async def send_with_stage(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                trace.stage("responding")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stage)
+        finally:
+            current_trace.reset(token)
+            self.tracker.end(trace, status)
+
+
+def build_admin_router(tracker: RequestTracker, admin_key: Optional[str]) -> APIRouter:
+    """Admin endpoints, authenticated with ``x-admin-key``; they answer 404 when no admin key is configured."""
+    profiler = SamplingProfiler()
+
+    def require_admin(x_admin_key: Optional[str] = Header(None, alias="x-admin-key")):
+        if not admin_key:
+            raise HTTPException(status_code=404, detail="Not Found")
+        if not x_admin_key or not hmac.compare_digest(x_admin_key, admin_key):
+            raise HTTPException(status_code=401, detail="Invalid admin key")
+
+    router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+    @router.get("/profile")
+    async def profile(
+        seconds: float = Query(10.0, gt=0, le=MAX_PROFILE_SECONDS),
+        intervalMs: float = Query(10.0, ge=1, le=1000),
+    ):
+        """Wall-clock samples of every thread and asyncio task, as collapsed stacks for flamegraph tools."""
+        profiler.loop = asyncio.get_running_loop()
+        try:
+            stacks, samples = await anyio.to_thread.run_sync(profiler.sample, seconds, intervalMs / 1000.0)
+        except RuntimeError as exc:
+            raise HTTPException(status_code=409, detail=str(exc)) from exc
+        return Response(
+            content=stacks,
+            media_type="text/plain",
+            headers={
+                "Content-Disposition": f'attachment; filename="profile-{os.getpid()}-{int(time.time())}.collapsed"',
+                "X-Profile-Samples": str(samples),
+                "X-Profile-Pid": str(os.getpid()),
+            },
+        )
+
+    @router.get("/requests")
+    async def in_flight(limit: int = Query(20, ge=1, le=500)):
+        """The oldest in-flight requests handled by this worker, with their current stage."""
+        return {"pid": os.getpid(), "inFlight": len(tracker.in_flight), "requests": tracker.top_in_flight(limit)}
+
+    @router.get("/slow-requests")
+    async def slow_requests():
+        return {
+            "pid": os.getpid(),
+            "thresholdSeconds": tracker.slow_threshold_seconds,
+            "requests": list(tracker.slow),
+        }
+
+    return router
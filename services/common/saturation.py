@@ -0,0 +1,201 @@
+"""Saturation tracking for readiness checks and load shedding.
+
+Liveness (``/healthz``) only says the process is up. Readiness (``/readyz``)
+reflects whether this worker can take more work right now: requests in flight,
+threadpool queue depth and event-loop lag. When any of those crosses its
+threshold the middleware answers new requests with 503 so the load balancer
+and ECS target tracking move traffic elsewhere instead of queueing it here.
+
+The recent upstream error rate is reported alongside, but it never sheds load
+or fails readiness: upstream failures are usually confined to one model and
+are handled per model by the gateway's circuit breakers, while every task sees
+the same upstream and would turn unready at once.
+
+The same monitor drives graceful shutdown: ``drain`` fails readiness, stops
+accepting new requests after a short grace period and waits for in-flight
+requests and streams to finish before the server is allowed to exit.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+import anyio.to_thread
+from starlette.responses import JSONResponse
+
+# Routed through the server's error log so drain progress shows up under gunicorn too.
+logger = logging.getLogger("uvicorn.error")
+
+PROBE_PATHS = ("/healthz", "/readyz")
+# Admin/diagnostic endpoints must keep working while the task is saturated or draining.
+EXEMPT_PREFIXES = ("/admin/",)
+
+
+class SaturationMonitor:
+    def __init__(
+        self,
+        max_in_flight: int = 0,
+        max_queue_depth: int = 0,
+        max_loop_lag_ms: float = 0.0,
+        error_window_seconds: float = 30.0,
+        min_upstream_samples: int = 20,
+        retry_after_seconds: int = 2,
+    ):
+        # A threshold of 0 disables that signal.
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.error_window_seconds = error_window_seconds
+        self.min_upstream_samples = min_upstream_samples
+        self.retry_after_seconds = retry_after_seconds
+
+        self.in_flight = 0
+        self.shed_total = 0
+        self.draining = False
+        self.accepting = True
+        self.loop_lag_ms = 0.0
+        self._upstream: Deque[Tuple[float, bool]] = deque()
+        # Upstream outcomes are recorded from threadpool threads as well as the loop.
+        self._upstream_lock = threading.Lock()
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def queue_depth(self) -> int:
+        """Sync handlers waiting for a threadpool slot."""
+        try:
+            return anyio.to_thread.current_default_thread_limiter().statistics().tasks_waiting
+        except RuntimeError:
+            return 0
+
+    def record_upstream(self, ok: bool) -> None:
+        now = time.monotonic()
+        with self._upstream_lock:
+            self._upstream.append((now, ok))
+            self._trim(now)
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.error_window_seconds
+        while self._upstream and self._upstream[0][0] < cutoff:
+            self._upstream.popleft()
+
+    def upstream_error_rate(self) -> float:
+        with self._upstream_lock:
+            self._trim(time.monotonic())
+            samples = len(self._upstream)
+            errors = sum(1 for _, ok in self._upstream if not ok)
+        if samples < self.min_upstream_samples:
+            return 0.0
+        return errors / samples
+
+    def overload_reasons(self) -> List[str]:
+        reasons = []
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            reasons.append("in_flight")
+        if self.max_queue_depth and self.queue_depth() >= self.max_queue_depth:
+            reasons.append("queue_depth")
+        if self.max_loop_lag_ms and self.loop_lag_ms >= self.max_loop_lag_ms:
+            reasons.append("loop_lag")
+        return reasons
+
+    def readiness_reasons(self) -> List[str]:
+        return (["draining"] if self.draining else []) + self.overload_reasons()
+
+    def snapshot(self) -> dict:
+        return {
+            "inFlight": self.in_flight,
+            "queueDepth": self.queue_depth(),
+            "loopLagMs": round(self.loop_lag_ms, 2),
+            "upstreamErrorRate": round(self.upstream_error_rate(), 4),
+            "shedTotal": self.shed_total,
+            "draining": self.draining,
+        }
+
+    async def _measure_loop_lag(self, interval: float) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag_ms = max(0.0, (loop.time() - started - interval) * 1000.0)
+            # Smooth a little so a single slow tick does not flap readiness.
+            self.loop_lag_ms = 0.7 * self.loop_lag_ms + 0.3 * lag_ms
+
+    def start(self, interval: float = 0.1) -> None:
+        if self._lag_task is None:
+            self._lag_task = asyncio.get_running_loop().create_task(self._measure_loop_lag(interval))
+
+    async def stop(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+
+    async def drain(self, readiness_grace_seconds: float, deadline_seconds: float) -> dict:
+        """Fail readiness, stop accepting work, then wait for in-flight requests up to the deadline."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.draining = True
+        logger.info("Draining: readiness failing, accepting requests for %.1fs more", readiness_grace_seconds)
+        await asyncio.sleep(readiness_grace_seconds)
+
+        self.accepting = False
+        in_flight_at_close = self.in_flight
+        deadline = loop.time() + deadline_seconds
+        while self.in_flight and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+
+        summary = {
+            "durationSeconds": round(loop.time() - started, 3),
+            "inFlightAtClose": in_flight_at_close,
+            "dropped": self.in_flight,
+        }
+        logger.info(
+            "Drain finished in %.3fs: %d in flight when intake closed, %d dropped at deadline",
+            summary["durationSeconds"],
+            summary["inFlightAtClose"],
+            summary["dropped"],
+        )
+        return summary
+
+
+class LoadSheddingMiddleware:
+    """Counts in-flight requests and rejects new ones with 503 while saturated."""
+
+    def __init__(self, app, monitor: SaturationMonitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in PROBE_PATHS or scope["path"].startswith(EXEMPT_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        if not self.monitor.accepting:
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Service shutting down, retry shortly", "reasons": ["draining"]},
+                headers={"Retry-After": str(self.monitor.retry_after_seconds), "Connection": "close"},
+            )
+            await response(scope, receive, send)
+            return
+
+        reasons = self.monitor.overload_reasons()
+        if reasons:
+            self.monitor.shed_total += 1
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Service saturated, retry shortly", "reasons": reasons},
+                headers={"Retry-After": str(self.monitor.retry_after_seconds)},
+            )
+            await response(scope, receive, send)
+            return
+
+        self.monitor.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.in_flight -= 1
@@ -0,0 +1,79 @@
+"""Gunicorn worker that drains in-flight requests before uvicorn shuts down.
+
+Stock uvicorn closes its listener and cancels whatever is still running once
+``timeout_graceful_shutdown`` expires. Here the first SIGTERM/SIGINT instead
+runs the app's ``app.state.drain`` coroutine (fail readiness, stop intake, wait
+for in-flight completions and streams) and only then hands over to uvicorn's
+normal exit path, which runs the lifespan shutdown that closes client pools.
+A second signal skips the drain.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import sys
+
+from gunicorn.arbiter import Arbiter
+from uvicorn.server import Server
+from uvicorn.workers import UvicornWorker
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def available_cpus() -> int:
+    """Return the CPU budget of this container, rounded up to whole cores."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max", encoding="utf-8") as handle:
+            quota, period = handle.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", encoding="utf-8") as handle:
+            quota = int(handle.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", encoding="utf-8") as handle:
+            period = int(handle.read())
+        if quota > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:  # pragma: no cover - non-Linux
+        return os.cpu_count() or 1
+
+
+class DrainingServer(Server):
+    def __init__(self, config, drain=None):
+        super().__init__(config=config)
+        self.drain = drain
+        self._drain_task = None
+
+    def handle_exit(self, sig, frame):
+        if self.drain is None or self._drain_task is not None:
+            super().handle_exit(sig, frame)
+            return
+
+        self._drain_task = asyncio.get_event_loop().create_task(self._drain_then_exit(sig, frame))
+
+    async def _drain_then_exit(self, sig, frame):
+        try:
+            await self.drain()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Drain failed; shutting down immediately")
+        super().handle_exit(sig, frame)
+
+
+class DrainingUvicornWorker(UvicornWorker):
+    async def _serve(self) -> None:
+        self.config.app = self.wsgi
+        drain = getattr(getattr(self.wsgi, "state", None), "drain", None)
+        server = DrainingServer(config=self.config, drain=drain)
+        self._install_sigquit_handler()
+        await server.serve(sockets=self.sockets)
+        if not server.started:
+            sys.exit(Arbiter.WORKER_BOOT_ERROR)
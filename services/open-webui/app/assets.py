@@ -0,0 +1,120 @@
+"""Static UI assets rendered once at startup and served from memory.
+
+Every asset is content-hashed, precompressed (gzip and, when the ``brotli``
+package is installed, brotli) and answered with an ETag so repeat page loads
+are served as 304s or straight from the browser cache.
+"""
+
+import gzip
+import hashlib
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from common.compression import choose_encoding
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Font files are vendored in static/fonts at pinned versions (scripts/vendor-fonts.sh).
+FONT_FACES = [
+    ("Space Grotesk", 400, "space-grotesk-latin-400-normal.woff2"),
+    ("Space Grotesk", 500, "space-grotesk-latin-500-normal.woff2"),
+    ("Space Grotesk", 600, "space-grotesk-latin-600-normal.woff2"),
+    ("Space Grotesk", 700, "space-grotesk-latin-700-normal.woff2"),
+    ("JetBrains Mono", 400, "jetbrains-mono-latin-400-normal.woff2"),
+    ("JetBrains Mono", 600, "jetbrains-mono-latin-600-normal.woff2"),
+]
+
+# Already-compressed formats gain nothing from another pass.
+INCOMPRESSIBLE_TYPES = ("font/woff2", "image/png", "image/jpeg")
+
+
+@dataclass
+class StaticAsset:
+    url: str
+    content_type: str
+    body: bytes
+    cache_control: str
+    etag: str = ""
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.etag = hashlib.sha256(self.body).hexdigest()[:20]
+        if self.content_type.startswith(INCOMPRESSIBLE_TYPES):
+            return
+        gzipped = gzip.compress(self.body, compresslevel=9, mtime=0)
+        if len(gzipped) < len(self.body):
+            self.encoded["gzip"] = gzipped
+        if brotli is not None:
+            compressed = brotli.compress(self.body, quality=11)
+            if len(compressed) < len(self.body):
+                self.encoded["br"] = compressed
+
+
+class AssetRegistry:
+    """In-memory map of URL path -> prerendered asset."""
+
+    def __init__(self, static_dir: str):
+        self.static_dir = static_dir
+        self.assets: Dict[str, StaticAsset] = {}
+
+    def read_text(self, name: str) -> str:
+        with open(os.path.join(self.static_dir, name), encoding="utf-8") as handle:
+            return handle.read()
+
+    def add(self, url: str, body: bytes, content_type: str, cache_control: str) -> StaticAsset:
+        asset = StaticAsset(url=url, content_type=content_type, body=body, cache_control=cache_control)
+        self.assets[url] = asset
+        return asset
+
+    def add_hashed(self, name: str, body: bytes, content_type: str) -> StaticAsset:
+        """Register ``name`` under an immutable, content-hashed URL such as ``/static/app.3f2a9c.css``."""
+        stem, ext = os.path.splitext(name)
+        digest = hashlib.sha256(body).hexdigest()[:12]
+        return self.add(f"/static/{stem}.{digest}{ext}", body, content_type, IMMUTABLE_CACHE_CONTROL)
+
+    def font_face_css(self) -> str:
+        rules = []
+        for family, weight, filename in FONT_FACES:
+            path = os.path.join(self.static_dir, "fonts", filename)
+            if not os.path.isfile(path):
+                continue
+            with open(path, "rb") as handle:
+                asset = self.add_hashed(filename, handle.read(), "font/woff2")
+            rules.append(
+                "@font-face {"
+                f' font-family: "{family}"; font-style: normal; font-weight: {weight};'
+                f' font-display: swap; src: local("{family}"), url("{asset.url}") format("woff2");'
+                " }"
+            )
+        return "\n".join(rules)
+
+    def get(self, url: str) -> Optional[StaticAsset]:
+        return self.assets.get(url)
+
+    def respond(self, asset: StaticAsset, request: Request) -> Response:
+        offered = [candidate for candidate in ("br", "gzip") if candidate in asset.encoded]
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), offered)
+
+        etag = f'"{asset.etag}-{encoding}"' if encoding else f'"{asset.etag}"'
+        headers = {"Cache-Control": asset.cache_control, "ETag": etag, "Vary": "Accept-Encoding"}
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if "*" in tags or any(tag.strip('"').startswith(asset.etag) for tag in tags):
+                return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return Response(asset.encoded[encoding], media_type=asset.content_type, headers=headers)
+        return Response(asset.body, media_type=asset.content_type, headers=headers)
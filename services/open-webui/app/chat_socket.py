@@ -0,0 +1,252 @@
+"""Multiplexed chat completions over one WebSocket per browser tab.
+
+The socket at ``/api/ws`` carries any number of concurrent completions, each
+identified by a client-chosen stream ID that also serves as its request ID.
+Frames are small JSON text messages:
+
+client -> server::
+
+    {"type": "start", "id": "<stream id>", "payload": {...}}   # same body as POST /api/completions
+    {"type": "cancel", "id": "<stream id>"}
+    {"type": "resume", "id": "<stream id>", "after": <last seq received>}
+    {"type": "ping"}
+
+server -> client::
+
+    {"type": "delta", "id": ..., "seq": n, "text": "..."}
+    {"type": "done", "id": ..., "seq": n, ...completion fields}
+    {"type": "error", "id": ..., "seq": n, "status": 502, "detail": "..."}
+    {"type": "cancelled", "id": ..., "seq": n}
+    {"type": "pong"}
+
+Every stream frame is numbered and kept until the stream has finished and
+``resume_seconds`` have passed. If the socket drops, the stream keeps running
+detached for ``resume_seconds``; a new socket can ``resume`` it and receives
+the frames it missed. A stream that nobody resumes in time is cancelled, which
+closes its gateway request. Streams live in the worker process that started
+them, so a resume that lands on another worker gets a 404 error frame.
+"""
+
+import asyncio
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+
+from common.logs import request_id_var
+from common.saturation import SaturationMonitor
+
+logger = logging.getLogger("uvicorn.error")
+
+STREAM_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Receives the completion payload and an ``emit(text)`` callback for deltas;
+# returns the fields of the final ``done`` frame.
+Runner = Callable[[Dict[str, Any], Callable[[str], None]], Awaitable[Dict[str, Any]]]
+
+
+@dataclass
+class ChatStream:
+    stream_id: str
+    frames: List[Dict[str, Any]] = field(default_factory=list)
+    socket: Optional["ChatSocket"] = None
+    task: Optional[asyncio.Task] = None
+    finished: bool = False
+    # Bumped whenever the stream is (re)attached so stale expiry timers do nothing.
+    generation: int = 0
+
+
+class ChatSocket:
+    """One browser connection; a single writer task owns the WebSocket's send side."""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.outbox: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self.streams: Dict[str, ChatStream] = {}
+
+    def send(self, frame: Dict[str, Any]) -> None:
+        self.outbox.put_nowait(frame)
+
+    async def write_loop(self) -> None:
+        try:
+            while True:
+                frame = await self.outbox.get()
+                await self.websocket.send_text(json.dumps(frame, separators=(",", ":"), ensure_ascii=False))
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            # The receive loop notices the disconnect and detaches the streams; resume replays what was lost.
+            pass
+
+
+class ChatStreams:
+    """Registry of this worker's streams, shared by all of its sockets."""
+
+    def __init__(
+        self,
+        runner: Runner,
+        monitor: SaturationMonitor,
+        resume_seconds: float = 30.0,
+        max_streams_per_socket: int = 4,
+    ):
+        self.runner = runner
+        self.monitor = monitor
+        self.resume_seconds = resume_seconds
+        self.max_streams_per_socket = max_streams_per_socket
+        self.streams: Dict[str, ChatStream] = {}
+        self.sockets = 0
+        self.resumed = 0
+        self.expired = 0
+
+    def _publish(self, stream: ChatStream, frame: Dict[str, Any]) -> None:
+        frame = {**frame, "id": stream.stream_id, "seq": len(stream.frames)}
+        stream.frames.append(frame)
+        if stream.socket is not None:
+            stream.socket.send(frame)
+
+    def _finish(self, stream: ChatStream, frame: Dict[str, Any]) -> None:
+        if stream.finished:
+            return
+        stream.finished = True
+        # Streams count as in-flight work so a draining worker waits for them.
+        self.monitor.in_flight -= 1
+        self._publish(stream, frame)
+        if stream.socket is not None:
+            stream.socket.streams.pop(stream.stream_id, None)
+        self._schedule_expiry(stream)
+
+    def _schedule_expiry(self, stream: ChatStream) -> None:
+        stream.generation += 1
+        asyncio.get_running_loop().call_later(self.resume_seconds, self._expire, stream, stream.generation)
+
+    def _expire(self, stream: ChatStream, generation: int) -> None:
+        if generation != stream.generation or (not stream.finished and stream.socket is not None):
+            return
+        if not stream.finished:
+            self.expired += 1
+            stream.task.cancel()
+        self.streams.pop(stream.stream_id, None)
+
+    async def _run(self, stream: ChatStream, payload: Dict[str, Any]) -> None:
+        request_id_var.set(stream.stream_id)
+        try:
+            result = await self.runner(payload, lambda text: self._publish(stream, {"type": "delta", "text": text}))
+            final = {"type": "done", **result}
+        except HTTPException as exc:
+            final = {"type": "error", "status": exc.status_code, "detail": exc.detail}
+        except asyncio.CancelledError:
+            final = {"type": "cancelled"}
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Chat stream %s failed", stream.stream_id)
+            final = {"type": "error", "status": 500, "detail": "Internal error"}
+        self._finish(stream, final)
+
+    def _reject(self, socket: ChatSocket, stream_id: str, status: int, detail: str) -> None:
+        socket.send({"type": "error", "id": stream_id, "status": status, "detail": detail})
+
+    def start(self, socket: ChatSocket, stream_id: str, payload: Any) -> None:
+        if not isinstance(payload, dict):
+            self._reject(socket, stream_id, 400, "'payload' must be an object")
+            return
+        if stream_id in self.streams:
+            self._reject(socket, stream_id, 409, "Stream ID already in use")
+            return
+        if not self.monitor.accepting:
+            self._reject(socket, stream_id, 503, "Service shutting down, retry shortly")
+            return
+        if self.monitor.overload_reasons():
+            self.monitor.shed_total += 1
+            self._reject(socket, stream_id, 503, "Service saturated, retry shortly")
+            return
+        if len(socket.streams) >= self.max_streams_per_socket:
+            self._reject(socket, stream_id, 429, "Too many concurrent streams on this connection")
+            return
+
+        stream = ChatStream(stream_id, socket=socket)
+        self.streams[stream_id] = socket.streams[stream_id] = stream
+        self.monitor.in_flight += 1
+        stream.task = asyncio.get_running_loop().create_task(self._run(stream, payload))
+        # A task cancelled before its first step never enters ``_run``; still release its slot.
+        stream.task.add_done_callback(lambda _: self._finish(stream, {"type": "cancelled"}))
+
+    def cancel(self, socket: ChatSocket, stream_id: str) -> None:
+        stream = socket.streams.get(stream_id)
+        if stream is not None and not stream.finished:
+            # Cancelling the task closes the gateway request, which stops the Bedrock stream.
+            stream.task.cancel()
+
+    def resume(self, socket: ChatSocket, stream_id: str, after: int) -> None:
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            self._reject(socket, stream_id, 404, "Unknown or expired stream")
+            return
+        if stream.socket is not None and stream.socket is not socket:
+            stream.socket.streams.pop(stream_id, None)
+        stream.socket = socket
+        self.resumed += 1
+        for frame in stream.frames[after + 1 :]:
+            socket.send(frame)
+        if not stream.finished:
+            socket.streams[stream_id] = stream
+            stream.generation += 1
+
+    def detach(self, socket: ChatSocket) -> None:
+        """The socket is gone: keep its running streams for ``resume_seconds``."""
+        for stream in socket.streams.values():
+            if stream.socket is socket:
+                stream.socket = None
+                self._schedule_expiry(stream)
+        socket.streams.clear()
+
+    def handle(self, socket: ChatSocket, message: Dict[str, Any]) -> None:
+        kind = message.get("type")
+        if kind == "ping":
+            socket.send({"type": "pong"})
+            return
+        stream_id = message.get("id")
+        if not isinstance(stream_id, str) or not STREAM_ID_PATTERN.match(stream_id):
+            socket.send({"type": "error", "status": 400, "detail": "Invalid stream ID"})
+        elif kind == "start":
+            self.start(socket, stream_id, message.get("payload"))
+        elif kind == "cancel":
+            self.cancel(socket, stream_id)
+        elif kind == "resume":
+            after = message.get("after")
+            self.resume(socket, stream_id, after if isinstance(after, int) else -1)
+        else:
+            self._reject(socket, stream_id, 400, f"Unknown message type: {kind}")
+
+    async def serve(self, websocket: WebSocket) -> None:
+        if not self.monitor.accepting:
+            # 1013 "try again later": the browser reconnects and the load balancer picks another task.
+            await websocket.close(code=1013)
+            return
+        await websocket.accept()
+        socket = ChatSocket(websocket)
+        writer = asyncio.get_running_loop().create_task(socket.write_loop())
+        self.sockets += 1
+        try:
+            while True:
+                raw = await websocket.receive_text()
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    socket.send({"type": "error", "status": 400, "detail": "Frames must be JSON"})
+                    continue
+                if isinstance(message, dict):
+                    self.handle(socket, message)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.sockets -= 1
+            self.detach(socket)
+            writer.cancel()
+
+    def snapshot(self) -> dict:
+        return {
+            "sockets": self.sockets,
+            "activeStreams": sum(1 for stream in self.streams.values() if not stream.finished),
+            "resumed": self.resumed,
+            "expired": self.expired,
+        }
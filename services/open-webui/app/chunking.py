@@ -0,0 +1,142 @@
+"""Turn source files into retrieval chunks.
+
+Plain text, Markdown, reStructuredText, HTML, JSON, CSV and source files are
+read directly; PDFs need the optional ``pypdf`` package. Text is split on
+paragraph, then sentence, then word boundaries into chunks of at most
+``max_chars`` characters, and each chunk starts with the last ``overlap``
+characters of the previous one so an answer that straddles a boundary is still
+retrievable.
+
+``chunk_stream`` does the same over text that arrives in parts (for example
+ranged reads from S3), holding only the unfinished paragraph in memory.
+"""
+
+import codecs
+import html
+import io
+import json
+import os
+import re
+from typing import Iterable, Iterator, List
+
+try:
+    import pypdf
+except ImportError:  # pragma: no cover - optional dependency
+    pypdf = None
+
+TEXT_EXTENSIONS = {
+    ".txt", ".md", ".markdown", ".rst", ".csv", ".tsv", ".log", ".yaml", ".yml", ".toml", ".ini", ".cfg",
+    ".py", ".js", ".ts", ".java", ".go", ".rs", ".c", ".h", ".cpp", ".cs", ".rb", ".php", ".sh", ".sql", ".tf",
+}
+HTML_EXTENSIONS = {".html", ".htm"}
+SUPPORTED_EXTENSIONS = TEXT_EXTENSIONS | HTML_EXTENSIONS | {".json", ".pdf"}
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+HTML_DROP = re.compile(r"<(script|style)\b.*?</\1>", re.IGNORECASE | re.DOTALL)
+HTML_TAG = re.compile(r"<[^>]+>")
+HTML_BLOCK_END = re.compile(r"</(p|div|li|h[1-6]|tr|section|article)>|<br\s*/?>", re.IGNORECASE)
+WHITESPACE_RUN = re.compile(r"[ \t\f\v]+")
+
+
+def is_supported(path: str) -> bool:
+    extension = os.path.splitext(path)[1].lower()
+    return extension in SUPPORTED_EXTENSIONS and (extension != ".pdf" or pypdf is not None)
+
+
+def html_to_text(markup: str) -> str:
+    markup = HTML_DROP.sub(" ", markup)
+    markup = HTML_BLOCK_END.sub("\n\n", markup)
+    return html.unescape(HTML_TAG.sub(" ", markup))
+
+
+def extract_text(name: str, data: bytes) -> str:
+    """Text content of a document, given its file name (for the type) and raw bytes."""
+    extension = os.path.splitext(name)[1].lower()
+    if extension == ".pdf":
+        if pypdf is None:
+            raise ValueError("PDF support needs the pypdf package")
+        reader = pypdf.PdfReader(io.BytesIO(data))
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+    text = data.decode("utf-8", errors="replace")
+    if extension in HTML_EXTENSIONS:
+        return html_to_text(text)
+    if extension == ".json":
+        try:
+            # Re-indent so nested structures split on line boundaries.
+            return json.dumps(json.loads(text), indent=1, ensure_ascii=False)
+        except ValueError:
+            return text
+    return text
+
+
+def extract_text_stream(name: str, parts: Iterable[bytes]) -> Iterator[str]:
+    """Like ``extract_text`` for a document that arrives in parts; plain text is decoded as it comes."""
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in TEXT_EXTENSIONS:
+        # PDF, HTML and JSON need the whole document to parse.
+        yield extract_text(name, b"".join(parts))
+        return
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for part in parts:
+        yield decoder.decode(part)
+    yield decoder.decode(b"", final=True)
+
+
+def read_document(path: str) -> str:
+    with open(path, "rb") as handle:
+        return extract_text(path, handle.read())
+
+
+def _pieces(text: str, max_chars: int) -> List[str]:
+    """Split into pieces no longer than ``max_chars``, preferring the coarsest boundary that fits."""
+    pieces = []
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        paragraph = WHITESPACE_RUN.sub(" ", paragraph).strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in SENTENCE_END.split(paragraph):
+            while len(sentence) > max_chars:
+                cut = sentence.rfind(" ", 0, max_chars)
+                cut = cut if cut > max_chars // 2 else max_chars
+                pieces.append(sentence[:cut].strip())
+                sentence = sentence[cut:]
+            if sentence.strip():
+                pieces.append(sentence.strip())
+    return pieces
+
+
+def _stream_pieces(texts: Iterable[str], max_chars: int) -> Iterator[str]:
+    pending = ""
+    for text in texts:
+        pending += text
+        last = None
+        for last in PARAGRAPH_BREAK.finditer(pending):
+            pass
+        if last is not None:
+            yield from _pieces(pending[: last.start()], max_chars)
+            pending = pending[last.end() :]
+    yield from _pieces(pending, max_chars)
+
+
+def chunk_stream(texts: Iterable[str], max_chars: int = 1200, overlap: int = 150) -> Iterator[str]:
+    current = ""
+    for piece in _stream_pieces(texts, max_chars):
+        if current and len(current) + 2 + len(piece) > max_chars:
+            yield current
+            tail = current[-overlap:] if overlap else ""
+            # Start the carried-over tail at a word boundary.
+            tail = tail[tail.find(" ") + 1 :] if " " in tail else tail
+            current = f"{tail} {piece}".strip() if len(tail) + 1 + len(piece) <= max_chars else piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        yield current
+
+
+def chunk_text(text: str, max_chars: int = 1200, overlap: int = 150) -> List[str]:
+    return list(chunk_stream([text], max_chars, overlap))
@@ -0,0 +1,160 @@
+"""Server-side conversation store backed by the shared data volume (EFS in AWS).
+
+Each conversation is a directory of append-only JSON Lines segment files
+(``000001.jsonl``, ``000002.jsonl``, ...). A new segment is started once the
+current one passes ``segment_max_bytes``, so no file is ever rewritten.
+
+Hot conversations are kept in an in-memory LRU together with the segment and
+byte offset already read. Because other workers and other tasks append to the
+same files, a cached conversation is refreshed by reading only the bytes added
+since the last look (one ``stat`` when nothing changed). Appends take a POSIX
+record lock on a per-conversation lock file, which NFSv4/EFS honours across
+hosts.
+
+Within a worker, reads and appends of one conversation are serialised by that
+conversation's own lock; the store-wide lock only guards the cache and lock
+tables, so a slow EFS read or fsync never holds up other conversations.
+"""
+
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+CONVERSATION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def new_conversation_id() -> str:
+    return uuid.uuid4().hex
+
+
+def is_valid_conversation_id(conversation_id: str) -> bool:
+    return bool(CONVERSATION_ID_PATTERN.match(conversation_id or ""))
+
+
+@dataclass
+class _CachedConversation:
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    segment: int = 1
+    offset: int = 0
+
+
+@dataclass
+class _ConversationLock:
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    users: int = 0
+
+
+class ConversationStore:
+    def __init__(self, root_dir: str, segment_max_bytes: int = 1 << 20, cache_size: int = 256):
+        self.root_dir = root_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, _CachedConversation]" = OrderedDict()
+        self._locks: Dict[str, _ConversationLock] = {}
+        self._lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _dir(self, conversation_id: str) -> str:
+        # Fan out by prefix so no single EFS directory grows unbounded.
+        return os.path.join(self.root_dir, conversation_id[:2], conversation_id)
+
+    def _segment_path(self, conversation_id: str, segment: int) -> str:
+        return os.path.join(self._dir(conversation_id), f"{segment:06d}.jsonl")
+
+    def _refresh(self, conversation_id: str, entry: _CachedConversation) -> None:
+        """Read whatever was appended since ``entry`` was last brought up to date."""
+        while True:
+            path = self._segment_path(conversation_id, entry.segment)
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                return
+            if size > entry.offset:
+                with open(path, "rb") as handle:
+                    handle.seek(entry.offset)
+                    data = handle.read(size - entry.offset)
+                # A concurrent writer may be mid-line; only consume complete records.
+                complete = data[: data.rfind(b"\n") + 1]
+                entry.messages.extend(json.loads(line) for line in complete.splitlines() if line)
+                entry.offset += len(complete)
+            if not os.path.exists(self._segment_path(conversation_id, entry.segment + 1)):
+                return
+            entry.segment += 1
+            entry.offset = 0
+
+    @contextmanager
+    def _conversation_lock(self, conversation_id: str) -> Iterator[None]:
+        """Hold this conversation's lock; the entry is dropped once nobody holds or waits for it."""
+        with self._lock:
+            holder = self._locks.get(conversation_id)
+            if holder is None:
+                holder = self._locks[conversation_id] = _ConversationLock()
+            holder.users += 1
+        try:
+            with holder.lock:
+                yield
+        finally:
+            with self._lock:
+                holder.users -= 1
+                if not holder.users:
+                    del self._locks[conversation_id]
+
+    def _checkout(self, conversation_id: str) -> _CachedConversation:
+        """Take the cached entry (or a fresh one); call with the conversation lock held."""
+        with self._lock:
+            return self._cache.pop(conversation_id, None) or _CachedConversation()
+
+    def _remember(self, conversation_id: str, entry: _CachedConversation) -> None:
+        with self._lock:
+            self._cache[conversation_id] = entry
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def exists(self, conversation_id: str) -> bool:
+        return conversation_id in self._cache or os.path.isdir(self._dir(conversation_id))
+
+    def get(self, conversation_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Return the conversation's messages, or None if it has never been written."""
+        if not self.exists(conversation_id):
+            return None
+        with self._conversation_lock(conversation_id):
+            entry = self._checkout(conversation_id)
+            self._refresh(conversation_id, entry)
+            self._remember(conversation_id, entry)
+            return list(entry.messages)
+
+    def append(self, conversation_id: str, messages: List[Dict[str, Any]]) -> int:
+        """Append messages as one write under the conversation lock; return the new message count."""
+        directory = self._dir(conversation_id)
+        os.makedirs(directory, exist_ok=True)
+        now = time.time()
+        data = "".join(
+            json.dumps({**message, "ts": now}, separators=(",", ":"), ensure_ascii=False) + "\n"
+            for message in messages
+        ).encode("utf-8")
+
+        with self._conversation_lock(conversation_id), open(os.path.join(directory, ".lock"), "a") as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            try:
+                entry = self._checkout(conversation_id)
+                self._refresh(conversation_id, entry)
+                if entry.offset and entry.offset + len(data) > self.segment_max_bytes:
+                    entry.segment += 1
+                    entry.offset = 0
+                with open(self._segment_path(conversation_id, entry.segment), "ab") as handle:
+                    handle.write(data)
+                    handle.flush()
+                    os.fsync(handle.fileno())
+                self._refresh(conversation_id, entry)
+                self._remember(conversation_id, entry)
+                return len(entry.messages)
+            finally:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,252 @@
+"""Content-addressed embedding cache on the data volume.
+
+Embeddings are keyed by a 128-bit hash of the input type and the normalized
+text (Unicode NFC, whitespace collapsed), in one directory per embedding
+model and dimension count, so re-ingesting or rebuilding a collection, or
+asking the same question again, does not pay for the same embedding twice::
+
+    meta.json     model, dimensions, storage dtype and table shape
+    index.bin     sets x ways entries: key, last use (epoch seconds), CRC32 of the row
+    vectors.f16   one row per entry (vectors.f32 with EMBEDDING_CACHE_DTYPE=float32)
+    stats.u64     hits, misses, inserts, evictions summed over every process
+
+The table is set-associative: a key can only live in the ``WAYS`` entries of
+the set its hash selects, and inserting into a full set evicts the least
+recently used of them, so the files never grow past the configured size.
+Lookups read the memory maps without locking and trust an entry only if its
+key still matches and its row still matches its CRC after the copy, so a row
+being rewritten by another process reads as a miss. Inserts take an
+exclusive lock on ``.lock``.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from contextlib import contextmanager
+from typing import List, Optional
+
+import httpx
+import numpy as np
+
+WAYS = 8
+STATS_FIELDS = ("hits", "misses", "inserts", "evictions")
+STATS_FLUSH_SECONDS = 10.0
+ENTRY = np.dtype([("key", "<u8", (2,)), ("used", "<u4"), ("crc", "<u4")])
+UNSAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_keys(texts: List[str], input_type: str) -> np.ndarray:
+    """(n, 2) uint64 keys; the input type is part of the key because some models embed queries differently."""
+    keys = np.empty((len(texts), 2), dtype=np.uint64)
+    for row, text in enumerate(texts):
+        digest = hashlib.blake2b(f"{input_type}\0{normalize_text(text)}".encode("utf-8"), digest_size=16).digest()
+        keys[row] = np.frombuffer(digest, dtype="<u8")
+    # All-zero marks an empty entry.
+    keys[(keys == 0).all(axis=1), 1] = 1
+    return keys
+
+
+class EmbeddingCache:
+    def __init__(self, root_dir: str, model_id: str, dimensions: int, max_bytes: int, dtype: str = "float16"):
+        self.dimensions = dimensions
+        self.dtype = np.dtype(dtype)
+        row_bytes = dimensions * self.dtype.itemsize + ENTRY.itemsize
+        self.sets = max(1, max_bytes // (row_bytes * WAYS))
+        self.capacity = self.sets * WAYS
+        self.directory = os.path.join(root_dir, UNSAFE_NAME.sub("_", f"{model_id}-{dimensions}"))
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(os.path.join(self.directory, ".lock"), "a")
+        self._stats_lock = threading.Lock()
+        self._pending = dict.fromkeys(STATS_FIELDS, 0)
+        self.local = dict.fromkeys(STATS_FIELDS, 0)
+        self._flushed = time.monotonic()
+
+        meta = {
+            "model": model_id,
+            "dimensions": dimensions,
+            "dtype": self.dtype.name,
+            "sets": self.sets,
+            "ways": WAYS,
+        }
+        vectors_name = "vectors.f16" if self.dtype == np.float16 else "vectors.f32"
+        with self._locked():
+            meta_path = os.path.join(self.directory, "meta.json")
+            try:
+                with open(meta_path, encoding="utf-8") as handle:
+                    current = json.load(handle)
+            except (FileNotFoundError, ValueError):
+                current = None
+            if current != meta:
+                # New cache, or the size or dtype changed: start over rather than reinterpret the files.
+                for name in ("index.bin", "vectors.f16", "vectors.f32", "stats.u64"):
+                    if os.path.exists(os.path.join(self.directory, name)):
+                        os.remove(os.path.join(self.directory, name))
+                self._allocate("index.bin", self.capacity * ENTRY.itemsize)
+                self._allocate(vectors_name, self.capacity * dimensions * self.dtype.itemsize)
+                self._allocate("stats.u64", len(STATS_FIELDS) * 8)
+                with open(meta_path, "w", encoding="utf-8") as handle:
+                    json.dump(meta, handle)
+        self.index = np.memmap(
+            os.path.join(self.directory, "index.bin"), dtype=ENTRY, mode="r+", shape=(self.sets, WAYS)
+        )
+        self.vectors = np.memmap(
+            os.path.join(self.directory, vectors_name), dtype=self.dtype, mode="r+", shape=(self.capacity, dimensions)
+        )
+        self._stats = np.memmap(
+            os.path.join(self.directory, "stats.u64"), dtype=np.uint64, mode="r+", shape=(len(STATS_FIELDS),)
+        )
+
+    def _allocate(self, name: str, size: int) -> None:
+        # Sparse: untouched entries take no space on disk.
+        with open(os.path.join(self.directory, name), "wb") as handle:
+            handle.truncate(size)
+
+    @contextmanager
+    def _locked(self):
+        fcntl.lockf(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_UN)
+
+    def _count(self, **deltas: int) -> None:
+        with self._stats_lock:
+            for field, delta in deltas.items():
+                self._pending[field] += delta
+                self.local[field] += delta
+
+    def flush_stats(self, force: bool = False) -> None:
+        """Add this process's counts to the shared totals (at most every few seconds unless forced)."""
+        if not force and time.monotonic() - self._flushed < STATS_FLUSH_SECONDS:
+            return
+        with self._stats_lock:
+            pending, self._pending = self._pending, dict.fromkeys(STATS_FIELDS, 0)
+            self._flushed = time.monotonic()
+        if not any(pending.values()):
+            return
+        with self._locked():
+            self._stats += np.array([pending[field] for field in STATS_FIELDS], dtype=np.uint64)
+
+    def lookup(self, keys: np.ndarray):
+        """Return (found mask, float32 rows for the found keys in order)."""
+        sets = (keys[:, 0] % np.uint64(self.sets)).astype(np.int64)
+        entries = self.index[sets]
+        matches = (entries["key"] == keys[:, None, :]).all(axis=2)
+        found = matches.any(axis=1)
+        ways = matches.argmax(axis=1)
+        positions = np.flatnonzero(found)
+        slots = sets[positions] * WAYS + ways[positions]
+        rows = np.asarray(self.vectors[slots])
+        # Re-read the entries after copying the rows; anything rewritten in between is dropped as a miss.
+        entries = np.asarray(self.index.reshape(-1)[slots])
+        valid = (entries["key"] == keys[positions]).all(axis=1)
+        for index, row in enumerate(rows):
+            if valid[index] and zlib.crc32(row.tobytes()) != entries["crc"][index]:
+                valid[index] = False
+        found[positions[~valid]] = False
+        rows = rows[valid]
+        if found.any():
+            # Unlocked: a lost update only makes the entry look a little older.
+            self.index["used"][sets[found], ways[found]] = int(time.time())
+        hits = int(found.sum())
+        self._count(hits=hits, misses=len(keys) - hits)
+        return found, rows.astype(np.float32)
+
+    def insert(self, keys: np.ndarray, vectors: np.ndarray) -> None:
+        now = int(time.time())
+        evictions = 0
+        with self._locked():
+            for key, vector in zip(keys, vectors):
+                set_index = int(key[0] % np.uint64(self.sets))
+                entries = self.index[set_index]
+                matches = np.flatnonzero((entries["key"] == key).all(axis=1))
+                if len(matches):
+                    way = int(matches[0])
+                else:
+                    way = int(np.argmin(entries["used"]))
+                    evictions += int(entries["used"][way] != 0)
+                row = np.asarray(vector, dtype=self.dtype)
+                # Unpublish, write the row, then publish, so unlocked readers never pair a key with the wrong row.
+                self.index["key"][set_index, way] = 0
+                self.vectors[set_index * WAYS + way] = row
+                self.index["crc"][set_index, way] = zlib.crc32(row.tobytes())
+                self.index["used"][set_index, way] = now
+                self.index["key"][set_index, way] = key
+        self._count(inserts=len(keys), evictions=evictions)
+        self.flush_stats()
+
+    def stats(self) -> dict:
+        self.flush_stats(force=True)
+        totals = {field: int(value) for field, value in zip(STATS_FIELDS, self._stats)}
+        lookups = totals["hits"] + totals["misses"]
+        local_lookups = self.local["hits"] + self.local["misses"]
+        return {
+            **totals,
+            "hitRate": round(totals["hits"] / lookups, 4) if lookups else None,
+            "entries": int((self.index["used"] != 0).sum()),
+            "capacity": self.capacity,
+            "dtype": self.dtype.name,
+            "worker": {
+                **self.local,
+                "hitRate": round(self.local["hits"] / local_lookups, 4) if local_lookups else None,
+            },
+        }
+
+
+class CachedEmbedder:
+    """Wraps an embedder so every text is looked up in an ``EmbeddingCache`` before it is sent."""
+
+    def __init__(self, embedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+        self.local = embedder.local
+        self.model_id = embedder.model_id
+        self.dimensions = embedder.dimensions
+
+    def _split(self, texts: List[str], input_type: str):
+        keys = text_keys(texts, input_type)
+        found, cached = self.cache.lookup(keys)
+        # Embed each distinct missing text once.
+        missing = {}
+        for position in np.flatnonzero(~found):
+            missing.setdefault(texts[position], []).append(position)
+        return keys, found, cached, missing
+
+    def _assemble(self, keys, found, cached, missing, fresh: Optional[np.ndarray]) -> np.ndarray:
+        result = np.empty((len(keys), self.dimensions), dtype=np.float32)
+        result[found] = cached
+        if missing:
+            if fresh.shape[1] != self.dimensions:
+                raise ValueError(
+                    f"{self.model_id} returned {fresh.shape[1]} dimensions; set EMBEDDING_DIMENSIONS={fresh.shape[1]}"
+                )
+            first = []
+            for vector, positions in zip(fresh, missing.values()):
+                result[positions] = vector
+                first.append(positions[0])
+            self.cache.insert(keys[first], fresh)
+        return result
+
+    def embed(self, texts: List[str], input_type: str = "document") -> np.ndarray:
+        if not texts:
+            return self.embedder.embed(texts, input_type)
+        keys, found, cached, missing = self._split(texts, input_type)
+        fresh = self.embedder.embed(list(missing), input_type) if missing else None
+        return self._assemble(keys, found, cached, missing, fresh)
+
+    async def aembed(
+        self, client: httpx.AsyncClient, texts: List[str], input_type: str = "query", headers: Optional[dict] = None
+    ) -> np.ndarray:
+        keys, found, cached, missing = self._split(texts, input_type)
+        fresh = await self.embedder.aembed(client, list(missing), input_type, headers) if missing else None
+        return self._assemble(keys, found, cached, missing, fresh)
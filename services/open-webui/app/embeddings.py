@@ -0,0 +1,167 @@
+"""Embedding backends for the retrieval store.
+
+``GatewayEmbedder`` calls the gateway's ``/api/v1/embeddings`` (Bedrock Titan
+or Cohere embedding models) in batches. ``HashingEmbedder`` is a local
+feature-hashing embedder: it matches words rather than meaning, but it is
+fast, deterministic and works offline, which makes it useful for development,
+tests and benchmarks (``EMBEDDING_MODEL=hash``).
+
+Both return float32 rows normalized to unit length, so a dot product is the
+cosine similarity. Gateway embeddings go through the persistent
+``EmbeddingCache`` unless ``EMBEDDING_CACHE_MAX_MB=0``. Ingestion calls ask
+the gateway for the ``EMBEDDING_INGEST_LANE`` priority lane (default
+``batch``) so bulk loads do not delay query embeddings.
+"""
+
+import os
+import re
+import time
+import zlib
+from typing import List, Optional
+
+import httpx
+import numpy as np
+
+from app.embedding_cache import CachedEmbedder, EmbeddingCache
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    local = True
+
+    def __init__(self, dimensions: int = 1024):
+        self.dimensions = dimensions
+        self.model_id = f"hash-{dimensions}"
+
+    def embed(self, texts: List[str], input_type: str = "document") -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter(
+                (zlib.crc32(token.encode("utf-8")) for token in TOKEN.findall(text.lower())), dtype=np.uint32
+            )
+            if not len(hashes):
+                continue
+            # The top bit picks the sign so colliding tokens tend to cancel rather than add up.
+            signs = np.where(hashes & 0x80000000, 1.0, -1.0).astype(np.float32)
+            np.add.at(matrix[row], (hashes % self.dimensions).astype(np.int64), signs)
+        return normalize_rows(matrix)
+
+    async def aembed(
+        self, client: httpx.AsyncClient, texts: List[str], input_type: str = "query", headers: Optional[dict] = None
+    ) -> np.ndarray:
+        return self.embed(texts, input_type)
+
+
+class GatewayEmbedder:
+    local = False
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        model_id: str,
+        dimensions: Optional[int] = None,
+        batch_size: int = 64,
+        timeout: float = 60.0,
+        attempts: int = 4,
+        ingest_lane: Optional[str] = None,
+    ):
+        self.url = f"{base_url.rstrip('/')}/api/v1/embeddings"
+        self.api_key = api_key
+        self.model_id = model_id
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.attempts = attempts
+        self.ingest_lane = ingest_lane
+        self.requests = 0
+        self._client: Optional[httpx.Client] = None
+
+    def _body(self, texts: List[str], input_type: str) -> dict:
+        body = {"texts": texts, "modelId": self.model_id, "inputType": input_type}
+        if self.dimensions:
+            body["dimensions"] = self.dimensions
+        return body
+
+    def _headers(self, extra: Optional[dict] = None) -> dict:
+        return {"x-openwebui-api-key": self.api_key, **(extra or {})}
+
+    def embed(self, texts: List[str], input_type: str = "document") -> np.ndarray:
+        """Blocking; used by the ingestion CLI. Retries throttling and gateway errors with backoff."""
+        if self._client is None:
+            self._client = httpx.Client(timeout=self.timeout)
+        rows = []
+        headers = self._headers({"x-gateway-lane": self.ingest_lane} if self.ingest_lane else None)
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start : start + self.batch_size]
+            for attempt in range(1, self.attempts + 1):
+                self.requests += 1
+                try:
+                    response = self._client.post(self.url, headers=headers, json=self._body(batch, input_type))
+                except httpx.TransportError:
+                    if attempt == self.attempts:
+                        raise
+                    time.sleep(2 ** attempt)
+                    continue
+                if response.status_code not in RETRY_STATUSES or attempt == self.attempts:
+                    break
+                time.sleep(float(response.headers.get("Retry-After") or 2 ** attempt))
+            response.raise_for_status()
+            rows.extend(response.json()["embeddings"])
+        return normalize_rows(np.asarray(rows, dtype=np.float32).reshape(len(rows), -1))
+
+    async def aembed(
+        self, client: httpx.AsyncClient, texts: List[str], input_type: str = "query", headers: Optional[dict] = None
+    ) -> np.ndarray:
+        """Query-time embedding on the app's shared async client."""
+        self.requests += 1
+        response = await client.post(self.url, headers=self._headers(headers), json=self._body(texts, input_type))
+        response.raise_for_status()
+        return normalize_rows(np.asarray(response.json()["embeddings"], dtype=np.float32))
+
+
+def embedder_from_env():
+    model_id = os.environ.get("EMBEDDING_MODEL", "amazon.titan-embed-text-v2:0")
+    dimensions = int(os.environ.get("EMBEDDING_DIMENSIONS", "1024"))
+    if model_id == "hash":
+        return HashingEmbedder(dimensions)
+    embedder = GatewayEmbedder(
+        os.environ["OPENAI_API_BASE_URL"],
+        os.environ["OPENAI_API_KEY"],
+        model_id,
+        dimensions=dimensions,
+        batch_size=int(os.environ.get("EMBEDDING_BATCH_SIZE", "64")),
+        ingest_lane=os.environ.get("EMBEDDING_INGEST_LANE", "batch"),
+    )
+    cache_megabytes = float(os.environ.get("EMBEDDING_CACHE_MAX_MB", "512"))
+    if cache_megabytes <= 0:
+        return embedder
+    cache = EmbeddingCache(
+        os.environ.get("EMBEDDING_CACHE_DIR", "/app/backend/data/embedding-cache"),
+        model_id,
+        dimensions,
+        max_bytes=int(cache_megabytes * 1024 * 1024),
+        dtype=os.environ.get("EMBEDDING_CACHE_DTYPE", "float16"),
+    )
+    return CachedEmbedder(embedder, cache)
+
+
+def embedding_report(embedder) -> dict:
+    """Embedding requests sent and cache hits for a CLI summary."""
+    inner = getattr(embedder, "embedder", embedder)
+    report = {}
+    if hasattr(inner, "requests"):
+        report["embeddingRequests"] = inner.requests
+    cache = getattr(embedder, "cache", None)
+    if cache is not None:
+        run = cache.stats()["worker"]
+        report["embeddingCache"] = {field: run[field] for field in ("hits", "misses", "hitRate", "evictions")}
+    return report
@@ -0,0 +1,443 @@
+"""Bulk ingestion of a directory tree into the retrieval store.
+
+    python -m app.ingest /path/to/docs --collection handbook
+    python -m app.ingest bench --synthetic 2000 --processes 1,2,4
+    python -m app.ingest sync s3://bucket/prefix --collection handbook
+    python -m app.ingest compact --collection handbook
+
+Files are read, parsed and chunked in a process pool sized to the container's
+CPUs. Chunks are embedded in large batches through the gateway (or locally in
+the pool workers with ``EMBEDDING_MODEL=hash``) and appended to the
+collection. The collection manifest is checkpointed every few seconds and
+records each finished file with its size and mtime, so an interrupted run
+picks up where it stopped and a re-run only processes new or changed files.
+``--prune`` also drops files that no longer exist.
+
+Each file gets a ``date`` (its mtime) plus any ``--owner``/``--tag`` given on
+the command line; a sidecar ``NAME.meta.json`` next to a file can set
+``owner``, ``tags`` and ``date`` for that file. They are stored in the manifest
+for filtered retrieval (see ``app.metadata``); changing a sidecar re-ingests
+its file.
+
+``sync`` mirrors an S3 prefix instead of a directory; see ``app.s3sync``.
+With ``--shard I/N`` either one only loads the files of shard ``I`` of ``N``,
+into ``COLLECTION.shardI`` (see ``app.shards``).
+
+Ingestion merges segments in the background as it goes (see
+``app.retrieval``); ``compact`` runs those merges on their own, and
+``--force`` rewrites every sealed segment that holds dead rows.
+
+``bench`` ingests the same tree into throwaway collections with 1..N
+processes and the local embedder and prints files/s and chunks/s for each, to
+show how parsing and chunking scale with cores.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app.chunking import chunk_text, is_supported, read_document
+from app.embeddings import HashingEmbedder, embedder_from_env, embedding_report
+from app.metadata import merge_metadata, normalize_metadata
+from app.retrieval import CollectionWriter, read_manifest
+from app.shards import parse_shard, shard_info, shard_name, shard_of
+from common.workers import available_cpus
+
+DEFAULT_DATA_DIR = os.environ.get("RETRIEVAL_DATA_DIR", "/app/backend/data/retrieval")
+SIDECAR_SUFFIX = ".meta.json"
+
+
+class SourceFile(NamedTuple):
+    key: str
+    path: str
+    size: int
+    mtime_ns: int
+    meta_mtime_ns: Optional[int] = None  # of the sidecar, if there is one
+
+    @property
+    def stamp(self) -> dict:
+        return {"size": self.size, "mtimeNs": self.mtime_ns, "metaMtimeNs": self.meta_mtime_ns}
+
+
+class ParsedFile(NamedTuple):
+    source: NamedTuple  # SourceFile, or S3Object for sync
+    chunks: List[str]
+    vectors: Optional[np.ndarray]
+    error: Optional[str]
+    meta: Optional[dict] = None
+
+
+def scan(root: str) -> Iterator[SourceFile]:
+    """Supported files under ``root`` in a stable order, keyed by their path relative to it."""
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = sorted(name for name in subdirectories if not name.startswith("."))
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            if name.startswith(".") or name.endswith(SIDECAR_SUFFIX) or not is_supported(path):
+                continue
+            stat = os.stat(path)
+            try:
+                meta_mtime_ns = os.stat(path + SIDECAR_SUFFIX).st_mtime_ns
+            except FileNotFoundError:
+                meta_mtime_ns = None
+            yield SourceFile(os.path.relpath(path, root), path, stat.st_size, stat.st_mtime_ns, meta_mtime_ns)
+
+
+# Per-process settings for pool workers, set by the pool initializer.
+_worker_settings = {}
+
+
+def _init_worker(max_chars: int, overlap: int, local_dimensions: Optional[int]) -> None:
+    _worker_settings.update(
+        max_chars=max_chars,
+        overlap=overlap,
+        embedder=HashingEmbedder(local_dimensions) if local_dimensions else None,
+    )
+
+
+def read_file_metadata(source: SourceFile) -> dict:
+    meta = {"date": source.mtime_ns / 1e9}
+    if source.meta_mtime_ns is not None:
+        with open(source.path + SIDECAR_SUFFIX, encoding="utf-8") as handle:
+            meta.update(json.load(handle))
+    return normalize_metadata(meta)
+
+
+def parse_file(source: SourceFile) -> ParsedFile:
+    try:
+        meta = read_file_metadata(source)
+        chunks = chunk_text(read_document(source.path), _worker_settings["max_chars"], _worker_settings["overlap"])
+    except Exception as exc:  # pylint: disable=broad-except
+        return ParsedFile(source, [], None, f"{type(exc).__name__}: {exc}")
+    embedder = _worker_settings["embedder"]
+    vectors = embedder.embed(chunks) if embedder is not None and chunks else None
+    return ParsedFile(source, chunks, vectors, None, meta)
+
+
+def bounded_map(pool: Executor, func, items: Iterable, window: int) -> Iterator:
+    """Like ``pool.map`` but keeps at most ``window`` items in flight, so huge trees stay cheap."""
+    items = iter(items)
+    pending = deque(pool.submit(func, item) for item in itertools.islice(items, window))
+    while pending:
+        result = pending.popleft().result()
+        for item in itertools.islice(items, 1):
+            pending.append(pool.submit(func, item))
+        yield result
+
+
+class Progress:
+    def __init__(self, total: int, skipped: int, interval: float = 2.0, stream=sys.stderr):
+        self.total = total
+        self.skipped = skipped
+        self.interval = interval
+        self.stream = stream
+        self.files = 0
+        self.chunks = 0
+        self.failed = 0
+        self.transferred = 0  # bytes read from S3, set by sync
+        self.started = time.monotonic()
+        self._reported = self.started
+
+    def update(self, files: int = 0, chunks: int = 0, failed: int = 0) -> None:
+        self.files += files
+        self.chunks += chunks
+        self.failed += failed
+        now = time.monotonic()
+        if self.stream is not None and now - self._reported >= self.interval:
+            self._reported = now
+            self.stream.write(self.line() + "\n")
+            self.stream.flush()
+
+    def rates(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return self.files / elapsed, self.chunks / elapsed
+
+    def line(self) -> str:
+        files_per_second, chunks_per_second = self.rates()
+        line = (
+            f"files {self.files}/{self.total} ({files_per_second:.1f}/s)  "
+            f"chunks {self.chunks} ({chunks_per_second:.1f}/s)  skipped {self.skipped}  failed {self.failed}"
+        )
+        if self.transferred:
+            line += f"  read {self.transferred / 2**20:.1f} MiB"
+        return line
+
+    def summary(self) -> dict:
+        files_per_second, chunks_per_second = self.rates()
+        return {
+            "files": self.files,
+            "chunks": self.chunks,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "seconds": round(time.monotonic() - self.started, 3),
+            "filesPerSecond": round(files_per_second, 1),
+            "chunksPerSecond": round(chunks_per_second, 1),
+        }
+
+
+class Loader:
+    """Embeds parsed files in batches, appends them to the collection and checkpoints as it goes."""
+
+    def __init__(
+        self,
+        writer: CollectionWriter,
+        embedder,
+        progress: Progress,
+        batch_size: int = 256,
+        checkpoint_seconds: float = 5.0,
+        log_stream=sys.stderr,
+        metadata: Optional[dict] = None,
+    ):
+        self.writer = writer
+        self.embedder = embedder
+        self.progress = progress
+        self.batch_size = batch_size
+        self.checkpoint_seconds = checkpoint_seconds
+        self.log_stream = log_stream
+        self.metadata = metadata or {}
+        self._batch: List[ParsedFile] = []
+        self._batch_chunks = 0
+        self._last_checkpoint = time.monotonic()
+
+    def put(self, parsed: ParsedFile) -> None:
+        if parsed.error:
+            if self.log_stream is not None:
+                self.log_stream.write(f"failed {parsed.source.key}: {parsed.error}\n")
+            self.progress.update(failed=1)
+        elif parsed.vectors is not None or not parsed.chunks:
+            self._store(parsed, parsed.vectors if parsed.vectors is not None else np.zeros((0, 0), dtype=np.float32))
+        else:
+            self._batch.append(parsed)
+            self._batch_chunks += len(parsed.chunks)
+            if self._batch_chunks >= self.batch_size:
+                self._write_batch()
+        if time.monotonic() - self._last_checkpoint >= self.checkpoint_seconds:
+            self._write_batch()
+            self.writer.checkpoint()
+            self._last_checkpoint = time.monotonic()
+
+    def finish(self) -> None:
+        self._write_batch()
+        self.writer.checkpoint()
+
+    def _write_batch(self) -> None:
+        texts = [chunk for parsed in self._batch for chunk in parsed.chunks]
+        vectors = self.embedder.embed(texts) if texts else np.zeros((0, 0), dtype=np.float32)
+        row = 0
+        for parsed in self._batch:
+            count = len(parsed.chunks)
+            self._store(parsed, vectors[row : row + count])
+            row += count
+        self._batch, self._batch_chunks = [], 0
+
+    def _store(self, parsed: ParsedFile, vectors: np.ndarray) -> None:
+        source = parsed.source
+        records = [{"source": source.key, "chunk": index, "text": text} for index, text in enumerate(parsed.chunks)]
+        self.writer.add(source.key, source.stamp, records, vectors, merge_metadata(self.metadata, parsed.meta or {}))
+        self.progress.update(files=1, chunks=len(records))
+
+
+def ingest(
+    root: str,
+    writer: CollectionWriter,
+    embedder,
+    processes: int,
+    batch_size: int = 256,
+    max_chars: int = 1200,
+    overlap: int = 150,
+    checkpoint_seconds: float = 5.0,
+    prune: bool = False,
+    metadata: Optional[dict] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    progress_stream=sys.stderr,
+) -> dict:
+    """Ingest ``root`` into ``writer``; with ``shard=(index, count)`` only the files that belong to that shard."""
+    sources = [source for source in scan(root) if shard is None or shard_of(source.key, shard[1]) == shard[0]]
+    todo = [source for source in sources if not writer.is_current(source.key, source.stamp)]
+    progress = Progress(len(todo), len(sources) - len(todo), stream=progress_stream)
+    if prune:
+        present = {source.key for source in sources}
+        removed = [key for key in list(writer.manifest["files"]) if key not in present]
+        for key in removed:
+            writer.remove(key)
+    loader = Loader(writer, embedder, progress, batch_size, checkpoint_seconds, progress_stream, metadata)
+
+    local_dimensions = embedder.dimensions if getattr(embedder, "local", False) else None
+    pool = ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(max_chars, overlap, local_dimensions))
+    with pool:
+        for parsed in bounded_map(pool, parse_file, todo, window=processes * 4):
+            loader.put(parsed)
+        loader.finish()
+    summary = progress.summary()
+    if prune:
+        summary["removed"] = len(removed)
+    return summary
+
+
+def open_writer(args, embedder) -> Tuple[str, CollectionWriter]:
+    """The collection named by ``--collection``, or its shard collection with ``--shard``."""
+    if args.shard is None:
+        return args.collection, CollectionWriter(args.data_dir, args.collection, embedder.model_id)
+    collection = shard_name(args.collection, args.shard[0])
+    info = shard_info(args.collection, *args.shard)
+    return collection, CollectionWriter(args.data_dir, collection, embedder.model_id, shard=info)
+
+
+def run_ingest(args) -> int:
+    embedder = embedder_from_env()
+    collection, writer = open_writer(args, embedder)
+    try:
+        summary = ingest(
+            args.source,
+            writer,
+            embedder,
+            processes=args.processes,
+            batch_size=args.batch_size,
+            max_chars=args.chunk_chars,
+            overlap=args.chunk_overlap,
+            checkpoint_seconds=args.checkpoint_seconds,
+            prune=args.prune,
+            metadata=normalize_metadata({"owner": args.owner, "tags": args.tag}),
+            shard=args.shard,
+        )
+    except KeyboardInterrupt:
+        # The manifest already holds the last checkpoint; the next run resumes from it.
+        writer.close(checkpoint=False)
+        print("Interrupted; re-run the same command to resume.", file=sys.stderr)
+        return 130
+    writer.close()
+    report = embedding_report(embedder)
+    print(json.dumps({"collection": collection, **summary, "totalChunks": writer.count, **report}))
+    return 1 if summary["failed"] else 0
+
+
+def write_synthetic_corpus(directory: str, files: int, paragraphs: int = 12) -> None:
+    words = np.array([f"term{index}" for index in range(5000)])
+    rng = np.random.default_rng(7)
+    for index in range(files):
+        sentences = rng.choice(words, size=(paragraphs, 5, 12))
+        text = "\n\n".join(". ".join(" ".join(sentence) for sentence in paragraph) + "." for paragraph in sentences)
+        subdirectory = os.path.join(directory, f"d{index % 50:02d}")
+        os.makedirs(subdirectory, exist_ok=True)
+        with open(os.path.join(subdirectory, f"doc{index:06d}.txt"), "w", encoding="utf-8") as handle:
+            handle.write(text)
+
+
+def run_bench(args) -> int:
+    scratch = tempfile.mkdtemp(prefix="ingest-bench-")
+    try:
+        source = args.source
+        if source is None:
+            source = os.path.join(scratch, "corpus")
+            write_synthetic_corpus(source, args.synthetic)
+        results = []
+        for processes in args.processes:
+            store_dir = os.path.join(scratch, f"store-{processes}")
+            embedder = HashingEmbedder(args.dimensions)
+            writer = CollectionWriter(store_dir, "bench", embedder.model_id)
+            summary = ingest(source, writer, embedder, processes=processes, progress_stream=None)
+            writer.close()
+            results.append({"processes": processes, **summary})
+        base = results[0]["filesPerSecond"] or 1.0
+        print(f"{'processes':>9}  {'files/s':>9}  {'chunks/s':>10}  {'speedup':>7}")
+        for result in results:
+            print(
+                f"{result['processes']:>9}  {result['filesPerSecond']:>9.1f}  {result['chunksPerSecond']:>10.1f}  "
+                f"{result['filesPerSecond'] / base:>6.2f}x"
+            )
+        print(f"CPUs available: {available_cpus()}", file=sys.stderr)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return 0
+
+
+def run_compact(args) -> int:
+    manifest = read_manifest(os.path.join(args.data_dir, args.collection))
+    if manifest is None:
+        print(f"Unknown collection: {args.collection}", file=sys.stderr)
+        return 1
+    writer = CollectionWriter(args.data_dir, args.collection, manifest["embeddingModel"])
+    started = time.monotonic()
+    try:
+        merges = writer.compact(force=args.force)
+    finally:
+        writer.close()
+    manifest = writer.manifest
+    print(
+        json.dumps(
+            {
+                "collection": args.collection,
+                "merges": merges,
+                "segments": len(manifest["segments"]),
+                "rows": manifest["count"],
+                "deadRows": sum(end - start for start, end in manifest["tombstones"]),
+                "seconds": round(time.monotonic() - started, 3),
+            }
+        )
+    )
+    return 0
+
+
+def add_metadata_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--owner", help="Owner recorded for every file (a sidecar or S3 metadata can override it)")
+    parser.add_argument("--tag", action="append", default=[], help="Tag added to every file; repeatable")
+
+
+def add_shard_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--shard", type=parse_shard, help="INDEX/COUNT: only the files of that shard, into COLLECTION.shardINDEX"
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["sync"]:
+        from app.s3sync import main as sync_main  # boto3 is only needed here
+
+        return sync_main(argv[1:])
+    if argv[:1] == ["compact"]:
+        parser = argparse.ArgumentParser(prog="python -m app.ingest compact", description="Merge segments.")
+        parser.add_argument("--collection", required=True)
+        parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help=f"Store root (default {DEFAULT_DATA_DIR})")
+        parser.add_argument("--force", action="store_true", help="Merge all sealed segments and drop every dead row")
+        return run_compact(parser.parse_args(argv[1:]))
+    if argv[:1] == ["bench"]:
+        parser = argparse.ArgumentParser(prog="python -m app.ingest bench")
+        parser.add_argument("source", nargs="?", help="Directory to ingest (default: a synthetic corpus)")
+        parser.add_argument("--synthetic", type=int, default=2000, help="Files in the synthetic corpus")
+        parser.add_argument("--dimensions", type=int, default=384)
+        parser.add_argument(
+            "--processes",
+            type=lambda value: [int(entry) for entry in value.split(",")],
+            default=sorted({1, 2, 4, available_cpus()}),
+            help="Comma-separated process counts (default: 1,2,4,<CPUs>)",
+        )
+        return run_bench(parser.parse_args(argv[1:]))
+
+    parser = argparse.ArgumentParser(prog="python -m app.ingest", description="Ingest a directory tree.")
+    parser.add_argument("source", help="Directory to ingest")
+    parser.add_argument("--collection", required=True, help="Collection name (letters, digits, '.', '_', '-')")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help=f"Store root (default {DEFAULT_DATA_DIR})")
+    parser.add_argument("--processes", type=int, default=available_cpus(), help="Parser processes (default: CPUs)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks per embedding batch")
+    parser.add_argument("--chunk-chars", type=int, default=1200)
+    parser.add_argument("--chunk-overlap", type=int, default=150)
+    parser.add_argument("--checkpoint-seconds", type=float, default=5.0)
+    parser.add_argument("--prune", action="store_true", help="Remove files that no longer exist under the source")
+    add_metadata_arguments(parser)
+    add_shard_argument(parser)
+    return run_ingest(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
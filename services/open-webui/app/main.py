@@ -1,10 +1,30 @@
+import asyncio
+import functools
 import json
 import os
+import time
 from html import escape as html_escape
 
 import httpx
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket
+from fastapi.responses import JSONResponse, Response
+
+from app.assets import REVALIDATE_CACHE_CONTROL, AssetRegistry
+from app.chat_socket import ChatStreams
+from app.conversations import ConversationStore, is_valid_conversation_id, new_conversation_id
+from app.embeddings import embedder_from_env
+from app.metadata import FilterError
+from app.rerank import reranker_from_env
+from app.retrieval import RetrievalStore, is_valid_collection
+from app.retrieval_cache import RetrievalCache, retrieval_cache_from_env
+from app.shards import ShardError, shard_coordinator_from_env
+from common.compression import CompressionMiddleware
+from common.logs import REQUEST_ID_HEADER, RequestIdMiddleware, pipeline_from_env, request_id_var
+from common.profiling import RequestTracker, RequestTrackingMiddleware, build_admin_router, stage
+from common.saturation import LoadSheddingMiddleware, SaturationMonitor
+
+log_pipeline = pipeline_from_env("open-webui")
+log_pipeline.install()
 
 OPENAI_API_BASE_URL = os.environ.get("OPENAI_API_BASE_URL")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
@@ -48,17 +68,96 @@ CONFIG = {
     "appTagline": APP_TAGLINE,
     "defaultSystemPrompt": DEFAULT_SYSTEM_PROMPT,
     "preferredModels": PREFERRED_MODEL_IDS,
+    "autoModel": os.environ.get("ENABLE_AUTO_MODEL", "true").lower() == "true",
+    "webSocket": os.environ.get("ENABLE_WEBSOCKET", "true").lower() == "true",
 }
 
 BACKEND_URL = OPENAI_API_BASE_URL.rstrip("/")
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get("COMPRESSION_MINIMUM_SIZE", "1024"))
+GATEWAY_TIMEOUT_SECONDS = float(os.environ.get("GATEWAY_TIMEOUT_SECONDS", "20"))
+# Leave the gateway a little less than our own timeout so it gives up first and says why.
+GATEWAY_DEADLINE_MS = int((GATEWAY_TIMEOUT_SECONDS - 0.5) * 1000)
+
+saturation = SaturationMonitor(
+    max_in_flight=int(os.environ.get("SHED_MAX_IN_FLIGHT", "200")),
+    max_queue_depth=int(os.environ.get("SHED_MAX_QUEUE_DEPTH", "20")),
+    max_loop_lag_ms=float(os.environ.get("SHED_MAX_LOOP_LAG_MS", "500")),
+)
+SHUTDOWN_READINESS_GRACE_SECONDS = float(os.environ.get("SHUTDOWN_READINESS_GRACE_SECONDS", "5"))
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", "30"))
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+
+# Conversations live on the shared EFS volume so every task (and every device) sees the same history.
+conversations = ConversationStore(
+    os.environ.get("CONVERSATION_DATA_DIR", "/app/backend/data/conversations"),
+    segment_max_bytes=int(os.environ.get("CONVERSATION_SEGMENT_MAX_BYTES", str(1 << 20))),
+    cache_size=int(os.environ.get("CONVERSATION_CACHE_SIZE", "256")),
+)
+
+
+# Collections written by ``python -m app.ingest`` on the same volume.
+retrieval_store = RetrievalStore(os.environ.get("RETRIEVAL_DATA_DIR", "/app/backend/data/retrieval"))
+query_embedder = embedder_from_env()
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "5"))
+RETRIEVAL_MAX_TOP_K = 50
+# Optional second stage: rerank a wider candidate set and keep the best topK (RERANK_MODEL).
+rerank_stage = reranker_from_env()
+# Final passages of recent retrievals, per worker, until the collection changes (RETRIEVAL_CACHE_MAX_MB).
+retrieval_cache = retrieval_cache_from_env()
+# Collections not stored here are searched on the shard services in RETRIEVAL_SHARD_URLS, if set.
+shard_coordinator = shard_coordinator_from_env()
+
+
+def build_assets() -> AssetRegistry:
+    """Render the UI once: hash CSS/JS/fonts, then point the page at the hashed URLs."""
+    registry = AssetRegistry(STATIC_DIR)
+    font_css = registry.font_face_css()
+    css = registry.add_hashed("app.css", (font_css + "\n" + registry.read_text("app.css")).encode("utf-8"), "text/css")
+    js = registry.add_hashed("app.js", registry.read_text("app.js").encode("utf-8"), "application/javascript")
+
+    html_page = registry.read_text("index.html")
+    html_page = html_page.replace("{{APP_TITLE}}", html_escape(APP_TITLE))
+    html_page = html_page.replace("{{APP_TAGLINE}}", html_escape(APP_TAGLINE))
+    html_page = html_page.replace("{{APP_CSS_URL}}", css.url)
+    html_page = html_page.replace("{{APP_JS_URL}}", js.url)
+    registry.add("/", html_page.encode("utf-8"), "text/html; charset=utf-8", REVALIDATE_CACHE_CONTROL)
+    registry.add(
+        "/api/config",
+        json.dumps(CONFIG, separators=(",", ":")).encode("utf-8"),
+        "application/json",
+        "public, max-age=60",
+    )
+    return registry
+
+
+assets = build_assets()
+tracker = RequestTracker(
+    float(os.environ.get("SLOW_REQUEST_THRESHOLD_SECONDS", "5")),
+    slow_capacity=int(os.environ.get("SLOW_REQUEST_BUFFER_SIZE", "100")),
+)
 
 app = FastAPI(title="Bedrock Chat UI", version="0.3.0")
-client = httpx.AsyncClient(timeout=20.0)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+app.add_middleware(LoadSheddingMiddleware, monitor=saturation)
+app.add_middleware(RequestTrackingMiddleware, tracker=tracker)
+app.add_middleware(RequestIdMiddleware)
+app.include_router(build_admin_router(tracker, os.environ.get("ADMIN_API_KEY")))
+app.state.drain = functools.partial(saturation.drain, SHUTDOWN_READINESS_GRACE_SECONDS, SHUTDOWN_DRAIN_SECONDS)
+client = httpx.AsyncClient(timeout=GATEWAY_TIMEOUT_SECONDS)
+
+
+@app.on_event("startup")
+async def start_saturation_monitor():
+    # Runs in each forked worker: restart the log listener and take over uvicorn's loggers.
+    log_pipeline.install()
+    saturation.start()
 
 
 @app.on_event("shutdown")
 async def cleanup_client():
+    await saturation.stop()
     await client.aclose()
+    log_pipeline.stop()
 
 
 @app.get("/healthz")
@@ -66,12 +165,42 @@ async def health():
     return {"status": "ok"}
 
 
-@app.get("/", response_class=HTMLResponse)
-async def index():
-    html_page = RAW_HTML_PAGE.replace("{{APP_TITLE}}", html_escape(APP_TITLE))
-    html_page = html_page.replace("{{APP_TAGLINE}}", html_escape(APP_TAGLINE))
-    html_page = html_page.replace("{{CONFIG_JSON}}", json.dumps(CONFIG))
-    return html_page
+@app.get("/readyz")
+async def readiness():
+    reasons = saturation.readiness_reasons()
+    return JSONResponse(
+        status_code=503 if reasons else 200,
+        content={
+            "status": "saturated" if reasons else "ok",
+            "reasons": reasons,
+            **saturation.snapshot(),
+            "chat": chat_streams.snapshot(),
+            "rerank": rerank_stage.snapshot() if rerank_stage is not None else None,
+        },
+    )
+
+
+@app.get("/")
+async def index(request: Request):
+    return assets.respond(assets.get("/"), request)
+
+
+@app.get("/api/config")
+async def ui_config(request: Request):
+    return assets.respond(assets.get("/api/config"), request)
+
+
+@app.get("/static/{filename}")
+async def static_asset(filename: str, request: Request):
+    asset = assets.get(f"/static/{filename}")
+    if asset is None:
+        return Response(status_code=404)
+    return assets.respond(asset, request)
+
+
+def gateway_headers() -> dict:
+    # Forward the request ID so gateway log lines can be matched to ours.
+    return {"x-openwebui-api-key": OPENAI_API_KEY, REQUEST_ID_HEADER: request_id_var.get() or ""}
 
 
 @app.get("/api/models")
@@ -79,955 +208,323 @@ async def proxy_models():
     try:
         response = await client.get(
             f"{BACKEND_URL}/models",
-            headers={"x-openwebui-api-key": OPENAI_API_KEY},
+            headers=gateway_headers(),
         )
         response.raise_for_status()
     except httpx.HTTPStatusError as exc:
+        saturation.record_upstream(exc.response.status_code < 500)
         raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
+    except httpx.RequestError as exc:
+        saturation.record_upstream(False)
+        raise HTTPException(status_code=502, detail=f"Gateway unreachable: {exc}")
 
+    saturation.record_upstream(True)
     return JSONResponse(content=response.json())
 
 
-@app.post("/api/completions")
-async def proxy_completion(payload: dict):
+async def until_disconnect(request: Request, coro):
+    """Await ``coro`` but cancel it, closing the gateway connection, if the browser goes away."""
+    task = asyncio.ensure_future(coro)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=0.25)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            raise HTTPException(status_code=499, detail="Client closed request")
+
+
+@app.get("/api/conversations/{conversation_id}")
+async def get_conversation(conversation_id: str):
+    if not is_valid_conversation_id(conversation_id):
+        raise HTTPException(status_code=400, detail="Invalid conversation ID")
+    messages = await asyncio.to_thread(conversations.get, conversation_id)
+    if messages is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"conversationId": conversation_id, "messages": messages}
+
+
+async def assemble_history(payload: dict):
+    """Turn a delta submission (``conversationId`` + ``message``) into a full ``messages`` payload."""
+    conversation_id = payload.pop("conversationId", None) or new_conversation_id()
+    if not is_valid_conversation_id(conversation_id):
+        raise HTTPException(status_code=400, detail="Invalid conversation ID")
+
+    message = payload.pop("message")
+    content = message.get("content") if isinstance(message, dict) else message
+    if not isinstance(content, str) or not content.strip():
+        raise HTTPException(status_code=400, detail="'message' must be non-empty text")
+    user_message = {"role": "user", "content": content}
+
+    stage("conversation_load")
+    history = await asyncio.to_thread(conversations.get, conversation_id) or []
+    system = payload.pop("system", None)
+    payload["messages"] = (
+        ([{"role": "system", "content": system}] if system else [])
+        + [{"role": entry["role"], "content": entry["content"]} for entry in history]
+        + [user_message]
+    )
+    return conversation_id, user_message
+
+
+def deadline_headers(started: float) -> dict:
+    """The gateway's share of the budget left for a request that began at ``started`` (``time.monotonic()``)."""
+    remaining_ms = GATEWAY_DEADLINE_MS - (time.monotonic() - started) * 1000
+    return {"x-deadline-ms": str(max(1, int(remaining_ms)))}
+
+
+async def gateway_completion(payload: dict, started: float) -> dict:
+    stage("gateway")
     try:
         response = await client.post(
             f"{BACKEND_URL}/api/v1/completions",
-            headers={"x-openwebui-api-key": OPENAI_API_KEY},
+            headers={**gateway_headers(), **deadline_headers(started)},
             json=payload,
         )
         response.raise_for_status()
     except httpx.HTTPStatusError as exc:
+        saturation.record_upstream(exc.response.status_code < 500)
         raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
+    except httpx.RequestError as exc:
+        saturation.record_upstream(False)
+        raise HTTPException(status_code=502, detail=f"Gateway unreachable: {exc}")
+
+    saturation.record_upstream(True)
+    return response.json()
+
+
+async def save_turn(conversation_id: str, user_message: dict, text: str, model_id: str = None) -> None:
+    # Persist the turn only once it succeeded, so a retried message is not stored twice.
+    reply = {"role": "assistant", "content": text}
+    if model_id:
+        reply["modelId"] = model_id
+    stage("conversation_append")
+    await asyncio.to_thread(conversations.append, conversation_id, [user_message, reply])
+
+
+@app.get("/api/collections")
+async def list_collections():
+    return {"collections": await asyncio.to_thread(retrieval_store.collections)}
+
+
+@app.get("/api/collections/{collection}/metadata")
+async def collection_metadata(collection: str):
+    """Owners and tags present in a collection, with row counts, for building filters."""
+    reader = await asyncio.to_thread(retrieval_store.reader, collection)
+    if reader is None:
+        raise HTTPException(status_code=404, detail=f"Unknown collection: {collection}")
+    index = await asyncio.to_thread(reader.metadata_index)
+    return {"collection": collection, **index.values()}
+
+
+@app.get("/api/embedding-cache")
+async def embedding_cache_stats():
+    cache = getattr(query_embedder, "cache", None)
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **(await asyncio.to_thread(cache.stats))}
+
+
+@app.get("/api/retrieval-cache")
+async def retrieval_cache_stats():
+    return retrieval_cache.snapshot()
+
+
+@app.get("/api/shards")
+async def shard_stats():
+    if shard_coordinator is None:
+        return {"enabled": False}
+    return shard_coordinator.snapshot()
+
+
+def last_user_text(payload: dict) -> str:
+    for message in reversed(payload.get("messages") or []):
+        if message.get("role") == "user":
+            return message.get("content") or ""
+    return payload.get("prompt") or ""
+
+
+async def attach_context(payload: dict):
+    """Resolve ``retrieval: {collection, topK, rerank, filter}`` into ``context`` passages for the gateway."""
+    options = payload.pop("retrieval", None)
+    if not options:
+        return None
+    if not isinstance(options, dict):
+        raise HTTPException(status_code=400, detail="'retrieval' must be an object")
+    collection = options.get("collection")
+    # Refreshing a reader stats the manifest on EFS and may re-read it and map new segments.
+    reader = await asyncio.to_thread(retrieval_store.reader, collection) if isinstance(collection, str) else None
+    # A collection that is not stored here may be split across the shard services.
+    sharded = reader is None and shard_coordinator is not None and is_valid_collection(str(collection))
+    if reader is None and not sharded:
+        raise HTTPException(status_code=404, detail=f"Unknown collection: {collection}")
+    top_k = options.get("topK") or RETRIEVAL_TOP_K
+    if not isinstance(top_k, int) or not 1 <= top_k <= RETRIEVAL_MAX_TOP_K:
+        raise HTTPException(status_code=400, detail=f"'topK' must be between 1 and {RETRIEVAL_MAX_TOP_K}")
+    if reader is not None and reader.manifest["embeddingModel"] != query_embedder.model_id:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Collection was embedded with {reader.manifest['embeddingModel']}, not {query_embedder.model_id}",
+        )
 
-    return JSONResponse(content=response.json())
-
-
-RAW_HTML_PAGE = """
-<!DOCTYPE html>
-<html lang="en">
-  <head>
-    <meta charset="utf-8" />
-    <title>{{APP_TITLE}}</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1" />
-    <link rel="preconnect" href="https://fonts.googleapis.com" />
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin />
-    <link
-      href="https://fonts.googleapis.com/css2?family=JetBrains+Mono:wght@400;600&family=Space+Grotesk:wght@400;500;600;700&display=swap"
-      rel="stylesheet"
-    />
-    <style>
-      :root {
-        color-scheme: dark;
-        --bg: #0b0d11;
-        --panel: #151923;
-        --panel-strong: #1b212e;
-        --border: rgba(255, 255, 255, 0.08);
-        --muted: #a2aab8;
-        --text: #f1f5f9;
-        --accent: #f97316;
-        --accent-soft: rgba(249, 115, 22, 0.16);
-        --accent-2: #22c55e;
-        --shadow: 0 40px 90px rgba(5, 8, 15, 0.55);
-      }
-      * {
-        box-sizing: border-box;
-      }
-      body {
-        margin: 0;
-        min-height: 100vh;
-        font-family: "Space Grotesk", "Segoe UI", sans-serif;
-        background: radial-gradient(circle at 20% 20%, rgba(34, 197, 94, 0.15), transparent 45%),
-          radial-gradient(circle at 80% 0%, rgba(249, 115, 22, 0.2), transparent 55%),
-          linear-gradient(160deg, #0b0d11 0%, #0f131c 55%, #0b0d11 100%);
-        color: var(--text);
-        padding: 32px 16px 48px;
-      }
-      body::before,
-      body::after {
-        content: "";
-        position: fixed;
-        width: 360px;
-        height: 360px;
-        border-radius: 50%;
-        filter: blur(0px);
-        opacity: 0.24;
-        z-index: 0;
-      }
-      body::before {
-        background: radial-gradient(circle, rgba(249, 115, 22, 0.6), transparent 70%);
-        top: -120px;
-        left: -60px;
-      }
-      body::after {
-        background: radial-gradient(circle, rgba(34, 197, 94, 0.55), transparent 70%);
-        bottom: -140px;
-        right: -40px;
-      }
-      main {
-        position: relative;
-        z-index: 1;
-        width: min(1200px, 100%);
-        margin: 0 auto;
-        display: flex;
-        flex-direction: column;
-        gap: 22px;
-        animation: floatIn 0.6s ease forwards;
-      }
-      @keyframes floatIn {
-        from {
-          opacity: 0;
-          transform: translateY(18px);
-        }
-        to {
-          opacity: 1;
-          transform: translateY(0);
-        }
-      }
-      header {
-        display: flex;
-        gap: 16px;
-        align-items: center;
-        justify-content: space-between;
-        flex-wrap: wrap;
-      }
-      .title-block {
-        display: flex;
-        flex-direction: column;
-        gap: 6px;
-      }
-      .eyebrow {
-        font-size: 12px;
-        text-transform: uppercase;
-        letter-spacing: 0.25em;
-        color: var(--muted);
-      }
-      h1 {
-        margin: 0;
-        font-size: clamp(26px, 3vw, 34px);
-        letter-spacing: -0.02em;
-      }
-      .subtitle {
-        margin: 0;
-        color: var(--muted);
-        font-size: 15px;
-      }
-      .status-pill {
-        display: inline-flex;
-        align-items: center;
-        gap: 10px;
-        padding: 10px 14px;
-        border-radius: 999px;
-        border: 1px solid var(--border);
-        background: rgba(255, 255, 255, 0.03);
-        font-size: 13px;
-        font-weight: 600;
-        color: var(--muted);
-      }
-      .status-dot {
-        width: 10px;
-        height: 10px;
-        border-radius: 50%;
-        background: var(--accent-2);
-        box-shadow: 0 0 0 5px rgba(34, 197, 94, 0.15);
-      }
-      .status-pill.error .status-dot {
-        background: #ef4444;
-        box-shadow: 0 0 0 5px rgba(239, 68, 68, 0.16);
-      }
-      .grid {
-        display: grid;
-        grid-template-columns: minmax(240px, 320px) minmax(0, 1fr);
-        gap: 20px;
-        align-items: start;
-      }
-      .panel {
-        background: var(--panel);
-        border: 1px solid var(--border);
-        border-radius: 18px;
-        padding: 18px;
-        box-shadow: var(--shadow);
-        backdrop-filter: blur(12px);
-      }
-      .controls {
-        display: flex;
-        flex-direction: column;
-        gap: 18px;
-      }
-      .field {
-        display: flex;
-        flex-direction: column;
-        gap: 8px;
-      }
-      label {
-        font-weight: 600;
-        font-size: 14px;
-      }
-      select,
-      textarea,
-      input[type="range"] {
-        width: 100%;
-      }
-      select,
-      textarea,
-      input[type="text"] {
-        border-radius: 12px;
-        border: 1px solid var(--border);
-        background: rgba(255, 255, 255, 0.04);
-        color: var(--text);
-        padding: 12px 14px;
-        font-size: 15px;
-        outline: none;
-      }
-      select:focus,
-      textarea:focus,
-      input[type="text"]:focus {
-        border-color: rgba(249, 115, 22, 0.6);
-        box-shadow: 0 0 0 3px rgba(249, 115, 22, 0.15);
-      }
-      textarea {
-        min-height: 90px;
-        max-height: 220px;
-        resize: vertical;
-        line-height: 1.5;
-      }
-      .range-wrap {
-        display: flex;
-        align-items: center;
-        gap: 12px;
-      }
-      input[type="range"] {
-        accent-color: var(--accent);
-      }
-      .range-value {
-        font-size: 13px;
-        color: var(--muted);
-        font-weight: 600;
-      }
-      .helper {
-        font-size: 13px;
-        color: var(--muted);
-      }
-      .model-meta {
-        font-size: 12px;
-        color: var(--muted);
-        line-height: 1.5;
-      }
-      .chip-row {
-        display: flex;
-        flex-wrap: wrap;
-        gap: 8px;
-      }
-      .chip {
-        border: 1px solid var(--border);
-        background: rgba(255, 255, 255, 0.04);
-        color: var(--text);
-        border-radius: 999px;
-        padding: 6px 10px;
-        font-size: 12px;
-        cursor: pointer;
-        transition: border-color 0.15s ease, transform 0.1s ease;
-      }
-      .chip:hover {
-        border-color: rgba(249, 115, 22, 0.4);
-        transform: translateY(-1px);
-      }
-      .chat-panel {
-        display: flex;
-        flex-direction: column;
-        gap: 16px;
-        min-height: 520px;
-      }
-      #chat {
-        display: flex;
-        flex-direction: column;
-        gap: 14px;
-        max-height: 460px;
-        overflow-y: auto;
-        padding-right: 6px;
-      }
-      .empty-state {
-        text-align: center;
-        color: var(--muted);
-        padding: 48px 12px;
-        border: 1px dashed rgba(255, 255, 255, 0.1);
-        border-radius: 14px;
-      }
-      .message {
-        display: grid;
-        grid-template-columns: 52px 1fr;
-        gap: 12px;
-        align-items: start;
-        animation: fadeUp 0.3s ease var(--delay, 0ms) both;
-      }
-      @keyframes fadeUp {
-        from {
-          opacity: 0;
-          transform: translateY(8px);
-        }
-        to {
-          opacity: 1;
-          transform: translateY(0);
-        }
-      }
-      .avatar {
-        width: 46px;
-        height: 46px;
-        border-radius: 14px;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        font-weight: 700;
-        font-size: 14px;
-        color: #0b0d11;
-      }
-      .message.user .avatar {
-        background: linear-gradient(135deg, #fbbf24, #f97316);
-      }
-      .message.assistant .avatar {
-        background: linear-gradient(135deg, #34d399, #22c55e);
-      }
-      .bubble {
-        border-radius: 16px;
-        border: 1px solid var(--border);
-        background: rgba(255, 255, 255, 0.04);
-        padding: 12px 14px;
-        line-height: 1.6;
-      }
-      .message.assistant .bubble {
-        background: linear-gradient(145deg, rgba(34, 197, 94, 0.14), rgba(15, 23, 42, 0.7));
-        border-color: rgba(34, 197, 94, 0.4);
-      }
-      .bubble.pending {
-        color: var(--muted);
-        font-style: italic;
-      }
-      .meta {
-        font-size: 12px;
-        text-transform: uppercase;
-        letter-spacing: 0.15em;
-        color: var(--muted);
-        margin-bottom: 6px;
-      }
-      .composer {
-        display: flex;
-        flex-direction: column;
-        gap: 12px;
-        border-top: 1px solid var(--border);
-        padding-top: 14px;
-      }
-      .composer textarea {
-        min-height: 70px;
-      }
-      .actions {
-        display: flex;
-        flex-wrap: wrap;
-        gap: 10px;
-      }
-      button {
-        border: none;
-        border-radius: 12px;
-        padding: 12px 18px;
-        font-weight: 700;
-        cursor: pointer;
-        transition: transform 0.1s ease, box-shadow 0.15s ease, opacity 0.2s ease;
-      }
-      button.primary {
-        background: linear-gradient(135deg, #f97316, #fbbf24);
-        color: #111827;
-        box-shadow: 0 14px 30px rgba(249, 115, 22, 0.25);
-      }
-      button.secondary {
-        background: rgba(255, 255, 255, 0.08);
-        color: var(--text);
-        border: 1px solid var(--border);
-      }
-      button:disabled {
-        opacity: 0.6;
-        cursor: not-allowed;
-        box-shadow: none;
-      }
-      button:active {
-        transform: translateY(1px);
-      }
-      details {
-        border-radius: 16px;
-        background: var(--panel-strong);
-        border: 1px solid var(--border);
-        padding: 14px;
-      }
-      summary {
-        cursor: pointer;
-        font-weight: 600;
-        font-size: 14px;
-      }
-      pre {
-        font-family: "JetBrains Mono", monospace;
-        font-size: 12px;
-        background: #0b0f16;
-        color: #d6dbe6;
-        border: 1px solid var(--border);
-        border-radius: 12px;
-        padding: 12px;
-        white-space: pre-wrap;
-        word-break: break-word;
-        max-height: 320px;
-        overflow-y: auto;
-      }
-      .footer-note {
-        font-size: 12px;
-        color: var(--muted);
-        margin-top: 8px;
-      }
-      @media (max-width: 960px) {
-        .grid {
-          grid-template-columns: 1fr;
-        }
-        #chat {
-          max-height: 380px;
-        }
-      }
-      @media (max-width: 640px) {
-        body {
-          padding: 24px 12px 36px;
-        }
-        .message {
-          grid-template-columns: 1fr;
-        }
-        .avatar {
-          width: 38px;
-          height: 38px;
-        }
-      }
-      @media (prefers-reduced-motion: reduce) {
-        * {
-          animation: none !important;
-          transition: none !important;
-        }
-      }
-    </style>
-  </head>
-  <body>
-    <main>
-      <header>
-        <div class="title-block">
-          <div class="eyebrow">Bedrock UI</div>
-          <h1>{{APP_TITLE}}</h1>
-          <p class="subtitle">{{APP_TAGLINE}}</p>
-        </div>
-        <div class="status-pill" id="status-pill">
-          <span class="status-dot"></span>
-          <span id="status-text">Ready</span>
-        </div>
-      </header>
-
-      <section class="grid">
-        <aside class="panel controls">
-          <div class="field">
-            <label for="model">Model</label>
-            <select id="model" aria-label="Choose a Bedrock model"></select>
-            <div class="helper" id="model-hint">Loading models...</div>
-            <div class="model-meta" id="model-meta"></div>
-          </div>
-
-          <div class="field">
-            <label for="temperature">Temperature</label>
-            <div class="range-wrap">
-              <input id="temperature" type="range" min="0" max="1" step="0.05" />
-              <span class="range-value" id="temperature-value">0.3</span>
-            </div>
-          </div>
-
-          <div class="field">
-            <label for="system">System prompt</label>
-            <textarea id="system" placeholder="Optional tone or role. Example: You are concise."></textarea>
-          </div>
-
-          <div class="field">
-            <label>Quick prompts</label>
-            <div class="chip-row" id="prompt-chips"></div>
-          </div>
-
-          <div class="field">
-            <label>Session</label>
-            <div class="actions">
-              <button class="secondary" id="clear-chat" type="button">New chat</button>
-              <button class="secondary" id="save-chat" type="button">Save transcript</button>
-            </div>
-          </div>
-        </aside>
-
-        <section class="panel chat-panel">
-          <div id="chat" role="log" aria-live="polite">
-            <div class="empty-state" id="empty-state">
-              Start a conversation. The assistant response will appear here.
-            </div>
-          </div>
-
-          <div class="composer">
-            <label for="prompt" style="display:none;">Message</label>
-            <textarea
-              id="prompt"
-              rows="3"
-              placeholder="Ask a question. Press Shift+Enter for a new line."
-            ></textarea>
-            <div class="actions">
-              <button class="primary" id="run" type="button">Send</button>
-            </div>
-          </div>
-        </section>
-      </section>
-
-      <details class="panel" open>
-        <summary>Response details</summary>
-        <pre id="output" aria-live="polite">Responses will appear here.</pre>
-        <div class="footer-note">Raw gateway response for debugging.</div>
-      </details>
-    </main>
-
-    <script>
-      const CONFIG = {{CONFIG_JSON}};
-
-      const modelsSelect = document.getElementById("model");
-      const output = document.getElementById("output");
-      const runButton = document.getElementById("run");
-      const promptField = document.getElementById("prompt");
-      const systemField = document.getElementById("system");
-      const chatContainer = document.getElementById("chat");
-      const emptyState = document.getElementById("empty-state");
-      const statusPill = document.getElementById("status-pill");
-      const statusText = document.getElementById("status-text");
-      const modelHint = document.getElementById("model-hint");
-      const modelMeta = document.getElementById("model-meta");
-      const temperatureInput = document.getElementById("temperature");
-      const temperatureValue = document.getElementById("temperature-value");
-      const clearButton = document.getElementById("clear-chat");
-      const saveButton = document.getElementById("save-chat");
-      const promptChips = document.getElementById("prompt-chips");
-
-      const STORAGE_KEY = "bedrock-chat-state-v1";
-      const state = {
-        models: [],
-        history: [],
-        temperature: 0.3,
-        systemPrompt: CONFIG.defaultSystemPrompt || "",
-        modelId: "",
-      };
-      let recommendedModelId = "";
-      const storage = {
-        get(key) {
-          try {
-            return window.localStorage ? localStorage.getItem(key) : null;
-          } catch (err) {
-            return null;
-          }
-        },
-        set(key, value) {
-          try {
-            if (window.localStorage) {
-              localStorage.setItem(key, value);
-            }
-          } catch (err) {
-            // Ignore storage failures (private mode, blocked storage, quota, etc.).
-          }
-        },
-      };
-
-      const quickPrompts = [
-        "Summarize this in three bullet points.",
-        "Draft a short email reply.",
-        "Explain this like I am five.",
-        "Give me a checklist for a launch.",
-      ];
-
-      function setStatus(message, isError = false) {
-        statusText.textContent = message;
-        statusPill.classList.toggle("error", isError);
-      }
-
-      function reportError(message) {
-        output.textContent = message;
-        setStatus("Client error", true);
-      }
-
-      function saveState() {
-        const payload = {
-          history: state.history,
-          temperature: state.temperature,
-          systemPrompt: state.systemPrompt,
-          modelId: state.modelId,
-        };
-        storage.set(STORAGE_KEY, JSON.stringify(payload));
-      }
-
-      function loadState() {
-        const raw = storage.get(STORAGE_KEY);
-        if (!raw) {
-          return;
-        }
-        try {
-          const stored = JSON.parse(raw);
-          state.history = Array.isArray(stored.history) ? stored.history : [];
-          state.temperature = typeof stored.temperature === "number" ? stored.temperature : 0.3;
-          state.systemPrompt = stored.systemPrompt || "";
-          state.modelId = stored.modelId || "";
-        } catch (err) {
-          console.warn("Failed to load stored state", err);
-        }
-      }
-
-      function renderChat() {
-        chatContainer.innerHTML = "";
-        const recent = state.history.slice(-80);
-        if (!recent.length) {
-          chatContainer.appendChild(emptyState);
-        } else {
-          recent.forEach((msg, index) => {
-            const row = document.createElement("div");
-            row.className = `message ${msg.role}`;
-            row.style.setProperty("--delay", `${index * 20}ms`);
-
-            const avatar = document.createElement("div");
-            avatar.className = "avatar";
-            avatar.textContent = msg.role === "user" ? "YOU" : "AI";
-
-            const bubble = document.createElement("div");
-            bubble.className = "bubble" + (msg.pending ? " pending" : "");
-
-            const meta = document.createElement("div");
-            meta.className = "meta";
-            meta.textContent = msg.role === "user" ? "User" : "Assistant";
-
-            const text = document.createElement("div");
-            text.textContent = msg.content || "";
-
-            bubble.appendChild(meta);
-            bubble.appendChild(text);
-            row.appendChild(avatar);
-            row.appendChild(bubble);
-            chatContainer.appendChild(row);
-          });
-        }
-        chatContainer.scrollTop = chatContainer.scrollHeight;
-      }
-
-      function renderChips() {
-        promptChips.innerHTML = "";
-        quickPrompts.forEach((text) => {
-          const chip = document.createElement("button");
-          chip.className = "chip";
-          chip.type = "button";
-          chip.textContent = text;
-          chip.addEventListener("click", () => {
-            promptField.value = text;
-            promptField.focus();
-            autoResize(promptField);
-          });
-          promptChips.appendChild(chip);
-        });
-      }
-
-      function updateTemperature(value) {
-        const clamped = Math.min(1, Math.max(0, value));
-        state.temperature = clamped;
-        temperatureInput.value = clamped;
-        temperatureValue.textContent = clamped.toFixed(2);
-        saveState();
-      }
-
-      function autoResize(textarea) {
-        textarea.style.height = "auto";
-        textarea.style.height = `${Math.min(textarea.scrollHeight, 220)}px`;
-      }
-
-      function normalizeModels(entries) {
-        return entries
-          .map((entry) => {
-            const modelId = entry.modelId || entry.model_id || entry.id || "";
-            return {
-              id: modelId,
-              name: entry.modelName || entry.name || modelId,
-              provider: entry.providerName || entry.provider || "",
-              inputModalities: entry.inputModalities || [],
-              outputModalities: entry.outputModalities || [],
-              inferenceTypes: entry.inferenceTypesSupported || [],
-              raw: entry,
-            };
-          })
-          .filter((entry) => entry.id);
-      }
-
-      function scoreModel(model) {
-        const id = model.id || "";
-        let score = 0;
-        (CONFIG.preferredModels || []).forEach((key, index) => {
-          if (id.includes(key)) {
-            score = Math.max(score, 1000 - index * 10);
-          }
-        });
-        if (/(70b|xlarge|xl|large|pro|opus)/i.test(id)) {
-          score += 25;
-        }
-        if (/(8b|small|lite|haiku)/i.test(id)) {
-          score -= 10;
-        }
-        if (model.inferenceTypes.includes("ON_DEMAND")) {
-          score += 5;
-        }
-        return score;
-      }
-
-      function rankModels(models) {
-        return [...models].sort((a, b) => {
-          const diff = scoreModel(b) - scoreModel(a);
-          if (diff !== 0) return diff;
-          return a.name.localeCompare(b.name);
-        });
-      }
-
-      function updateModelMeta(selectedId) {
-        const model = state.models.find((entry) => entry.id === selectedId);
-        if (!model) {
-          modelMeta.textContent = "";
-          return;
-        }
-        const parts = [];
-        if (model.provider) parts.push(`Provider: ${model.provider}`);
-        if (model.outputModalities?.length) parts.push(`Output: ${model.outputModalities.join(", ")}`);
-        if (model.inferenceTypes?.length) parts.push(`Inference: ${model.inferenceTypes.join(", ")}`);
-        modelMeta.textContent = parts.join(" | ");
-      }
-
-      async function loadModels() {
-        try {
-          setStatus("Loading models...");
-          const response = await fetch("/api/models");
-          if (!response.ok) {
-            throw new Error(await response.text());
-          }
-          const data = await response.json();
-          const entries = data.models || data.modelSummaries || [];
-
-          const normalized = normalizeModels(entries);
-          const filtered = normalized.filter((entry) => {
-            if (!entry.outputModalities?.length) return true;
-            const outputs = entry.outputModalities;
-            const inference = entry.inferenceTypes || [];
-            const isTextCapable = outputs.includes("TEXT");
-            const isOnDemand = inference.includes("ON_DEMAND") || !inference.length;
-            return isTextCapable && isOnDemand;
-          });
-
-          state.models = rankModels(filtered.length ? filtered : normalized);
-          modelsSelect.innerHTML = "";
-
-          state.models.forEach((entry, index) => {
-            const option = document.createElement("option");
-            option.value = entry.id;
-            const provider = entry.provider ? ` - ${entry.provider}` : "";
-            option.textContent = `${entry.name || entry.id}${provider}`;
-            if (index === 0) {
-              option.dataset.recommended = "true";
-            }
-            modelsSelect.appendChild(option);
-          });
-
-          if (!state.models.length) {
-            const option = document.createElement("option");
-            option.textContent = "No models found";
-            option.disabled = true;
-            modelsSelect.appendChild(option);
-            setStatus("No models found", true);
-            return;
-          }
-
-          recommendedModelId = state.models[0].id;
-          const storedModel = state.modelId && state.models.find((m) => m.id === state.modelId);
-          modelsSelect.value = storedModel ? state.modelId : recommendedModelId;
-          state.modelId = modelsSelect.value;
-          modelHint.textContent =
-            state.modelId === recommendedModelId
-              ? "Recommended model selected."
-              : `Recommended: ${recommendedModelId}`;
-          updateModelMeta(state.modelId);
-          setStatus("Ready");
-          saveState();
-        } catch (err) {
-          output.textContent = "Failed to load models: " + err.message;
-          setStatus("Model load failed", true);
-        }
-      }
-
-      function extractAssistantText(payload) {
-        if (!payload) return "";
-        const body = payload.body || payload;
-        if (!body) return "";
-        if (typeof body === "string") return body;
-        if (body.generation) return body.generation;
-        if (body.output) return body.output;
-        if (Array.isArray(body.choices) && body.choices[0]) {
-          const choice = body.choices[0];
-          if (choice.message?.content) return choice.message.content;
-          if (choice.text) return choice.text;
-        }
-        if (Array.isArray(body.outputs) && body.outputs[0]?.text) return body.outputs[0].text;
-        if (Array.isArray(body.results) && body.results[0]?.outputText) return body.results[0].outputText;
-        if (Array.isArray(body.generations) && body.generations[0]?.text) return body.generations[0].text;
-        if (body.completion) return body.completion;
-        if (body.message?.content) return body.message.content;
-        if (Array.isArray(body.content)) {
-          return body.content.map((part) => part.text || part.outputText || "").join("");
-        }
-        if (body.outputText) return body.outputText;
-        return "";
-      }
-
-      async function runPrompt() {
-        const modelId = modelsSelect.value;
-        if (!modelId) {
-          output.textContent = "Select a model before sending.";
-          setStatus("Select a model", true);
-          return;
+    use_rerank = options.get("rerank", True)
+    if not isinstance(use_rerank, bool):
+        raise HTTPException(status_code=400, detail="'rerank' must be true or false")
+    reranker = rerank_stage if use_rerank else None
+    spec = options.get("filter")
+    if spec is not None and not isinstance(spec, dict):
+        raise HTTPException(status_code=400, detail="'filter' must be an object")
+
+    stage("retrieval")
+    query = last_user_text(payload)
+    started = time.perf_counter()
+    result = {"collection": collection}
+    # Shard versions are only known after asking the shards, so sharded results are not cached.
+    cache_key = hits = None
+    if reader is not None:
+        cache_key = RetrievalCache.key(
+            query, collection, reader.version, spec, top_k, reranker.model_id if reranker is not None else None
+        )
+        hits = retrieval_cache.get(cache_key)
+    if hits is not None:
+        result["cached"] = True
+        timings = {"cacheMs": round((time.perf_counter() - started) * 1000, 2)}
+    else:
+        vectors = await via_gateway(query_embedder.aembed(client, [query], "query", headers=gateway_headers()))
+        embedded = time.perf_counter()
+        candidates = max(top_k, reranker.candidates) if reranker is not None else top_k
+        try:
+            if reader is not None:
+                hits = await asyncio.to_thread(reader.search, vectors[0], candidates, spec)
+            else:
+                hits, result["shards"] = await shard_coordinator.search(
+                    client, collection, vectors[0], candidates, spec, query_embedder.model_id
+                )
+        except FilterError as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid filter: {exc}")
+        except ShardError as exc:
+            raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+        if hits is None:
+            raise HTTPException(status_code=404, detail=f"Unknown collection: {collection}")
+        timings = {
+            "embedMs": round((embedded - started) * 1000, 2),
+            "searchMs": round((time.perf_counter() - embedded) * 1000, 2),
         }
+        if reranker is not None and hits:
+            stage("rerank")
+            hits, result["rerank"] = await via_gateway(
+                reranker.rerank(client, query, hits, top_k, headers=gateway_headers())
+            )
+            timings["rerankMs"] = result["rerank"]["latencyMs"]
+        if cache_key is not None:
+            retrieval_cache.put(cache_key, hits, time.perf_counter() - started)
+    payload["context"] = [{"text": hit.text, "source": hit.source} for hit in hits]
+    result["passages"] = [{key: value for key, value in hit.to_dict().items() if key != "text"} for hit in hits]
+    result["timings"] = timings
+    return result
+
+
+async def via_gateway(awaitable):
+    """Await an embedding or rerank call to the gateway, turning its errors into HTTP errors."""
+    try:
+        return await awaitable
+    except httpx.HTTPStatusError as exc:
+        raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
+    except httpx.RequestError as exc:
+        raise HTTPException(status_code=502, detail=f"Gateway unreachable: {exc}")
 
-        const userMessage = promptField.value.trim();
-        if (!userMessage) {
-          output.textContent = "Type a message before sending.";
-          setStatus("Nothing to send", true);
-          return;
-        }
 
-        state.history.push({ role: "user", content: userMessage });
-        const pending = { role: "assistant", content: "Thinking...", pending: true };
-        state.history.push(pending);
-        renderChat();
-        promptField.value = "";
-        autoResize(promptField);
-
-        runButton.disabled = true;
-        runButton.textContent = "Sending...";
-        setStatus("Waiting for the gateway...");
-        output.textContent = "Awaiting response...";
-
-        try {
-          const messages = state.history.filter((msg) => !msg.pending);
-          if (state.systemPrompt) {
-            messages.unshift({ role: "system", content: state.systemPrompt });
-          }
-
-          const response = await fetch("/api/completions", {
-            method: "POST",
-            headers: {
-              "Content-Type": "application/json",
-            },
-            body: JSON.stringify({
-              modelId,
-              messages,
-              temperature: state.temperature,
-            }),
-          });
-
-          if (!response.ok) {
-            throw new Error(await response.text());
-          }
-
-          const data = await response.json();
-          const text = extractAssistantText(data) || "No text returned. See response details.";
-          pending.content = text;
-          pending.pending = false;
-          renderChat();
-          output.textContent = JSON.stringify(data, null, 2);
-          setStatus("Ready");
-          saveState();
-        } catch (err) {
-          pending.content = "Request failed. See response details.";
-          pending.pending = false;
-          renderChat();
-          output.textContent = "Request failed: " + err.message;
-          setStatus("Request failed", true);
-        } finally {
-          runButton.disabled = false;
-          runButton.textContent = "Send";
-        }
-      }
-
-      function clearChat() {
-        state.history = [];
-        renderChat();
-        saveState();
-        setStatus("New chat started");
-      }
-
-      function saveTranscript() {
-        if (!state.history.length) {
-          setStatus("Nothing to save", true);
-          return;
-        }
-        const lines = state.history.map((msg) => `${msg.role.toUpperCase()}: ${msg.content}`);
-        const blob = new Blob([lines.join("\\n\\n")], { type: "text/plain" });
-        const url = URL.createObjectURL(blob);
-        const link = document.createElement("a");
-        link.href = url;
-        const timestamp = new Date().toISOString().replace(/[:]/g, "-").slice(0, 19);
-        link.download = `chat-${timestamp}.txt`;
-        document.body.appendChild(link);
-        link.click();
-        link.remove();
-        URL.revokeObjectURL(url);
-        setStatus("Transcript saved");
-      }
-
-      function updateSystemPrompt(value) {
-        state.systemPrompt = value;
-        saveState();
-      }
-
-      function handleModelChange() {
-        state.modelId = modelsSelect.value;
-        updateModelMeta(state.modelId);
-        if (recommendedModelId) {
-          modelHint.textContent =
-            state.modelId === recommendedModelId
-              ? "Recommended model selected."
-              : `Recommended: ${recommendedModelId}`;
-        }
-        saveState();
-      }
-
-      function init() {
-        loadState();
-        renderChat();
-        renderChips();
-        systemField.value = state.systemPrompt;
-        updateTemperature(state.temperature || 0.3);
-        autoResize(promptField);
-        loadModels();
-      }
-
-      window.addEventListener("error", (event) => {
-        reportError(`Client error: ${event.message}`);
-      });
-      window.addEventListener("unhandledrejection", (event) => {
-        const message = event.reason?.message || String(event.reason || "Unknown error");
-        reportError(`Client error: ${message}`);
-      });
-
-      runButton.addEventListener("click", runPrompt);
-      promptField.addEventListener("keydown", (event) => {
-        if (event.key === "Enter" && !event.shiftKey) {
-          event.preventDefault();
-          runPrompt();
-        }
-      });
-      promptField.addEventListener("input", () => autoResize(promptField));
-      systemField.addEventListener("input", (event) => updateSystemPrompt(event.target.value));
-      modelsSelect.addEventListener("change", handleModelChange);
-      temperatureInput.addEventListener("input", (event) => updateTemperature(Number(event.target.value)));
-      clearButton.addEventListener("click", clearChat);
-      saveButton.addEventListener("click", saveTranscript);
-
-      init();
-    </script>
-  </body>
-</html>
-"""
+@app.post("/api/completions")
+async def proxy_completion(payload: dict, request: Request):
+    started = time.monotonic()
+    conversation_id = user_message = None
+    if "message" in payload:
+        conversation_id, user_message = await assemble_history(payload)
+    retrieval = await attach_context(payload)
+
+    data = await until_disconnect(request, gateway_completion(payload, started))
+    if retrieval:
+        data["retrieval"] = retrieval
+    if conversation_id:
+        text = (data.get("output") or {}).get("text") or ""
+        await save_turn(conversation_id, user_message, text, data.get("modelId"))
+        data["conversationId"] = conversation_id
+    return JSONResponse(content=data)
+
+
+async def stream_from_gateway(payload: dict, emit, started: float) -> dict:
+    """Relay the gateway's SSE stream through ``emit``; return the fields of its ``done`` event."""
+    stage("gateway")
+    headers = {**gateway_headers(), **deadline_headers(started)}
+    try:
+        async with client.stream(
+            "POST", f"{BACKEND_URL}/api/v1/completions/stream", headers=headers, json=payload
+        ) as response:
+            if response.status_code >= 400:
+                detail = (await response.aread()).decode("utf-8", "replace")
+                saturation.record_upstream(response.status_code < 500)
+                raise HTTPException(status_code=response.status_code, detail=detail)
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: ") :])
+                kind = event.pop("type", None)
+                if kind == "delta":
+                    emit(event["text"])
+                elif kind == "done":
+                    saturation.record_upstream(True)
+                    return event
+                elif kind == "error":
+                    saturation.record_upstream(event["status"] < 500)
+                    raise HTTPException(status_code=event["status"], detail=event["detail"])
+    except httpx.RequestError as exc:
+        saturation.record_upstream(False)
+        raise HTTPException(status_code=502, detail=f"Gateway unreachable: {exc}")
+    raise HTTPException(status_code=502, detail="Gateway stream ended without a result")
+
+
+async def run_socket_completion(payload: dict, emit) -> dict:
+    with tracker.track("WS", "/api/ws"):
+        started = time.monotonic()
+        conversation_id = user_message = None
+        if "message" in payload:
+            conversation_id, user_message = await assemble_history(payload)
+        retrieval = await attach_context(payload)
+
+        parts = []
+
+        def relay(text: str) -> None:
+            parts.append(text)
+            emit(text)
+
+        try:
+            result = await stream_from_gateway(payload, relay, started)
+        except HTTPException as exc:
+            # Families without Converse support only answer unstreamed; send their reply as one delta.
+            if exc.status_code != 400 or "Streaming is not supported" not in str(exc.detail):
+                raise
+            data = await gateway_completion({**payload, "responseFormat": "compact"}, started)
+            result = {key: value for key, value in data.items() if key != "output"}
+            output = dict(data.get("output") or {})
+            relay(output.pop("text", "") or "")
+            result["output"] = output
+
+        if retrieval:
+            result["retrieval"] = retrieval
+        if conversation_id:
+            await save_turn(conversation_id, user_message, "".join(parts), result.get("modelId"))
+            result["conversationId"] = conversation_id
+        return result
+
+
+chat_streams = ChatStreams(
+    run_socket_completion,
+    saturation,
+    resume_seconds=float(os.environ.get("WEBSOCKET_RESUME_SECONDS", "30")),
+    max_streams_per_socket=int(os.environ.get("WEBSOCKET_MAX_STREAMS", "4")),
+)
+
+
+@app.websocket("/api/ws")
+async def chat_socket(websocket: WebSocket):
+    await chat_streams.serve(websocket)
@@ -0,0 +1,319 @@
+"""Metadata filters for the retrieval store.
+
+Every ingested file may carry ``owner``, ``tags`` and a ``date``; together
+with the file's own key (``document``) they are recorded in the collection
+manifest. A reader turns them into an index over rows:
+
+- ``owner`` and ``tag`` values get a posting bitset (NumPy, one bit per row),
+- ``document`` maps to the contiguous row range of the file's chunks,
+- ``date`` is a per-row column of days since 1970-01-01 for range queries.
+
+Filters are JSON objects; fields listed together must all match::
+
+    {"document": "handbook/pto.md"}
+    {"document": {"prefix": "handbook/"}}
+    {"owner": {"in": ["hr", "legal"]}, "tag": "policy"}
+    {"tag": {"all": ["policy", "2024"]}}
+    {"date": {"gte": "2024-01-01", "lt": "2025-01-01"}}
+    {"or": [{"tag": "faq"}, {"not": {"owner": "archive"}}]}
+
+``evaluate`` returns the matching rows as a bitset, which the reader uses to
+score only those rows (see ``CollectionReader.search``).
+
+    python -m app.metadata bench
+
+builds a synthetic collection and times selective and broad filters against
+an unfiltered scan and against filtering after top-k.
+"""
+
+import argparse
+import bisect
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+EPOCH = datetime.date(1970, 1, 1)
+NO_DATE = np.iinfo(np.int32).min
+FIELDS = ("document", "owner", "tag", "date")
+DATE_BOUNDS = {"gt", "gte", "lt", "lte"}
+
+
+class FilterError(ValueError):
+    pass
+
+
+def parse_date(value) -> datetime.date:
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.datetime.fromtimestamp(value, datetime.timezone.utc).date()
+    if isinstance(value, str):
+        try:
+            return datetime.date.fromisoformat(value[:10])
+        except ValueError:
+            pass
+    raise FilterError(f"Not a date: {value!r} (expected YYYY-MM-DD)")
+
+
+def day_number(value) -> int:
+    return (parse_date(value) - EPOCH).days
+
+
+def normalize_metadata(raw: Optional[dict]) -> dict:
+    """Clean ``owner``/``tags``/``date`` from a sidecar file, S3 user metadata or CLI flags."""
+    meta = {}
+    if not raw:
+        return meta
+    owner = raw.get("owner")
+    if owner:
+        meta["owner"] = str(owner).strip()
+    tags = raw.get("tags") or []
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    tags = sorted({str(tag).strip() for tag in tags if str(tag).strip()})
+    if tags:
+        meta["tags"] = tags
+    if raw.get("date") not in (None, ""):
+        meta["date"] = parse_date(raw["date"]).isoformat()
+    return meta
+
+
+def merge_metadata(defaults: dict, specific: dict) -> dict:
+    """``specific`` wins for owner and date; tags are combined."""
+    merged = {**defaults, **specific}
+    tags = sorted(set(defaults.get("tags", [])) | set(specific.get("tags", [])))
+    if tags:
+        merged["tags"] = tags
+    return merged
+
+
+def _packed(mask: np.ndarray) -> np.ndarray:
+    return np.packbits(mask, bitorder="little")
+
+
+class MetadataIndex:
+    """Bitset postings and a date column over a collection's rows, built from its manifest."""
+
+    def __init__(self, manifest: dict):
+        self.count = count = manifest["count"]
+        self.documents: Dict[str, Tuple[int, int]] = {}
+        self.dates = np.full(count, NO_DATE, dtype=np.int32)
+        covered = np.zeros(count, dtype=bool)
+        owners: Dict[str, np.ndarray] = {}
+        tags: Dict[str, np.ndarray] = {}
+        for key, entry in manifest["files"].items():
+            start, end = entry["rows"]
+            self.documents[key] = (start, end)
+            if end == start:
+                continue
+            covered[start:end] = True
+            meta = entry.get("meta") or {}
+            if "owner" in meta:
+                owners.setdefault(meta["owner"], np.zeros(count, dtype=bool))[start:end] = True
+            for tag in meta.get("tags", []):
+                tags.setdefault(tag, np.zeros(count, dtype=bool))[start:end] = True
+            if "date" in meta:
+                self.dates[start:end] = day_number(meta["date"])
+        # Rows of removed or replaced files belong to no file and never match.
+        self.all = _packed(covered)
+        self.none = np.zeros_like(self.all)
+        self.owners = {value: _packed(mask) for value, mask in owners.items()}
+        self.tags = {value: _packed(mask) for value, mask in tags.items()}
+        self._sorted_documents = sorted(self.documents)
+
+    def values(self) -> dict:
+        """Distinct owners and tags with their row counts, for clients building filters."""
+        return {
+            "owners": {value: int(np.unpackbits(bits).sum()) for value, bits in sorted(self.owners.items())},
+            "tags": {value: int(np.unpackbits(bits).sum()) for value, bits in sorted(self.tags.items())},
+        }
+
+    def mask(self, bits: np.ndarray) -> np.ndarray:
+        return np.unpackbits(bits, count=self.count, bitorder="little").view(bool)
+
+    def _ranges(self, spans: Iterable[Tuple[int, int]]) -> np.ndarray:
+        mask = np.zeros(self.count, dtype=bool)
+        for start, end in spans:
+            mask[start:end] = True
+        return _packed(mask)
+
+    def _any(self, postings: List[np.ndarray]) -> np.ndarray:
+        result = self.none.copy()
+        for bits in postings:
+            result |= bits
+        return result
+
+    def _all(self, postings: List[np.ndarray]) -> np.ndarray:
+        result = self.all.copy()
+        for bits in postings:
+            result &= bits
+        return result
+
+    def _documents(self, condition) -> np.ndarray:
+        if isinstance(condition, str):
+            condition = {"in": [condition]}
+        if not isinstance(condition, dict) or len(condition) != 1:
+            raise FilterError("'document' takes a name, {'in': [...]} or {'prefix': ...}")
+        (operator, operand), = condition.items()
+        if operator == "eq":
+            return self._documents({"in": [operand]})
+        if operator == "in" and isinstance(operand, list):
+            return self._ranges(self.documents[name] for name in operand if name in self.documents)
+        if operator == "prefix" and isinstance(operand, str):
+            position = bisect.bisect_left(self._sorted_documents, operand)
+            spans = []
+            for name in self._sorted_documents[position:]:
+                if not name.startswith(operand):
+                    break
+                spans.append(self.documents[name])
+            return self._ranges(spans)
+        raise FilterError(f"Unsupported 'document' condition: {condition!r}")
+
+    def _postings(self, field: str, table: Dict[str, np.ndarray], condition) -> np.ndarray:
+        if isinstance(condition, str):
+            return table.get(condition, self.none)
+        if not isinstance(condition, dict) or len(condition) != 1:
+            raise FilterError(f"'{field}' takes a value, {{'in': [...]}} or {{'all': [...]}}")
+        (operator, operand), = condition.items()
+        if operator == "eq" and isinstance(operand, str):
+            return table.get(operand, self.none)
+        if operator in ("in", "all") and isinstance(operand, list) and all(isinstance(v, str) for v in operand):
+            postings = [table.get(value, self.none) for value in operand]
+            return self._any(postings) if operator == "in" else self._all(postings)
+        raise FilterError(f"Unsupported '{field}' condition: {condition!r}")
+
+    def _dates(self, condition) -> np.ndarray:
+        if isinstance(condition, str):
+            condition = {"gte": condition, "lte": condition}
+        if not isinstance(condition, dict) or not condition or not set(condition) <= DATE_BOUNDS:
+            raise FilterError("'date' takes a day or a range with gt, gte, lt and lte")
+        mask = self.dates != NO_DATE
+        for operator, value in condition.items():
+            day = day_number(value)
+            if operator == "gt":
+                mask &= self.dates > day
+            elif operator == "gte":
+                mask &= self.dates >= day
+            elif operator == "lt":
+                mask &= self.dates < day
+            else:
+                mask &= self.dates <= day
+        return _packed(mask)
+
+    def evaluate(self, spec) -> np.ndarray:
+        """Packed bitset of the rows matching ``spec``; raises ``FilterError`` for malformed filters."""
+        if not isinstance(spec, dict) or not spec:
+            raise FilterError("A filter must be a non-empty object")
+        parts = []
+        for field, condition in spec.items():
+            if field in ("and", "or"):
+                if not isinstance(condition, list) or not condition:
+                    raise FilterError(f"'{field}' takes a non-empty list of filters")
+                postings = [self.evaluate(item) for item in condition]
+                parts.append(self._all(postings) if field == "and" else self._any(postings))
+            elif field == "not":
+                parts.append(self.all & ~self.evaluate(condition))
+            elif field == "document":
+                parts.append(self._documents(condition))
+            elif field == "owner":
+                parts.append(self._postings("owner", self.owners, condition))
+            elif field == "tag":
+                parts.append(self._postings("tag", self.tags, condition))
+            elif field == "date":
+                parts.append(self._dates(condition))
+            else:
+                raise FilterError(f"Unknown filter field {field!r}; use one of {', '.join(FIELDS)}, and, or, not")
+        return self._all(parts)
+
+
+def build_bench_collection(directory: str, rows: int, dimensions: int, documents: int) -> None:
+    from app.retrieval import CollectionWriter
+
+    rng = np.random.default_rng(11)
+    writer = CollectionWriter(directory, "bench", f"random-{dimensions}")
+    per_document = rows // documents
+    tag_names = [f"t{index:02d}" for index in range(20)]
+    # Zipf-like tag popularity: t00 is on about half the documents, t19 on a few.
+    tag_odds = 0.5 / np.arange(1, len(tag_names) + 1)
+    start_day = datetime.date(2022, 1, 1)
+    for document in range(documents):
+        vectors = rng.standard_normal((per_document, dimensions)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        meta = {
+            "owner": f"team{int(rng.integers(50)):02d}",
+            "tags": [name for name, odds in zip(tag_names, tag_odds) if rng.random() < odds],
+            "date": (start_day + datetime.timedelta(days=int(rng.integers(3 * 365)))).isoformat(),
+        }
+        records = [{"source": f"doc{document:05d}.md", "chunk": chunk, "text": ""} for chunk in range(per_document)]
+        writer.add(f"doc{document:05d}.md", {"size": 0}, records, vectors, normalize_metadata(meta))
+    writer.close()
+
+
+def run_bench(args) -> int:
+    from app.retrieval import CollectionReader
+
+    scratch = tempfile.mkdtemp(prefix="metadata-bench-")
+    try:
+        build_bench_collection(scratch, args.rows, args.dimensions, args.documents)
+        reader = CollectionReader(os.path.join(scratch, "bench"))
+        reader.refresh()
+        started = time.perf_counter()
+        reader.metadata_index()
+        print(f"{args.rows} rows x {args.dimensions} dims; index built in {(time.perf_counter() - started) * 1000:.0f} ms")
+        filters = {
+            "none": None,
+            "document (selective)": {"document": "doc00042.md"},
+            "owner (selective)": {"owner": "team07"},
+            "rare tag (selective)": {"tag": "t19"},
+            "one week (selective)": {"date": {"gte": "2023-03-01", "lt": "2023-03-08"}},
+            "common tag (broad)": {"tag": "t00"},
+            "two years (broad)": {"date": {"gte": "2022-06-01", "lt": "2024-06-01"}},
+            "not owner (broad)": {"not": {"owner": "team07"}},
+        }
+        rng = np.random.default_rng(5)
+        queries = rng.standard_normal((args.queries, args.dimensions)).astype(np.float32)
+        print(f"{'filter':>22}  {'rows':>7}  {'p50 ms':>7}  {'speedup':>7}  {'post-filter top-k hits':>22}")
+        baseline = None
+        for label, spec in filters.items():
+            matching = int(reader.metadata_index().mask(reader.metadata_index().evaluate(spec)).sum()) if spec else args.rows
+            timings, post_hits = [], []
+            for query in queries:
+                started = time.perf_counter()
+                reader.search(query, args.top_k, spec)
+                timings.append(time.perf_counter() - started)
+                if spec:
+                    # The alternative: take top-k unfiltered, then drop what does not match.
+                    allowed = reader.metadata_index().mask(reader.metadata_index().evaluate(spec))
+                    post_hits.append(sum(bool(allowed[hit.row]) for hit in reader.search(query, args.top_k)))
+            p50 = float(np.percentile(timings, 50)) * 1000
+            baseline = baseline or p50
+            post = f"{np.mean(post_hits):.1f} of {args.top_k}" if post_hits else "-"
+            print(f"{label:>22}  {matching:>7}  {p50:>7.2f}  {baseline / p50:>6.1f}x  {post:>22}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m app.metadata")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="Time filtered searches on a synthetic collection")
+    bench.add_argument("--rows", type=int, default=200000)
+    bench.add_argument("--dimensions", type=int, default=384)
+    bench.add_argument("--documents", type=int, default=4000)
+    bench.add_argument("--queries", type=int, default=50)
+    bench.add_argument("--top-k", type=int, default=10)
+    return run_bench(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""Second-stage reranking of retrieval candidates.
+
+Vector search is run for a wider candidate set (``RERANK_CANDIDATES``), every
+(query, passage) pair is scored by a reranker, and only the best ``topK``
+passages are sent to the model. Backends, chosen with ``RERANK_MODEL``:
+
+- ``lexical``: BM25 over the candidates; no model, useful for development and
+  benchmarks.
+- ``cross-encoder``: a local CPU cross-encoder exported to ONNX
+  (``model.onnx`` and ``tokenizer.json`` in ``RERANK_MODEL_DIR``, for example
+  ms-marco-MiniLM-L-6-v2). Needs the optional ``onnxruntime`` and
+  ``tokenizers`` packages.
+- anything else is a Bedrock rerank model (``cohere.rerank-v3-5:0``,
+  ``amazon.rerank-v1:0``) called through the gateway's ``/api/v1/rerank``.
+
+Scores are cached per worker by (model, normalized query, passage text), so
+a repeated question only scores passages it has not seen.
+
+    python -m app.rerank bench --collection handbook
+
+compares plain top-k retrieval with reranking on queries sampled from the
+collection and prints recall, context tokens per completion and rerank
+latency.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter, OrderedDict
+from dataclasses import replace
+from typing import List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from app.embedding_cache import normalize_text
+from app.retrieval import Hit
+
+try:
+    import onnxruntime
+    import tokenizers
+except ImportError:  # pragma: no cover - optional dependency
+    onnxruntime = None
+    tokenizers = None
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+class LexicalReranker:
+    # IDF comes from the candidate set, which is the same for a repeated question, so cached scores still line up.
+    model_id = "lexical"
+    local = True
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        terms = set(TOKEN.findall(query.lower()))
+        documents = [Counter(TOKEN.findall(text.lower())) for text in texts]
+        lengths = np.array([sum(counts.values()) for counts in documents], dtype=np.float64)
+        average = lengths.mean() if len(lengths) and lengths.mean() else 1.0
+        scores = np.zeros(len(texts), dtype=np.float64)
+        for term in terms:
+            frequencies = np.array([counts.get(term, 0) for counts in documents], dtype=np.float64)
+            present = int((frequencies > 0).sum())
+            if not present:
+                continue
+            idf = math.log(1 + (len(texts) - present + 0.5) / (present + 0.5))
+            scores += idf * frequencies * (self.k1 + 1) / (frequencies + self.k1 * (1 - self.b + self.b * lengths / average))
+        return scores.astype(np.float32)
+
+
+class CrossEncoderReranker:
+    local = True
+
+    def __init__(self, model_dir: str, batch_size: int = 32, max_length: int = 512):
+        if onnxruntime is None or tokenizers is None:
+            raise RuntimeError("The cross-encoder reranker needs the onnxruntime and tokenizers packages")
+        self.model_id = f"cross-encoder:{os.path.basename(os.path.normpath(model_dir))}"
+        self.batch_size = batch_size
+        self.tokenizer = tokenizers.Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        options = onnxruntime.SessionOptions()
+        # One gunicorn worker per CPU already; more threads per worker would only contend.
+        options.intra_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.inputs = {item.name for item in self.session.get_inputs()}
+
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        scores = []
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self.tokenizer.encode_batch([(query, text) for text in texts[start : start + self.batch_size]])
+            feeds = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+                "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+            }
+            logits = self.session.run(None, {name: value for name, value in feeds.items() if name in self.inputs})[0]
+            logits = np.asarray(logits, dtype=np.float32).reshape(len(encodings), -1)
+            # One relevance logit, or (irrelevant, relevant) logits whose difference is the log-odds.
+            scores.append(logits[:, 0] if logits.shape[1] == 1 else logits[:, -1] - logits[:, 0])
+        return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+
+class GatewayReranker:
+    local = False
+
+    def __init__(self, base_url: str, api_key: str, model_id: str, batch_size: int = 100):
+        self.url = f"{base_url.rstrip('/')}/api/v1/rerank"
+        self.api_key = api_key
+        self.model_id = model_id
+        self.batch_size = batch_size
+
+    async def ascore(
+        self, client: httpx.AsyncClient, query: str, texts: List[str], headers: Optional[dict] = None
+    ) -> np.ndarray:
+        async def score_batch(batch: List[str]) -> List[Optional[float]]:
+            response = await client.post(
+                self.url,
+                headers={"x-openwebui-api-key": self.api_key, **(headers or {})},
+                json={"query": query, "documents": batch, "modelId": self.model_id},
+            )
+            response.raise_for_status()
+            return response.json()["scores"]
+
+        batches = await asyncio.gather(
+            *(score_batch(texts[start : start + self.batch_size]) for start in range(0, len(texts), self.batch_size))
+        )
+        return np.array([-np.inf if score is None else score for batch in batches for score in batch], dtype=np.float32)
+
+
+class ScoreCache:
+    """Per-worker LRU of rerank scores keyed by a hash of (model, normalized query, passage)."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._scores: "OrderedDict[bytes, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model_id: str, query: str, text: str) -> bytes:
+        return hashlib.blake2b(f"{model_id}\0{query}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[float]:
+        score = self._scores.get(key)
+        if score is None:
+            self.misses += 1
+            return None
+        self._scores.move_to_end(key)
+        self.hits += 1
+        return score
+
+    def put(self, key: bytes, score: float) -> None:
+        if self.capacity <= 0:
+            return
+        self._scores[key] = score
+        self._scores.move_to_end(key)
+        while len(self._scores) > self.capacity:
+            self._scores.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._scores),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class RerankStage:
+    """Scores candidates with a backend, reusing cached scores, and keeps the best ``keep``."""
+
+    def __init__(self, backend, candidates: int, cache_size: int):
+        self.backend = backend
+        self.model_id = backend.model_id
+        self.candidates = candidates
+        self.cache = ScoreCache(cache_size)
+        self.calls = 0
+        self.seconds = 0.0
+
+    async def _score(self, client, query: str, texts: List[str], headers: Optional[dict]) -> np.ndarray:
+        if self.backend.local:
+            return await asyncio.to_thread(self.backend.score, query, texts)
+        return await self.backend.ascore(client, query, texts, headers)
+
+    async def rerank(
+        self, client: Optional[httpx.AsyncClient], query: str, hits: List[Hit], keep: int, headers: Optional[dict] = None
+    ) -> Tuple[List[Hit], dict]:
+        started = time.perf_counter()
+        normalized = normalize_text(query)
+        keys = [ScoreCache.key(self.model_id, normalized, hit.text) for hit in hits]
+        scores = [self.cache.get(key) for key in keys]
+        missing = [index for index, score in enumerate(scores) if score is None]
+        if missing:
+            fresh = await self._score(client, query, [hits[index].text for index in missing], headers)
+            for index, score in zip(missing, fresh):
+                scores[index] = float(score)
+                self.cache.put(keys[index], float(score))
+        ranked = sorted(
+            (replace(hit, rerank_score=score) for hit, score in zip(hits, scores)),
+            key=lambda hit: hit.rerank_score,
+            reverse=True,
+        )[:keep]
+        elapsed = time.perf_counter() - started
+        self.calls += 1
+        self.seconds += elapsed
+        return ranked, {
+            "model": self.model_id,
+            "candidates": len(hits),
+            "scored": len(missing),
+            "cached": len(hits) - len(missing),
+            "latencyMs": round(elapsed * 1000, 2),
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "model": self.model_id,
+            "candidates": self.candidates,
+            "calls": self.calls,
+            "averageLatencyMs": round(self.seconds / self.calls * 1000, 2) if self.calls else None,
+            "scoreCache": self.cache.snapshot(),
+        }
+
+
+def reranker_from_env() -> Optional[RerankStage]:
+    model = os.environ.get("RERANK_MODEL", "").strip()
+    if not model:
+        return None
+    batch_size = int(os.environ.get("RERANK_BATCH_SIZE", "32"))
+    if model == "lexical":
+        backend = LexicalReranker()
+    elif model == "cross-encoder":
+        backend = CrossEncoderReranker(os.environ["RERANK_MODEL_DIR"], batch_size=batch_size)
+    else:
+        backend = GatewayReranker(
+            os.environ["OPENAI_API_BASE_URL"], os.environ["OPENAI_API_KEY"], model, batch_size=max(batch_size, 100)
+        )
+    return RerankStage(
+        backend,
+        candidates=int(os.environ.get("RERANK_CANDIDATES", "30")),
+        cache_size=int(os.environ.get("RERANK_CACHE_SIZE", "20000")),
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    # Same rough rule as the gateway's deadline estimate: about four characters per token.
+    return max(1, len(text) // 4)
+
+
+def sample_queries(reader, count: int, seed: int = 7) -> List[Tuple[str, Tuple[str, int]]]:
+    """Queries made from words of random chunks, mixed with words of other chunks, and the chunk they came from."""
+    rng = random.Random(seed)
+    rows = [row for row in range(reader.manifest["count"]) if reader.alive is None or reader.alive[row]]
+    queries = []
+    for row in rng.sample(rows, min(count, len(rows))):
+        record, noise = reader.records([row, rng.choice(rows)])
+        words = TOKEN.findall(record["text"])
+        other = TOKEN.findall(noise["text"])
+        if len(words) < 8:
+            continue
+        picked = rng.sample(words, 6) + rng.sample(other, min(4, len(other)))
+        rng.shuffle(picked)
+        queries.append((" ".join(picked), (record["source"], record["chunk"])))
+    return queries
+
+
+async def run_bench(args) -> int:
+    from app.embeddings import embedder_from_env
+    from app.retrieval import RetrievalStore
+
+    reader = RetrievalStore(args.data_dir).reader(args.collection)
+    if reader is None:
+        print(f"Unknown collection: {args.collection}", file=sys.stderr)
+        return 1
+    embedder = embedder_from_env()
+    stage = reranker_from_env() or RerankStage(LexicalReranker(), args.candidates, 20000)
+    queries = sample_queries(reader, args.queries)
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        vectors = await embedder.aembed(client, [query for query, _ in queries], "query")
+        rows = {f"top {args.baseline_k}": [], f"top {args.keep}": [], "rerank": [], "rerank (cached)": []}
+        for (query, target), vector in zip(queries, vectors):
+            candidates = reader.search(vector, max(args.candidates, args.baseline_k))
+            rows[f"top {args.baseline_k}"].append((candidates[: args.baseline_k], 0.0))
+            rows[f"top {args.keep}"].append((candidates[: args.keep], 0.0))
+            for label in ("rerank", "rerank (cached)"):
+                kept, info = await stage.rerank(client, query, candidates[: args.candidates], args.keep)
+                rows[label].append((kept, info["latencyMs"]))
+
+    targets = [target for _, target in queries]
+    print(f"{len(queries)} queries on {args.collection!r}, reranker {stage.model_id}, {args.candidates} candidates")
+    print(f"{'':>16}  {'passages':>8}  {'recall':>6}  {'tokens/completion':>17}  {'rerank p50 ms':>13}  {'p95 ms':>7}")
+    base_tokens = None
+    for label, results in rows.items():
+        recall = np.mean([any((hit.source, hit.chunk) == target for hit in hits) for (hits, _), target in zip(results, targets)])
+        tokens = np.mean([sum(estimate_tokens(hit.text) for hit in hits) for hits, _ in results])
+        latencies = [latency for _, latency in results]
+        base_tokens = base_tokens or tokens
+        passages = args.baseline_k if label == f"top {args.baseline_k}" else args.keep
+        print(
+            f"{label:>16}  {passages:>8}  {recall:>6.2f}  {tokens:>9.0f} ({tokens / base_tokens - 1:+.0%})  "
+            f"{np.percentile(latencies, 50):>13.2f}  {np.percentile(latencies, 95):>7.2f}"
+        )
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m app.rerank")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="Compare top-k retrieval with reranking")
+    bench.add_argument("--collection", required=True)
+    bench.add_argument("--data-dir", default=os.environ.get("RETRIEVAL_DATA_DIR", "/app/backend/data/retrieval"))
+    bench.add_argument("--queries", type=int, default=200)
+    bench.add_argument("--baseline-k", type=int, default=8, help="Passages sent without reranking")
+    bench.add_argument("--candidates", type=int, default=30, help="Vector hits passed to the reranker")
+    bench.add_argument("--keep", type=int, default=3, help="Passages sent after reranking")
+    args = parser.parse_args(argv)
+    return asyncio.run(run_bench(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
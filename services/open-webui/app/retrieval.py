@@ -0,0 +1,854 @@
+"""Retrieval store on the shared data volume.
+
+Each collection is a directory of segments under the store root::
+
+    manifest.json       collection metadata, segments, ingested files with
+                        their size and mtime or ETag, owner/tags/date and row
+                        range (the checkpoint)
+    seg-000001/         a sealed segment, never modified again
+        vectors.f32     one float32 row per chunk, unit length
+        chunks.jsonl    one JSON record per chunk: source, chunk number, text
+        offsets.u64     byte offset of each chunk record in chunks.jsonl
+    seg-000002/         the head: the only segment still being appended to
+
+Rows are numbered across segments in manifest order. The writer appends to
+the head and seals it once it holds ``segment_rows`` rows; ``manifest.json``
+is replaced atomically and is the source of truth. A writer that dies mid-batch
+leaves rows past the head's checkpointed size, and maybe a segment directory
+the manifest never listed; the next writer truncates and deletes those, so an
+interrupted ingestion resumes from its last checkpoint without a rebuild.
+
+Rows of files that were changed or removed are listed in ``tombstones`` and
+skipped by searches. A background thread in the writer merges runs of small
+or mostly-dead sealed segments into one new segment, dropping dead rows; the
+writer swaps it into the manifest at its next checkpoint, renumbering rows.
+Replaced segments are deleted only ``RETIRE_SECONDS`` later, so readers on
+other tasks that still use the previous manifest keep working.
+
+Readers memory-map each segment once and re-read the manifest when it changes;
+every search runs against one snapshot (manifest, segments, tombstones), so a
+checkpoint or compaction swap in the middle of a query does not affect it.
+Searches can be restricted with a metadata filter (see ``app.metadata``);
+selective filters only score the matching rows.
+
+    python -m app.retrieval bench
+
+times queries while a large ingest with compactions runs on the same
+collection, and crash recovery of an interrupted writer.
+"""
+
+import argparse
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app.metadata import MetadataIndex
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+SEGMENT_PATTERN = re.compile(r"^seg-\d{6}$")
+MANIFEST = "manifest.json"
+VECTORS = "vectors.f32"
+CHUNKS = "chunks.jsonl"
+OFFSETS = "offsets.u64"
+# Collections written before segments existed keep their files in the collection directory.
+LEGACY_SEGMENT = "."
+# The head is sealed once it holds this many rows.
+SEGMENT_ROWS = 50000
+# Compaction merges runs of sealed segments that are small (under half of MAX_SEGMENT_ROWS live rows) or
+# have at least DEAD_FRACTION of their rows tombstoned, up to MAX_SEGMENT_ROWS live rows per merged segment.
+# A run is merged once it has MERGE_SEGMENTS segments or contains a mostly-dead one.
+MAX_SEGMENT_ROWS = 1000000
+DEAD_FRACTION = 0.25
+MERGE_SEGMENTS = 4
+RETIRE_SECONDS = 600.0
+COPY_ROWS = 16384
+# Filtered searches score only the matching rows: in place when they form runs averaging at least
+# MIN_RUN_ROWS rows, else by gathering them. Filters matching most rows just mask a full scan.
+MIN_RUN_ROWS = 32
+FULL_SCAN_FRACTION = 0.8
+
+
+def is_valid_collection(name: str) -> bool:
+    return bool(COLLECTION_PATTERN.match(name or "")) and name not in (".", "..")
+
+
+def read_manifest(directory: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(directory: str, manifest: dict) -> None:
+    path = os.path.join(directory, MANIFEST)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle, separators=(",", ":"))
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temporary, path)
+
+
+def segments_of(manifest: dict) -> List[dict]:
+    """The manifest's segments; an older collection is one unsealed segment in the collection directory."""
+    if "segments" in manifest:
+        return manifest["segments"]
+    if not manifest["count"]:
+        return []
+    return [{"name": LEGACY_SEGMENT, "rows": manifest["count"], "chunksBytes": manifest.get("chunksBytes", 0)}]
+
+
+def alive_mask(manifest: dict) -> Optional[np.ndarray]:
+    """Per-row liveness, or None when nothing is tombstoned."""
+    if not manifest["tombstones"]:
+        return None
+    alive = np.ones(manifest["count"], dtype=bool)
+    for start, end in manifest["tombstones"]:
+        alive[start:end] = False
+    return alive
+
+
+def plan_compaction(manifest: dict, force: bool = False) -> Optional[List[int]]:
+    """Indices of the consecutive sealed segments to merge next, or None if none are worth it.
+
+    ``force`` merges any two or more segments and rewrites any segment with a dead row.
+    """
+    segments = segments_of(manifest)
+    alive = alive_mask(manifest)
+    run: List[int] = []
+    run_live = 0
+    run_dirty = False
+    position = 0
+    for index, segment in enumerate(segments):
+        if not segment.get("sealed"):
+            break
+        rows = segment["rows"]
+        live = rows if alive is None else int(np.count_nonzero(alive[position : position + rows]))
+        position += rows
+        dirty = live < rows if force else live < rows * (1 - DEAD_FRACTION)
+        eligible = dirty or force or live < MAX_SEGMENT_ROWS // 2
+        if eligible and run_live + live <= MAX_SEGMENT_ROWS:
+            run.append(index)
+            run_live += live
+            run_dirty = run_dirty or dirty
+            continue
+        if run_dirty or len(run) >= (2 if force else MERGE_SEGMENTS):
+            return run
+        run, run_live, run_dirty = ([index], live, dirty) if eligible else ([], 0, False)
+    if run_dirty or len(run) >= (2 if force else MERGE_SEGMENTS):
+        return run
+    return None
+
+
+def _runs(mask: np.ndarray) -> List[Tuple[int, int]]:
+    """(start, end) of each run of True in ``mask``."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+    return list(zip(edges[0::2].tolist(), edges[1::2].tolist()))
+
+
+def _remove_segment(directory: str, name: str) -> None:
+    path = os.path.join(directory, name)
+    if name == LEGACY_SEGMENT:
+        for filename in (VECTORS, CHUNKS, OFFSETS):
+            if os.path.exists(os.path.join(path, filename)):
+                os.remove(os.path.join(path, filename))
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class Compaction:
+    """Copies the live rows of a run of sealed segments into a new segment on a background thread."""
+
+    def __init__(self, directory: str, name: str, segments: List[dict], kept: np.ndarray, dimensions: int):
+        self.directory = directory
+        self.name = name
+        self.segments = segments
+        self.kept = kept  # liveness of the run's rows when it was planned
+        self.dimensions = dimensions
+        self.rows = int(np.count_nonzero(kept))
+        self.chunks_bytes = 0
+        self.error: Optional[BaseException] = None
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"compact-{name}", daemon=True)
+
+    def start(self) -> "Compaction":
+        self._thread.start()
+        return self
+
+    def done(self) -> bool:
+        return not self._thread.is_alive()
+
+    def wait(self) -> None:
+        self._thread.join()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        self._thread.join()
+        _remove_segment(self.directory, self.name)
+
+    def _run(self) -> None:
+        try:
+            self._merge()
+        except BaseException as exc:  # pylint: disable=broad-except
+            self.error = exc
+
+    def _merge(self) -> None:
+        target = os.path.join(self.directory, self.name)
+        os.makedirs(target)
+        outputs = [open(os.path.join(target, name), "wb") for name in (VECTORS, CHUNKS, OFFSETS)]
+        out_vectors, out_chunks, out_offsets = outputs
+        try:
+            first_row = 0
+            for segment in self.segments:
+                rows = segment["rows"]
+                kept = self.kept[first_row : first_row + rows]
+                first_row += rows
+                if not kept.any():
+                    continue
+                source = os.path.join(self.directory, segment["name"])
+                vectors = np.memmap(
+                    os.path.join(source, VECTORS), dtype=np.float32, mode="r", shape=(rows, self.dimensions)
+                )
+                offsets = np.memmap(os.path.join(source, OFFSETS), dtype=np.uint64, mode="r", shape=(rows,))
+                ends = np.append(offsets[1:], np.uint64(segment["chunksBytes"]))
+                with open(os.path.join(source, CHUNKS), "rb") as chunks:
+                    for start, end in _runs(kept):
+                        for block in range(start, end, COPY_ROWS):
+                            if self._cancelled.is_set():
+                                raise RuntimeError("Compaction cancelled")
+                            stop = min(block + COPY_ROWS, end)
+                            begin = int(offsets[block])
+                            chunks.seek(begin)
+                            data = chunks.read(int(ends[stop - 1]) - begin)
+                            out_vectors.write(np.asarray(vectors[block:stop]).tobytes())
+                            moved = offsets[block:stop] - np.uint64(begin) + np.uint64(self.chunks_bytes)
+                            out_offsets.write(moved.tobytes())
+                            out_chunks.write(data)
+                            self.chunks_bytes += len(data)
+            for handle in outputs:
+                handle.flush()
+                os.fsync(handle.fileno())
+        finally:
+            for handle in outputs:
+                handle.close()
+
+
+class CollectionWriter:
+    """Single writer for one collection; holds an exclusive lock until closed."""
+
+    def __init__(
+        self,
+        root_dir: str,
+        collection: str,
+        embedding_model: str,
+        segment_rows: int = SEGMENT_ROWS,
+        background_compaction: bool = True,
+        shard: Optional[dict] = None,
+    ):
+        if not is_valid_collection(collection):
+            raise ValueError(f"Invalid collection name: {collection!r}")
+        self.directory = os.path.join(root_dir, collection)
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(os.path.join(self.directory, ".lock"), "a")
+        try:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as exc:
+            self._lock_file.close()
+            raise RuntimeError(f"Collection {collection!r} is being written by another process") from exc
+
+        self.manifest = read_manifest(self.directory) or {
+            "collection": collection,
+            "id": uuid.uuid4().hex,
+            "embeddingModel": embedding_model,
+            "dimensions": None,
+            "count": 0,
+            "version": 0,
+            "files": {},
+            "tombstones": [],
+        }
+        if self.manifest["embeddingModel"] != embedding_model:
+            self.close(checkpoint=False)
+            raise ValueError(
+                f"Collection {collection!r} was built with {self.manifest['embeddingModel']}, not {embedding_model}"
+            )
+        if shard is not None and self.manifest.setdefault("shard", shard) != shard:
+            self.close(checkpoint=False)
+            raise ValueError(f"Collection {collection!r} is shard {self.manifest['shard']}, not {shard}")
+        self.manifest.setdefault("id", uuid.uuid4().hex)
+        self.manifest["segments"] = segments_of(self.manifest)
+        self.manifest.pop("chunksBytes", None)
+        self.manifest.setdefault("nextSegment", 1)
+        self.manifest.setdefault("retired", [])
+        self.segment_rows = segment_rows
+        self.background_compaction = background_compaction
+        self.compactions = 0
+        self._compaction: Optional[Compaction] = None
+        self._recover()
+        # A new shard writes its manifest even if it gets no files, so it answers searches with no hits.
+        self._dirty = shard is not None and self.manifest["version"] == 0
+        self._files = None
+        head = self._head()
+        if head is not None:
+            self._files = self._open_files(head["name"])
+
+    def _head(self) -> Optional[dict]:
+        segments = self.manifest["segments"]
+        return segments[-1] if segments and not segments[-1].get("sealed") else None
+
+    def _recover(self) -> None:
+        """Undo what an interrupted writer did after its last checkpoint."""
+        head = self._head()
+        if head is not None:
+            sizes = {
+                VECTORS: head["rows"] * (self.manifest["dimensions"] or 0) * 4,
+                OFFSETS: head["rows"] * 8,
+                CHUNKS: head["chunksBytes"],
+            }
+            for name, size in sizes.items():
+                path = os.path.join(self.directory, head["name"], name)
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    os.truncate(path, size)
+        # Segments the manifest never listed: a head opened or a compaction written after the last checkpoint.
+        known = {segment["name"] for segment in self.manifest["segments"] + self.manifest["retired"]}
+        for name in os.listdir(self.directory):
+            if SEGMENT_PATTERN.match(name) and name not in known:
+                _remove_segment(self.directory, name)
+        self._purge_retired()
+
+    def _purge_retired(self) -> None:
+        cutoff = time.time() - RETIRE_SECONDS
+        for entry in [entry for entry in self.manifest["retired"] if entry["at"] < cutoff]:
+            _remove_segment(self.directory, entry["name"])
+            self.manifest["retired"].remove(entry)
+
+    def _new_segment_name(self) -> str:
+        name = f"seg-{self.manifest['nextSegment']:06d}"
+        self.manifest["nextSegment"] += 1
+        return name
+
+    def _open_files(self, name: str):
+        path = os.path.join(self.directory, name)
+        os.makedirs(path, exist_ok=True)
+        return tuple(open(os.path.join(path, filename), "ab") for filename in (VECTORS, CHUNKS, OFFSETS))
+
+    def _sync_head(self) -> None:
+        for handle in self._files:
+            handle.flush()
+            os.fsync(handle.fileno())
+        self._head()["chunksBytes"] = self._files[1].tell()
+
+    def _seal_head(self) -> None:
+        self._sync_head()
+        self._head()["sealed"] = True
+        for handle in self._files:
+            handle.close()
+        self._files = None
+
+    @property
+    def count(self) -> int:
+        return self.manifest["count"]
+
+    def is_current(self, key: str, stamp: dict) -> bool:
+        """Whether ``key`` was ingested with this stamp (``size`` plus ``mtimeNs``/``metaMtimeNs`` or ``etag``)."""
+        entry = self.manifest["files"].get(key)
+        return entry is not None and all(entry.get(field) == value for field, value in stamp.items())
+
+    def remove(self, key: str) -> bool:
+        entry = self.manifest["files"].pop(key, None)
+        if entry is None:
+            return False
+        start, end = entry["rows"]
+        if end > start:
+            self.manifest["tombstones"].append([start, end])
+        self._dirty = True
+        return True
+
+    def add(
+        self, key: str, stamp: dict, records: List[dict], vectors: np.ndarray, meta: Optional[dict] = None
+    ) -> None:
+        """Append one file's chunks to the head; replaces any rows previously ingested for ``key``."""
+        if self.manifest["dimensions"] is None:
+            self.manifest["dimensions"] = int(vectors.shape[1]) if len(records) else None
+        if len(records) and vectors.shape != (len(records), self.manifest["dimensions"]):
+            raise ValueError(f"Expected {len(records)} vectors of {self.manifest['dimensions']} dimensions")
+        self.remove(key)
+        if self._files is None:
+            name = self._new_segment_name()
+            self._files = self._open_files(name)
+            self.manifest["segments"].append({"name": name, "rows": 0, "chunksBytes": 0})
+        vectors_file, chunks_file, offsets_file = self._files
+
+        start = self.count
+        position = chunks_file.tell()
+        lines = [
+            json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n" for record in records
+        ]
+        offsets = np.cumsum([position] + [len(line) for line in lines[:-1]], dtype=np.uint64) if lines else []
+        chunks_file.write(b"".join(lines))
+        offsets_file.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+        vectors_file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes() if len(records) else b"")
+        self.manifest["count"] = start + len(records)
+        self._head()["rows"] += len(records)
+        self.manifest["files"][key] = {**stamp, "rows": [start, start + len(records)]}
+        if meta:
+            self.manifest["files"][key]["meta"] = meta
+        self._dirty = True
+        if self._head()["rows"] >= self.segment_rows:
+            # Files never span segments: the head is only sealed between files.
+            self._seal_head()
+
+    def checkpoint(self) -> None:
+        """Make everything added so far durable and visible to readers; swap in a finished compaction."""
+        if self._compaction is not None and self._compaction.done():
+            self._finish_compaction()
+        self._write_checkpoint()
+        if self.background_compaction and self._compaction is None:
+            self._compaction = self._start_compaction()
+
+    def _write_checkpoint(self) -> None:
+        if not self._dirty:
+            return
+        if self._files is not None:
+            self._sync_head()
+        self.manifest["version"] += 1
+        write_manifest(self.directory, self.manifest)
+        self._dirty = False
+        self._purge_retired()
+
+    def _start_compaction(self, force: bool = False) -> Optional[Compaction]:
+        indices = plan_compaction(self.manifest, force)
+        if not indices:
+            return None
+        segments = self.manifest["segments"]
+        start = sum(segment["rows"] for segment in segments[: indices[0]])
+        chosen = [dict(segments[index]) for index in indices]
+        end = start + sum(segment["rows"] for segment in chosen)
+        alive = alive_mask(self.manifest)
+        kept = np.ones(end - start, dtype=bool) if alive is None else alive[start:end].copy()
+        name = self._new_segment_name()
+        return Compaction(self.directory, name, chosen, kept, self.manifest["dimensions"]).start()
+
+    def _finish_compaction(self) -> None:
+        compaction, self._compaction = self._compaction, None
+        if compaction.error is not None:
+            logger.warning("Compaction into %s failed: %s", compaction.name, compaction.error)
+            _remove_segment(self.directory, compaction.name)
+            return
+        segments = self.manifest["segments"]
+        names = [segment["name"] for segment in compaction.segments]
+        first = [segment["name"] for segment in segments].index(names[0])
+        start = sum(segment["rows"] for segment in segments[:first])
+        end = start + len(compaction.kept)
+        delta = compaction.rows - len(compaction.kept)
+        before = np.concatenate(([0], np.cumsum(compaction.kept)))
+
+        def renumber(row: int) -> int:
+            if row <= start:
+                return row
+            if row >= end:
+                return row + delta
+            return start + int(before[row - start])
+
+        for entry in self.manifest["files"].values():
+            entry["rows"] = [renumber(row) for row in entry["rows"]]
+        # Rows that were dead when the run was planned are gone; files removed since keep a tombstone.
+        tombstones = ([renumber(start_row), renumber(end_row)] for start_row, end_row in self.manifest["tombstones"])
+        self.manifest["tombstones"] = [span for span in tombstones if span[1] > span[0]]
+        segments[first : first + len(names)] = [
+            {"name": compaction.name, "rows": compaction.rows, "chunksBytes": compaction.chunks_bytes, "sealed": True}
+        ]
+        self.manifest["count"] += delta
+        self.manifest["retired"].extend({"name": name, "at": time.time()} for name in names)
+        self.compactions += 1
+        self._dirty = True
+
+    def _await_compaction(self) -> None:
+        if self._compaction is not None:
+            self._compaction.wait()
+            self._finish_compaction()
+
+    def compact(self, force: bool = False) -> int:
+        """Merge segments in the foreground until the policy finds nothing to do; returns the merges made.
+
+        ``force`` also seals the head, so every dead row can be dropped.
+        """
+        self._await_compaction()
+        if force and self._files is not None and self._head()["rows"]:
+            self._seal_head()
+            self._dirty = True
+        self._write_checkpoint()
+        merges = 0
+        while True:
+            self._compaction = self._start_compaction(force)
+            if self._compaction is None:
+                return merges
+            self._compaction.wait()
+            failed = self._compaction.error
+            self._finish_compaction()
+            if failed is not None:
+                raise RuntimeError(f"Compaction failed: {failed}") from failed
+            self._write_checkpoint()
+            merges += 1
+
+    def close(self, checkpoint: bool = True) -> None:
+        if checkpoint and hasattr(self, "_dirty"):
+            # Let a running merge finish so its work is not lost; the next writer picks up further merges.
+            self._await_compaction()
+            self._write_checkpoint()
+        elif getattr(self, "_compaction", None) is not None:
+            self._compaction.cancel()
+            self._compaction = None
+        for handle in getattr(self, "_files", None) or ():
+            handle.close()
+        fcntl.lockf(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+
+
+@dataclass
+class Hit:
+    row: int
+    score: float
+    source: str
+    chunk: int
+    text: str
+    rerank_score: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        result = {"source": self.source, "chunk": self.chunk, "score": round(self.score, 4), "text": self.text}
+        if self.rerank_score is not None:
+            result["rerankScore"] = round(self.rerank_score, 4)
+        return result
+
+
+class Segment:
+    """One segment's rows, memory-mapped read-only."""
+
+    def __init__(self, path: str, rows: int, dimensions: int):
+        self.rows = rows
+        self.chunks_path = os.path.join(path, CHUNKS)
+        if rows and dimensions:
+            self.vectors = np.memmap(os.path.join(path, VECTORS), dtype=np.float32, mode="r", shape=(rows, dimensions))
+            self.offsets = np.memmap(os.path.join(path, OFFSETS), dtype=np.uint64, mode="r", shape=(rows,))
+        else:
+            self.vectors, self.offsets = np.zeros((0, dimensions), dtype=np.float32), np.zeros(0, dtype=np.uint64)
+
+    def top(self, query: np.ndarray, top_k: int, allowed: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """(segment rows, scores) of up to ``top_k`` best rows, only among ``allowed`` rows if given."""
+        vectors = self.vectors
+        rows = None
+        if allowed is None:
+            scores = vectors @ query
+        else:
+            matching = int(np.count_nonzero(allowed))
+            if matching > FULL_SCAN_FRACTION * len(vectors):
+                scores = np.where(allowed, vectors @ query, -np.inf)
+            else:
+                rows = np.flatnonzero(allowed)
+                # A file's chunks are contiguous rows, so matches come in runs that can be scored in place.
+                breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+                if len(rows) >= MIN_RUN_ROWS * (len(breaks) + 1):
+                    scores = np.empty(len(rows), dtype=np.float32)
+                    bounds = [0, *breaks.tolist(), len(rows)]
+                    for first, last in zip(bounds, bounds[1:]):
+                        scores[first:last] = vectors[rows[first] : rows[last - 1] + 1] @ query
+                else:
+                    scores = vectors[rows] @ query
+        top_k = min(top_k, len(scores))
+        if not top_k:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.isfinite(scores[best])]
+        return (best if rows is None else rows[best]), scores[best]
+
+
+class Snapshot(NamedTuple):
+    manifest: dict
+    segments: List[Segment]
+    starts: np.ndarray  # first row of each segment
+    alive: Optional[np.ndarray]
+
+
+EMPTY_SNAPSHOT = Snapshot({}, [], np.zeros(0, dtype=np.int64), None)
+
+
+class CollectionReader:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._stamp: Optional[Tuple[int, int]] = None
+        self.snapshot = EMPTY_SNAPSHOT
+        # Sealed segments never change, so their maps are kept across refreshes; a grown head is mapped again.
+        self._segments: Dict[Tuple[str, int], Segment] = {}
+        self._metadata: Optional[Tuple[dict, MetadataIndex]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def manifest(self) -> dict:
+        return self.snapshot.manifest
+
+    @property
+    def alive(self) -> Optional[np.ndarray]:
+        return self.snapshot.alive
+
+    @property
+    def version(self) -> str:
+        """Changes with every checkpoint, and when a collection is deleted and built again under its name."""
+        manifest = self.manifest
+        return f"{manifest.get('id', '')}:{manifest.get('version', 0)}"
+
+    def refresh(self) -> bool:
+        """Reload if the manifest changed since the last look (one ``stat`` otherwise). False if missing."""
+        try:
+            stat = os.stat(os.path.join(self.directory, MANIFEST))
+        except FileNotFoundError:
+            return False
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return True
+        with self._lock:
+            if stamp == self._stamp:
+                return True
+            manifest = read_manifest(self.directory)
+            dimensions = manifest["dimensions"] or 0
+            segments: Dict[Tuple[str, int], Segment] = {}
+            for entry in segments_of(manifest):
+                key = (entry["name"], entry["rows"])
+                segments[key] = self._segments.get(key) or Segment(
+                    os.path.join(self.directory, entry["name"]), entry["rows"], dimensions
+                )
+            rows = [segment.rows for segment in segments.values()]
+            starts = np.cumsum([0] + rows[:-1], dtype=np.int64) if rows else np.zeros(0, dtype=np.int64)
+            # One assignment, so a search sees either the old snapshot or the new one.
+            self.snapshot = Snapshot(manifest, list(segments.values()), starts, alive_mask(manifest))
+            self._segments = segments
+            self._stamp = stamp
+        return True
+
+    def records(self, rows: List[int], snapshot: Optional[Snapshot] = None) -> List[dict]:
+        """Chunk records of ``rows`` in the given (by default the current) snapshot."""
+        snapshot = snapshot or self.snapshot
+        handles: Dict[int, object] = {}
+        records = []
+        try:
+            for row in rows:
+                index = int(np.searchsorted(snapshot.starts, row, side="right")) - 1
+                segment = snapshot.segments[index]
+                handle = handles.get(index)
+                if handle is None:
+                    handle = handles[index] = open(segment.chunks_path, "rb")
+                handle.seek(int(segment.offsets[row - snapshot.starts[index]]))
+                records.append(json.loads(handle.readline()))
+        finally:
+            for handle in handles.values():
+                handle.close()
+        return records
+
+    def metadata_index(self, manifest: Optional[dict] = None) -> MetadataIndex:
+        """Filter index for ``manifest`` (the current one by default), built on first use."""
+        manifest = manifest or self.manifest
+        cached = self._metadata
+        if cached is None or cached[0] is not manifest:
+            with self._lock:
+                cached = self._metadata
+                if cached is None or cached[0] is not manifest:
+                    cached = self._metadata = (manifest, MetadataIndex(manifest))
+        return cached[1]
+
+    def search(self, query: np.ndarray, top_k: int, spec: Optional[dict] = None) -> List[Hit]:
+        """Best ``top_k`` rows for ``query``, restricted to rows matching the filter ``spec`` if given."""
+        # One consistent view, even if a refresh swaps in a new checkpoint meanwhile.
+        snapshot = self.snapshot
+        if not snapshot.manifest.get("count"):
+            return []
+        query = query.astype(np.float32)
+        allowed = snapshot.alive
+        if spec:
+            index = self.metadata_index(snapshot.manifest)
+            allowed = index.mask(index.evaluate(spec))
+        found_rows, found_scores = [], []
+        for segment, start in zip(snapshot.segments, snapshot.starts.tolist()):
+            window = None if allowed is None else allowed[start : start + segment.rows]
+            rows, scores = segment.top(query, top_k, window)
+            found_rows.append(rows + start)
+            found_scores.append(scores)
+        rows, scores = np.concatenate(found_rows), np.concatenate(found_scores)
+        best = np.argsort(-scores, kind="stable")[:top_k]
+        records = self.records(rows[best].tolist(), snapshot)
+        return [
+            Hit(int(rows[position]), float(scores[position]), record["source"], record["chunk"], record["text"])
+            for position, record in zip(best, records)
+        ]
+
+
+class RetrievalStore:
+    """Query side used by the web workers: one cached reader per collection."""
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self._readers: Dict[str, CollectionReader] = {}
+
+    def reader(self, collection: str) -> Optional[CollectionReader]:
+        if not is_valid_collection(collection):
+            return None
+        reader = self._readers.get(collection)
+        if reader is None:
+            reader = CollectionReader(os.path.join(self.root_dir, collection))
+        if not reader.refresh():
+            return None
+        self._readers[collection] = reader
+        return reader
+
+    def collections(self) -> List[dict]:
+        try:
+            names = sorted(os.listdir(self.root_dir))
+        except FileNotFoundError:
+            return []
+        result = []
+        for name in names:
+            reader = self.reader(name)
+            if reader is not None:
+                manifest = reader.manifest
+                result.append(
+                    {
+                        "collection": name,
+                        "embeddingModel": manifest["embeddingModel"],
+                        "dimensions": manifest["dimensions"],
+                        "files": len(manifest["files"]),
+                        "chunks": manifest["count"] - sum(end - start for start, end in manifest["tombstones"]),
+                        "segments": len(segments_of(manifest)),
+                        "version": manifest["version"],
+                    }
+                )
+        return result
+
+
+def _directory_bytes(directory: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(directory) for name in names
+    )
+
+
+def _bench_file(rng, writer: CollectionWriter, document: int, rows: int, dimensions: int) -> None:
+    vectors = rng.standard_normal((rows, dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    records = [{"source": f"doc{document:05d}.md", "chunk": chunk, "text": ""} for chunk in range(rows)]
+    writer.add(f"doc{document:05d}.md", {"size": document}, records, vectors)
+
+
+def _latencies(timings: List[float]) -> str:
+    p50, p95, p99 = (float(np.percentile(timings, q)) * 1000 for q in (50, 95, 99))
+    return f"p50 {p50:6.2f}  p95 {p95:6.2f}  p99 {p99:6.2f} ms  ({len(timings)} queries)"
+
+
+def run_bench(args) -> int:
+    scratch = tempfile.mkdtemp(prefix="retrieval-bench-")
+    try:
+        rng = np.random.default_rng(3)
+        per_document = args.rows // args.documents
+        writer = CollectionWriter(scratch, "bench", "random", segment_rows=args.segment_rows)
+        for document in range(args.documents):
+            _bench_file(rng, writer, document, per_document, args.dimensions)
+        writer.close()
+        reader = CollectionReader(os.path.join(scratch, "bench"))
+        queries = rng.standard_normal((256, args.dimensions)).astype(np.float32)
+
+        def query_loop(stop) -> List[float]:
+            timings = []
+            while not stop():
+                started = time.perf_counter()
+                reader.refresh()
+                reader.search(queries[len(timings) % len(queries)], args.top_k)
+                timings.append(time.perf_counter() - started)
+            return timings
+
+        deadline = time.monotonic() + args.seconds
+        idle = query_loop(lambda: time.monotonic() > deadline)
+        print(f"{args.rows} rows x {args.dimensions} dims in {len(reader.snapshot.segments)} segments")
+        print(f"  idle:             {_latencies(idle)}")
+
+        # Re-ingest a share of the documents (each replacement tombstones the old rows) while querying.
+        writer = CollectionWriter(
+            scratch, "bench", "random", segment_rows=args.segment_rows, background_compaction=not args.no_compaction
+        )
+        done = threading.Event()
+
+        def ingest() -> None:
+            last = time.monotonic()
+            for document in rng.permutation(args.documents)[: int(args.documents * args.rewrite)]:
+                _bench_file(np.random.default_rng(int(document)), writer, int(document), per_document, args.dimensions)
+                if time.monotonic() - last >= args.checkpoint_seconds:
+                    writer.checkpoint()
+                    last = time.monotonic()
+            writer.checkpoint()
+            done.set()
+
+        started = time.perf_counter()
+        thread = threading.Thread(target=ingest)
+        thread.start()
+        busy = query_loop(done.is_set)
+        thread.join()
+        ingest_seconds = time.perf_counter() - started
+        manifest = writer.manifest
+        live = manifest["count"] - sum(end - start for start, end in manifest["tombstones"])
+        print(f"  during ingest:    {_latencies(busy)}")
+        print(
+            f"  rewrote {args.rewrite:.0%} of documents in {ingest_seconds:.1f}s; {writer.compactions} compactions; "
+            f"{len(segments_of(manifest))} segments; {manifest['count']} rows on disk for {live} live"
+        )
+        started = time.perf_counter()
+        merges = 0 if args.no_compaction else writer.compact()
+        print(f"  compact:          {merges} more merges in {time.perf_counter() - started:.2f}s")
+        writer.close()
+
+        # Crash recovery: abandon a writer mid-batch and time the next one opening the collection.
+        writer = CollectionWriter(scratch, "bench", "random", segment_rows=args.segment_rows)
+        for document in range(args.documents, args.documents + args.documents // 10):
+            _bench_file(rng, writer, document, per_document, args.dimensions)
+        for handle in writer._files or ():
+            handle.flush()
+        fcntl.lockf(writer._lock_file, fcntl.LOCK_UN)
+        writer._lock_file.close()
+        started = time.perf_counter()
+        writer = CollectionWriter(scratch, "bench", "random", segment_rows=args.segment_rows)
+        recovery = time.perf_counter() - started
+        writer.close(checkpoint=False)
+        size = _directory_bytes(os.path.join(scratch, "bench")) / 2**20
+        print(f"  crash recovery:   {recovery * 1000:.1f} ms; {size:.0f} MiB on disk incl. retired segments")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m app.retrieval")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="Query latency during a large ingest, and crash recovery")
+    bench.add_argument("--rows", type=int, default=200000)
+    bench.add_argument("--dimensions", type=int, default=384)
+    bench.add_argument("--documents", type=int, default=2000)
+    bench.add_argument("--rewrite", type=float, default=0.5, help="Share of documents re-ingested under load")
+    bench.add_argument("--segment-rows", type=int, default=SEGMENT_ROWS)
+    bench.add_argument("--no-compaction", action="store_true", help="Only tombstone, as a baseline")
+    bench.add_argument("--checkpoint-seconds", type=float, default=1.0)
+    bench.add_argument("--seconds", type=float, default=5.0, help="Length of the idle measurement")
+    bench.add_argument("--top-k", type=int, default=10)
+    return run_bench(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""Per-worker cache of retrieval results for grounded completions.
+
+Entries are keyed by the normalized question (Unicode NFC, whitespace
+collapsed, case-folded), collection, collection version, metadata filter,
+``topK`` and rerank model. A hit returns the passages of the earlier identical
+retrieval without embedding, searching or reranking again.
+
+The collection version changes with every ingestion checkpoint or compaction,
+so a write to a collection retires its entries: they can no longer be looked
+up, and they are dropped as soon as the worker sees the new version. Entries
+are evicted least recently used first once their estimated size passes
+``RETRIEVAL_CACHE_MAX_MB``.
+
+    python -m app.retrieval_cache bench --collection handbook
+
+replays a skewed stream of repeated questions and compares retrieval
+latency with and without the cache.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.embedding_cache import normalize_text
+from app.retrieval import Hit
+
+# Rough per-entry overhead in bytes: the key, the list and one Hit object per passage.
+ENTRY_OVERHEAD = 400
+HIT_OVERHEAD = 250
+
+
+def normalize_query(query: str) -> str:
+    return normalize_text(query).casefold()
+
+
+class RetrievalCache:
+    """LRU of final (post-rerank) hits, bounded by the estimated size of their text."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, Tuple[List[Hit], int, float]]" = OrderedDict()
+        self._versions: Dict[str, str] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(
+        query: str, collection: str, version: str, spec: Optional[dict], top_k: int, rerank_model: Optional[str]
+    ) -> tuple:
+        canonical = json.dumps(spec, sort_keys=True, separators=(",", ":")) if spec else ""
+        return (collection, version, normalize_query(query), canonical, top_k, rerank_model)
+
+    def _observe(self, collection: str, version: str) -> None:
+        """Drop the entries of older versions of ``collection`` the first time a new version shows up."""
+        if self._versions.get(collection) == version:
+            return
+        self._versions[collection] = version
+        stale = [key for key in self._entries if key[0] == collection and key[1] != version]
+        for key in stale:
+            self.bytes -= self._entries.pop(key)[1]
+        self.invalidations += len(stale)
+
+    def get(self, key: tuple) -> Optional[List[Hit]]:
+        if not self.enabled:
+            return None
+        self._observe(key[0], key[1])
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += entry[2]
+        return entry[0]
+
+    def put(self, key: tuple, hits: List[Hit], seconds: float) -> None:
+        """Store ``hits``, which took ``seconds`` to compute, for ``key``."""
+        if not self.enabled:
+            return
+        self._observe(key[0], key[1])
+        size = ENTRY_OVERHEAD + len(key[2]) + len(key[3])
+        size += sum(HIT_OVERHEAD + len(hit.text) + len(hit.source) for hit in hits)
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous[1]
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (hits, size, seconds)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "savedMs": round(self.saved_seconds * 1000, 1),
+        }
+
+
+def retrieval_cache_from_env() -> RetrievalCache:
+    return RetrievalCache(int(float(os.environ.get("RETRIEVAL_CACHE_MAX_MB", "64")) * 1024 * 1024))
+
+
+def faq_stream(questions: List[str], count: int, skew: float, seed: int = 3) -> List[str]:
+    """``count`` questions drawn with Zipf-like popularity, each with random casing and spacing."""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) ** skew for rank in range(len(questions))]
+    stream = []
+    for question in rng.choices(questions, weights, k=count):
+        if rng.random() < 0.3:
+            question = question.lower()
+        if rng.random() < 0.3:
+            question = "  " + question.replace(" ", "  ") + " "
+        stream.append(question)
+    return stream
+
+
+async def run_bench(args) -> int:
+    import httpx
+
+    from app.embeddings import embedder_from_env
+    from app.rerank import LexicalReranker, RerankStage, reranker_from_env, sample_queries
+    from app.retrieval import RetrievalStore
+
+    reader = RetrievalStore(args.data_dir).reader(args.collection)
+    if reader is None:
+        print(f"Unknown collection: {args.collection}", file=sys.stderr)
+        return 1
+    embedder = embedder_from_env()
+    reranker = reranker_from_env() or RerankStage(LexicalReranker(), 30, 20000)
+    questions = [query for query, _ in sample_queries(reader, args.questions)]
+    stream = faq_stream(questions, args.requests, args.skew)
+    print(f"{len(stream)} requests over {len(questions)} distinct questions (skew {args.skew})")
+    print(f"{'':>14}  {'mean ms':>8}  {'p50 ms':>8}  {'p95 ms':>8}  {'hit rate':>8}")
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        for label, max_bytes in (("no cache", 0), ("cache", args.max_mb * 1024 * 1024)):
+            cache = RetrievalCache(int(max_bytes))
+            reranker.cache = type(reranker.cache)(0)  # score reuse would blur the comparison
+            timings = []
+            for question in stream:
+                started = time.perf_counter()
+                key = RetrievalCache.key(question, args.collection, reader.version, None, args.top_k, reranker.model_id)
+                hits = cache.get(key)
+                if hits is None:
+                    vectors = await embedder.aembed(client, [question], "query")
+                    candidates = reader.search(vectors[0], reranker.candidates)
+                    hits, _ = await reranker.rerank(client, question, candidates, args.top_k)
+                    cache.put(key, hits, time.perf_counter() - started)
+                timings.append(time.perf_counter() - started)
+            stats = cache.snapshot()
+            rate = f"{stats['hitRate']:.2f}" if stats["hitRate"] is not None else "-"
+            print(
+                f"{label:>14}  {np.mean(timings) * 1000:>8.2f}  {np.percentile(timings, 50) * 1000:>8.2f}  "
+                f"{np.percentile(timings, 95) * 1000:>8.2f}  {rate:>8}"
+            )
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m app.retrieval_cache")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="Replay repeated questions with and without the cache")
+    bench.add_argument("--collection", required=True)
+    bench.add_argument("--data-dir", default=os.environ.get("RETRIEVAL_DATA_DIR", "/app/backend/data/retrieval"))
+    bench.add_argument("--questions", type=int, default=200, help="Distinct questions")
+    bench.add_argument("--requests", type=int, default=2000)
+    bench.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of question popularity")
+    bench.add_argument("--top-k", type=int, default=5)
+    bench.add_argument("--max-mb", type=float, default=64.0)
+    return asyncio.run(run_bench(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""Mirror an S3 bucket/prefix into a retrieval collection.
+
+    python -m app.ingest sync s3://bucket/prefix --collection handbook
+    python -m app.ingest sync s3://docs/handbook --collection handbook --endpoint-url http://localhost:9000
+
+The prefix is listed and each object is compared with the collection manifest
+by ETag and size. Unchanged objects are skipped without being read, objects
+that are gone are removed from the collection (unless ``--keep-deleted``), and
+new or changed objects are read with concurrent ranged GETs. The parts are fed
+to the chunker in order as they arrive, so nothing is staged on local disk and
+a large object only holds a few parts in memory. Each GET is pinned to the
+listed ETag, so an object replaced mid-read fails and is retried by the next
+sync instead of mixing two versions.
+
+An object's ``date`` is its last-modified time; user metadata
+``x-amz-meta-owner``, ``x-amz-meta-tags`` (comma-separated) and
+``x-amz-meta-date`` set the rest. Metadata-only changes keep the ETag and are
+not picked up until the object's content changes.
+
+``--endpoint-url`` (or boto3's ``AWS_ENDPOINT_URL_S3``) points the sync at a
+local S3 stand-in such as MinIO or ``moto_server``.
+"""
+
+import argparse
+import itertools
+import json
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import boto3
+from botocore.config import Config
+
+from app.chunking import chunk_stream, extract_text_stream, is_supported
+from app.embeddings import embedder_from_env, embedding_report
+from app.ingest import (
+    DEFAULT_DATA_DIR,
+    Loader,
+    ParsedFile,
+    Progress,
+    add_metadata_arguments,
+    add_shard_argument,
+    bounded_map,
+    open_writer,
+)
+from app.metadata import normalize_metadata
+from app.retrieval import CollectionWriter
+from app.shards import shard_of
+
+MIB = 1024 * 1024
+
+
+class S3Object(NamedTuple):
+    key: str  # relative to the synced prefix; this is the key stored in the manifest
+    s3_key: str
+    size: int
+    etag: str
+    last_modified: Optional[datetime] = None
+
+    @property
+    def stamp(self) -> dict:
+        return {"size": self.size, "etag": self.etag}
+
+
+def parse_s3_url(url: str) -> Tuple[str, str]:
+    if not url.startswith("s3://"):
+        raise ValueError(f"Expected s3://bucket/prefix, got {url!r}")
+    bucket, _, prefix = url[len("s3://") :].partition("/")
+    if not bucket:
+        raise ValueError(f"Missing bucket in {url!r}")
+    return bucket, prefix
+
+
+def list_objects(client, bucket: str, prefix: str) -> Iterator[S3Object]:
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            s3_key = item["Key"]
+            if s3_key.endswith("/"):
+                continue  # folder placeholder
+            key = s3_key[len(prefix) :].lstrip("/") or s3_key.rsplit("/", 1)[-1]
+            yield S3Object(key, s3_key, item["Size"], item["ETag"].strip('"'), item.get("LastModified"))
+
+
+class RangeReader:
+    """Reads objects as ordered parts, fetching up to ``read_ahead`` parts of each concurrently."""
+
+    def __init__(self, client, bucket: str, pool: ThreadPoolExecutor, part_size: int, read_ahead: int):
+        self.client = client
+        self.bucket = bucket
+        self.pool = pool
+        self.part_size = part_size
+        self.read_ahead = read_ahead
+        self.transferred = 0
+        self._lock = threading.Lock()
+
+    def _get(self, obj: S3Object, start: int, end: int, metadata: Optional[dict] = None) -> bytes:
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=obj.s3_key, Range=f"bytes={start}-{end}", IfMatch=f'"{obj.etag}"'
+        )
+        if metadata is not None:
+            metadata.update(response.get("Metadata") or {})
+        data = response["Body"].read()
+        with self._lock:
+            self.transferred += len(data)
+        if len(data) != end - start + 1:
+            raise IOError(f"Short read of {obj.s3_key}: {len(data)} of {end - start + 1} bytes")
+        return data
+
+    def parts(self, obj: S3Object, metadata: Optional[dict] = None) -> Iterator[bytes]:
+        """The object's bytes in order; ``metadata`` receives its user metadata once the first part is read."""
+        ranges = ((start, min(start + self.part_size, obj.size) - 1) for start in range(0, obj.size, self.part_size))
+        if obj.size <= self.part_size:
+            # One part: read it on the calling thread rather than handing it to the pool.
+            for start, end in ranges:
+                yield self._get(obj, start, end, metadata)
+            return
+        first = next(ranges)
+        pending = deque([self.pool.submit(self._get, obj, *first, metadata)])
+        for span in itertools.islice(ranges, self.read_ahead - 1):
+            pending.append(self.pool.submit(self._get, obj, *span))
+        try:
+            while pending:
+                data = pending.popleft().result()
+                for span in itertools.islice(ranges, 1):
+                    pending.append(self.pool.submit(self._get, obj, *span))
+                yield data
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def parse_object(reader: RangeReader, max_chars: int, overlap: int, obj: S3Object) -> ParsedFile:
+    user_metadata = {}
+    try:
+        parts = reader.parts(obj, user_metadata)
+        chunks = list(chunk_stream(extract_text_stream(obj.key, parts), max_chars, overlap))
+        meta = normalize_metadata({"date": obj.last_modified, **user_metadata})
+    except Exception as exc:  # pylint: disable=broad-except
+        return ParsedFile(obj, [], None, f"{type(exc).__name__}: {exc}")
+    return ParsedFile(obj, chunks, None, None, meta)
+
+
+def s3_client(endpoint_url: Optional[str], concurrency: int):
+    options = {"addressing_style": "path"} if endpoint_url else {}
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint_url,
+        config=Config(
+            max_pool_connections=concurrency * 2,
+            retries={"mode": "standard", "max_attempts": 5},
+            s3=options,
+        ),
+    )
+
+
+def sync(
+    client,
+    bucket: str,
+    prefix: str,
+    writer: CollectionWriter,
+    embedder,
+    concurrency: int = 16,
+    part_size: int = 8 * MIB,
+    read_ahead: int = 4,
+    batch_size: int = 256,
+    max_chars: int = 1200,
+    overlap: int = 150,
+    checkpoint_seconds: float = 5.0,
+    delete: bool = True,
+    metadata: Optional[dict] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    progress_stream=sys.stderr,
+) -> dict:
+    objects = [
+        obj
+        for obj in list_objects(client, bucket, prefix)
+        if is_supported(obj.key) and (shard is None or shard_of(obj.key, shard[1]) == shard[0])
+    ]
+    todo = [obj for obj in objects if not writer.is_current(obj.key, obj.stamp)]
+    changed = {obj.key for obj in todo}
+    progress = Progress(len(todo), len(objects) - len(todo), stream=progress_stream)
+    removed: List[str] = []
+    if delete:
+        present = {obj.key for obj in objects}
+        removed = [key for key in list(writer.manifest["files"]) if key not in present]
+        for key in removed:
+            writer.remove(key)
+    loader = Loader(writer, embedder, progress, batch_size, checkpoint_seconds, progress_stream, metadata)
+
+    range_pool = ThreadPoolExecutor(concurrency, thread_name_prefix="s3-range")
+    object_pool = ThreadPoolExecutor(concurrency, thread_name_prefix="s3-object")
+    reader = RangeReader(client, bucket, range_pool, part_size, read_ahead)
+    try:
+        for parsed in bounded_map(object_pool, partial(parse_object, reader, max_chars, overlap), todo, concurrency * 2):
+            progress.transferred = reader.transferred
+            loader.put(parsed)
+        loader.finish()
+    finally:
+        object_pool.shutdown(cancel_futures=True)
+        range_pool.shutdown(cancel_futures=True)
+    summary = progress.summary()
+    summary.update(
+        objects=len(objects),
+        removed=len(removed),
+        bytesTransferred=reader.transferred,
+        bytesSkipped=sum(obj.size for obj in objects if obj.key not in changed),
+    )
+    return summary
+
+
+def run_sync(args) -> int:
+    bucket, prefix = parse_s3_url(args.source)
+    client = s3_client(args.endpoint_url, args.concurrency)
+    embedder = embedder_from_env()
+    collection, writer = open_writer(args, embedder)
+    try:
+        summary = sync(
+            client,
+            bucket,
+            prefix,
+            writer,
+            embedder,
+            concurrency=args.concurrency,
+            part_size=int(args.part_size_mb * MIB),
+            batch_size=args.batch_size,
+            max_chars=args.chunk_chars,
+            overlap=args.chunk_overlap,
+            checkpoint_seconds=args.checkpoint_seconds,
+            delete=not args.keep_deleted,
+            metadata=normalize_metadata({"owner": args.owner, "tags": args.tag}),
+            shard=args.shard,
+        )
+    except KeyboardInterrupt:
+        writer.close(checkpoint=False)
+        print("Interrupted; re-run the same command to resume.", file=sys.stderr)
+        return 130
+    writer.close()
+    report = embedding_report(embedder)
+    print(json.dumps({"collection": collection, **summary, "totalChunks": writer.count, **report}))
+    return 1 if summary["failed"] else 0
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.ingest sync", description="Mirror an S3 prefix.")
+    parser.add_argument("source", help="s3://bucket/prefix")
+    parser.add_argument("--collection", required=True, help="Collection name (letters, digits, '.', '_', '-')")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help=f"Store root (default {DEFAULT_DATA_DIR})")
+    parser.add_argument("--endpoint-url", help="S3 endpoint, e.g. a local MinIO or moto_server")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent GETs and objects in flight")
+    parser.add_argument("--part-size-mb", type=float, default=8.0, help="Size of each ranged GET")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks per embedding batch")
+    parser.add_argument("--chunk-chars", type=int, default=1200)
+    parser.add_argument("--chunk-overlap", type=int, default=150)
+    parser.add_argument("--checkpoint-seconds", type=float, default=5.0)
+    parser.add_argument("--keep-deleted", action="store_true", help="Keep chunks of objects that no longer exist")
+    add_metadata_arguments(parser)
+    add_shard_argument(parser)
+    return run_sync(parser.parse_args(argv))
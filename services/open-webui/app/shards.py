@@ -0,0 +1,488 @@
+"""Collections split into shards on separate replicas, searched scatter-gather.
+
+A collection too big for one task's memory is stored as ``N`` shard
+collections ``NAME.shard0`` … ``NAME.shard{N-1}``. Every file goes to shard
+``crc32(key) % N``, so all chunks of a file, and the tombstones left when it
+changes, stay in one shard::
+
+    python -m app.ingest /docs --collection handbook --shard 0/4      # once per shard
+    python -m app.ingest sync s3://docs/handbook --collection handbook --shard 0/4
+    python -m app.shards split --collection handbook --shards 4       # re-partition, no re-embedding
+
+Each shard is served by its own replicas::
+
+    python -m app.shards serve --port 80
+
+A replica answers ``POST /api/shards/NAME.shardI/search`` from the collections
+under ``RETRIEVAL_DATA_DIR``, and only maps the shards it is asked for. In ECS
+every shard is one service registered in the Cloud Map ``internal`` namespace
+as ``retrieval-I.internal``.
+
+The web app coordinates. With ``RETRIEVAL_SHARD_URLS`` set (URL ``I`` serves
+shard ``I``), a collection that is not stored locally is searched on all
+shards in parallel. Each shard's host name resolves to all of its replicas (A
+records, looked up again every ``RETRIEVAL_SHARD_RESOLVE_SECONDS``). Queries
+rotate across the replicas and move on to the next one if a connection is
+refused. A shard has ``RETRIEVAL_SHARD_TIMEOUT_MS`` to answer. The best
+``topK`` of the answers are returned, and a slow, failing or missing shard
+only makes the result partial.
+
+    python -m app.shards bench --collection handbook --shards 1,2,4
+
+splits a collection into throwaway shards, starts one server process per
+shard and compares query latency by shard count. It then repeats the queries
+with one shard stopped and with one shard frozen.
+"""
+
+import argparse
+import asyncio
+import base64
+import heapq
+import itertools
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+import numpy as np
+from fastapi import APIRouter, FastAPI, HTTPException
+
+from app.metadata import FilterError
+from app.retrieval import CollectionReader, CollectionWriter, Hit, RetrievalStore, is_valid_collection
+
+DEFAULT_DATA_DIR = "/app/backend/data/retrieval"
+MAX_SHARD_TOP_K = 1000
+
+
+def shard_of(key: str, count: int) -> int:
+    return zlib.crc32(key.encode("utf-8")) % count
+
+
+def shard_name(collection: str, index: int) -> str:
+    return f"{collection}.shard{index}"
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """``"I/N"`` as ``(I, N)``, for ``--shard`` options."""
+    index, _, count = value.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected INDEX/COUNT, got {value!r}") from None
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index must be between 0 and {count - 1}")
+    return index, count
+
+
+def shard_info(collection: str, index: int, count: int) -> dict:
+    """The manifest's ``shard`` entry for shard ``index`` of ``count``."""
+    return {"collection": collection, "index": index, "count": count}
+
+
+def split_collection(root_dir: str, collection: str, count: int, target_dir: Optional[str] = None) -> List[str]:
+    """Write the live files of ``collection`` into ``count`` shard collections, reusing the stored vectors."""
+    reader = CollectionReader(os.path.join(root_dir, collection))
+    if not reader.refresh():
+        raise ValueError(f"Unknown collection: {collection}")
+    snapshot = reader.snapshot
+    manifest = snapshot.manifest
+    names = [shard_name(collection, index) for index in range(count)]
+    writers = [
+        CollectionWriter(
+            target_dir or root_dir, name, manifest["embeddingModel"], shard=shard_info(collection, index, count)
+        )
+        for index, name in enumerate(names)
+    ]
+    try:
+        for key, entry in manifest["files"].items():
+            start, end = entry["rows"]
+            rows = list(range(start, end))
+            if rows:
+                # Files never span segments, so their vectors are one slice of one segment.
+                segment = int(np.searchsorted(snapshot.starts, start, side="right")) - 1
+                offset = start - int(snapshot.starts[segment])
+                vectors = np.asarray(snapshot.segments[segment].vectors[offset : offset + len(rows)])
+            else:
+                vectors = np.zeros((0, manifest["dimensions"] or 0), dtype=np.float32)
+            stamp = {field: value for field, value in entry.items() if field not in ("rows", "meta")}
+            writers[shard_of(key, count)].add(key, stamp, reader.records(rows, snapshot), vectors, entry.get("meta"))
+    finally:
+        for writer in writers:
+            writer.close()
+    return names
+
+
+def encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(np.ascontiguousarray(vector, dtype="<f4").tobytes()).decode("ascii")
+
+
+def build_shard_router(store: RetrievalStore) -> APIRouter:
+    router = APIRouter()
+
+    @router.post("/api/shards/{name}/search")
+    async def search_shard(name: str, body: dict):
+        """Top ``topK`` rows of one shard for a query ``vector`` (base64 little-endian float32)."""
+        reader = await asyncio.to_thread(store.reader, name)
+        if reader is None:
+            raise HTTPException(status_code=404, detail=f"Unknown shard: {name}")
+        manifest = reader.manifest
+        model = body.get("embeddingModel")
+        if model is not None and model != manifest["embeddingModel"]:
+            raise HTTPException(
+                status_code=409, detail=f"Shard was embedded with {manifest['embeddingModel']}, not {model}"
+            )
+        try:
+            vector = np.frombuffer(base64.b64decode(body["vector"], validate=True), dtype="<f4")
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="'vector' must be base64 float32")
+        if manifest["dimensions"] and vector.shape[0] != manifest["dimensions"]:
+            raise HTTPException(status_code=400, detail=f"Expected a vector of {manifest['dimensions']} dimensions")
+        top_k = body.get("topK")
+        if not isinstance(top_k, int) or not 1 <= top_k <= MAX_SHARD_TOP_K:
+            raise HTTPException(status_code=400, detail=f"'topK' must be between 1 and {MAX_SHARD_TOP_K}")
+        spec = body.get("filter")
+        if spec is not None and not isinstance(spec, dict):
+            raise HTTPException(status_code=400, detail="'filter' must be an object")
+
+        started = time.perf_counter()
+        try:
+            hits = await asyncio.to_thread(reader.search, vector, top_k, spec)
+        except FilterError as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid filter: {exc}")
+        return {
+            "collection": name,
+            "version": reader.version,
+            "shard": manifest.get("shard"),
+            # Unrounded scores, so the coordinator merges shards in the same order as one collection would.
+            "hits": [
+                {"row": hit.row, "score": hit.score, "source": hit.source, "chunk": hit.chunk, "text": hit.text}
+                for hit in hits
+            ],
+            "searchMs": round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    return router
+
+
+def build_shard_app(data_dir: str) -> FastAPI:
+    app = FastAPI(title="Retrieval shard")
+    app.include_router(build_shard_router(RetrievalStore(data_dir)))
+
+    @app.get("/healthz")
+    async def health():
+        return {"status": "ok"}
+
+    return app
+
+
+class ShardError(Exception):
+    """A shard rejected the query itself (bad filter, other embedding model), or no shard answered."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class ShardCoordinator:
+    """Fans a query out to one replica of every shard and merges the answers."""
+
+    def __init__(self, urls: List[str], timeout_seconds: float, resolve_seconds: float = 10.0):
+        self.urls = [url.rstrip("/") for url in urls]
+        self.timeout_seconds = timeout_seconds
+        self.resolve_seconds = resolve_seconds
+        self._replicas: Dict[int, Tuple[float, List[str]]] = {}
+        self._turn = itertools.count()
+        self.queries = 0
+        self.partial = 0
+        self.failures: Counter = Counter()
+
+    async def replicas(self, shard: int) -> List[str]:
+        """Base URLs of the replicas of ``shard``: one per address its host name resolves to."""
+        now = time.monotonic()
+        cached = self._replicas.get(shard)
+        if cached is not None and now - cached[0] < self.resolve_seconds:
+            return cached[1]
+        parts = urlsplit(self.urls[shard])
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        try:
+            addresses = await asyncio.get_running_loop().getaddrinfo(
+                parts.hostname, port, family=socket.AF_INET, type=socket.SOCK_STREAM
+            )
+            hosts = sorted({address[4][0] for address in addresses})
+            replicas = [urlunsplit(parts._replace(netloc=f"{host}:{port}")) for host in hosts]
+        except OSError:
+            # Keep the last known replicas through a DNS hiccup.
+            replicas = cached[1] if cached is not None else [self.urls[shard]]
+        self._replicas[shard] = (now, replicas)
+        return replicas
+
+    async def _ask(self, client: httpx.AsyncClient, shard: int, name: str, body: dict) -> Optional[dict]:
+        replicas = await self.replicas(shard)
+        turn = next(self._turn)
+        for attempt in range(len(replicas)):
+            base = replicas[(turn + attempt) % len(replicas)]
+            try:
+                response = await client.post(f"{base}/api/shards/{name}/search", json=body)
+            except httpx.ConnectError:
+                if attempt == len(replicas) - 1:
+                    raise
+                continue
+            if response.status_code == 404:
+                return None
+            if response.status_code in (400, 409):
+                raise ShardError(response.status_code, response.json().get("detail", response.text))
+            response.raise_for_status()
+            return response.json()
+        return None
+
+    async def _ask_within_deadline(
+        self, client: httpx.AsyncClient, shard: int, name: str, body: dict
+    ) -> Tuple[str, Optional[dict], float]:
+        """``(status, answer, milliseconds)``; status is ``ok``, ``missing``, ``timeout`` or ``error``."""
+        started = time.perf_counter()
+        try:
+            answer = await asyncio.wait_for(self._ask(client, shard, name, body), self.timeout_seconds)
+            status = "ok" if answer is not None else "missing"
+        except asyncio.TimeoutError:
+            status, answer = "timeout", None
+        except (httpx.HTTPError, ValueError):
+            status, answer = "error", None
+        return status, answer, (time.perf_counter() - started) * 1000
+
+    async def search(
+        self,
+        client: httpx.AsyncClient,
+        collection: str,
+        vector: np.ndarray,
+        top_k: int,
+        spec: Optional[dict] = None,
+        embedding_model: Optional[str] = None,
+    ) -> Tuple[Optional[List[Hit]], dict]:
+        """Best ``top_k`` hits over all shards and a report; ``None`` hits if no shard has the collection."""
+        body = {"vector": encode_vector(vector), "topK": top_k, "filter": spec, "embeddingModel": embedding_model}
+        outcomes = await asyncio.gather(
+            *(
+                self._ask_within_deadline(client, shard, shard_name(collection, shard), body)
+                for shard in range(len(self.urls))
+            ),
+            return_exceptions=True,
+        )
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+
+        failed = [{"shard": shard, "reason": status} for shard, (status, _, _) in enumerate(outcomes) if status != "ok"]
+        if len(failed) == len(self.urls) and all(entry["reason"] == "missing" for entry in failed):
+            return None, {"shards": len(self.urls), "answered": 0, "partial": False}
+        self.queries += 1
+        candidates, slowest = [], 0.0
+        for shard, (status, answer, elapsed_ms) in enumerate(outcomes):
+            if status != "ok":
+                self.failures[(shard, status)] += 1
+                continue
+            slowest = max(slowest, elapsed_ms)
+            candidates.extend(
+                Hit(hit["row"], hit["score"], hit["source"], hit["chunk"], hit["text"]) for hit in answer["hits"]
+            )
+        answered = len(self.urls) - len(failed)
+        report = {
+            "shards": len(self.urls),
+            "answered": answered,
+            "partial": bool(failed),
+            "slowestShardMs": round(slowest, 2),
+        }
+        if failed:
+            report["failed"] = failed
+        if failed:
+            self.partial += 1
+        if not answered:
+            raise ShardError(503, "No retrieval shard answered in time")
+        return heapq.nlargest(top_k, candidates, key=lambda hit: hit.score), report
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": True,
+            "shards": [
+                {
+                    "shard": shard,
+                    "url": url,
+                    "replicas": len(self._replicas.get(shard, (0, []))[1]),
+                    "timeouts": self.failures[(shard, "timeout")],
+                    "errors": self.failures[(shard, "error")],
+                    "missing": self.failures[(shard, "missing")],
+                }
+                for shard, url in enumerate(self.urls)
+            ],
+            "timeoutMs": round(self.timeout_seconds * 1000),
+            "queries": self.queries,
+            "partial": self.partial,
+        }
+
+
+def shard_coordinator_from_env() -> Optional[ShardCoordinator]:
+    urls = [url.strip() for url in os.environ.get("RETRIEVAL_SHARD_URLS", "").split(",") if url.strip()]
+    if not urls:
+        return None
+    return ShardCoordinator(
+        urls,
+        timeout_seconds=float(os.environ.get("RETRIEVAL_SHARD_TIMEOUT_MS", "300")) / 1000,
+        resolve_seconds=float(os.environ.get("RETRIEVAL_SHARD_RESOLVE_SECONDS", "10")),
+    )
+
+
+def _serve(data_dir: str, host: str, port: int) -> None:
+    import uvicorn
+
+    uvicorn.run(build_shard_app(data_dir), host=host, port=port, log_level="warning", access_log=False)
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _start_servers(data_dir: str, count: int) -> Tuple[List[multiprocessing.Process], List[str]]:
+    ports = [_free_port() for _ in range(count)]
+    servers = [
+        multiprocessing.Process(target=_serve, args=(data_dir, "127.0.0.1", port), daemon=True) for port in ports
+    ]
+    for server in servers:
+        server.start()
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+    deadline = time.monotonic() + 30
+    for url in urls:
+        while True:
+            try:
+                httpx.get(f"{url}/healthz", timeout=1.0).raise_for_status()
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Shard server at {url} did not start")
+                time.sleep(0.05)
+    return servers, urls
+
+
+async def _measure(coordinator: ShardCoordinator, collection: str, queries: np.ndarray, expected: list, top_k: int):
+    timings, exact, partial = [], 0, 0
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        await coordinator.search(client, collection, queries[0], top_k)  # connect and map every shard first
+        for query, reference in zip(queries, expected):
+            started = time.perf_counter()
+            hits, report = await coordinator.search(client, collection, query, top_k)
+            timings.append(time.perf_counter() - started)
+            exact += [round(hit.score, 5) for hit in hits] == reference
+            partial += report["partial"]
+    return timings, exact / len(queries), partial / len(queries)
+
+
+def _row(label: str, timings: List[float], exact: float, partial: float) -> str:
+    p50, p95 = (float(np.percentile(timings, q)) * 1000 for q in (50, 95))
+    return f"{label:>16}  {p50:>7.2f}  {p95:>7.2f}  {exact:>9.2f}  {partial:>8.2f}"
+
+
+def run_bench(args) -> int:
+    source = CollectionReader(os.path.join(args.data_dir, args.collection))
+    if not source.refresh():
+        print(f"Unknown collection: {args.collection}", file=sys.stderr)
+        return 1
+    snapshot = source.snapshot
+    rng = np.random.default_rng(5)
+    # Queries near stored chunks, so every shard count is checked against the unsharded top-k.
+    vectors = np.concatenate([np.asarray(segment.vectors) for segment in snapshot.segments])
+    if snapshot.alive is not None:
+        vectors = vectors[snapshot.alive[: len(vectors)]]
+    queries = vectors[rng.choice(len(vectors), args.queries)] + rng.normal(0, 0.05, (args.queries, vectors.shape[1]))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+    # Compared by score: duplicate chunks tie, and ties may come back in another order.
+    expected = [[round(hit.score, 5) for hit in source.search(query, args.top_k)] for query in queries]
+
+    scratch = tempfile.mkdtemp(prefix="shards-bench-")
+    print(f"{len(vectors)} chunks, {args.queries} queries, top {args.top_k}, shard deadline {args.timeout_ms:.0f} ms")
+    print(f"{'shards':>16}  {'p50 ms':>7}  {'p95 ms':>7}  {'same top-k':>9}  {'partial':>8}")
+    servers: List[multiprocessing.Process] = []
+    try:
+        for count in args.shards:
+            data_dir = os.path.join(scratch, str(count))
+            split_collection(args.data_dir, args.collection, count, data_dir)
+            servers, urls = _start_servers(data_dir, count)
+            coordinator = ShardCoordinator(urls, args.timeout_ms / 1000)
+            print(_row(str(count), *asyncio.run(_measure(coordinator, args.collection, queries, expected, args.top_k))))
+            if count == args.shards[-1] and count > 1:
+                servers[-1].terminate()
+                servers[-1].join()
+                result = asyncio.run(_measure(coordinator, args.collection, queries, expected, args.top_k))
+                print(_row(f"{count}, 1 stopped", *result))
+                os.kill(servers[0].pid, signal.SIGSTOP)
+                try:
+                    # Every query now waits out the shard deadline, so fewer of them.
+                    result = asyncio.run(
+                        _measure(coordinator, args.collection, queries[:20], expected[:20], args.top_k)
+                    )
+                finally:
+                    os.kill(servers[0].pid, signal.SIGCONT)
+                print(_row(f"{count}, 1 frozen", *result))
+            for server in servers:
+                server.terminate()
+                server.join()
+    finally:
+        for server in servers:
+            if server.is_alive():
+                server.kill()
+        shutil.rmtree(scratch, ignore_errors=True)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m app.shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    data_dir = os.environ.get("RETRIEVAL_DATA_DIR", DEFAULT_DATA_DIR)
+
+    serve = commands.add_parser("serve", help="Answer shard searches from the local store")
+    serve.add_argument("--data-dir", default=data_dir)
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=80)
+
+    split = commands.add_parser("split", help="Re-partition a collection into shard collections")
+    split.add_argument("--collection", required=True)
+    split.add_argument("--shards", type=int, required=True)
+    split.add_argument("--data-dir", default=data_dir)
+    split.add_argument("--target-dir", help="Store root for the shards (default: --data-dir)")
+
+    bench = commands.add_parser("bench", help="Latency by shard count, and with a stopped and a frozen shard")
+    bench.add_argument("--collection", required=True)
+    bench.add_argument("--data-dir", default=data_dir)
+    bench.add_argument(
+        "--shards", type=lambda value: [int(entry) for entry in value.split(",")], default=[1, 2, 4], help="e.g. 1,2,4"
+    )
+    bench.add_argument("--queries", type=int, default=300)
+    bench.add_argument("--top-k", type=int, default=10)
+    bench.add_argument("--timeout-ms", type=float, default=300.0)
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        _serve(args.data_dir, args.host, args.port)
+        return 0
+    if args.command == "split":
+        if args.shards < 1 or not is_valid_collection(args.collection):
+            parser.error("--shards must be at least 1 and --collection a valid name")
+        started = time.monotonic()
+        names = split_collection(args.data_dir, args.collection, args.shards, args.target_dir)
+        print(f"Wrote {', '.join(names)} in {time.monotonic() - started:.1f}s")
+        return 0
+    return run_bench(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,701 @@
+let CONFIG = {};
+
+const modelsSelect = document.getElementById("model");
+const output = document.getElementById("output");
+const runButton = document.getElementById("run");
+const promptField = document.getElementById("prompt");
+const systemField = document.getElementById("system");
+const chatContainer = document.getElementById("chat");
+const emptyState = document.getElementById("empty-state");
+const statusPill = document.getElementById("status-pill");
+const statusText = document.getElementById("status-text");
+const modelHint = document.getElementById("model-hint");
+const modelMeta = document.getElementById("model-meta");
+const temperatureInput = document.getElementById("temperature");
+const temperatureValue = document.getElementById("temperature-value");
+const clearButton = document.getElementById("clear-chat");
+const saveButton = document.getElementById("save-chat");
+const promptChips = document.getElementById("prompt-chips");
+
+const STORAGE_KEY = "bedrock-chat-state-v1";
+const state = {
+  models: [],
+  history: [],
+  temperature: 0.3,
+  systemPrompt: "",
+  modelId: "",
+  conversationId: null,
+};
+let recommendedModelId = "";
+const storage = {
+  get(key) {
+    try {
+      return window.localStorage ? localStorage.getItem(key) : null;
+    } catch (err) {
+      return null;
+    }
+  },
+  set(key, value) {
+    try {
+      if (window.localStorage) {
+        localStorage.setItem(key, value);
+      }
+    } catch (err) {
+      // Ignore storage failures (private mode, blocked storage, quota, etc.).
+    }
+  },
+};
+
+const quickPrompts = [
+  "Summarize this in three bullet points.",
+  "Draft a short email reply.",
+  "Explain this like I am five.",
+  "Give me a checklist for a launch.",
+];
+
+function setStatus(message, isError = false) {
+  statusText.textContent = message;
+  statusPill.classList.toggle("error", isError);
+}
+
+function reportError(message) {
+  output.textContent = message;
+  setStatus("Client error", true);
+}
+
+function saveState() {
+  const payload = {
+    history: state.history,
+    temperature: state.temperature,
+    systemPrompt: state.systemPrompt,
+    modelId: state.modelId,
+    conversationId: state.conversationId,
+  };
+  storage.set(STORAGE_KEY, JSON.stringify(payload));
+}
+
+async function loadConfig() {
+  try {
+    const response = await fetch("/api/config");
+    if (response.ok) {
+      CONFIG = await response.json();
+    }
+  } catch (err) {
+    console.warn("Failed to load config", err);
+  }
+  state.systemPrompt = CONFIG.defaultSystemPrompt || "";
+}
+
+function loadState() {
+  const raw = storage.get(STORAGE_KEY);
+  if (!raw) {
+    return;
+  }
+  try {
+    const stored = JSON.parse(raw);
+    state.history = Array.isArray(stored.history) ? stored.history : [];
+    state.temperature = typeof stored.temperature === "number" ? stored.temperature : 0.3;
+    state.systemPrompt = stored.systemPrompt || "";
+    state.modelId = stored.modelId || "";
+    state.conversationId = stored.conversationId || null;
+  } catch (err) {
+    console.warn("Failed to load stored state", err);
+  }
+}
+
+function showConversationInUrl() {
+  const url = new URL(window.location.href);
+  if (state.conversationId) {
+    url.searchParams.set("c", state.conversationId);
+  } else {
+    url.searchParams.delete("c");
+  }
+  window.history.replaceState(null, "", url);
+}
+
+async function loadConversation() {
+  // A ?c= link opens the same conversation on any device; the server copy wins over local storage.
+  const fromUrl = new URL(window.location.href).searchParams.get("c");
+  if (fromUrl) {
+    state.conversationId = fromUrl;
+  }
+  if (!state.conversationId) {
+    return;
+  }
+  try {
+    const response = await fetch(`/api/conversations/${encodeURIComponent(state.conversationId)}`);
+    if (response.status === 404 || response.status === 400) {
+      state.conversationId = null;
+      state.history = [];
+    } else if (response.ok) {
+      const data = await response.json();
+      state.history = data.messages.map((msg) => ({ role: msg.role, content: msg.content }));
+    }
+  } catch (err) {
+    console.warn("Failed to load conversation", err);
+  }
+  showConversationInUrl();
+  saveState();
+}
+
+function renderChat() {
+  chatContainer.innerHTML = "";
+  const recent = state.history.slice(-80);
+  if (!recent.length) {
+    chatContainer.appendChild(emptyState);
+  } else {
+    recent.forEach((msg, index) => {
+      const row = document.createElement("div");
+      row.className = `message ${msg.role}`;
+      row.style.setProperty("--delay", `${index * 20}ms`);
+
+      const avatar = document.createElement("div");
+      avatar.className = "avatar";
+      avatar.textContent = msg.role === "user" ? "YOU" : "AI";
+
+      const bubble = document.createElement("div");
+      bubble.className = "bubble" + (msg.pending ? " pending" : "");
+
+      const meta = document.createElement("div");
+      meta.className = "meta";
+      meta.textContent = msg.role === "user" ? "User" : "Assistant";
+
+      const text = document.createElement("div");
+      text.textContent = msg.content || "";
+
+      bubble.appendChild(meta);
+      bubble.appendChild(text);
+      row.appendChild(avatar);
+      row.appendChild(bubble);
+      chatContainer.appendChild(row);
+    });
+  }
+  chatContainer.scrollTop = chatContainer.scrollHeight;
+}
+
+function renderChips() {
+  promptChips.innerHTML = "";
+  quickPrompts.forEach((text) => {
+    const chip = document.createElement("button");
+    chip.className = "chip";
+    chip.type = "button";
+    chip.textContent = text;
+    chip.addEventListener("click", () => {
+      promptField.value = text;
+      promptField.focus();
+      autoResize(promptField);
+    });
+    promptChips.appendChild(chip);
+  });
+}
+
+function updateTemperature(value) {
+  const clamped = Math.min(1, Math.max(0, value));
+  state.temperature = clamped;
+  temperatureInput.value = clamped;
+  temperatureValue.textContent = clamped.toFixed(2);
+  saveState();
+}
+
+function autoResize(textarea) {
+  textarea.style.height = "auto";
+  textarea.style.height = `${Math.min(textarea.scrollHeight, 220)}px`;
+}
+
+function normalizeModels(entries) {
+  return entries
+    .map((entry) => {
+      const modelId = entry.modelId || entry.model_id || entry.id || "";
+      return {
+        id: modelId,
+        name: entry.modelName || entry.name || modelId,
+        provider: entry.providerName || entry.provider || "",
+        inputModalities: entry.inputModalities || [],
+        outputModalities: entry.outputModalities || [],
+        inferenceTypes: entry.inferenceTypesSupported || [],
+        raw: entry,
+      };
+    })
+    .filter((entry) => entry.id);
+}
+
+function scoreModel(model) {
+  const id = model.id || "";
+  let score = 0;
+  (CONFIG.preferredModels || []).forEach((key, index) => {
+    if (id.includes(key)) {
+      score = Math.max(score, 1000 - index * 10);
+    }
+  });
+  if (/(70b|xlarge|xl|large|pro|opus)/i.test(id)) {
+    score += 25;
+  }
+  if (/(8b|small|lite|haiku)/i.test(id)) {
+    score -= 10;
+  }
+  if (model.inferenceTypes.includes("ON_DEMAND")) {
+    score += 5;
+  }
+  return score;
+}
+
+function rankModels(models) {
+  return [...models].sort((a, b) => {
+    const diff = scoreModel(b) - scoreModel(a);
+    if (diff !== 0) return diff;
+    return a.name.localeCompare(b.name);
+  });
+}
+
+const AUTO_MODEL_ID = "auto";
+
+function updateModelMeta(selectedId) {
+  if (selectedId === AUTO_MODEL_ID) {
+    modelMeta.textContent = "The gateway picks a model per message from prompt complexity and live latency.";
+    return;
+  }
+  const model = state.models.find((entry) => entry.id === selectedId);
+  if (!model) {
+    modelMeta.textContent = "";
+    return;
+  }
+  const parts = [];
+  if (model.provider) parts.push(`Provider: ${model.provider}`);
+  if (model.outputModalities?.length) parts.push(`Output: ${model.outputModalities.join(", ")}`);
+  if (model.inferenceTypes?.length) parts.push(`Inference: ${model.inferenceTypes.join(", ")}`);
+  modelMeta.textContent = parts.join(" | ");
+}
+
+async function loadModels() {
+  try {
+    setStatus("Loading models...");
+    const response = await fetch("/api/models");
+    if (!response.ok) {
+      throw new Error(await response.text());
+    }
+    const data = await response.json();
+    const entries = data.models || data.modelSummaries || [];
+
+    const normalized = normalizeModels(entries);
+    const filtered = normalized.filter((entry) => {
+      if (!entry.outputModalities?.length) return true;
+      const outputs = entry.outputModalities;
+      const inference = entry.inferenceTypes || [];
+      const isTextCapable = outputs.includes("TEXT");
+      const isOnDemand = inference.includes("ON_DEMAND") || !inference.length;
+      return isTextCapable && isOnDemand;
+    });
+
+    state.models = rankModels(filtered.length ? filtered : normalized);
+    modelsSelect.innerHTML = "";
+
+    state.models.forEach((entry, index) => {
+      const option = document.createElement("option");
+      option.value = entry.id;
+      const provider = entry.provider ? ` - ${entry.provider}` : "";
+      option.textContent = `${entry.name || entry.id}${provider}`;
+      if (index === 0) {
+        option.dataset.recommended = "true";
+      }
+      modelsSelect.appendChild(option);
+    });
+
+    if (!state.models.length) {
+      const option = document.createElement("option");
+      option.textContent = "No models found";
+      option.disabled = true;
+      modelsSelect.appendChild(option);
+      setStatus("No models found", true);
+      return;
+    }
+
+    recommendedModelId = state.models[0].id;
+    if (CONFIG.autoModel) {
+      const option = document.createElement("option");
+      option.value = AUTO_MODEL_ID;
+      option.textContent = "Auto - fastest suitable model";
+      option.dataset.recommended = "true";
+      modelsSelect.prepend(option);
+      recommendedModelId = AUTO_MODEL_ID;
+    }
+    const storedModel =
+      state.modelId &&
+      ((CONFIG.autoModel && state.modelId === AUTO_MODEL_ID) || state.models.find((m) => m.id === state.modelId));
+    modelsSelect.value = storedModel ? state.modelId : recommendedModelId;
+    state.modelId = modelsSelect.value;
+    modelHint.textContent =
+      state.modelId === recommendedModelId
+        ? "Recommended model selected."
+        : `Recommended: ${recommendedModelId}`;
+    updateModelMeta(state.modelId);
+    setStatus("Ready");
+    saveState();
+  } catch (err) {
+    output.textContent = "Failed to load models: " + err.message;
+    setStatus("Model load failed", true);
+  }
+}
+
+async function postWithRetry(url, body, attempts = 3) {
+  // 503 means this task is saturated or draining for a deploy; another task will take the retry.
+  for (let attempt = 1; ; attempt += 1) {
+    const response = await fetch(url, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify(body),
+    });
+    if (response.status !== 503 || attempt >= attempts) {
+      return response;
+    }
+    const retryAfter = Number(response.headers.get("Retry-After")) || 1;
+    setStatus("Service busy, retrying...");
+    await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+  }
+}
+
+// One WebSocket per tab carries every completion as a numbered stream of frames.
+const SOCKET_PING_MS = 25000;
+const SOCKET_MAX_RECONNECTS = 5;
+const chatSocket = {
+  ws: null,
+  ready: null,
+  streams: new Map(),
+  reconnects: 0,
+  pingTimer: null,
+};
+let activeStream = null;
+let renderQueued = false;
+
+function scheduleRender() {
+  if (renderQueued) return;
+  renderQueued = true;
+  requestAnimationFrame(() => {
+    renderQueued = false;
+    renderChat();
+  });
+}
+
+function sendFrame(frame) {
+  if (chatSocket.ws && chatSocket.ws.readyState === WebSocket.OPEN) {
+    chatSocket.ws.send(JSON.stringify(frame));
+  }
+}
+
+function newStreamId() {
+  if (window.crypto?.randomUUID) {
+    return crypto.randomUUID().replace(/-/g, "");
+  }
+  return Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
+
+function failStreams(message, status) {
+  chatSocket.streams.forEach((stream) => {
+    const error = new Error(message);
+    error.status = status;
+    stream.reject(error);
+  });
+  chatSocket.streams.clear();
+}
+
+function handleFrame(frame) {
+  const stream = chatSocket.streams.get(frame.id);
+  if (!stream) {
+    return;
+  }
+  if (typeof frame.seq === "number") {
+    if (frame.seq <= stream.lastSeq) return;
+    stream.lastSeq = frame.seq;
+  }
+  if (frame.type === "delta") {
+    stream.onDelta(frame.text);
+    return;
+  }
+  chatSocket.streams.delete(frame.id);
+  if (frame.type === "done" || frame.type === "cancelled") {
+    stream.resolve(frame);
+  } else {
+    const error = new Error(frame.detail || "Request failed");
+    error.status = frame.status;
+    stream.reject(error);
+  }
+}
+
+function scheduleReconnect() {
+  chatSocket.reconnects += 1;
+  if (chatSocket.reconnects > SOCKET_MAX_RECONNECTS) {
+    failStreams("Connection lost", 0);
+    return;
+  }
+  setStatus("Connection lost, reconnecting...");
+  const delay = Math.min(500 * 2 ** (chatSocket.reconnects - 1), 8000);
+  setTimeout(() => connectSocket().catch(() => {}), delay);
+}
+
+function connectSocket() {
+  if (chatSocket.ready) {
+    return chatSocket.ready;
+  }
+  chatSocket.ready = new Promise((resolve, reject) => {
+    const scheme = window.location.protocol === "https:" ? "wss:" : "ws:";
+    const ws = new WebSocket(`${scheme}//${window.location.host}/api/ws`);
+    let opened = false;
+    ws.onopen = () => {
+      opened = true;
+      chatSocket.ws = ws;
+      chatSocket.reconnects = 0;
+      // Keeps the load balancer from closing an idle connection.
+      chatSocket.pingTimer = setInterval(() => sendFrame({ type: "ping" }), SOCKET_PING_MS);
+      // Pick up replies that were still streaming when the previous connection dropped.
+      chatSocket.streams.forEach((stream, id) => sendFrame({ type: "resume", id, after: stream.lastSeq }));
+      resolve(ws);
+    };
+    ws.onmessage = (event) => handleFrame(JSON.parse(event.data));
+    ws.onclose = () => {
+      clearInterval(chatSocket.pingTimer);
+      chatSocket.ws = null;
+      chatSocket.ready = null;
+      if (!opened) {
+        reject(new Error("WebSocket unavailable"));
+      }
+      if (chatSocket.streams.size) {
+        scheduleReconnect();
+      }
+    };
+  });
+  return chatSocket.ready;
+}
+
+function startSocketStream(payload, onDelta) {
+  const id = newStreamId();
+  const result = new Promise((resolve, reject) => {
+    chatSocket.streams.set(id, { lastSeq: -1, onDelta, resolve, reject });
+  });
+  sendFrame({ type: "start", id, payload });
+  return {
+    result,
+    cancel: () => sendFrame({ type: "cancel", id }),
+  };
+}
+
+async function streamWithRetry(payload, onDelta, attempts = 3) {
+  for (let attempt = 1; ; attempt += 1) {
+    await connectSocket();
+    activeStream = startSocketStream(payload, onDelta);
+    try {
+      return await activeStream.result;
+    } catch (err) {
+      if (err.status !== 503 || attempt >= attempts) {
+        throw err;
+      }
+      setStatus("Service busy, retrying...");
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+  }
+}
+
+async function socketAvailable() {
+  if (!CONFIG.webSocket || !("WebSocket" in window)) {
+    return false;
+  }
+  try {
+    await connectSocket();
+    return true;
+  } catch (err) {
+    console.warn("WebSocket unavailable, using HTTP", err);
+    return false;
+  }
+}
+
+async function runPrompt() {
+  if (activeStream) {
+    return;
+  }
+  const modelId = modelsSelect.value;
+  if (!modelId) {
+    output.textContent = "Select a model before sending.";
+    setStatus("Select a model", true);
+    return;
+  }
+
+  const userMessage = promptField.value.trim();
+  if (!userMessage) {
+    output.textContent = "Type a message before sending.";
+    setStatus("Nothing to send", true);
+    return;
+  }
+
+  state.history.push({ role: "user", content: userMessage });
+  const pending = { role: "assistant", content: "Thinking...", pending: true };
+  state.history.push(pending);
+  renderChat();
+  promptField.value = "";
+  autoResize(promptField);
+
+  runButton.disabled = true;
+  runButton.textContent = "Sending...";
+  setStatus("Waiting for the gateway...");
+  output.textContent = "Awaiting response...";
+
+  // Only the new message travels; the server appends it to the stored conversation.
+  const body = {
+    modelId,
+    conversationId: state.conversationId,
+    message: userMessage,
+    system: state.systemPrompt,
+    temperature: state.temperature,
+    responseFormat: "compact",
+  };
+
+  try {
+    let data;
+    if (await socketAvailable()) {
+      runButton.disabled = false;
+      runButton.textContent = "Stop";
+      data = await streamWithRetry(body, (text) => {
+        if (pending.pending) {
+          pending.content = "";
+          pending.pending = false;
+          setStatus("Streaming...");
+        }
+        pending.content += text;
+        scheduleRender();
+      });
+      if (data.type === "cancelled") {
+        pending.content = pending.pending ? "Stopped." : `${pending.content} [stopped]`;
+        pending.pending = false;
+        renderChat();
+        output.textContent = "Stopped before the reply finished; it was not saved.";
+        setStatus("Stopped");
+        saveState();
+        return;
+      }
+      data.output = { ...data.output, text: pending.pending ? "" : pending.content };
+    } else {
+      const response = await postWithRetry("/api/completions", body);
+      if (!response.ok) {
+        throw new Error(await response.text());
+      }
+      data = await response.json();
+    }
+
+    if (data.conversationId && data.conversationId !== state.conversationId) {
+      state.conversationId = data.conversationId;
+      showConversationInUrl();
+    }
+    const text = data.output?.text || "No text returned. See response details.";
+    pending.content = text;
+    pending.pending = false;
+    renderChat();
+    output.textContent = JSON.stringify(data, null, 2);
+    if (data.routing) {
+      modelMeta.textContent = `Answered by ${data.modelId}: ${data.routing.reason}`;
+    }
+    setStatus("Ready");
+    saveState();
+  } catch (err) {
+    pending.content = "Request failed. See response details.";
+    pending.pending = false;
+    renderChat();
+    output.textContent =
+      err.status === 404
+        ? "The connection dropped mid-reply and the reply was lost. Please resend."
+        : "Request failed: " + err.message;
+    setStatus("Request failed", true);
+  } finally {
+    activeStream = null;
+    runButton.disabled = false;
+    runButton.textContent = "Send";
+  }
+}
+
+function handleRunClick() {
+  if (activeStream) {
+    // The server cancels the gateway call as soon as this frame arrives.
+    activeStream.cancel();
+    return;
+  }
+  runPrompt();
+}
+
+function clearChat() {
+  state.history = [];
+  state.conversationId = null;
+  showConversationInUrl();
+  renderChat();
+  saveState();
+  setStatus("New chat started");
+}
+
+function saveTranscript() {
+  if (!state.history.length) {
+    setStatus("Nothing to save", true);
+    return;
+  }
+  const lines = state.history.map((msg) => `${msg.role.toUpperCase()}: ${msg.content}`);
+  const blob = new Blob([lines.join("\n\n")], { type: "text/plain" });
+  const url = URL.createObjectURL(blob);
+  const link = document.createElement("a");
+  link.href = url;
+  const timestamp = new Date().toISOString().replace(/[:]/g, "-").slice(0, 19);
+  link.download = `chat-${timestamp}.txt`;
+  document.body.appendChild(link);
+  link.click();
+  link.remove();
+  URL.revokeObjectURL(url);
+  setStatus("Transcript saved");
+}
+
+function updateSystemPrompt(value) {
+  state.systemPrompt = value;
+  saveState();
+}
+
+function handleModelChange() {
+  state.modelId = modelsSelect.value;
+  updateModelMeta(state.modelId);
+  if (recommendedModelId) {
+    modelHint.textContent =
+      state.modelId === recommendedModelId
+        ? "Recommended model selected."
+        : `Recommended: ${recommendedModelId}`;
+  }
+  saveState();
+}
+
+async function init() {
+  await loadConfig();
+  loadState();
+  await loadConversation();
+  renderChat();
+  renderChips();
+  systemField.value = state.systemPrompt;
+  updateTemperature(state.temperature || 0.3);
+  autoResize(promptField);
+  loadModels();
+}
+
+window.addEventListener("error", (event) => {
+  reportError(`Client error: ${event.message}`);
+});
+window.addEventListener("unhandledrejection", (event) => {
+  const message = event.reason?.message || String(event.reason || "Unknown error");
+  reportError(`Client error: ${message}`);
+});
+
+runButton.addEventListener("click", handleRunClick);
+promptField.addEventListener("keydown", (event) => {
+  if (event.key === "Enter" && !event.shiftKey) {
+    event.preventDefault();
+    runPrompt();
+  }
+});
+promptField.addEventListener("input", () => autoResize(promptField));
+systemField.addEventListener("input", (event) => updateSystemPrompt(event.target.value));
+modelsSelect.addEventListener("change", handleModelChange);
+temperatureInput.addEventListener("input", (event) => updateTemperature(Number(event.target.value)));
+clearButton.addEventListener("click", clearChat);
+saveButton.addEventListener("click", saveTranscript);
+
+init();
@@ -0,0 +1,21 @@
+"""Gunicorn settings for running the UI proxy with several uvicorn workers.
+
+Worker count follows the CPUs the container is allowed to use (cgroup quota
+first, then scheduler affinity) unless ``WEB_CONCURRENCY`` overrides it.
+"""
+
+import os
+
+from common.workers import available_cpus
+
+bind = os.environ.get("BIND", "0.0.0.0:80")
+workers = int(os.environ.get("WEB_CONCURRENCY") or available_cpus())
+# Drains in-flight requests on SIGTERM before exiting (see common/workers.py).
+worker_class = "common.workers.DrainingUvicornWorker"
+# Import the app once in the master so workers fork with the code already loaded.
+preload_app = True
+keepalive = 75
+timeout = 120
+# Must cover SHUTDOWN_READINESS_GRACE_SECONDS + SHUTDOWN_DRAIN_SECONDS and stay below the ECS stopTimeout.
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "45"))
+accesslog = "-"
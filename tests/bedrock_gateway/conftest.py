@@ -0,0 +1,13 @@
+"""Settings the gateway reads at import time, so ``app.main`` can be imported without AWS or a volume."""
+
+import os
+import tempfile
+
+STATE_DIR = tempfile.mkdtemp(prefix="bedrock-gateway-tests-")
+
+os.environ.setdefault("OPENWEBUI_GATEWAY_API_KEY", "test-key")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+os.environ.setdefault("GATEWAY_SHARED_STATE_PATH", os.path.join(STATE_DIR, "state.sqlite3"))
+os.environ.setdefault("GATEWAY_USAGE_DB_PATH", os.path.join(STATE_DIR, "usage.sqlite3"))
@@ -0,0 +1,50 @@
+import json
+
+from app.budgets import BudgetPolicy, TokenLimits, output_read_timeout
+
+LIMITS = json.dumps(
+    {
+        "models": {
+            "anthropic.claude-3": {"defaultMaxTokens": 1024, "maxTokens": 4096},
+            "anthropic.claude-3-5-sonnet": {"maxTokens": 8192},
+        },
+        "keys": {"batch": {"defaultMaxTokens": 256, "maxTokens": 512}},
+    }
+)
+
+
+def policy() -> BudgetPolicy:
+    return BudgetPolicy.from_env(2048, 16384, LIMITS)
+
+
+def test_defaults_come_from_the_most_specific_scope():
+    assert policy().resolve("amazon.nova-lite-v1:0", "default", None) == (2048, False)
+    assert policy().resolve("anthropic.claude-3-haiku-20240307-v1:0", "default", None) == (1024, False)
+    assert policy().resolve("anthropic.claude-3-haiku-20240307-v1:0", "batch", None) == (256, False)
+
+
+def test_requests_are_clamped_to_every_cap():
+    assert policy().resolve("amazon.nova-lite-v1:0", "default", 100) == (100, False)
+    assert policy().resolve("anthropic.claude-3-haiku-20240307-v1:0", "default", 10000) == (4096, True)
+    assert policy().resolve("anthropic.claude-3-haiku-20240307-v1:0", "batch", 1000) == (512, True)
+    assert policy().resolve("amazon.nova-lite-v1:0", "default", 100000) == (16384, True)
+
+
+def test_longest_model_prefix_wins_and_profile_prefixes_are_ignored():
+    sonnet = "us.anthropic.claude-3-5-sonnet-20240620-v1:0"
+    assert policy().resolve(sonnet, "default", 6000) == (6000, False)
+    # The sonnet entry has no default, so the global default applies.
+    assert policy().resolve(sonnet, "default", None) == (2048, False)
+
+
+def test_empty_configuration_uses_the_global_limits():
+    plain = BudgetPolicy.from_env(512, 1024, None)
+    assert plain.models == [] and plain.keys == {}
+    assert plain.resolve("meta.llama3-8b-instruct-v1:0", "any", None) == (512, False)
+    assert TokenLimits.from_dict({"maxTokens": 10}) == TokenLimits(None, 10)
+
+
+def test_read_timeout_grows_with_the_budget():
+    assert output_read_timeout(150, 10.0, 15.0) == 20.0
+    assert output_read_timeout(151, 10.0, 15.0) == 21.0
+    assert output_read_timeout(4096, 10.0, 15.0) > output_read_timeout(1024, 10.0, 15.0)
@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+import pytest
+from botocore.exceptions import ReadTimeoutError
+from fastapi import HTTPException
+
+from app import circuit, main
+from app.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitRegistry
+from app.deadlines import Deadline
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit.time, "monotonic", clock)
+    return clock
+
+
+def breaker(**options) -> CircuitBreaker:
+    defaults = {"min_samples": 4, "error_rate_threshold": 0.5, "cooldown_seconds": 30.0}
+    return CircuitBreaker("amazon.nova-lite-v1:0", "us-east-1", **{**defaults, **options})
+
+
+def test_opens_once_the_error_rate_crosses_the_threshold(clock):
+    cb = breaker()
+    for failed in (False, True, False):
+        assert cb.allow()
+        cb.record(failed, 0.1)
+    assert cb.state == CLOSED  # below min_samples
+    cb.record(True, 0.1)
+    assert cb.state == OPEN
+    assert not cb.allow()
+    assert cb.rejected == 1
+    assert cb.retry_after() == pytest.approx(30.0)
+
+
+def test_slow_calls_open_the_circuit(clock):
+    cb = breaker(slow_call_seconds=5.0, slow_rate_threshold=0.75)
+    for _ in range(4):
+        cb.record(False, 6.0)
+    assert cb.state == OPEN
+
+
+def test_outcomes_outside_the_window_are_forgotten(clock):
+    cb = breaker(window_seconds=60.0)
+    for _ in range(3):
+        cb.record(True, 0.1)
+    clock.now += 61
+    cb.record(True, 0.1)
+    assert cb.state == CLOSED
+    assert cb.rates()[0] == 1
+
+
+def test_half_open_probe_success_closes(clock):
+    cb = breaker()
+    cb._open()
+    clock.now += 31
+    assert cb.allow()
+    assert cb.state == HALF_OPEN
+    assert not cb.allow()  # one probe at a time
+    cb.record(False, 0.1)
+    assert cb.state == CLOSED
+    assert cb.allow()
+
+
+def test_half_open_probe_failure_reopens(clock):
+    cb = breaker()
+    cb._open()
+    clock.now += 31
+    assert cb.allow()
+    cb.record(True, 0.1)
+    assert cb.state == OPEN
+    assert cb.times_opened == 2
+    assert cb.retry_after() == pytest.approx(30.0)
+
+
+def test_released_probe_frees_the_slot(clock):
+    cb = breaker()
+    cb._open()
+    clock.now += 31
+    assert cb.allow()
+    cb.release()
+    assert cb.state == HALF_OPEN
+    assert cb.allow()
+
+
+def test_registry_falls_back_when_the_primary_is_open(clock):
+    registry = CircuitRegistry("us-east-1", fallbacks={"primary": "backup"}, min_samples=1)
+    registry.get("primary")._open()
+    chosen, reason = registry.acquire("primary")
+    assert chosen.model_id == "backup" and reason is None
+
+    registry.get("backup")._open()
+    chosen, reason = registry.acquire("primary")
+    assert chosen is None
+    assert "Circuit open for primary in us-east-1" in reason
+    assert {entry["modelId"]: entry["state"] for entry in registry.snapshot()} == {"primary": OPEN, "backup": OPEN}
+
+
+def test_breakers_are_per_model_and_region(clock):
+    registry = CircuitRegistry("eu-west-1")
+    assert registry.get("a") is registry.get("a")
+    assert registry.get("a") is not registry.get("b")
+    assert registry.get("a").region == "eu-west-1"
+
+
+class Connected:
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+def call_until_failure(cb: CircuitBreaker, deadline_seconds: float, func) -> int:
+    assert cb.allow()
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.call_bedrock(Connected(), Deadline(deadline_seconds), cb, func))
+    return error.value.status_code
+
+
+def test_caller_deadlines_do_not_count_against_the_model():
+    cb = breaker(min_samples=2)
+
+    for _ in range(4):
+        assert call_until_failure(cb, 0.02, lambda: time.sleep(0.1)) == 504
+
+    assert cb.state == CLOSED and cb.rates()[0] == 0
+
+
+def test_upstream_read_timeouts_open_the_circuit():
+    cb = breaker(min_samples=2)
+
+    def timed_out():
+        raise main.bedrock_error(ReadTimeoutError(endpoint_url="https://bedrock-runtime"))
+
+    for _ in range(2):
+        assert call_until_failure(cb, 5.0, timed_out) == 504
+
+    assert cb.state == OPEN
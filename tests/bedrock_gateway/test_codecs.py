@@ -0,0 +1,172 @@
+import pytest
+
+from app.codecs import (
+    AnthropicCodec,
+    CohereCodec,
+    CohereCommandRCodec,
+    DEFAULT_CODEC,
+    GenerationParams,
+    LlamaCodec,
+    MistralCodec,
+    NovaCodec,
+    OpenAIChatCodec,
+    TitanTextCodec,
+    resolve_codec,
+)
+
+MESSAGES = [
+    ("system", "Answer briefly."),
+    ("user", "What is EFS?"),
+    ("assistant", "A managed NFS file system."),
+    ("user", "Is it regional?"),
+]
+PARAMS = GenerationParams(temperature=0.2, max_tokens=128, top_p=0.9, stop=["###"])
+
+
+@pytest.mark.parametrize(
+    "model_id, codec_type",
+    [
+        ("anthropic.claude-3-5-haiku-20241022-v1:0", AnthropicCodec),
+        ("us.anthropic.claude-3-5-haiku-20241022-v1:0", AnthropicCodec),
+        ("amazon.nova-lite-v1:0", NovaCodec),
+        ("amazon.titan-text-express-v1", TitanTextCodec),
+        ("openai.gpt-oss-20b-1:0", OpenAIChatCodec),
+        ("meta.llama3-8b-instruct-v1:0", LlamaCodec),
+        ("mistral.mistral-7b-instruct-v0:2", MistralCodec),
+        ("cohere.command-text-v14", CohereCodec),
+        ("cohere.command-light-text-v14", CohereCodec),
+        ("cohere.command-r-v1:0", CohereCommandRCodec),
+        ("cohere.command-r-plus-v1:0", CohereCommandRCodec),
+    ],
+)
+def test_resolve_codec_picks_the_family(model_id, codec_type):
+    assert type(resolve_codec(model_id)) is codec_type
+
+
+def test_unknown_models_fall_back_to_a_plain_prompt():
+    codec = resolve_codec("example.unknown-model-v1")
+    assert codec is DEFAULT_CODEC
+    assert not codec.supports_converse
+    assert codec.build_body([("user", "Hi")], GenerationParams())["prompt"].endswith("Assistant:")
+
+
+def test_anthropic_round_trip():
+    codec = resolve_codec("anthropic.claude-3-5-haiku-20241022-v1:0")
+    body = codec.build_body(MESSAGES, PARAMS)
+    assert body["system"] == "Answer briefly."
+    assert [turn["role"] for turn in body["messages"]] == ["user", "assistant", "user"]
+    assert body["messages"][-1]["content"] == [{"type": "text", "text": "Is it regional?"}]
+    assert (body["max_tokens"], body["top_p"], body["stop_sequences"]) == (128, 0.9, ["###"])
+
+    output = codec.parse(
+        {
+            "content": [{"type": "text", "text": "Yes."}],
+            "stop_reason": "max_tokens",
+            "usage": {"input_tokens": 30, "output_tokens": 2},
+        }
+    )
+    assert (output.text, output.input_tokens, output.output_tokens) == ("Yes.", 30, 2)
+    assert output.truncated
+
+
+def test_nova_round_trip():
+    codec = resolve_codec("amazon.nova-lite-v1:0")
+    body = codec.build_body(MESSAGES, PARAMS)
+    assert body["system"] == [{"text": "Answer briefly."}]
+    assert body["messages"][0] == {"role": "user", "content": [{"text": "What is EFS?"}]}
+    assert body["inferenceConfig"] == {
+        "temperature": 0.2,
+        "max_new_tokens": 128,
+        "top_p": 0.9,
+        "stopSequences": ["###"],
+    }
+
+    output = codec.parse(
+        {
+            "output": {"message": {"role": "assistant", "content": [{"text": "Yes, "}, {"text": "regional."}]}},
+            "stopReason": "end_turn",
+            "usage": {"inputTokens": 25, "outputTokens": 3},
+        }
+    )
+    assert (output.text, output.stop_reason, output.output_tokens) == ("Yes, regional.", "end_turn", 3)
+    assert not output.truncated
+
+
+def test_titan_text_round_trip():
+    codec = resolve_codec("amazon.titan-text-express-v1")
+    body = codec.build_body(MESSAGES, PARAMS, raw_prompt="Is EFS regional?")
+    assert body["inputText"] == "Is EFS regional?"
+    assert body["textGenerationConfig"]["maxTokenCount"] == 128
+
+    output = codec.parse(
+        {"inputTextTokenCount": 5, "results": [{"outputText": "Yes.", "tokenCount": 2, "completionReason": "LENGTH"}]}
+    )
+    assert (output.text, output.input_tokens, output.output_tokens) == ("Yes.", 5, 2)
+    assert output.truncated
+
+
+def test_openai_chat_round_trip():
+    codec = resolve_codec("openai.gpt-oss-20b-1:0")
+    body = codec.build_body(MESSAGES, PARAMS)
+    assert body["messages"][0] == {"role": "system", "content": "Answer briefly."}
+    assert body["stop"] == ["###"]
+
+    output = codec.parse(
+        {
+            "choices": [{"message": {"role": "assistant", "content": "Yes."}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 20, "completion_tokens": 2},
+        }
+    )
+    assert (output.text, output.stop_reason, output.input_tokens) == ("Yes.", "stop", 20)
+
+
+def test_llama_round_trip():
+    codec = resolve_codec("meta.llama3-8b-instruct-v1:0")
+    body = codec.build_body(MESSAGES, PARAMS)
+    assert body["prompt"].startswith("System:\nAnswer briefly.")
+    assert body["max_gen_len"] == 128
+    assert "stop" not in body
+
+    output = codec.parse(
+        {"generation": "Yes.", "stop_reason": "stop", "prompt_token_count": 18, "generation_token_count": 2}
+    )
+    assert (output.text, output.input_tokens, output.output_tokens) == ("Yes.", 18, 2)
+
+
+def test_mistral_round_trip():
+    codec = resolve_codec("mistral.mistral-7b-instruct-v0:2")
+    assert codec.build_body(MESSAGES, PARAMS, raw_prompt="<s>[INST] Hi [/INST]")["prompt"] == "<s>[INST] Hi [/INST]"
+    assert codec.parse({"outputs": [{"text": "Yes.", "stop_reason": "length"}]}).truncated
+    assert codec.parse({"choices": [{"message": {"content": "Yes."}}]}).text == "Yes."
+
+
+def test_cohere_command_round_trip():
+    codec = resolve_codec("cohere.command-text-v14")
+    body = codec.build_body(MESSAGES, PARAMS)
+    assert "Is it regional?" in body["prompt"]
+    assert (body["p"], body["stop_sequences"]) == (0.9, ["###"])
+
+    output = codec.parse({"generations": [{"text": "Yes.", "finish_reason": "COMPLETE"}]})
+    assert (output.text, output.stop_reason) == ("Yes.", "COMPLETE")
+
+
+def test_cohere_command_r_round_trip():
+    codec = resolve_codec("cohere.command-r-plus-v1:0")
+    body = codec.build_body(MESSAGES, PARAMS)
+    assert "prompt" not in body
+    assert body["message"] == "Is it regional?"
+    assert body["chat_history"] == [
+        {"role": "USER", "message": "What is EFS?"},
+        {"role": "CHATBOT", "message": "A managed NFS file system."},
+    ]
+    assert body["preamble"] == "Answer briefly."
+    assert (body["max_tokens"], body["temperature"], body["p"], body["stop_sequences"]) == (128, 0.2, 0.9, ["###"])
+
+    output = codec.parse({"text": "Yes, EFS is regional.", "finish_reason": "MAX_TOKENS", "chat_history": []})
+    assert output.text == "Yes, EFS is regional."
+    assert output.truncated
+
+
+def test_cohere_command_r_sends_a_raw_prompt_as_the_message():
+    body = resolve_codec("cohere.command-r-v1:0").build_body([("user", "Hi")], GenerationParams(), raw_prompt="Hi")
+    assert body == {"message": "Hi"}
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+
+from app import main
+from app.context_compression import GAP, ContextCompressor, ScoredContext, split_sentences, uncompressed
+from app.main import CompletionRequest, ground_messages, prepare_completion
+
+LEAVE = (
+    "The office is in Berlin. Employees accrue two days of paid leave per month. "
+    "Unused leave carries over to the next year. The cafeteria serves lunch at noon."
+)
+TRAVEL = "Travel must be booked through the portal. Economy class is required for flights under six hours."
+
+
+def test_sentences_split_on_punctuation_blank_lines_and_list_items():
+    text = "First point. Second point?\n\nNew paragraph\n- item one\n- item two"
+    assert split_sentences(text) == ["First point.", "Second point?", "New paragraph", "- item one", "- item two"]
+    long_line = "word " * 200
+    assert all(len(piece) <= 600 for piece in split_sentences(long_line))
+
+
+def test_only_relevant_sentences_are_packed_into_the_budget():
+    context = ScoredContext("How much paid leave do employees accrue?", [("leave.md", LEAVE), ("travel.md", TRAVEL)])
+
+    passages, report = context.pack(budget=25)
+
+    assert [(passage.index, passage.source) for passage in passages] == [(1, "leave.md")]
+    text = passages[0].text
+    assert text.startswith("… Employees accrue two days of paid leave per month.")
+    assert "Berlin" not in text and "cafeteria" not in text
+    assert report["compressed"] and report["tokensAfter"] < report["tokensBefore"]
+    assert (report["passagesIn"], report["sentencesIn"]) == (2, 6)
+
+
+def test_neighbours_stay_with_an_answer_and_gaps_are_marked():
+    text = (
+        "Leave accrues monthly. The office is in Berlin. The cafeteria is open. "
+        "Parking is free. Badges are blue. Leave carries over."
+    )
+    passages, _ = ScoredContext("leave", [(None, text)]).pack(budget=100)
+    assert passages[0].text == (
+        "Leave accrues monthly. The office is in Berlin." + GAP + "Badges are blue. Leave carries over."
+    )
+
+
+def test_sentences_repeated_from_a_higher_ranked_passage_are_dropped():
+    overlapping = "Unused leave carries over to the next year. The cafeteria serves lunch at noon. Parking is free."
+    context = ScoredContext("leave", [("a.md", LEAVE), ("b.md", overlapping)])
+
+    assert context.duplicates == 2
+    passages, report = context.pack(budget=1000)
+    assert sum(passage.text.count("Unused leave carries over") for passage in passages) == 1
+    assert report["duplicates"] == 2
+
+
+def test_a_question_sharing_no_words_falls_back_to_retrieval_order():
+    context = ScoredContext("Quelle est la politique?", [("leave.md", LEAVE), ("travel.md", TRAVEL)])
+
+    assert not context.relevant
+    passages, _ = context.pack(budget=20)
+    assert passages[0].index == 1 and passages[0].text.startswith("The office is in Berlin.")
+
+
+def test_the_best_sentence_is_kept_even_over_budget():
+    passages, report = ScoredContext("leave", [(None, LEAVE)]).pack(budget=1)
+    assert report["sentences"] == 1 and passages
+
+
+def test_budgets_per_model_prefix():
+    compressor = ContextCompressor(1000, {"amazon.nova": 1500, "amazon.nova-lite": 800})
+    assert compressor.budget("amazon.nova-lite-v1:0") == 800
+    assert compressor.budget("us.amazon.nova-pro-v1:0") == 1500
+    assert compressor.budget("anthropic.claude-3-haiku") == 1000
+    assert compressor.budget("amazon.nova-lite-v1:0", requested=300) == 300
+    assert compressor.budget("amazon.nova-lite-v1:0", requested=5000) == 800
+
+    from_env = ContextCompressor.from_env("false", "2000", '{"amazon.nova": 500}')
+    assert not from_env.enabled and from_env.budget("amazon.nova-micro-v1:0") == 500
+
+
+def test_uncompressed_passages_are_numbered_from_one():
+    passages, report = uncompressed([("a.md", "Alpha."), (None, "Beta.")])
+    assert [(passage.index, passage.source, passage.text) for passage in passages] == [
+        (1, "a.md", "Alpha."),
+        (2, None, "Beta."),
+    ]
+    assert report["compressed"] is False and report["tokensBefore"] == report["tokensAfter"]
+
+
+def test_grounded_prompt_keeps_the_request_numbering_of_passages():
+    question = "How much paid leave do employees accrue?"
+    passages, _ = ScoredContext(question, [("travel.md", TRAVEL), ("leave.md", LEAVE)]).pack(budget=25)
+
+    messages = ground_messages([("system", "Be brief."), ("user", question), ("assistant", "")], passages)
+
+    assert messages[0] == ("system", "Be brief.") and messages[2] == ("assistant", "")
+    role, grounded = messages[1]
+    assert role == "user"
+    assert "[2] (leave.md)\n… Employees accrue two days" in grounded and "[1]" not in grounded
+    assert grounded.endswith(f"Question: {question}")
+
+
+def test_passages_are_scored_off_the_event_loop(monkeypatch):
+    threads = []
+
+    def scored_context(question, passages):
+        threads.append(threading.current_thread())
+        return ScoredContext(question, passages)
+
+    monkeypatch.setattr(main, "ScoredContext", scored_context)
+    question = "How much paid leave do employees accrue?"
+    payload = CompletionRequest(
+        modelId="amazon.nova-lite-v1:0",
+        prompt=question,
+        context=[{"source": "leave.md", "text": LEAVE}],
+        compressContext=True,
+        contextTokens=25,
+    )
+    prompt, _ = prepare_completion(payload)
+    assert prompt.scored is None
+
+    asyncio.run(prompt.score())
+
+    assert threads and threads[0] is not threading.main_thread()
+    prompt.for_model(payload.modelId)
+    assert prompt.report["compressed"] is True
@@ -0,0 +1,39 @@
+import asyncio
+import sqlite3
+
+from app.deadlines import CancellationStats
+from app.shared_store import SharedStore
+
+
+def test_cancellations_are_counted_in_memory_and_summed_across_workers(tmp_path):
+    store = SharedStore(str(tmp_path / "state.sqlite3"))
+    first, second = CancellationStats(store), CancellationStats(store)
+
+    first.record("abandonedCalls", seconds_saved=1.5)
+    first.record("cancelledStreams", seconds_saved=0.5, tokens_saved=200)
+    second.record("abandonedCalls", seconds_saved=2.0)
+    assert store.get_totals(CancellationStats.PREFIX) == {}
+
+    asyncio.run(second.flush())
+    totals = asyncio.run(first.snapshot())
+    assert totals == {
+        "abandonedCalls": 2,
+        "cancelledStreams": 1,
+        "secondsSaved": 4.0,
+        "estimatedTokensSaved": 200,
+    }
+
+
+def test_a_failed_flush_keeps_the_counts(tmp_path, monkeypatch):
+    store = SharedStore(str(tmp_path / "state.sqlite3"))
+    stats = CancellationStats(store)
+    stats.record("abandonedCalls", seconds_saved=1.0)
+
+    def locked(amounts):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(store, "add_totals", locked)
+    asyncio.run(stats.flush())
+    monkeypatch.undo()
+
+    assert asyncio.run(stats.snapshot())["abandonedCalls"] == 1
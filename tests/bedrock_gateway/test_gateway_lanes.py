@@ -0,0 +1,95 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+from fastapi.testclient import TestClient
+
+from app import main
+from app.circuit import CircuitRegistry
+from app.lanes import LanePool
+
+HEADERS = {"x-openwebui-api-key": "test-key"}
+TITAN = "amazon.titan-embed-text-v2:0"
+
+
+class FakeRuntime:
+    """``invoke_model`` for Titan embeddings; texts starting with "fail" raise a throttling error."""
+
+    def __init__(self, delay_seconds: float = 0.01):
+        self.delay_seconds = delay_seconds
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def invoke_model(self, modelId, body, **kwargs):
+        text = json.loads(body)["inputText"]
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            time.sleep(self.delay_seconds)
+            if text.startswith("fail"):
+                raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "InvokeModel")
+            payload = {"embedding": [0.1, 0.2], "inputTextTokenCount": 3}
+            return {"body": io.BytesIO(json.dumps(payload).encode()), "contentType": "application/json"}
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    runtime = FakeRuntime()
+    monkeypatch.setattr(main, "runtime_client_for", lambda budget_seconds: runtime)
+    monkeypatch.setattr(main, "completion_lanes", LanePool("completions", 2, main.lane_policy))
+    monkeypatch.setattr(main, "embedding_lanes", LanePool("embeddings", 2, main.lane_policy))
+    monkeypatch.setattr(main, "circuits", CircuitRegistry(region="us-east-1"))
+    return TestClient(main.app), runtime
+
+
+def test_a_large_batch_embedding_request_takes_one_slot(gateway):
+    client, runtime = gateway
+    texts = [f"passage {index}" for index in range(64)]
+    response = client.post(
+        "/api/v1/embeddings", headers={**HEADERS, "x-gateway-lane": "batch"}, json={"texts": texts, "modelId": TITAN}
+    )
+    assert response.status_code == 200
+    assert len(response.json()["embeddings"]) == 64
+    assert runtime.calls == 64
+    assert runtime.peak <= main.EMBEDDING_FANOUT
+    batch = main.embedding_lanes.snapshot()["lanes"]["batch"]
+    assert batch["admitted"] == 1 and batch["rejected"]["queueFull"] == 0
+
+
+def test_a_failed_slice_cancels_the_rest(gateway):
+    client, runtime = gateway
+    texts = ["fail first"] + [f"passage {index}" for index in range(63)]
+    response = client.post("/api/v1/embeddings", headers=HEADERS, json={"texts": texts, "modelId": TITAN})
+    assert response.status_code == 502
+    # Only the calls already running when the first one failed were made.
+    assert runtime.calls < 2 * main.EMBEDDING_FANOUT
+    assert main.embedding_lanes.active == 0
+
+
+def test_open_circuit_is_refused_before_queueing(gateway):
+    client, _ = gateway
+    model_id = "amazon.nova-lite-v1:0"
+    main.circuits.get(model_id)._open()
+    # Every completion slot is taken, so a request that queued would wait out its deadline.
+    interactive = main.completion_lanes.lanes["interactive"]
+    for _ in range(main.completion_lanes.slots):
+        main.completion_lanes._grant(interactive)
+
+    started = time.monotonic()
+    response = client.post(
+        "/api/v1/completions", headers={**HEADERS, "x-deadline-ms": "5000"}, json={"modelId": model_id, "prompt": "Hi"}
+    )
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    assert time.monotonic() - started < 1.0
+    assert interactive.admitted == 0 and not interactive.waiters
@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.deadlines import Deadline
+from app.lanes import DEFAULT_LANES, LanePolicy, LanePool
+
+# The same two lanes as the default, but batch waits its turn instead of being preempted.
+PATIENT = {"interactive": {}, "batch": {"share": 0.5, "maxQueue": 4}}
+
+
+class Connected:
+    def __init__(self):
+        self.gone = False
+
+    async def is_disconnected(self) -> bool:
+        return self.gone
+
+
+def pool(slots: int = 1, lanes: dict = PATIENT) -> LanePool:
+    return LanePool("completions", slots, LanePolicy(lanes), retry_after_seconds=3)
+
+
+def admit(pool: LanePool, lane: str, seconds: float = 5.0, request=None):
+    return asyncio.ensure_future(pool.admit(lane, request or Connected(), Deadline(seconds), poll_seconds=0.01))
+
+
+def test_lanes_are_chosen_by_key_then_route_and_may_only_be_lowered():
+    routes = {"/api/v1/embed": "batch", "/api/v1/embeddings": "interactive"}
+    policy = LanePolicy(DEFAULT_LANES, {"eval": "batch"}, routes)
+
+    assert policy.classify("web", "/api/v1/chat") == "interactive"
+    assert policy.classify("eval", "/api/v1/chat") == "batch"
+    assert policy.classify("web", "/api/v1/embed") == "batch"
+    assert policy.classify("web", "/api/v1/embeddings") == "interactive"
+    assert policy.classify("web", "/api/v1/chat", requested="batch") == "batch"
+    assert policy.classify("eval", "/api/v1/chat", requested="interactive") == "batch"
+    with pytest.raises(HTTPException) as error:
+        policy.classify("web", "/api/v1/chat", requested="urgent")
+    assert error.value.status_code == 400
+    with pytest.raises(ValueError):
+        LanePolicy(DEFAULT_LANES, {"eval": "bulk"})
+
+
+def test_a_free_slot_is_granted_at_once_and_released_once():
+    lanes = pool(slots=2)
+
+    async def run():
+        lease = await admit(lanes, "interactive")
+        assert lease.waited_seconds == 0.0 and lanes.active == 1
+        lease.release()
+        lease.release()
+        assert lanes.active == 0
+        async with lanes.slot("batch", Connected(), Deadline(1.0)) as held:
+            assert held.to_dict() == {"name": "batch", "queuedMs": 0.0}
+            assert lanes.lanes["batch"].active == 1
+        assert lanes.active == 0
+
+    asyncio.run(run())
+    stats = lanes.snapshot()["lanes"]
+    assert (stats["interactive"]["admitted"], stats["batch"]["admitted"]) == (1, 1)
+    assert stats["interactive"]["queueWait"]["samples"] == 1
+
+
+def test_a_freed_slot_goes_to_the_highest_priority_lane_first():
+    lanes = pool()
+
+    async def run():
+        holder = await admit(lanes, "interactive")
+        batch = admit(lanes, "batch")
+        await asyncio.sleep(0.02)
+        interactive = admit(lanes, "interactive")
+        await asyncio.sleep(0.02)
+        holder.release()
+        first = await interactive
+        assert not batch.done()
+        first.release()
+        (await batch).release()
+        assert first.waited_seconds > 0
+
+    asyncio.run(run())
+    assert lanes.active == 0
+
+
+def test_share_caps_a_lower_lane_but_never_holds_it_behind_an_idle_one():
+    lanes = pool(slots=4)
+    assert lanes.lanes["batch"].limit == 2
+
+    async def run():
+        held = [await admit(lanes, "batch") for _ in range(2)]
+        third = admit(lanes, "batch")
+        await asyncio.sleep(0.02)
+        assert not third.done() and lanes.active == 2
+        # The two slots kept for interactive traffic are free.
+        interactive = await admit(lanes, "interactive")
+        assert interactive.waited_seconds == 0.0
+        held[0].release()
+        (await third).release()
+        for lease in held[1:] + [interactive]:
+            lease.release()
+
+    asyncio.run(run())
+
+
+def test_waiting_interactive_traffic_preempts_a_preemptible_lane():
+    lanes = pool(lanes=DEFAULT_LANES)
+
+    async def run():
+        holder = await admit(lanes, "interactive")
+        batch = admit(lanes, "batch")
+        await asyncio.sleep(0.02)
+        interactive = admit(lanes, "interactive")
+        await asyncio.sleep(0.02)
+
+        with pytest.raises(HTTPException) as error:
+            await batch
+        assert error.value.status_code == 429 and error.value.headers == {"Retry-After": "3"}
+        # While interactive requests wait, batch requests are turned away without queueing.
+        with pytest.raises(HTTPException):
+            await admit(lanes, "batch")
+        holder.release()
+        (await interactive).release()
+
+    asyncio.run(run())
+    assert lanes.snapshot()["lanes"]["batch"]["rejected"]["preempted"] == 2
+
+
+def test_a_full_queue_is_rejected_with_retry_after():
+    lanes = pool(lanes={"interactive": {"maxQueue": 1}})
+
+    async def run():
+        holder = await admit(lanes, "interactive")
+        queued = admit(lanes, "interactive")
+        await asyncio.sleep(0.02)
+        with pytest.raises(HTTPException) as error:
+            await admit(lanes, "interactive")
+        assert error.value.status_code == 429 and error.value.headers["Retry-After"] == "3"
+        holder.release()
+        (await queued).release()
+
+    asyncio.run(run())
+    assert lanes.snapshot()["lanes"]["interactive"]["rejected"]["queueFull"] == 1
+
+
+def test_waits_end_at_the_lane_limit_the_deadline_or_a_disconnect():
+    lanes = pool(lanes={"interactive": {}, "batch": {"maxWaitSeconds": 0.05}})
+
+    async def run():
+        holder = await admit(lanes, "interactive")
+        with pytest.raises(HTTPException) as error:
+            await admit(lanes, "batch")
+        assert error.value.status_code == 429
+        with pytest.raises(HTTPException) as error:
+            await admit(lanes, "interactive", seconds=0.05)
+        assert error.value.status_code == 504
+
+        request = Connected()
+        waiting = admit(lanes, "interactive", request=request)
+        await asyncio.sleep(0.02)
+        request.gone = True
+        with pytest.raises(HTTPException) as error:
+            await waiting
+        assert error.value.status_code == 499
+
+        # Nobody is left queued, so the released slot stays free.
+        holder.release()
+        assert lanes.active == 0
+
+    asyncio.run(run())
+    stats = lanes.snapshot()["lanes"]
+    assert stats["batch"]["rejected"]["timedOut"] == 1
+    assert stats["interactive"]["abandoned"] == 1
+    assert all(lane["waiting"] == 0 for lane in stats.values())
@@ -0,0 +1,82 @@
+import io
+import json
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.circuit import CircuitRegistry
+from app.lanes import LanePool
+from app.rerank import DOCUMENTS_PER_CALL, build_rerank_body, is_rerank_model, parse_rerank_body
+
+HEADERS = {"x-openwebui-api-key": "test-key"}
+COHERE = "cohere.rerank-v3-5:0"
+
+
+class FakeRuntime:
+    """``invoke_model`` for rerank models; each document scores its number (documents are "doc N")."""
+
+    def __init__(self):
+        self.bodies = []
+        self.lock = threading.Lock()
+
+    def invoke_model(self, modelId, body, **kwargs):
+        body = json.loads(body)
+        with self.lock:
+            self.bodies.append(body)
+        results = [
+            {"index": index, "relevance_score": int(document.split()[1]) / 1000}
+            for index, document in enumerate(body["documents"])
+        ]
+        payload = {"results": sorted(results, key=lambda result: -result["relevance_score"])}
+        return {"body": io.BytesIO(json.dumps(payload).encode()), "contentType": "application/json"}
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    runtime = FakeRuntime()
+    monkeypatch.setattr(main, "runtime_client_for", lambda budget_seconds: runtime)
+    monkeypatch.setattr(main, "embedding_lanes", LanePool("embeddings", 2, main.lane_policy))
+    monkeypatch.setattr(main, "circuits", CircuitRegistry(region="us-east-1"))
+    return TestClient(main.app), runtime
+
+
+def test_rerank_bodies_per_model_family():
+    assert is_rerank_model(COHERE) and is_rerank_model("amazon.rerank-v1:0")
+    assert not is_rerank_model("amazon.titan-embed-text-v2:0")
+    assert build_rerank_body(COHERE, "q", ["a", "b"]) == {
+        "query": "q",
+        "documents": ["a", "b"],
+        "top_n": 2,
+        "api_version": 2,
+    }
+    assert "api_version" not in build_rerank_body("amazon.rerank-v1:0", "q", ["a"])
+
+
+def test_parsed_scores_follow_document_order():
+    body = {"results": [{"index": 2, "relevance_score": 0.9}, {"index": 0, "relevance_score": 0.1}]}
+    assert parse_rerank_body(body, 3) == [0.1, None, 0.9]
+
+
+def test_long_document_lists_are_scored_in_slices(gateway):
+    client, runtime = gateway
+    documents = [f"doc {index}" for index in range(DOCUMENTS_PER_CALL * 2 + 5)]
+
+    response = client.post("/api/v1/rerank", headers=HEADERS, json={"query": "q", "documents": documents})
+
+    assert response.status_code == 200
+    assert response.json()["modelId"] == main.RERANK_MODEL_ID
+    assert response.json()["scores"] == [index / 1000 for index in range(len(documents))]
+    assert sorted(len(body["documents"]) for body in runtime.bodies) == [5, DOCUMENTS_PER_CALL, DOCUMENTS_PER_CALL]
+
+
+def test_non_rerank_models_are_rejected(gateway):
+    client, runtime = gateway
+    response = client.post(
+        "/api/v1/rerank",
+        headers=HEADERS,
+        json={"query": "q", "documents": ["doc 1"], "modelId": "amazon.titan-embed-text-v2:0"},
+    )
+    assert response.status_code == 400
+    assert runtime.bodies == []
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from app.routing import COMPLEX, MODERATE, SIMPLE, ModelProfile, ModelRouter, classify_prompt, load_profiles
+
+PROFILES = [
+    ModelProfile("small", SIMPLE, 0.0001, 0.0004, 1.0),
+    ModelProfile("medium", MODERATE, 0.0005, 0.002, 2.0),
+    ModelProfile("large", COMPLEX, 0.003, 0.015, 5.0),
+]
+
+
+def everything_available(model_id: str) -> bool:
+    return True
+
+
+def test_classify_prompt_by_length_and_cues():
+    assert classify_prompt([("user", "What time is it in Paris?")]).complexity == SIMPLE
+    assert classify_prompt([("user", "Summarize this paragraph for me.")]).complexity == MODERATE
+    complex_prompt = classify_prompt([("user", "Refactor this algorithm and analyze the trade-offs step by step.")])
+    assert complex_prompt.complexity == COMPLEX
+    assert any(signal.startswith("complex cues") for signal in complex_prompt.signals)
+    assert classify_prompt([("user", "word " * 2000)]).complexity >= MODERATE
+
+
+def test_policies_pick_the_expected_model():
+    router = ModelRouter(PROFILES)
+    simple = [("user", "Hi there")]
+    assert router.route(simple, "fastest", everything_available).model_id == "small"
+    assert router.route(simple, "cheapest", everything_available).model_id == "small"
+    assert router.route(simple, "quality", everything_available).model_id == "large"
+
+    moderate = [("user", "Explain how DNS works.")]
+    assert router.route(moderate, "fastest", everything_available).model_id == "medium"
+    decision = router.route(moderate, None, everything_available)
+    assert decision.policy == "fastest" and decision.complexity == "moderate"
+    assert "(prior)" in decision.reason
+
+
+def test_live_latency_replaces_the_prior():
+    router = ModelRouter(PROFILES, min_samples=3)
+    for _ in range(3):
+        router.record("small", 9.0, False)
+    decision = router.route([("user", "Hi")], "fastest", everything_available)
+    assert decision.model_id == "medium"
+
+
+def test_unhealthy_and_unavailable_models_are_skipped():
+    router = ModelRouter(PROFILES, min_samples=3, max_error_rate=0.25)
+    for _ in range(3):
+        router.record("medium", 1.0, True)
+    decision = router.route([("user", "Explain how DNS works.")], "fastest", lambda model_id: model_id != "large")
+    # Nothing healthy and available meets the tier, so the best of the rest is used.
+    assert decision.model_id == "small"
+    assert "no healthy model meets the quality tier" in decision.reason
+    assert router.route([("user", "Hi")], "fastest", lambda model_id: False) is None
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        ModelRouter(PROFILES, default_policy="random")
+
+
+def test_load_profiles_from_json():
+    raw = json.dumps(
+        [
+            {
+                "model_id": "custom",
+                "quality": 2,
+                "input_cost_per_1k": 0.001,
+                "output_cost_per_1k": 0.002,
+                "expected_latency_seconds": 1.5,
+            }
+        ]
+    )
+    assert load_profiles(raw) == [ModelProfile("custom", 2, 0.001, 0.002, 1.5)]
+    assert len(load_profiles(None)) == 4
+
+
+def test_snapshot_reports_live_stats():
+    router = ModelRouter(PROFILES)
+    router.record("small", 0.5, False)
+    router.record("small", 1.5, True)
+    router.record("unknown", 1.0, False)
+    small = next(entry for entry in router.snapshot() if entry["modelId"] == "small")
+    assert small == {"modelId": "small", "quality": SIMPLE, "samples": 2, "p95Seconds": 0.5, "errorRate": 0.5}
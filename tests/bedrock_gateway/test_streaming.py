@@ -0,0 +1,68 @@
+import asyncio
+
+from app import main
+from app.deadlines import Deadline
+from app.lanes import LanePolicy, LanePool
+from app.usage import UsageEntry
+
+
+class FakeEventStream:
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def close(self):
+        self.closed = True
+
+
+def run_response(event_stream, client_leaves: bool):
+    async def scenario():
+        deadline = Deadline(30.0)
+        pool = LanePool("test", 1, LanePolicy({"interactive": {}}))
+        lease = await pool.admit("interactive", None, deadline)
+        usage = UsageEntry("key", "amazon.nova-lite-v1:0", deferred=True)
+        response = main.LeasedStreamingResponse(
+            main.stream_events(event_stream, {}, deadline, usage), lease, event_stream, usage
+        )
+        sent = []
+
+        async def send(message):
+            if client_leaves:
+                # A slow client: the response is cancelled before the headers go out.
+                await asyncio.sleep(3600)
+            sent.append(message)
+
+        async def receive():
+            if client_leaves:
+                return {"type": "http.disconnect"}
+            await asyncio.sleep(3600)
+
+        scope = {"type": "http", "asgi": {"spec_version": "2.4"}, "method": "POST", "path": "/"}
+        await response(scope, receive, send)
+        return pool, usage, sent
+
+    return asyncio.run(scenario())
+
+
+def test_stream_that_never_starts_still_closes_upstream_and_records_usage():
+    event_stream = FakeEventStream([{"contentBlockDelta": {"delta": {"text": "never sent"}}}])
+    pool, usage, _ = run_response(event_stream, client_leaves=True)
+    assert event_stream.closed
+    assert usage.finished and usage.status == 499
+    assert pool.active == 0
+
+
+def test_completed_stream_is_recorded_once():
+    events = [
+        {"contentBlockDelta": {"delta": {"text": "Hello"}}},
+        {"messageStop": {"stopReason": "end_turn"}},
+        {"metadata": {"usage": {"inputTokens": 3, "outputTokens": 1}}},
+    ]
+    pool, usage, sent = run_response(FakeEventStream(events), client_leaves=False)
+    body = b"".join(message.get("body", b"") for message in sent)
+    assert b'"type":"done"' in body
+    assert usage.status == 200 and usage.output_tokens == 1
+    assert pool.active == 0
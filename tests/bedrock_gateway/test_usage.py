@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.usage import UsageEntry, UsageLedger
+
+
+def ledger(tmp_path, **options) -> UsageLedger:
+    return UsageLedger(str(tmp_path / "usage.sqlite3"), **options)
+
+
+def test_track_records_success_and_http_errors(tmp_path):
+    usage = ledger(tmp_path)
+    with usage.track(UsageEntry("team-a", "amazon.nova-lite-v1:0")) as entry:
+        entry.input_tokens, entry.output_tokens = 10, 20
+    with pytest.raises(HTTPException):
+        with usage.track(UsageEntry("team-a", "amazon.nova-lite-v1:0")):
+            raise HTTPException(status_code=429, detail="slow down")
+    with pytest.raises(RuntimeError):
+        with usage.track(UsageEntry("team-b", "amazon.nova-lite-v1:0")):
+            raise RuntimeError("boom")
+
+    now = time.time()
+    groups = asyncio.run(usage.aggregate(now - 60, now + 60, "key"))
+    by_key = {group["apiKey"]: group for group in groups}
+    assert by_key["team-a"]["requests"] == 2 and by_key["team-a"]["errors"] == 1
+    assert by_key["team-a"]["inputTokens"] == 10 and by_key["team-a"]["outputTokens"] == 20
+    assert by_key["team-b"]["errors"] == 1
+    assert usage.snapshot() == {"buffered": 0, "dropped": 0}
+
+
+def test_deferred_entries_are_finished_by_their_owner(tmp_path):
+    usage = ledger(tmp_path)
+    with usage.track(UsageEntry("team-a", "m")) as entry:
+        entry.deferred = True
+    assert usage.snapshot()["buffered"] == 0
+    usage.finish(entry)
+    usage.finish(entry)
+    assert usage.snapshot()["buffered"] == 1
+
+
+def test_full_buffer_drops_the_oldest_records(tmp_path):
+    usage = ledger(tmp_path, capacity=3)
+    for index in range(5):
+        usage.finish(UsageEntry(f"key-{index}", "m"))
+    assert usage.snapshot() == {"buffered": 3, "dropped": 2}
+    now = time.time()
+    keys = {group["apiKey"] for group in asyncio.run(usage.aggregate(now - 60, now + 60, "key"))}
+    assert keys == {"key-2", "key-3", "key-4"}
+
+
+def test_aggregate_groups_and_scopes_by_key(tmp_path):
+    usage = ledger(tmp_path)
+    for key, model in [("a", "m1"), ("a", "m2"), ("a", "m2"), ("b", "m1")]:
+        usage.finish(UsageEntry(key, model, cached=model == "m1"))
+    now = time.time()
+
+    by_model = asyncio.run(usage.aggregate(now - 60, now + 60, "model"))
+    assert {group["modelId"]: (group["requests"], group["cacheHits"]) for group in by_model} == {
+        "m1": (2, 2),
+        "m2": (2, 0),
+    }
+    scoped = asyncio.run(usage.aggregate(now - 60, now + 60, "key,model", api_key="a"))
+    assert {(group["apiKey"], group["modelId"]) for group in scoped} == {("a", "m1"), ("a", "m2")}
+    assert asyncio.run(usage.aggregate(now + 60, now + 120, "key")) == []
+
+
+def test_workers_share_one_database(tmp_path):
+    first, second = ledger(tmp_path), ledger(tmp_path)
+    first.finish(UsageEntry("a", "m"))
+    asyncio.run(first.flush())
+    second.finish(UsageEntry("a", "m"))
+    now = time.time()
+    assert asyncio.run(second.aggregate(now - 60, now + 60, "key"))[0]["requests"] == 2
+
+
+def test_background_flush_writes_without_the_request_path(tmp_path):
+    usage = ledger(tmp_path, flush_interval=0.01)
+
+    async def scenario():
+        usage.start()
+        usage.finish(UsageEntry("a", "m"))
+        await asyncio.sleep(0.1)
+        buffered = usage.snapshot()["buffered"]
+        await usage.stop()
+        return buffered
+
+    assert asyncio.run(scenario()) == 0
+    rows = usage._connection().execute("SELECT COUNT(*) FROM usage").fetchone()[0]
+    assert rows == 1
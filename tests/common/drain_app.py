@@ -0,0 +1,36 @@
+"""Minimal app wired for draining the way both services are, served by tests/common/test_drain.py."""
+
+import asyncio
+import functools
+import os
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from common.saturation import LoadSheddingMiddleware, SaturationMonitor
+
+saturation = SaturationMonitor()
+app = FastAPI()
+app.add_middleware(LoadSheddingMiddleware, monitor=saturation)
+app.state.drain = functools.partial(
+    saturation.drain,
+    float(os.environ.get("SHUTDOWN_READINESS_GRACE_SECONDS", "1")),
+    float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", "10")),
+)
+
+
+@app.on_event("startup")
+async def start_monitor():
+    saturation.start()
+
+
+@app.get("/readyz")
+async def readiness():
+    reasons = saturation.readiness_reasons()
+    return JSONResponse(status_code=503 if reasons else 200, content={"reasons": reasons})
+
+
+@app.get("/work")
+async def work(seconds: float = 0.0):
+    await asyncio.sleep(seconds)
+    return {"slept": seconds}
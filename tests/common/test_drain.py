@@ -0,0 +1,100 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+import pytest
+
+TESTS_DIR = Path(__file__).resolve().parent
+SERVICES_DIR = TESTS_DIR.parent.parent / "services"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(predicate, timeout: float = 15.0, interval: float = 0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(interval)
+    raise AssertionError("condition not met in time")
+
+
+@pytest.fixture
+def server():
+    port = free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join([str(SERVICES_DIR), str(TESTS_DIR)]),
+        "SHUTDOWN_READINESS_GRACE_SECONDS": "1",
+        "SHUTDOWN_DRAIN_SECONDS": "10",
+    }
+    command = [sys.executable, "-m", "gunicorn", "drain_app:app", "--workers", "1", "--bind", f"127.0.0.1:{port}"]
+    command += ["--worker-class", "common.workers.DrainingUvicornWorker", "--graceful-timeout", "30"]
+    process = subprocess.Popen(
+        command,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+
+    def ready():
+        try:
+            return httpx.get(f"{base_url}/readyz", timeout=1).status_code == 200
+        except httpx.TransportError:
+            return False
+
+    try:
+        wait_for(ready)
+        yield process, base_url
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait(timeout=10)
+
+
+def test_sigterm_drains_in_flight_requests_and_refuses_new_ones(server):
+    process, base_url = server
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        in_flight = [pool.submit(httpx.get, f"{base_url}/work", params={"seconds": 3}, timeout=20) for _ in range(6)]
+        time.sleep(0.5)
+        process.send_signal(signal.SIGTERM)
+
+        # Readiness flips right away while requests are still accepted during the grace period.
+        wait_for(lambda: _status(f"{base_url}/readyz") == 503)
+
+        # After the grace period new work is refused while the earlier requests are still running.
+        wait_for(lambda: _refused(f"{base_url}/work"))
+        assert not any(future.done() for future in in_flight)
+
+        responses = [future.result() for future in in_flight]
+    assert [response.status_code for response in responses] == [200] * 6
+    assert process.wait(timeout=20) == 0
+    assert "0 dropped at deadline" in process.stderr.read()
+
+
+def _status(url: str):
+    try:
+        return httpx.get(url, timeout=1).status_code
+    except httpx.TransportError:
+        return None
+
+
+def _refused(url: str) -> bool:
+    try:
+        response = httpx.get(url, timeout=1)
+    except httpx.TransportError:
+        return False
+    return response.status_code == 503 and response.json()["reasons"] == ["draining"]
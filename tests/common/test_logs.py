@@ -0,0 +1,127 @@
+import io
+import json
+import logging
+import queue
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from common import logs
+from common.logs import (
+    REQUEST_ID_HEADER,
+    JsonFormatter,
+    LogBudgetFilter,
+    LogPipeline,
+    NonBlockingQueueHandler,
+    RequestIdMiddleware,
+    request_id_var,
+)
+
+
+def record(level=logging.ERROR, msg="upstream failed: %s", args=("timeout",), exc=None) -> logging.LogRecord:
+    exc_info = (type(exc), exc, None) if exc else None
+    return logging.LogRecord("gateway", level, __file__, 1, msg, args, exc_info)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_identical_errors_are_collapsed_within_the_window(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(logs.time, "monotonic", clock)
+    budget = LogBudgetFilter(1.0, dedup_window_seconds=60.0, max_errors_per_second=100.0)
+    assert budget.filter(record())
+    assert not budget.filter(record())
+    assert not budget.filter(record())
+    assert budget.filter(record(msg="another error"))
+
+    clock.now += 61
+    again = record()
+    assert budget.filter(again)
+    assert again.suppressed == 2
+    assert budget.suppressed == 2
+
+
+def test_distinct_errors_are_rate_limited(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(logs.time, "monotonic", clock)
+    budget = LogBudgetFilter(1.0, dedup_window_seconds=60.0, max_errors_per_second=2.0)
+    kept = [budget.filter(record(msg=f"error {index}")) for index in range(5)]
+    assert kept == [True, True, False, False, False]
+    assert budget.rate_limited == 3
+    clock.now += 1
+    assert budget.filter(record(msg="error after refill"))
+
+
+def test_info_records_are_sampled_per_request():
+    budget = LogBudgetFilter(0.5, dedup_window_seconds=60.0, max_errors_per_second=10.0)
+    kept_requests = 0
+    for index in range(200):
+        token = request_id_var.set(f"request-{index}")
+        try:
+            first = budget.filter(record(logging.INFO))
+            # Every record of a request shares the request's fate.
+            assert budget.filter(record(logging.INFO, msg="access")) == first
+            kept_requests += first
+        finally:
+            request_id_var.reset(token)
+    assert 60 < kept_requests < 140
+    assert budget.filter(record(logging.INFO))  # outside a request
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(2))
+    for _ in range(5):
+        handler.handle(record(logging.INFO))
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+
+def test_json_formatter_fields():
+    formatter = JsonFormatter("bedrock-gateway")
+    entry = record(exc=ValueError("bad"))
+    entry.request_id = "abc"
+    entry.suppressed = 4
+    line = json.loads(formatter.format(entry))
+    assert line["service"] == "bedrock-gateway" and line["level"] == "ERROR"
+    assert line["message"] == "upstream failed: timeout"
+    assert line["requestId"] == "abc" and line["suppressed"] == 4
+    assert "ValueError: bad" in line["exception"]
+
+
+def test_pipeline_writes_json_lines_from_the_listener_thread():
+    pipeline = LogPipeline("test", info_sample_rate=1.0)
+    stream = io.StringIO()
+    pipeline.output.setStream(stream)
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    pipeline.install()
+    try:
+        logging.getLogger("tests.logs").info("hello %s", "world")
+    finally:
+        pipeline.stop()  # drains the queue
+        root.handlers = saved_handlers
+        root.setLevel(saved_level)
+    assert json.loads(stream.getvalue())["message"] == "hello world"
+    assert pipeline.snapshot()["queueDropped"] == 0
+
+
+def test_request_id_middleware_propagates_and_echoes_ids():
+    app = FastAPI()
+
+    @app.get("/")
+    async def index():
+        return {"requestId": request_id_var.get()}
+
+    client = TestClient(RequestIdMiddleware(app))
+    response = client.get("/", headers={REQUEST_ID_HEADER: "caller-id"})
+    assert response.json() == {"requestId": "caller-id"}
+    assert response.headers[REQUEST_ID_HEADER] == "caller-id"
+    generated = client.get("/")
+    assert generated.headers[REQUEST_ID_HEADER] == generated.json()["requestId"]
+    assert request_id_var.get() is None
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from common.profiling import RequestTracker, RequestTrackingMiddleware, SamplingProfiler, build_admin_router, stage
+
+ADMIN = {"x-admin-key": "secret"}
+
+
+def build_app(tracker: RequestTracker, admin_key="secret"):
+    app = FastAPI()
+    app.include_router(build_admin_router(tracker, admin_key))
+
+    @app.get("/work")
+    async def work(seconds: float = 0.0):
+        stage("upstream")
+        await asyncio.sleep(seconds)
+        stage("render")
+        return {"ok": True}
+
+    return TestClient(RequestTrackingMiddleware(app, tracker))
+
+
+def test_slow_requests_keep_their_stage_timings():
+    tracker = RequestTracker(slow_threshold_seconds=0.05)
+    client = build_app(tracker)
+    client.get("/work")
+    assert not tracker.slow
+    client.get("/work", params={"seconds": 0.1})
+    (entry,) = tracker.slow
+    assert entry["path"] == "/work" and entry["status"] == 200
+    assert [timing["stage"] for timing in entry["stages"]] == ["received", "upstream", "render", "responding"]
+    assert entry["stages"][1]["durationMs"] >= 90
+    assert tracker.in_flight == {}
+
+
+def test_slow_buffer_is_bounded():
+    tracker = RequestTracker(slow_threshold_seconds=0.0, slow_capacity=2)
+    client = build_app(tracker)
+    for _ in range(5):
+        client.get("/work")
+    assert len(tracker.slow) == 2
+
+
+def test_track_records_the_status_of_non_http_work():
+    tracker = RequestTracker(slow_threshold_seconds=0.0)
+    with tracker.track("WS", "/api/ws"):
+        stage("gateway")
+    with pytest.raises(HTTPException):
+        with tracker.track("WS", "/api/ws"):
+            raise HTTPException(status_code=429)
+    assert [entry["status"] for entry in tracker.slow] == [200, 429]
+    assert tracker.slow[0]["stage"] == "gateway"
+
+
+def test_admin_endpoints_require_the_key():
+    client = build_app(RequestTracker(5.0))
+    assert client.get("/admin/requests").status_code == 401
+    assert client.get("/admin/requests", headers={"x-admin-key": "wrong"}).status_code == 401
+    assert client.get("/admin/requests", headers=ADMIN).json()["inFlight"] == 0
+    assert build_app(RequestTracker(5.0), admin_key=None).get("/admin/requests", headers=ADMIN).status_code == 404
+
+
+def test_in_flight_requests_show_their_current_stage():
+    tracker = RequestTracker(5.0)
+    client = build_app(tracker)
+    worker = threading.Thread(target=client.get, args=("/work",), kwargs={"params": {"seconds": 0.5}})
+    worker.start()
+    try:
+        for _ in range(100):
+            if tracker.in_flight:
+                break
+            time.sleep(0.01)
+        requests = client.get("/admin/requests", headers=ADMIN).json()["requests"]
+        assert requests[0]["path"] == "/work" and requests[0]["stage"] == "upstream"
+    finally:
+        worker.join(5)
+
+
+def test_profile_returns_collapsed_stacks():
+    client = build_app(RequestTracker(5.0))
+    response = client.get("/admin/profile", headers=ADMIN, params={"seconds": 0.1, "intervalMs": 10})
+    assert response.status_code == 200
+    assert int(response.headers["X-Profile-Samples"]) >= 5
+    lines = response.text.strip().splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any(line.startswith("thread:") for line in lines)
+
+
+def test_only_one_profile_runs_at_a_time():
+    profiler = SamplingProfiler()
+    running = threading.Thread(target=profiler.sample, args=(0.3, 0.01))
+    running.start()
+    time.sleep(0.05)
+    try:
+        with pytest.raises(RuntimeError):
+            profiler.sample(0.01, 0.01)
+    finally:
+        running.join(5)
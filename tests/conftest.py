@@ -0,0 +1,53 @@
+"""Unit tests for both services and the shared ``common`` package.
+
+Both services name their package ``app``, so tests are grouped by service
+(``tests/bedrock_gateway``, ``tests/open_webui``) and the service's directory
+is put on ``sys.path`` while its tests are collected and run. Each service
+keeps its own ``app`` modules; switching services swaps them in
+``sys.modules``, so the whole suite runs in one session:
+
+    python -m pytest -q tests
+"""
+
+import sys
+from pathlib import Path
+from typing import Dict, Optional
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent / "services"
+SERVICE_DIRS = {"bedrock_gateway": "bedrock-gateway", "open_webui": "open-webui"}
+
+sys.path.insert(0, str(SERVICES_DIR))
+
+_loaded: Dict[str, dict] = {}
+_active: Optional[str] = None
+
+
+def use_service(name: str) -> None:
+    """Make ``import app`` resolve to the given service's package."""
+    global _active
+    if name == _active:
+        return
+    if _active is not None:
+        modules = [module for module in sys.modules if module == "app" or module.startswith("app.")]
+        _loaded[_active] = {module: sys.modules.pop(module) for module in modules}
+    service_paths = {str(SERVICES_DIR / directory) for directory in SERVICE_DIRS.values()}
+    sys.path[:] = [entry for entry in sys.path if entry not in service_paths]
+    sys.path.insert(0, str(SERVICES_DIR / SERVICE_DIRS[name]))
+    sys.modules.update(_loaded.get(name, {}))
+    _active = name
+
+
+def _service_of(path: Path) -> Optional[str]:
+    return next((name for name in SERVICE_DIRS if name in path.parts), None)
+
+
+def pytest_collectstart(collector):
+    name = _service_of(Path(str(collector.path)))
+    if name:
+        use_service(name)
+
+
+def pytest_runtest_setup(item):
+    name = _service_of(Path(str(item.path)))
+    if name:
+        use_service(name)
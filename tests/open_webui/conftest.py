@@ -0,0 +1,12 @@
+"""Settings the UI service reads at import time, so ``app.main`` can be imported without a gateway or a volume."""
+
+import os
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix="open-webui-tests-")
+
+os.environ.setdefault("OPENAI_API_BASE_URL", "http://gateway.test")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.setdefault("CONVERSATION_DATA_DIR", os.path.join(DATA_DIR, "conversations"))
+os.environ.setdefault("RETRIEVAL_DATA_DIR", os.path.join(DATA_DIR, "retrieval"))
+os.environ.setdefault("EMBEDDING_CACHE_DIR", os.path.join(DATA_DIR, "embedding-cache"))
@@ -0,0 +1,148 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI, HTTPException, WebSocket
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.chat_socket import ChatStreams
+from common.saturation import SaturationMonitor
+
+
+async def runner(payload, emit):
+    """Emits ``payload["deltas"]`` one every ``delay`` seconds, then fails with ``status`` if given."""
+    for text in payload.get("deltas", []):
+        await asyncio.sleep(payload.get("delay", 0))
+        emit(text)
+    if "status" in payload:
+        raise HTTPException(status_code=payload["status"], detail="upstream said no")
+    return {"modelId": "stub", "output": {"stopReason": "end_turn"}}
+
+
+def build(resume_seconds: float = 5.0, max_streams: int = 2, monitor=None):
+    monitor = monitor or SaturationMonitor()
+    streams = ChatStreams(runner, monitor, resume_seconds=resume_seconds, max_streams_per_socket=max_streams)
+    app = FastAPI()
+
+    @app.websocket("/api/ws")
+    async def chat_socket(websocket: WebSocket):
+        await streams.serve(websocket)
+
+    return TestClient(app), streams, monitor
+
+
+def receive_until(ws, stream_id, kinds=("done", "error", "cancelled")):
+    frames = []
+    while True:
+        frame = ws.receive_json()
+        if frame.get("id") == stream_id:
+            frames.append(frame)
+            if frame["type"] in kinds:
+                return frames
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+def test_concurrent_streams_are_multiplexed_and_numbered():
+    client, streams, monitor = build()
+    with client.websocket_connect("/api/ws") as ws:
+        ws.send_json({"type": "start", "id": "a", "payload": {"deltas": ["a1", "a2", "a3"], "delay": 0.01}})
+        ws.send_json({"type": "start", "id": "b", "payload": {"deltas": ["b1", "b2"], "delay": 0.01}})
+        frames = {"a": [], "b": []}
+        while not all(stream and stream[-1]["type"] == "done" for stream in frames.values()):
+            frame = ws.receive_json()
+            frames[frame["id"]].append(frame)
+    assert [frame.get("text") for frame in frames["a"]] == ["a1", "a2", "a3", None]
+    assert [frame["seq"] for frame in frames["b"]] == [0, 1, 2]
+    assert frames["b"][-1]["modelId"] == "stub"
+    assert monitor.in_flight == 0
+
+
+def test_runner_errors_become_error_frames():
+    client, _, _ = build()
+    with client.websocket_connect("/api/ws") as ws:
+        ws.send_json({"type": "start", "id": "e", "payload": {"deltas": ["x"], "status": 429}})
+        frames = receive_until(ws, "e")
+    assert frames[-1] == {"type": "error", "status": 429, "detail": "upstream said no", "id": "e", "seq": 1}
+
+
+def test_cancel_stops_the_stream():
+    client, streams, monitor = build()
+    with client.websocket_connect("/api/ws") as ws:
+        ws.send_json({"type": "start", "id": "slow", "payload": {"deltas": ["x"] * 100, "delay": 0.05}})
+        assert ws.receive_json()["type"] == "delta"
+        ws.send_json({"type": "cancel", "id": "slow"})
+        frames = receive_until(ws, "slow")
+    assert frames[-1]["type"] == "cancelled"
+    assert monitor.in_flight == 0
+    assert streams.snapshot()["activeStreams"] == 0
+
+
+def test_a_new_socket_resumes_a_dropped_stream():
+    client, streams, _ = build()
+    # Keep one event loop across sockets, as a worker does, so the detached stream keeps running.
+    with client:
+        with client.websocket_connect("/api/ws") as ws:
+            ws.send_json({"type": "start", "id": "r", "payload": {"deltas": ["1", "2", "3", "4"], "delay": 0.05}})
+            first = ws.receive_json()
+        assert first["seq"] == 0
+        wait_for(lambda: streams.streams["r"].socket is None)
+
+        with client.websocket_connect("/api/ws") as ws:
+            ws.send_json({"type": "resume", "id": "r", "after": first["seq"]})
+            frames = receive_until(ws, "r")
+        assert [frame["seq"] for frame in frames] == [1, 2, 3, 4]
+        assert "".join(frame.get("text", "") for frame in [first] + frames) == "1234"
+        assert streams.resumed == 1
+
+
+def test_unresumed_streams_expire_and_are_cancelled():
+    client, streams, monitor = build(resume_seconds=0.1)
+    with client:
+        with client.websocket_connect("/api/ws") as ws:
+            ws.send_json({"type": "start", "id": "gone", "payload": {"deltas": ["x"] * 100, "delay": 0.05}})
+            ws.receive_json()
+        # Expiry drops the stream first; its cancelled task finishes on a later loop iteration.
+        wait_for(lambda: "gone" not in streams.streams and monitor.in_flight == 0)
+        assert streams.expired == 1
+        with client.websocket_connect("/api/ws") as ws:
+            ws.send_json({"type": "resume", "id": "gone", "after": 0})
+            assert ws.receive_json()["status"] == 404
+
+
+def test_invalid_and_excess_requests_are_rejected():
+    client, _, _ = build(max_streams=1)
+    with client.websocket_connect("/api/ws") as ws:
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+        ws.send_text("not json")
+        assert ws.receive_json()["status"] == 400
+        ws.send_json({"type": "start", "id": "bad id!", "payload": {}})
+        assert ws.receive_json()["detail"] == "Invalid stream ID"
+        ws.send_json({"type": "start", "id": "one", "payload": {"deltas": ["x"] * 100, "delay": 0.05}})
+        ws.send_json({"type": "start", "id": "one", "payload": {}})
+        ws.send_json({"type": "start", "id": "two", "payload": {}})
+        rejected = []
+        while len(rejected) < 2:
+            frame = ws.receive_json()
+            if frame["type"] == "error":
+                rejected.append((frame["id"], frame["status"]))
+        assert rejected == [("one", 409), ("two", 429)]
+        ws.send_json({"type": "cancel", "id": "one"})
+        receive_until(ws, "one")
+
+
+def test_draining_worker_refuses_new_sockets():
+    monitor = SaturationMonitor()
+    monitor.accepting = False
+    client, _, _ = build(monitor=monitor)
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect("/api/ws") as ws:
+            ws.receive_json()
+    assert closed.value.code == 1013
@@ -0,0 +1,106 @@
+import os
+import threading
+
+from app import conversations as conversations_module
+from app.conversations import ConversationStore, is_valid_conversation_id, new_conversation_id
+
+
+def message(role: str, content: str) -> dict:
+    return {"role": role, "content": content}
+
+
+def test_new_ids_are_valid():
+    assert is_valid_conversation_id(new_conversation_id())
+    assert not is_valid_conversation_id("../etc/passwd")
+
+
+def test_append_and_get_round_trip(tmp_path):
+    store = ConversationStore(str(tmp_path))
+    conversation_id = new_conversation_id()
+    assert store.get(conversation_id) is None
+
+    assert store.append(conversation_id, [message("user", "Hi"), message("assistant", "Hello")]) == 2
+    assert store.append(conversation_id, [message("user", "Bye")]) == 3
+
+    history = store.get(conversation_id)
+    assert [entry["content"] for entry in history] == ["Hi", "Hello", "Bye"]
+    assert all("ts" in entry for entry in history)
+
+
+def test_appends_roll_over_to_new_segments(tmp_path):
+    store = ConversationStore(str(tmp_path), segment_max_bytes=200)
+    conversation_id = new_conversation_id()
+    for index in range(10):
+        store.append(conversation_id, [message("user", f"message {index} " + "x" * 40)])
+
+    segments = sorted(os.listdir(store._dir(conversation_id)))
+    assert len([name for name in segments if name.endswith(".jsonl")]) > 1
+    assert len(ConversationStore(str(tmp_path)).get(conversation_id)) == 10
+
+
+def test_cached_conversation_picks_up_appends_from_other_workers(tmp_path):
+    reader = ConversationStore(str(tmp_path), segment_max_bytes=150)
+    writer = ConversationStore(str(tmp_path), segment_max_bytes=150)
+    conversation_id = new_conversation_id()
+    writer.append(conversation_id, [message("user", "first")])
+    assert len(reader.get(conversation_id)) == 1
+
+    for index in range(5):
+        writer.append(conversation_id, [message("assistant", f"reply {index} " + "y" * 40)])
+    assert [entry["content"] for entry in reader.get(conversation_id)][-1].startswith("reply 4")
+    assert len(reader.get(conversation_id)) == 6
+
+
+def test_cache_is_bounded(tmp_path):
+    store = ConversationStore(str(tmp_path), cache_size=2)
+    ids = [new_conversation_id() for _ in range(3)]
+    for conversation_id in ids:
+        store.append(conversation_id, [message("user", "Hi")])
+    assert list(store._cache) == ids[1:]
+    assert [entry["content"] for entry in store.get(ids[0])] == ["Hi"]
+
+
+def test_slow_io_on_one_conversation_does_not_block_another(tmp_path, monkeypatch):
+    store = ConversationStore(str(tmp_path))
+    slow_id, fast_id = new_conversation_id(), new_conversation_id()
+    store.append(fast_id, [message("user", "warm")])
+    in_fsync, release = threading.Event(), threading.Event()
+    real_fsync = os.fsync
+
+    def fsync(fd):
+        if slow_id in os.readlink(f"/proc/self/fd/{fd}"):
+            in_fsync.set()
+            release.wait(10)
+        real_fsync(fd)
+
+    monkeypatch.setattr(conversations_module.os, "fsync", fsync)
+    slow = threading.Thread(target=store.append, args=(slow_id, [message("user", "slow")]))
+    slow.start()
+    try:
+        assert in_fsync.wait(10)
+        # The slow append is parked inside fsync; other conversations still read and write.
+        fast = threading.Thread(target=lambda: (store.append(fast_id, [message("user", "fast")]), store.get(fast_id)))
+        fast.start()
+        fast.join(5)
+        assert not fast.is_alive()
+        assert len(store.get(fast_id)) == 2
+    finally:
+        release.set()
+        slow.join(10)
+    assert store.get(slow_id)[0]["content"] == "slow"
+    assert store._locks == {}
+
+
+def test_concurrent_appends_to_one_conversation_are_all_kept(tmp_path):
+    store = ConversationStore(str(tmp_path), segment_max_bytes=500)
+    conversation_id = new_conversation_id()
+    threads = [
+        threading.Thread(target=store.append, args=(conversation_id, [message("user", f"m{index}")]))
+        for index in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    contents = sorted(entry["content"] for entry in ConversationStore(str(tmp_path)).get(conversation_id))
+    assert contents == sorted(f"m{index}" for index in range(20))
@@ -0,0 +1,62 @@
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.conversations import ConversationStore
+
+
+@pytest.fixture
+def proxy(monkeypatch, tmp_path):
+    sent = []
+
+    def gateway(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        sent.append((request, payload))
+        reply = f"Reply {len(sent)}"
+        return httpx.Response(200, json={"modelId": payload["modelId"], "output": {"text": reply}})
+
+    monkeypatch.setattr(main, "client", httpx.AsyncClient(transport=httpx.MockTransport(gateway)))
+    monkeypatch.setattr(main, "conversations", ConversationStore(str(tmp_path)))
+    return TestClient(main.app), sent
+
+
+def test_delta_submissions_carry_the_stored_history(proxy):
+    client, sent = proxy
+    first = client.post(
+        "/api/completions", json={"modelId": "amazon.nova-lite-v1:0", "system": "Be brief.", "message": "Hi"}
+    ).json()
+    conversation_id = first["conversationId"]
+    assert sent[0][1]["messages"] == [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi"}]
+
+    client.post(
+        "/api/completions",
+        json={"modelId": "amazon.nova-lite-v1:0", "conversationId": conversation_id, "message": {"content": "More?"}},
+    )
+    assert [message["content"] for message in sent[1][1]["messages"]] == ["Hi", "Reply 1", "More?"]
+
+    stored = client.get(f"/api/conversations/{conversation_id}").json()["messages"]
+    assert [(entry["role"], entry["content"]) for entry in stored] == [
+        ("user", "Hi"),
+        ("assistant", "Reply 1"),
+        ("user", "More?"),
+        ("assistant", "Reply 2"),
+    ]
+    assert stored[-1]["modelId"] == "amazon.nova-lite-v1:0"
+
+
+def test_the_gateway_gets_the_remaining_deadline(proxy):
+    client, sent = proxy
+    client.post("/api/completions", json={"modelId": "amazon.nova-lite-v1:0", "message": "Hi"})
+    deadline_ms = int(sent[0][0].headers["x-deadline-ms"])
+    assert 0 < deadline_ms <= main.GATEWAY_DEADLINE_MS
+
+
+def test_invalid_delta_submissions_are_rejected(proxy):
+    client, sent = proxy
+    assert client.post("/api/completions", json={"conversationId": "../x", "message": "Hi"}).status_code == 400
+    assert client.post("/api/completions", json={"message": "   "}).status_code == 400
+    assert client.get(f"/api/conversations/{'0' * 32}").status_code == 404
+    assert not sent
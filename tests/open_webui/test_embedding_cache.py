@@ -0,0 +1,98 @@
+import asyncio
+
+import numpy as np
+
+from app.embedding_cache import WAYS, CachedEmbedder, EmbeddingCache, text_keys
+from app.embeddings import HashingEmbedder
+
+DIMENSIONS = 32
+MIB = 1024 * 1024
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__(DIMENSIONS)
+        self.calls = []
+
+    def embed(self, texts, input_type="document"):
+        self.calls.append(list(texts))
+        return super().embed(texts, input_type)
+
+    async def aembed(self, client, texts, input_type="query", headers=None):
+        return self.embed(texts, input_type)
+
+
+def cache(tmp_path, max_bytes: int = MIB, dtype: str = "float32") -> EmbeddingCache:
+    return EmbeddingCache(str(tmp_path), "hash-32", DIMENSIONS, max_bytes, dtype)
+
+
+def test_keys_ignore_whitespace_and_depend_on_the_input_type():
+    document, spaced = text_keys(["Paid  time\noff", " Paid time off "], "document").tolist()
+    (query,) = text_keys(["Paid time off"], "query").tolist()
+    assert document == spaced
+    assert document != query
+
+
+def test_repeated_texts_are_embedded_once(tmp_path):
+    inner = CountingEmbedder()
+    embedder = CachedEmbedder(inner, cache(tmp_path))
+
+    first = embedder.embed(["alpha", "beta", "alpha"])
+    second = embedder.embed(["beta", "gamma"])
+
+    assert inner.calls == [["alpha", "beta"], ["gamma"]]
+    np.testing.assert_allclose(first, inner.embed(["alpha", "beta", "alpha"]))
+    np.testing.assert_allclose(second[0], first[1])
+    stats = embedder.cache.stats()
+    assert (stats["hits"], stats["misses"], stats["inserts"]) == (1, 4, 3)
+
+
+def test_entries_are_shared_with_other_processes_through_the_files(tmp_path):
+    inner = CountingEmbedder()
+    CachedEmbedder(inner, cache(tmp_path)).embed(["alpha", "beta"])
+
+    reopened = CachedEmbedder(inner, cache(tmp_path))
+    asyncio.run(reopened.aembed(None, ["alpha", "beta"], "document"))
+
+    assert len(inner.calls) == 1
+    assert reopened.cache.stats()["hits"] == 2
+
+
+def test_changing_the_size_or_dtype_starts_a_new_table(tmp_path):
+    cache(tmp_path).insert(text_keys(["alpha"], "document"), HashingEmbedder(DIMENSIONS).embed(["alpha"]))
+
+    resized = cache(tmp_path, max_bytes=2 * MIB, dtype="float16")
+    found, _ = resized.lookup(text_keys(["alpha"], "document"))
+
+    assert not found.any()
+    assert resized.stats()["entries"] == 0
+
+
+def test_a_full_set_evicts_its_least_recently_used_entry(tmp_path):
+    small = cache(tmp_path, max_bytes=1)
+    assert (small.sets, small.capacity) == (1, WAYS)
+    texts = [f"text {index}" for index in range(WAYS + 1)]
+    keys = text_keys(texts, "document")
+    vectors = HashingEmbedder(DIMENSIONS).embed(texts)
+    for way, (key, vector) in enumerate(zip(keys[:WAYS], vectors[:WAYS])):
+        small.insert(key[None], vector[None])
+        small.index["used"][0, way] = 1000 + way  # distinct ages, oldest first
+
+    small.insert(keys[WAYS:], vectors[WAYS:])
+
+    found, _ = small.lookup(keys)
+    assert found.tolist() == [False] + [True] * WAYS
+    assert small.stats()["evictions"] == 1
+
+
+def test_a_row_that_no_longer_matches_its_checksum_is_a_miss(tmp_path):
+    table = cache(tmp_path)
+    keys = text_keys(["alpha"], "document")
+    table.insert(keys, HashingEmbedder(DIMENSIONS).embed(["alpha"]))
+    slot = np.flatnonzero((table.index["key"].reshape(-1, 2) == keys[0]).all(axis=1))[0]
+    table.vectors[slot] += 1.0
+
+    found, rows = table.lookup(keys)
+
+    assert not found.any()
+    assert len(rows) == 0
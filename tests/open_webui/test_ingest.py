@@ -0,0 +1,145 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.embeddings import HashingEmbedder
+from app.ingest import bounded_map, ingest
+from app.retrieval import CollectionReader, CollectionWriter
+
+DIMENSIONS = 64
+
+
+def write(path, text: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write(text)
+
+
+def make_tree(root, files: int = 6) -> None:
+    for index in range(files):
+        write(os.path.join(root, f"d{index % 2}", f"doc{index}.txt"), f"Document {index}. " * 30)
+
+
+class FailingEmbedder(HashingEmbedder):
+    """Embeds through the loader like the gateway embedder does, and is interrupted after ``batches`` calls."""
+
+    local = False
+
+    def __init__(self, batches: int):
+        super().__init__(DIMENSIONS)
+        self.batches = batches
+
+    def embed(self, texts, input_type="document"):
+        if self.batches == 0:
+            raise KeyboardInterrupt
+        self.batches -= 1
+        return super().embed(texts, input_type)
+
+
+def run(root, store, embedder=None, **options):
+    embedder = embedder or HashingEmbedder(DIMENSIONS)
+    writer = CollectionWriter(str(store), "docs", embedder.model_id)
+    try:
+        summary = ingest(str(root), writer, embedder, processes=2, max_chars=200, progress_stream=None, **options)
+    finally:
+        writer.close()
+    return summary
+
+
+def sources(store) -> dict:
+    reader = CollectionReader(os.path.join(str(store), "docs"))
+    reader.refresh()
+    return reader.manifest["files"]
+
+
+def test_ingests_a_tree_and_skips_unchanged_files(tmp_path):
+    root, store = tmp_path / "docs", tmp_path / "store"
+    make_tree(str(root))
+
+    first = run(root, store)
+    assert (first["files"], first["skipped"], first["failed"]) == (6, 0, 0)
+    assert first["chunks"] > 6
+    assert sorted(sources(store)) == sorted(os.path.join(f"d{index % 2}", f"doc{index}.txt") for index in range(6))
+
+    again = run(root, store)
+    assert (again["files"], again["chunks"], again["skipped"]) == (0, 0, 6)
+
+
+def test_changed_files_are_replaced_and_missing_ones_pruned(tmp_path):
+    root, store = tmp_path / "docs", tmp_path / "store"
+    make_tree(str(root))
+    run(root, store)
+    changed = os.path.join("d0", "doc0.txt")
+    previous_rows = sources(store)[changed]["rows"]
+
+    write(os.path.join(root, changed), "Rewritten. " * 200)
+    os.remove(os.path.join(root, "d1", "doc1.txt"))
+    summary = run(root, store, prune=True)
+
+    assert (summary["files"], summary["skipped"], summary["removed"]) == (1, 4, 1)
+    files = sources(store)
+    assert os.path.join("d1", "doc1.txt") not in files
+    assert files[changed]["rows"] != previous_rows
+
+
+def test_interrupted_run_resumes_from_its_checkpoint(tmp_path):
+    root, store = tmp_path / "docs", tmp_path / "store"
+    make_tree(str(root))
+    embedder = FailingEmbedder(batches=3)
+    writer = CollectionWriter(str(store), "docs", embedder.model_id)
+    with pytest.raises(KeyboardInterrupt):
+        ingest(str(root), writer, embedder, processes=1, batch_size=1, checkpoint_seconds=0, progress_stream=None)
+    writer.close(checkpoint=False)
+    assert len(sources(store)) == 3
+
+    summary = run(root, store, embedder=FailingEmbedder(batches=100), batch_size=1)
+    assert (summary["files"], summary["skipped"]) == (3, 3)
+    files = sources(store)
+    assert len(files) == 6
+    spans = sorted(entry["rows"] for entry in files.values())
+    assert all(end == start for (_, end), (start, _) in zip(spans, spans[1:]))
+
+
+def test_metadata_comes_from_the_command_line_and_sidecars(tmp_path):
+    root, store = tmp_path / "docs", tmp_path / "store"
+    write(os.path.join(root, "plain.txt"), "Plain text. " * 10)
+    write(os.path.join(root, "policy.md"), "# Policy\n\nRules. " * 10)
+    sidecar = {"owner": "hr", "tags": ["policy"], "date": "2024-03-01"}
+    write(os.path.join(root, "policy.md.meta.json"), json.dumps(sidecar))
+
+    run(root, store, metadata={"owner": "ops", "tags": ["handbook"]})
+
+    files = sources(store)
+    assert "policy.md.meta.json" not in files
+    assert files["policy.md"]["meta"] == {"owner": "hr", "tags": ["handbook", "policy"], "date": "2024-03-01"}
+    assert files["plain.txt"]["meta"]["owner"] == "ops"
+    assert files["plain.txt"]["meta"]["tags"] == ["handbook"]
+
+
+def test_unreadable_files_are_counted_as_failed(tmp_path):
+    root, store = tmp_path / "docs", tmp_path / "store"
+    write(os.path.join(root, "good.txt"), "Good. " * 10)
+    write(os.path.join(root, "bad.txt"), "Bad. " * 10)
+    write(os.path.join(root, "bad.txt.meta.json"), "{not json")
+
+    summary = run(root, store)
+
+    assert (summary["files"], summary["failed"]) == (1, 1)
+    assert list(sources(store)) == ["good.txt"]
+
+
+def test_bounded_map_keeps_order_and_a_bounded_window():
+    pulled = []
+
+    def items():
+        for item in range(20):
+            pulled.append(item)
+            yield item
+
+    with ThreadPoolExecutor(4) as pool:
+        results = bounded_map(pool, lambda item: item * 2, items(), window=3)
+        assert next(results) == 0
+        assert len(pulled) == 4
+        assert list(results) == [item * 2 for item in range(1, 20)]
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from app.metadata import FilterError, MetadataIndex, merge_metadata, normalize_metadata
+from app.retrieval import CollectionReader, CollectionWriter
+
+# Rows 0-1 handbook/pto.md, 2-4 handbook/travel.md, 5 notes.txt, 6-7 left by removed files, 8 archive/old.md.
+MANIFEST = {
+    "count": 9,
+    "files": {
+        "handbook/pto.md": {"rows": [0, 2], "meta": {"owner": "hr", "tags": ["leave", "policy"], "date": "2024-03-01"}},
+        "handbook/travel.md": {"rows": [2, 5], "meta": {"owner": "finance", "tags": ["policy"], "date": "2024-06-15"}},
+        "notes.txt": {"rows": [5, 6], "meta": {}},
+        "empty.md": {"rows": [6, 6], "meta": {"owner": "hr"}},
+        "archive/old.md": {"rows": [8, 9], "meta": {"owner": "archive", "tags": ["faq"], "date": "2019-01-01"}},
+    },
+}
+
+
+@pytest.fixture(scope="module")
+def index():
+    return MetadataIndex(MANIFEST)
+
+
+def rows(index: MetadataIndex, spec) -> list:
+    return np.flatnonzero(index.mask(index.evaluate(spec))).tolist()
+
+
+def test_normalize_and_merge_metadata():
+    meta = normalize_metadata({"owner": " hr ", "tags": "policy, leave,,policy", "date": "2024-03-01T10:00:00Z"})
+    assert meta == {"owner": "hr", "tags": ["leave", "policy"], "date": "2024-03-01"}
+    assert normalize_metadata({"owner": "", "tags": [], "date": None}) == {}
+    merged = merge_metadata({"owner": "ops", "tags": ["handbook"]}, {"owner": "hr", "tags": ["policy"]})
+    assert merged == {"owner": "hr", "tags": ["handbook", "policy"]}
+
+
+def test_field_conditions(index):
+    assert rows(index, {"document": "handbook/pto.md"}) == [0, 1]
+    assert rows(index, {"document": {"prefix": "handbook/"}}) == [0, 1, 2, 3, 4]
+    assert rows(index, {"owner": {"in": ["hr", "archive"]}}) == [0, 1, 8]
+    assert rows(index, {"tag": {"all": ["policy", "leave"]}}) == [0, 1]
+    assert rows(index, {"tag": "unknown"}) == []
+    assert rows(index, {"date": {"gte": "2024-01-01", "lt": "2024-06-15"}}) == [0, 1]
+    assert rows(index, {"date": "2024-06-15"}) == [2, 3, 4]
+
+
+def test_combined_conditions(index):
+    assert rows(index, {"owner": "finance", "tag": "policy"}) == [2, 3, 4]
+    assert rows(index, {"or": [{"tag": "faq"}, {"owner": "hr"}]}) == [0, 1, 8]
+    # Rows that belong to no file (6 and 7) never match, not even a negation.
+    assert rows(index, {"not": {"tag": "policy"}}) == [5, 8]
+    assert rows(index, {"and": [{"tag": "policy"}, {"not": {"document": {"prefix": "handbook/t"}}}]}) == [0, 1]
+
+
+def test_values_count_rows_per_owner_and_tag(index):
+    assert index.values() == {
+        "owners": {"archive": 1, "finance": 3, "hr": 2},
+        "tags": {"faq": 1, "leave": 2, "policy": 5},
+    }
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        {},
+        {"colour": "red"},
+        {"tag": {"near": "policy"}},
+        {"date": "yesterday"},
+        {"date": {"after": "2024-01-01"}},
+        {"or": []},
+        {"document": 7},
+    ],
+)
+def test_malformed_filters_are_rejected(index, spec):
+    with pytest.raises(FilterError):
+        index.evaluate(spec)
+
+
+def test_filtered_search_only_returns_matching_rows(tmp_path):
+    dimensions = 8
+    rng = np.random.default_rng(3)
+    writer = CollectionWriter(str(tmp_path), "docs", "random-8")
+    for document in range(20):
+        vectors = rng.standard_normal((50, dimensions)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        records = [{"source": f"doc{document}.md", "chunk": chunk, "text": ""} for chunk in range(50)]
+        meta = {"owner": "legal" if document == 7 else "eng", "tags": ["even"] if document % 2 == 0 else []}
+        writer.add(f"doc{document}.md", {"size": 0}, records, vectors, normalize_metadata(meta))
+    writer.close()
+    reader = CollectionReader(str(tmp_path / "docs"))
+    reader.refresh()
+    query = rng.standard_normal(dimensions).astype(np.float32)
+
+    selective = reader.search(query, 5, {"owner": "legal"})
+    broad = reader.search(query, 5, {"tag": "even"})
+
+    assert len(selective) == 5 and {hit.source for hit in selective} == {"doc7.md"}
+    assert all(int(hit.source[3:-3]) % 2 == 0 for hit in broad)
+    unfiltered = reader.search(query, 1000)
+    expected = [hit.row for hit in unfiltered if hit.source == "doc7.md"][:5]
+    assert [hit.row for hit in selective] == expected
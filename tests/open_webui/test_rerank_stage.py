@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import httpx
+import numpy as np
+
+from app.rerank import GatewayReranker, LexicalReranker, RerankStage, ScoreCache
+from app.retrieval import Hit
+
+PASSAGES = [
+    "The cafeteria opens at eight.",
+    "Paid time off accrues monthly; unused paid time off carries over.",
+    "Expense reports are due within thirty days.",
+    "Parking permits are issued by facilities.",
+]
+
+
+def hits(texts=PASSAGES):
+    return [Hit(row, 1.0 - row / 10, "handbook.md", row, text) for row, text in enumerate(texts)]
+
+
+class CountingReranker(LexicalReranker):
+    def __init__(self):
+        super().__init__()
+        self.scored = []
+
+    def score(self, query, texts):
+        self.scored.append(list(texts))
+        return super().score(query, texts)
+
+
+def test_lexical_scores_favour_passages_with_the_query_terms():
+    scores = LexicalReranker().score("paid time off", PASSAGES)
+    assert int(np.argmax(scores)) == 1
+    assert scores[0] == 0
+
+
+def test_rerank_keeps_the_best_and_reuses_cached_scores():
+    backend = CountingReranker()
+    stage = RerankStage(backend, candidates=4, cache_size=100)
+
+    kept, info = asyncio.run(stage.rerank(None, "How does paid time off work?", hits(), keep=2))
+    assert kept[0].row == 1
+    assert len(kept) == 2 and kept[0].rerank_score >= kept[1].rerank_score
+    assert (info["candidates"], info["scored"], info["cached"]) == (4, 4, 0)
+
+    # The same question, differently spaced, with one new candidate: only that one is scored.
+    more = hits(PASSAGES + ["Remote work needs a manager's approval."])
+    _, info = asyncio.run(stage.rerank(None, "How does  paid time off work?", more, keep=2))
+    assert (info["scored"], info["cached"]) == (1, 4)
+    assert backend.scored[-1] == ["Remote work needs a manager's approval."]
+    assert stage.snapshot()["scoreCache"]["hits"] == 4
+
+
+def test_score_cache_evicts_the_least_recently_used():
+    cache = ScoreCache(capacity=2)
+    cache.put(b"a", 1.0)
+    cache.put(b"b", 2.0)
+    assert cache.get(b"a") == 1.0
+    cache.put(b"c", 3.0)
+
+    assert cache.get(b"b") is None
+    assert (cache.get(b"a"), cache.get(b"c")) == (1.0, 3.0)
+
+    disabled = ScoreCache(capacity=0)
+    disabled.put(b"a", 1.0)
+    assert disabled.get(b"a") is None
+
+
+def test_gateway_reranker_scores_in_batches_and_keeps_document_order():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        requests.append(payload)
+        scores = [None if text == "skipped" else float(len(text)) for text in payload["documents"]]
+        return httpx.Response(200, json={"modelId": payload["modelId"], "scores": scores})
+
+    reranker = GatewayReranker("http://gateway.test/", "test-key", "cohere.rerank-v3-5:0", batch_size=2)
+    texts = ["a", "bbb", "skipped", "cc", "dddd"]
+
+    async def score():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await reranker.ascore(client, "query", texts)
+
+    scores = asyncio.run(score())
+
+    assert [payload["documents"] for payload in requests] == [["a", "bbb"], ["skipped", "cc"], ["dddd"]]
+    assert scores.tolist() == [1.0, 3.0, -np.inf, 2.0, 4.0]
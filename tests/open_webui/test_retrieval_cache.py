@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from app import main
+from app.embeddings import HashingEmbedder
+from app.retrieval import CollectionWriter, Hit, RetrievalStore
+from app.retrieval_cache import ENTRY_OVERHEAD, HIT_OVERHEAD, RetrievalCache
+
+PASSAGES = ["Paid time off accrues monthly.", "Expense reports are due in thirty days.", "Parking is free."]
+
+
+def key(query="How much PTO?", version="id:1", collection="handbook", spec=None, top_k=3, rerank_model=None) -> tuple:
+    return RetrievalCache.key(query, collection, version, spec, top_k, rerank_model)
+
+
+def hits(text: str = "x" * 100) -> list:
+    return [Hit(0, 0.9, "handbook.md", 0, text)]
+
+
+def test_keys_normalize_the_question_and_canonicalize_the_filter():
+    assert key("How much  PTO?") == key(" how much pto? ")
+    assert key(spec={"tag": "a", "owner": "b"}) == key(spec={"owner": "b", "tag": "a"})
+    assert key() != key(top_k=5)
+    assert key() != key(rerank_model="lexical")
+    assert key() != key(version="id:2")
+
+
+def test_hits_misses_and_saved_time():
+    cache = RetrievalCache(1024 * 1024)
+    assert cache.get(key()) is None
+    cache.put(key(), hits(), seconds=0.25)
+
+    assert cache.get(key("how much pto?")) == hits()
+    stats = cache.snapshot()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["savedMs"]) == (1, 1, 1, 250.0)
+
+
+def test_a_new_collection_version_drops_the_old_entries():
+    cache = RetrievalCache(1024 * 1024)
+    cache.put(key(), hits(), 0.1)
+    cache.put(key(collection="other"), hits(), 0.1)
+
+    assert cache.get(key(version="id:2")) is None
+    assert cache.snapshot()["invalidations"] == 1
+    assert cache.get(key(collection="other")) is not None
+    assert cache.get(key()) is None
+
+
+def test_entries_are_evicted_by_size_least_recently_used_first():
+    entry_bytes = ENTRY_OVERHEAD + len("q1") + HIT_OVERHEAD + 100 + len("handbook.md")
+    cache = RetrievalCache(entry_bytes * 2)
+    cache.put(key("q1"), hits(), 0.1)
+    cache.put(key("q2"), hits(), 0.1)
+    cache.get(key("q1"))
+    cache.put(key("q3"), hits(), 0.1)
+
+    assert cache.get(key("q2")) is None
+    assert cache.get(key("q1")) is not None and cache.get(key("q3")) is not None
+    assert cache.snapshot()["evictions"] == 1
+    assert cache.bytes <= cache.max_bytes
+
+    cache.put(key("huge"), hits("x" * entry_bytes * 2), 0.1)
+    assert cache.get(key("huge")) is None
+
+
+def test_a_disabled_cache_stores_nothing():
+    cache = RetrievalCache(0)
+    cache.put(key(), hits(), 0.1)
+    assert cache.get(key()) is None
+    assert cache.snapshot()["enabled"] is False
+
+
+@pytest.fixture
+def grounded(monkeypatch, tmp_path):
+    embedder = HashingEmbedder(16)
+    writer = CollectionWriter(str(tmp_path), "handbook", embedder.model_id, background_compaction=False)
+    records = [{"source": "handbook.md", "chunk": index, "text": text} for index, text in enumerate(PASSAGES)]
+    writer.add("handbook.md", {"size": 1}, records, embedder.embed(PASSAGES))
+    writer.checkpoint()
+    monkeypatch.setattr(main, "retrieval_store", RetrievalStore(str(tmp_path)))
+    monkeypatch.setattr(main, "query_embedder", embedder)
+    monkeypatch.setattr(main, "rerank_stage", None)
+    monkeypatch.setattr(main, "shard_coordinator", None)
+    monkeypatch.setattr(main, "retrieval_cache", RetrievalCache(1024 * 1024))
+    yield writer, embedder
+    writer.close()
+
+
+def ground(question: str) -> tuple:
+    payload = {"prompt": question, "retrieval": {"collection": "handbook", "topK": 1}}
+    result = asyncio.run(main.attach_context(payload))
+    return payload, result
+
+
+def test_repeated_questions_are_answered_from_the_cache_until_the_collection_changes(grounded):
+    writer, embedder = grounded
+
+    payload, first = ground("When does paid time off accrue?")
+    assert payload["context"] == [{"text": PASSAGES[0], "source": "handbook.md"}]
+    assert "cached" not in first and "embedMs" in first["timings"]
+
+    payload, second = ground("when does paid  time off accrue?")
+    assert second["cached"] is True and "cacheMs" in second["timings"]
+    assert payload["context"] == [{"text": PASSAGES[0], "source": "handbook.md"}]
+
+    updated = "Paid time off accrues every two weeks."
+    record = {"source": "handbook.md", "chunk": 0, "text": updated}
+    writer.add("handbook.md", {"size": 2}, [record], embedder.embed([updated]))
+    writer.checkpoint()
+
+    payload, third = ground("When does paid time off accrue?")
+    assert "cached" not in third
+    assert payload["context"] == [{"text": updated, "source": "handbook.md"}]
+    assert main.retrieval_cache.snapshot()["invalidations"] == 1
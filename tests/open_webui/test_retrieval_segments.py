@@ -0,0 +1,160 @@
+import os
+import zlib
+
+import numpy as np
+
+from app.retrieval import MERGE_SEGMENTS, CollectionReader, CollectionWriter, plan_compaction, read_manifest
+
+DIMENSIONS = 8
+
+
+def vectors_for(key: str, rows: int) -> np.ndarray:
+    rng = np.random.default_rng(zlib.crc32(key.encode()))
+    vectors = rng.standard_normal((rows, DIMENSIONS)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def add(writer: CollectionWriter, key: str, rows: int, version: int = 0) -> np.ndarray:
+    vectors = vectors_for(f"{key}:{version}", rows)
+    records = [{"source": key, "chunk": chunk, "text": f"{key} v{version} #{chunk}"} for chunk in range(rows)]
+    writer.add(key, {"size": rows, "version": version}, records, vectors)
+    return vectors
+
+
+def open_reader(tmp_path) -> CollectionReader:
+    reader = CollectionReader(str(tmp_path / "docs"))
+    assert reader.refresh()
+    return reader
+
+
+def live_texts(reader: CollectionReader) -> dict:
+    """Text of every row each file's manifest entry points at."""
+    return {
+        key: [record["text"] for record in reader.records(list(range(*entry["rows"])))]
+        for key, entry in reader.manifest["files"].items()
+    }
+
+
+def sealed(rows: int, name: str = "seg") -> dict:
+    return {"name": name, "rows": rows, "chunksBytes": 0, "sealed": True}
+
+
+def test_plan_compaction_merges_runs_of_small_or_dead_segments():
+    small = [sealed(10, f"seg-{index}") for index in range(MERGE_SEGMENTS)]
+    head = {"name": "head", "rows": 5, "chunksBytes": 0}
+    manifest = {"count": 10 * MERGE_SEGMENTS + 5, "segments": small + [head], "tombstones": []}
+    assert plan_compaction(manifest) == list(range(MERGE_SEGMENTS))
+
+    manifest["segments"] = small[1:] + [head]
+    manifest["count"] -= 10
+    assert plan_compaction(manifest) is None
+    assert plan_compaction(manifest, force=True) == list(range(MERGE_SEGMENTS - 1))
+
+    # One mostly dead segment is rewritten on its own.
+    manifest = {"count": 15, "segments": [sealed(10), head], "tombstones": [[0, 6]]}
+    assert plan_compaction(manifest) == [0]
+
+
+def test_the_head_is_sealed_between_files(tmp_path):
+    writer = CollectionWriter(str(tmp_path), "docs", "random-8", segment_rows=10, background_compaction=False)
+    for index in range(5):
+        add(writer, f"file{index}", 6)
+    writer.close()
+
+    manifest = read_manifest(str(tmp_path / "docs"))
+    assert [segment["rows"] for segment in manifest["segments"]] == [12, 12, 6]
+    assert [bool(segment.get("sealed")) for segment in manifest["segments"]] == [True, True, False]
+    reader = open_reader(tmp_path)
+    assert live_texts(reader)["file3"] == [f"file3 v0 #{chunk}" for chunk in range(6)]
+
+
+def test_search_spans_segments_and_skips_replaced_rows(tmp_path):
+    writer = CollectionWriter(str(tmp_path), "docs", "random-8", segment_rows=10, background_compaction=False)
+    old = [add(writer, f"file{index}", 6) for index in range(4)][1]
+    new = add(writer, "file1", 6, version=1)
+    writer.close()
+    reader = open_reader(tmp_path)
+
+    top = reader.search(new[2], 1)[0]
+    assert (top.source, top.chunk, top.text) == ("file1", 2, "file1 v1 #2")
+    assert reader.manifest["tombstones"] == [[6, 12]]
+    assert not any(hit.text.startswith("file1 v0") for hit in reader.search(old[2], 50))
+
+
+def test_forced_compaction_drops_dead_rows_and_renumbers_files(tmp_path):
+    writer = CollectionWriter(str(tmp_path), "docs", "random-8", segment_rows=10, background_compaction=False)
+    for index in range(6):
+        add(writer, f"file{index}", 5)
+    add(writer, "file2", 5, version=1)
+    writer.remove("file4")
+    writer.checkpoint()
+    before = live_texts(open_reader(tmp_path))
+
+    merges = writer.compact(force=True)
+    writer.close()
+
+    assert merges >= 1
+    manifest = read_manifest(str(tmp_path / "docs"))
+    assert manifest["tombstones"] == []
+    assert manifest["count"] == 25
+    assert all(segment["sealed"] for segment in manifest["segments"])
+    assert live_texts(open_reader(tmp_path)) == before
+
+
+def test_a_snapshot_in_use_survives_a_compaction_swap(tmp_path):
+    writer = CollectionWriter(str(tmp_path), "docs", "random-8", segment_rows=5, background_compaction=False)
+    for index in range(MERGE_SEGMENTS):
+        add(writer, f"file{index}", 5)
+    writer.checkpoint()
+    reader = open_reader(tmp_path)
+    snapshot = reader.snapshot
+    rows = list(range(*snapshot.manifest["files"]["file0"]["rows"]))
+
+    writer.remove("file0")
+    assert writer.compact() >= 1
+    assert reader.refresh()
+
+    # The old snapshot still reads its (now retired) segments; the new one no longer has file0.
+    assert [record["text"] for record in reader.records(rows, snapshot)][0] == "file0 v0 #0"
+    assert "file0" not in reader.manifest["files"]
+    assert len(reader.manifest["segments"]) < len(snapshot.manifest["segments"])
+    assert live_texts(reader)["file1"][0] == "file1 v0 #0"
+    writer.close()
+
+
+def test_background_compaction_is_swapped_in_at_a_checkpoint(tmp_path):
+    writer = CollectionWriter(str(tmp_path), "docs", "random-8", segment_rows=5)
+    for index in range(MERGE_SEGMENTS * 2):
+        add(writer, f"file{index}", 5)
+        writer.checkpoint()
+    writer.close()
+
+    assert writer.compactions >= 1
+    manifest = read_manifest(str(tmp_path / "docs"))
+    assert len(manifest["segments"]) < MERGE_SEGMENTS * 2
+    assert live_texts(open_reader(tmp_path))["file0"][0] == "file0 v0 #0"
+
+
+def test_an_interrupted_writer_is_rolled_back_to_its_checkpoint(tmp_path):
+    writer = CollectionWriter(str(tmp_path), "docs", "random-8", segment_rows=10, background_compaction=False)
+    add(writer, "kept", 4)
+    writer.checkpoint()
+    add(writer, "lost", 4)
+    add(writer, "also lost", 6)  # seals the head past its checkpointed size
+    add(writer, "lost too", 2)  # in a new segment the manifest never listed
+    writer.close(checkpoint=False)
+    assert os.path.isdir(tmp_path / "docs" / "seg-000002")
+
+    writer = CollectionWriter(str(tmp_path), "docs", "random-8", segment_rows=10, background_compaction=False)
+    manifest = writer.manifest
+    assert list(manifest["files"]) == ["kept"]
+    assert [segment["name"] for segment in manifest["segments"]] == ["seg-000001"]
+    assert sorted(name for name in os.listdir(tmp_path / "docs") if name.startswith("seg-")) == ["seg-000001"]
+    assert os.path.getsize(tmp_path / "docs" / "seg-000001" / "vectors.f32") == 4 * DIMENSIONS * 4
+    add(writer, "again", 3)
+    writer.close()
+
+    assert live_texts(open_reader(tmp_path)) == {
+        "kept": [f"kept v0 #{chunk}" for chunk in range(4)],
+        "again": [f"again v0 #{chunk}" for chunk in range(3)],
+    }
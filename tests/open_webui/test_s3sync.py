@@ -0,0 +1,125 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from app.embeddings import HashingEmbedder
+from app.retrieval import CollectionReader, CollectionWriter
+from app.s3sync import RangeReader, S3Object, list_objects, parse_s3_url, sync
+
+BUCKET = "docs"
+PREFIX = "handbook/"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def put(client, key: str, text: str, **metadata) -> None:
+    client.put_object(Bucket=BUCKET, Key=PREFIX + key, Body=text.encode("utf-8"), Metadata=metadata)
+
+
+def run(client, store, **options) -> dict:
+    embedder = HashingEmbedder(64)
+    writer = CollectionWriter(str(store), "handbook", embedder.model_id)
+    try:
+        return sync(client, BUCKET, PREFIX, writer, embedder, max_chars=300, progress_stream=None, **options)
+    finally:
+        writer.close()
+
+
+def manifest_files(store) -> dict:
+    reader = CollectionReader(os.path.join(str(store), "handbook"))
+    reader.refresh()
+    return reader.manifest["files"]
+
+
+def test_parse_s3_url():
+    assert parse_s3_url("s3://docs/handbook/") == ("docs", "handbook/")
+    assert parse_s3_url("s3://docs") == ("docs", "")
+    with pytest.raises(ValueError):
+        parse_s3_url("https://docs/handbook")
+
+
+def test_listing_skips_folders_and_keys_objects_by_their_path_under_the_prefix(s3):
+    put(s3, "pto.md", "Paid time off.")
+    put(s3, "travel/expenses.txt", "Expenses.")
+    s3.put_object(Bucket=BUCKET, Key=PREFIX + "empty/", Body=b"")
+
+    objects = list(list_objects(s3, BUCKET, PREFIX))
+
+    assert [obj.key for obj in objects] == ["pto.md", "travel/expenses.txt"]
+    assert objects[0].s3_key == "handbook/pto.md"
+    assert objects[0].size == len("Paid time off.")
+
+
+def test_ranged_reads_return_the_object_in_order(s3):
+    text = "".join(f"line {index}\n" for index in range(2000))
+    put(s3, "big.txt", text, owner="hr")
+    obj = next(list_objects(s3, BUCKET, PREFIX))
+    metadata = {}
+
+    with ThreadPoolExecutor(4) as pool:
+        reader = RangeReader(s3, BUCKET, pool, part_size=1000, read_ahead=3)
+        parts = list(reader.parts(obj, metadata))
+
+    assert len(parts) == -(-len(text) // 1000)
+    assert all(len(part) == 1000 for part in parts[:-1])
+    assert b"".join(parts).decode("utf-8") == text
+    assert reader.transferred == len(text)
+    assert metadata == {"owner": "hr"}
+
+
+def test_reads_are_pinned_to_the_listed_etag(s3):
+    put(s3, "pto.md", "Paid time off.")
+    obj = next(list_objects(s3, BUCKET, PREFIX))
+    put(s3, "pto.md", "Replaced while the sync was running.")
+
+    with ThreadPoolExecutor(2) as pool:
+        reader = RangeReader(s3, BUCKET, pool, part_size=1000, read_ahead=2)
+        with pytest.raises(Exception, match="PreconditionFailed"):
+            list(reader.parts(S3Object(obj.key, obj.s3_key, obj.size, obj.etag)))
+
+
+def test_sync_skips_unchanged_objects_and_removes_deleted_ones(s3, tmp_path):
+    put(s3, "pto.md", "Paid time off. " * 50, owner="hr", tags="policy,leave")
+    put(s3, "travel.txt", "Travel policy. " * 50)
+    put(s3, "logo.png", "not a document")
+
+    first = run(s3, tmp_path, part_size=256)
+    assert (first["objects"], first["files"], first["bytesSkipped"]) == (2, 2, 0)
+    assert first["bytesTransferred"] == len("Paid time off. " * 50) + len("Travel policy. " * 50)
+    files = manifest_files(tmp_path)
+    assert set(files) == {"pto.md", "travel.txt"}
+    assert files["pto.md"]["meta"]["owner"] == "hr"
+    assert files["pto.md"]["meta"]["tags"] == ["leave", "policy"]
+
+    put(s3, "travel.txt", "New travel policy. " * 50)
+    s3.delete_object(Bucket=BUCKET, Key=PREFIX + "pto.md")
+    put(s3, "faq.md", "Questions. " * 10)
+    second = run(s3, tmp_path)
+
+    assert (second["objects"], second["files"], second["skipped"], second["removed"]) == (2, 2, 0, 1)
+    assert set(manifest_files(tmp_path)) == {"travel.txt", "faq.md"}
+
+    third = run(s3, tmp_path)
+    assert (third["files"], third["skipped"], third["bytesTransferred"]) == (0, 2, 0)
+    assert third["bytesSkipped"] == len("New travel policy. " * 50) + len("Questions. " * 10)
+
+
+def test_keep_deleted_leaves_removed_objects_in_the_collection(s3, tmp_path):
+    put(s3, "pto.md", "Paid time off.")
+    run(s3, tmp_path)
+    s3.delete_object(Bucket=BUCKET, Key=PREFIX + "pto.md")
+
+    summary = run(s3, tmp_path, delete=False)
+
+    assert summary["removed"] == 0
+    assert set(manifest_files(tmp_path)) == {"pto.md"}
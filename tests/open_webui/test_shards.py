@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import time
+
+import httpx
+import numpy as np
+import pytest
+
+from app.retrieval import CollectionReader, CollectionWriter
+from app.shards import (
+    ShardCoordinator,
+    ShardError,
+    build_shard_app,
+    parse_shard,
+    shard_name,
+    shard_of,
+    split_collection,
+)
+
+DIMENSIONS = 8
+SHARDS = 3
+
+
+def shard_url(shard: int, replica: int = 0) -> str:
+    return f"http://127.0.0.1:{9000 + 10 * shard + replica}"
+
+
+class ShardTransport(httpx.AsyncBaseTransport):
+    """Routes each port to a shard app, or to a failure: "refused", "frozen", "broken" or "missing"."""
+
+    def __init__(self, routes: dict):
+        self.routes = {
+            port: target if isinstance(target, str) else httpx.ASGITransport(target) for port, target in routes.items()
+        }
+        self.calls = []
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.calls.append(request.url.port)
+        target = self.routes[request.url.port]
+        if target == "refused":
+            raise httpx.ConnectError("Connection refused", request=request)
+        if target == "frozen":
+            await asyncio.sleep(5)
+        if target == "broken":
+            return httpx.Response(500, text="boom")
+        if target == "missing":
+            return httpx.Response(404, json={"detail": "Unknown shard"})
+        return await target.handle_async_request(request)
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    """A 30-file collection and its split into shards, with one query vector."""
+    root = tmp_path_factory.mktemp("shards")
+    rng = np.random.default_rng(9)
+    writer = CollectionWriter(str(root), "handbook", "random-8")
+    for document in range(30):
+        vectors = rng.standard_normal((4, DIMENSIONS)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        source = f"doc{document}.md"
+        records = [{"source": source, "chunk": chunk, "text": f"doc {document} #{chunk}"} for chunk in range(4)]
+        writer.add(source, {"size": document}, records, vectors, {"owner": f"team{document % 2}"})
+    writer.close()
+    names = split_collection(str(root), "handbook", SHARDS)
+    query = rng.standard_normal(DIMENSIONS).astype(np.float32)
+    return root, names, query / np.linalg.norm(query)
+
+
+def search(routes: dict, query, top_k: int = 10, spec=None, model=None, timeout_seconds: float = 1.0, replicas=None):
+    coordinator = ShardCoordinator([shard_url(shard) for shard in range(SHARDS)], timeout_seconds)
+    for shard, urls in (replicas or {}).items():
+        coordinator._replicas[shard] = (time.monotonic(), urls)
+    transport = ShardTransport(routes)
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await coordinator.search(client, "handbook", query, top_k, spec, model)
+
+    hits, report = asyncio.run(run())
+    return hits, report, coordinator, transport
+
+
+def healthy(root) -> dict:
+    app = build_shard_app(str(root))
+    return {9000 + 10 * shard: app for shard in range(SHARDS)}
+
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    for value in ("4/4", "-1/4", "a/b", "3"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(value)
+
+
+def test_split_puts_each_file_in_its_shard(store):
+    root, names, _ = store
+    assert names == [shard_name("handbook", shard) for shard in range(SHARDS)]
+    seen = []
+    for shard, name in enumerate(names):
+        reader = CollectionReader(str(root / name))
+        assert reader.refresh()
+        assert reader.manifest["shard"] == {"collection": "handbook", "index": shard, "count": SHARDS}
+        for key, entry in reader.manifest["files"].items():
+            assert shard_of(key, SHARDS) == shard
+            assert entry["meta"]["owner"] == f"team{int(key[3:-3]) % 2}"
+            texts = [record["text"] for record in reader.records(list(range(*entry["rows"])))]
+            assert texts == [f"doc {key[3:-3]} #{chunk}" for chunk in range(4)]
+        seen.extend(reader.manifest["files"])
+    assert sorted(seen) == sorted(f"doc{document}.md" for document in range(30))
+
+
+def test_scatter_gather_matches_the_unsharded_search(store):
+    root, _, query = store
+    whole = CollectionReader(str(root / "handbook"))
+    whole.refresh()
+
+    hits, report, _, _ = search(healthy(root), query, top_k=10, spec={"owner": "team1"})
+
+    expected = whole.search(query, 10, {"owner": "team1"})
+    assert [(hit.source, hit.chunk) for hit in hits] == [(hit.source, hit.chunk) for hit in expected]
+    assert report["answered"] == SHARDS and report["partial"] is False
+
+
+def test_a_slow_or_failing_shard_only_makes_the_result_partial(store):
+    root, _, query = store
+    routes = healthy(root)
+    routes[9010] = "frozen"
+    routes[9020] = "broken"
+
+    started = time.monotonic()
+    hits, report, coordinator, _ = search(routes, query, top_k=5, timeout_seconds=0.2)
+
+    assert time.monotonic() - started < 2
+    assert report["partial"] is True and report["answered"] == 1
+    assert report["failed"] == [{"shard": 1, "reason": "timeout"}, {"shard": 2, "reason": "error"}]
+    assert {shard_of(hit.source, SHARDS) for hit in hits} == {0}
+    stats = coordinator.snapshot()
+    assert (stats["partial"], stats["shards"][1]["timeouts"], stats["shards"][2]["errors"]) == (1, 1, 1)
+
+
+def test_a_refused_replica_is_skipped(store):
+    root, _, query = store
+    routes = {**healthy(root), 9001: "refused"}
+    replicas = {0: [shard_url(0, 1), shard_url(0)]}
+
+    _, report, _, transport = search(routes, query, replicas=replicas)
+
+    assert report["partial"] is False
+    assert transport.calls.count(9001) == 1 and transport.calls.count(9000) == 1
+
+
+def test_unknown_collections_and_unanswered_queries(store):
+    _, _, query = store
+    missing = {9000 + 10 * shard: "missing" for shard in range(SHARDS)}
+    hits, report, _, _ = search(missing, query)
+    assert hits is None and report["answered"] == 0
+
+    broken = {9000 + 10 * shard: "broken" for shard in range(SHARDS)}
+    with pytest.raises(ShardError) as error:
+        search(broken, query)
+    assert error.value.status_code == 503
+
+
+def test_a_shard_rejecting_the_query_fails_it(store):
+    root, _, query = store
+    with pytest.raises(ShardError) as error:
+        search(healthy(root), query, model="another-model")
+    assert error.value.status_code == 409
+    with pytest.raises(ShardError) as error:
+        search(healthy(root), query, spec={"colour": "red"})
+    assert error.value.status_code == 400